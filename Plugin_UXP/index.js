@@ -16,6 +16,26 @@ let isConnected = false;
 // 历史快照存储 (docId -> historyState)
 const docSnapshots = new Map();
 
+// 原子任务取消标记：activeAtomicIds 记录已收到但未结束的任务，cancelledRequests 记录被取消的任务
+const activeAtomicIds = new Set();
+const cancelledRequests = new Set();
+
+// 换图底稿 (reuse_stage)：已置入当前行图片的源文档副本 { key, docId, sourceId }
+// 连续多行图片输入相同时，后续行直接复制底稿，跳过 internalReplaceImage（复制文件 + 打开智能对象）
+let stagedBase = null;
+
+/**
+ * 关闭换图底稿（需在 executeAsModal 内调用）
+ */
+async function releaseStagedBase() {
+    if (!stagedBase) return;
+    const stageDoc = app.documents.find(d => d.id === stagedBase.docId);
+    stagedBase = null;
+    if (stageDoc) {
+        try { await stageDoc.close(constants.SaveOptions.DONOTSAVECHANGES); } catch(e) {}
+    }
+}
+
 // --- 核心编辑操作 (Internal API, 不直接响应 WS) ---
 
 /**
@@ -46,7 +66,7 @@ async function internalUpdateText(layerId, text, parentChain) {
 /**
  * 内部换图函数
  */
-async function internalReplaceImage(layerId, imagePath, parentChain) {
+async function internalReplaceImage(layerId, imagePath, parentChain, cached = false) {
     const fs = require("uxp").storage.localFileSystem;
     const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
 
@@ -61,8 +81,12 @@ async function internalReplaceImage(layerId, imagePath, parentChain) {
         try { cleanPath = new URL(cleanPath).href; } catch(e) { cleanPath = encodeURI(cleanPath); }
 
         const sourceEntry = await fs.getEntryWithUrl(cleanPath);
+        // Python 端缓存仓库中的文件（内容寻址、文件名只含十六进制）直接置入，不再复制
+        if (cached) return sourceEntry;
         const dataFolder = await fs.getDataFolder();
-        const safeName = `rep_${Date.now()}.jpg`;
+        // 保留真实扩展名（PS 按扩展名识别格式，PNG 透明通道等不会因误标为 JPG 而出错）
+        const extMatch = cleanPath.match(/\.([a-zA-Z0-9]{2,5})$/);
+        const safeName = `rep_${Date.now()}.${extMatch ? extMatch[1].toLowerCase() : "jpg"}`;
         return await sourceEntry.copyTo(dataFolder, { newName: safeName, overwrite: true });
     };
 
@@ -243,6 +267,13 @@ async function serializeLayers(layers, depth=0, openSO=false) {
 
             const node = { id: layer.id, name: layer.name, visible: layer.visible, kind: kind, opacity: layer.opacity };
             if (editable) node.editable = editable;
+            if (isSO) {
+                // 外框尺寸：Python 端据此把替换图片预先缩小到目标大小
+                try {
+                    const b = layer.bounds;
+                    node.bounds = { width: Math.round(b.right - b.left), height: Math.round(b.bottom - b.top) };
+                } catch(e) {}
+            }
 
             // 2. 递归
             if (isGroup) {
@@ -251,6 +282,7 @@ async function serializeLayers(layers, depth=0, openSO=false) {
                 try {
                     await openSmartObjectByBatchPlay(layer.id);
                     if (app.activeDocument && app.activeDocument.id !== curDocId) {
+                        node.content_size = { width: Math.round(app.activeDocument.width), height: Math.round(app.activeDocument.height) };
                         const inner = await serializeLayers(app.activeDocument.layers, depth+1, openSO);
                         if (inner.length > 0) {
                             node.children = inner;
@@ -299,26 +331,51 @@ function connect() {
             try {
                 const msg = JSON.parse(evt.data);
                 
+                // 1.4 取消原子任务 (不进入模态，随时响应)
+                if (msg.type === "cancel") {
+                    const targetId = msg.target_id;
+                    const found = activeAtomicIds.has(targetId);
+                    if (found) cancelledRequests.add(targetId);
+                    console.warn(`[JS] 收到取消请求: ${targetId} (${found ? "已标记" : "任务不存在或已结束"})`);
+                    ws.send(JSON.stringify({ id: msg.id, type: "cancel_response", status: found ? "success" : "error", target_id: targetId, error: found ? undefined : "任务不存在或已结束" }));
+                }
                 // 1.5 原子化执行策略包 (副本机制保护)
-                if (msg.type === "execute_atomic") {
+                else if (msg.type === "execute_atomic") {
+                    activeAtomicIds.add(msg.id);
                     await core.executeAsModal(async () => {
                         console.warn(`[JS] 收到原子化执行请求，操作数: ${msg.operations?.length}, 渲染数: ${msg.renders?.length}`);
+
+                        // 取消检查：在每个操作/渲染之间调用，被取消时抛出带 cancelled 标记的异常
+                        const checkCancelled = () => {
+                            if (cancelledRequests.has(msg.id)) {
+                                const e = new Error("任务已取消");
+                                e.cancelled = true;
+                                throw e;
+                            }
+                        };
                         
                         // 进度通知辅助函数
-                        const sendProgress = (step, current, total, details) => {
+                        // step: init(创建副本) / operation / render / save；extra 可附带 op_type、format 等字段
+                        const sendProgress = (step, current, total, details, extra = {}) => {
                             ws.send(JSON.stringify({
                                 id: msg.id,
                                 type: "atomic_progress",
                                 step: step,
                                 current: current,
                                 total: total,
-                                message: details
+                                message: details,
+                                ...extra
                             }));
                         };
 
                         let workCopy = null;
+                        let sourceDoc = null;
                         const renderedFiles = [];
+                        let cancelled = false;
                         try {
+                            // 排队期间已被取消则直接结束
+                            checkCancelled();
+
                             // A0. 自动切换焦点文档 (工作流支持)
                             if (msg.target_document) {
                                 console.warn(`[JS] 正在寻找目标文档: ${msg.target_document}`);
@@ -332,19 +389,59 @@ function connect() {
                             }
 
                             // A. 创建主工作副本
-                            sendProgress("init", 0, 1, "正在创建工作副本...");
-                            workCopy = await app.activeDocument.duplicate(`${app.activeDocument.name}_WorkCopy`);
+                            let ops = msg.operations || [];
+                            if (msg.reuse_stage) {
+                                // 图片输入与上一行相同：基于已换图的底稿复制，本行跳过 replace_image
+                                sourceDoc = app.activeDocument;
+                                const imageOps = ops.filter(op => op.type === "replace_image");
+                                const key = JSON.stringify([sourceDoc.id, imageOps.map(op => [op.layer_id, op.parent_chain || [], op.image_path])]);
+                                let stageDoc = stagedBase && stagedBase.key === key ? app.documents.find(d => d.id === stagedBase.docId) : null;
+                                if (!stageDoc) {
+                                    await releaseStagedBase();
+                                    sendProgress("init", 0, 1, "正在准备换图底稿...");
+                                    stageDoc = await sourceDoc.duplicate(`${sourceDoc.name}_Stage`);
+                                    stagedBase = { key: key, docId: stageDoc.id, sourceId: sourceDoc.id };
+                                    let failed = false;
+                                    try {
+                                        for (let i = 0; i < imageOps.length; i++) {
+                                            checkCancelled();
+                                            const op = imageOps[i];
+                                            sendProgress("operation", i + 1, imageOps.length, "正在执行: replace_image...", { op_type: op.type });
+                                            try {
+                                                await internalReplaceImage(op.layer_id, op.image_path, op.parent_chain, op.cached);
+                                            } catch (e) {
+                                                failed = true;
+                                                console.error(`[JS] 操作失败: ${e.message}`);
+                                            }
+                                        }
+                                    } catch (e) {
+                                        await releaseStagedBase();
+                                        throw e;
+                                    }
+                                    // 换图失败的底稿只用于本行，下一行重新准备
+                                    if (failed) stagedBase.key = null;
+                                } else {
+                                    console.warn(`[JS] 图片输入未变化，复用换图底稿`);
+                                }
+                                ops = ops.filter(op => op.type !== "replace_image");
+                                app.activeDocument = stageDoc;
+                                sendProgress("init", 0, 1, "正在创建工作副本...");
+                                workCopy = await stageDoc.duplicate(`${sourceDoc.name}_WorkCopy`);
+                            } else {
+                                sendProgress("init", 0, 1, "正在创建工作副本...");
+                                workCopy = await app.activeDocument.duplicate(`${app.activeDocument.name}_WorkCopy`);
+                            }
                             
                             // B. 执行编辑操作
-                            const ops = msg.operations || [];
                             for (let i = 0; i < ops.length; i++) {
+                                checkCancelled();
                                 const op = ops[i];
-                                sendProgress("operation", i + 1, ops.length, `正在执行: ${op.type}...`);
+                                sendProgress("operation", i + 1, ops.length, `正在执行: ${op.type}...`, { op_type: op.type });
                                 try {
                                     if (op.type === "update_text_layer") {
                                         await internalUpdateText(op.layer_id, op.text, op.parent_chain);
                                     } else if (op.type === "replace_image") {
-                                        await internalReplaceImage(op.layer_id, op.image_path, op.parent_chain);
+                                        await internalReplaceImage(op.layer_id, op.image_path, op.parent_chain, op.cached);
                                     } else if (op.type === "apply_filter") {
                                         await internalApplyFilter(op.layer_id, op.filter_type, op.params, op.parent_chain);
                                     }
@@ -356,8 +453,9 @@ function connect() {
                             // C. 循环执行渲染
                             const renders = msg.renders || [];
                             for (let i = 0; i < renders.length; i++) {
+                                checkCancelled();
                                 const render = renders[i];
-                                sendProgress("render", i + 1, renders.length, `正在渲染: ${render.file_name}...`);
+                                sendProgress("render", i + 1, renders.length, `正在渲染: ${render.file_name}...`, { format: render.format });
                                 let renderCopy = null;
                                 try {
                                     app.activeDocument = workCopy;
@@ -384,7 +482,8 @@ function connect() {
                                         }
                                     }
 
-                                    const savedPath = await saveExportFile(renderCopy, render.folder, render.file_name, render.format);
+                                    sendProgress("save", i + 1, renders.length, `正在保存: ${render.file_name}.${render.format}...`, { format: render.format });
+                                    const savedPath = await saveExportFile(renderCopy, render.folder, render.file_name, render.format, { quality: render.quality, encoding: render.encoding });
                                     renderedFiles.push({
                                         name: render.file_name,
                                         path: savedPath || `${render.folder}/${render.file_name}.${render.format}`,
@@ -409,16 +508,37 @@ function connect() {
                             }));
 
                         } catch (err) {
-                            ws.send(JSON.stringify({ 
-                                id: msg.id, 
-                                type: "execute_atomic_response",
-                                status: "error", 
-                                error: err.message 
-                            }));
+                            if (err.cancelled) {
+                                // 取消：返回已完成的部分输出
+                                cancelled = true;
+                                console.warn(`[JS] 原子任务已取消，已输出 ${renderedFiles.length} 个文件`);
+                                ws.send(JSON.stringify({ 
+                                    id: msg.id, 
+                                    type: "execute_atomic_response",
+                                    status: "cancelled", 
+                                    error: "Cancelled",
+                                    rendered_files: renderedFiles 
+                                }));
+                            } else {
+                                ws.send(JSON.stringify({ 
+                                    id: msg.id, 
+                                    type: "execute_atomic_response",
+                                    status: "error", 
+                                    error: err.message,
+                                    rendered_files: renderedFiles 
+                                }));
+                            }
                         } finally {
-                            if (workCopy && !msg.debug) {
+                            // 被取消的工作副本无论是否调试模式都要清理
+                            if (workCopy && (!msg.debug || cancelled)) {
                                 try { await workCopy.close(constants.SaveOptions.DONOTSAVECHANGES); } catch(e){}
                             }
+                            // 底稿保持打开，激活文档切回源文档（避免后续读取图层读到底稿）
+                            if (sourceDoc) {
+                                try { app.activeDocument = sourceDoc; } catch(e){}
+                            }
+                            activeAtomicIds.delete(msg.id);
+                            cancelledRequests.delete(msg.id);
                         }
                     }, { "commandName": "原子化策略执行" });
                 }
@@ -594,8 +714,12 @@ else if (msg.type === "replace_image") {
             try { cleanPath = new URL(cleanPath).href; } catch(e) { cleanPath = encodeURI(cleanPath); }
 
             const sourceEntry = await fs.getEntryWithUrl(cleanPath);
+            // 缓存仓库中的文件直接置入，不再复制
+            if (msg.cached) return sourceEntry;
             const dataFolder = await fs.getDataFolder();
-            const safeName = `rep_${Date.now()}.jpg`;
+            // 保留真实扩展名（PS 按扩展名识别格式，PNG 透明通道等不会因误标为 JPG 而出错）
+            const extMatch = cleanPath.match(/\.([a-zA-Z0-9]{2,5})$/);
+            const safeName = `rep_${Date.now()}.${extMatch ? extMatch[1].toLowerCase() : "jpg"}`;
             return await sourceEntry.copyTo(dataFolder, { newName: safeName, overwrite: true });
         } catch (e) {
             throw new Error(`图片准备失败: ${e.message}`);
@@ -772,7 +896,7 @@ else if (msg.type === "render_output") {
 
             // 5. 保存 (总是保存 finalDoc)
             console.warn("[JS] 保存...");
-            await saveExportFile(finalDoc, msg.folder, msg.file_name, msg.format);
+            await saveExportFile(finalDoc, msg.folder, msg.file_name, msg.format, { quality: msg.quality, encoding: msg.encoding });
             
             ws.send(JSON.stringify({ id: msg.id, status: "success" }));
 
@@ -1158,9 +1282,9 @@ else if (msg.type === "restore_snapshot") {
         ws.send(JSON.stringify({ id: msg.id, status: "error", error: "未找到快照" }));
     }
 }
-// 13. 获取所有打开的文档列表
+// 13. 获取所有打开的文档列表（不含换图底稿）
 else if (msg.type === "get_open_docs") {
-    const docs = app.documents.map(d => ({
+    const docs = app.documents.filter(d => !stagedBase || d.id !== stagedBase.docId).map(d => ({
         id: d.id,
         name: d.name,
         path: d.path || "unsaved",
@@ -1207,6 +1331,13 @@ else if (msg.type === "close_doc") {
         }
     }, { "commandName": "关闭文档" });
 }
+// 15.1 关闭换图底稿 (批量结束时由服务端发送)
+else if (msg.type === "release_stage") {
+    core.executeAsModal(async () => {
+        await releaseStagedBase();
+        ws.send(JSON.stringify({ id: msg.id, status: "success" }));
+    }, { "commandName": "关闭换图底稿" });
+}
 // 16. 激活指定文档 (修复版：加入 Modal 作用域)
 else if (msg.type === "activate_doc") {
     core.executeAsModal(async () => {
@@ -1424,8 +1555,9 @@ async function applyEmbossEffect(angle = 135, height = 2, amount = 100) {
 }
 /**
  * 保存文件核心逻辑
+ * options: { quality: 1-100, encoding: { png_compress: 0-9, webp_lossless: bool } }（均可省略）
  */
-async function saveExportFile(doc, folderPath, fileName, format) {
+async function saveExportFile(doc, folderPath, fileName, format, options = {}) {
     const fs = require("uxp").storage.localFileSystem;
     const action = require("photoshop").action;
     
@@ -1460,12 +1592,17 @@ async function saveExportFile(doc, folderPath, fileName, format) {
     let exportCmd = {};
     const commonIn = { _path: token, _kind: "local" };
 
+    // 方案中的编码参数（质量 0-100 按比例换算为 PS 的 JPEG 品质 0-12）
+    const encoding = (options && options.encoding) || {};
+    const hasQuality = options && options.quality !== undefined && options.quality !== null && !isNaN(Number(options.quality));
+    const quality = hasQuality ? Math.max(1, Math.min(100, Number(options.quality))) : null;
+
     if (lowerFormat === "jpg" || lowerFormat === "jpeg") {
         exportCmd = {
             _obj: "save",
             as: {
                 _obj: "JPEG",
-                extendedQuality: 10, // 0-12
+                extendedQuality: quality === null ? 10 : Math.round(quality * 12 / 100), // 0-12
                 matte: { _enum: "matteColor", _value: "none" }
             },
             in: commonIn,
@@ -1476,7 +1613,8 @@ async function saveExportFile(doc, folderPath, fileName, format) {
             _obj: "save",
             as: {
                 _obj: "PNGFormat",
-                method: { _enum: "PNGMethod", _value: "quick" }, // 快速压缩
+                // 压缩级别 7 以上使用最小文件（慢），否则快速压缩
+                method: { _enum: "PNGMethod", _value: Number(encoding.png_compress) >= 7 ? "thorough" : "quick" },
                 PNGInterlaceType: { _enum: "PNGInterlaceType", _value: "PNGInterlaceNone" }
             },
             in: commonIn,
@@ -1489,8 +1627,8 @@ async function saveExportFile(doc, folderPath, fileName, format) {
             as: {
                 _obj: "WebPFormat",
                 // 压缩方式: compressionLossy (有损) / compressionLossless (无损)
-                compression: { _enum: "WebPCompression", _value: "compressionLossy" },
-                quality: 75, // 0-100
+                compression: { _enum: "WebPCompression", _value: encoding.webp_lossless ? "compressionLossless" : "compressionLossy" },
+                quality: quality === null ? 75 : Math.round(quality), // 0-100
                 includeXMP: false,
                 includeEXIF: false,
                 includeIPTC: false
@@ -1543,7 +1681,8 @@ async function saveExportFile(doc, folderPath, fileName, format) {
     // 注意：如果是 WebP 但 PS版本过低不支持，这里可能会报错，外层 try-catch 会捕获
     await action.batchPlay([exportCmd], {});
     
-    return `${folderPath}/${fullFileName}`;
+    // 返回实际保存的本地路径，Python 端据此建立输出索引，无需再按文件名搜索导出目录
+    return fileEntry.nativePath || `${folderPath}/${fullFileName}`;
 }
 document.addEventListener("DOMContentLoaded", () => {
     updateStatus("disconnected", "连接中...");
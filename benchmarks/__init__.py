@@ -0,0 +1,7 @@
+"""
+小冰美化助手 - 性能基准测试
+
+用法:
+    python -m benchmarks --output bench.json
+    python -m benchmarks --compare baseline.json --output bench.json
+"""
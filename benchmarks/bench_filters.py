@@ -0,0 +1,71 @@
+"""
+全局滤镜基准：image_filters 的吞吐量与精度
+
+高斯模糊与参考实现（float64 直接卷积，半宽 ⌈4σ⌉）逐像素比较，
+平均绝对误差超过 MAX_ERROR（8 位灰阶）时记为失败，覆盖高斯核与三次盒式模糊两条路径。
+"""
+
+import math
+
+from .harness import measure, result, skipped, failed
+import image_filters
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+# 允许的平均绝对误差（Pillow 的 GaussianBlur 约为 0.4-0.8）
+MAX_ERROR = 1.0
+
+SIGMAS = (0.3, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+
+def build_image(size: int):
+    """随机噪声 + 中间一个实心方块（同时有高频细节与硬边缘）"""
+    rng = np.random.default_rng(1)
+    pixels = (rng.random((size, size, 3)) * 255).astype(np.uint8)
+    pixels[size // 4: size * 3 // 4, size // 4: size * 3 // 4] = 255
+    return Image.fromarray(pixels)
+
+
+def reference_blur(img, sigma: float):
+    """参考高斯模糊：可分离 float64 卷积，边缘像素延伸"""
+    half = int(math.ceil(4 * sigma))
+    x = np.arange(-half, half + 1, dtype=np.float64)
+    kernel = np.exp(-(x * x) / (2 * sigma * sigma))
+    kernel /= kernel.sum()
+    a = np.asarray(img, dtype=np.float64)
+    for axis in (1, 0):
+        pad = [(0, 0)] * a.ndim
+        pad[axis] = (half, half)
+        padded = np.pad(a, pad, mode="edge")
+        n = a.shape[axis]
+        a = sum(w * np.take(padded, np.arange(k, k + n), axis=axis) for k, w in enumerate(kernel))
+    return np.clip(np.rint(a), 0, 255)
+
+
+def bench_filters(size: int = 512, repeat: int = 5) -> dict:
+    if not image_filters.available():
+        return {"filters.gaussian_blur": skipped("NumPy / Pillow 未安装")}
+    img = build_image(size)
+    errors = {}
+    for sigma in SIGMAS:
+        out = np.asarray(image_filters.gaussian_blur(img, sigma), dtype=np.float64)
+        errors[sigma] = float(np.abs(out - reference_blur(img, sigma)).mean())
+    worst = max(errors, key=errors.get)
+    if errors[worst] > MAX_ERROR:
+        blur = failed(f"σ={worst} 时与参考高斯核的平均误差为 {errors[worst]:.2f}（上限 {MAX_ERROR}）")
+    else:
+        timing = measure(lambda: image_filters.gaussian_blur(img, 3.0), repeat=repeat)
+        blur = result("megapixels_per_sec", megapixels_per_sec=size * size / 1e6 / timing["median"],
+                      max_error=round(errors[worst], 3), worst_sigma=worst,
+                      small_sigma_error=round(max(e for s, e in errors.items()
+                                                  if s <= image_filters.KERNEL_MAX_SIGMA), 3))
+    timing = measure(lambda: image_filters.emboss(img), repeat=repeat)
+    return {
+        "filters.gaussian_blur": blur,
+        "filters.emboss": result("megapixels_per_sec", megapixels_per_sec=size * size / 1e6 / timing["median"]),
+    }
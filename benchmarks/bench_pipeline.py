@@ -0,0 +1,196 @@
+"""
+端到端批量管线基准（PSServer + mock_plugin）
+
+- batch.execute_batch_with_data: 单文档批量
+- batch.execute_workflow: 多文档工作流
+- batch.rapid_export_process_queue: 极速出图面板的队列循环（需能导入 main.py）
+
+per_row_overhead_ms = 每行耗时 - 插件上报的阶段耗时，即 Python 端 + 传输的开销
+"""
+
+import asyncio
+import shutil
+import tempfile
+import time
+
+import os
+
+from mock_plugin import write_placeholder
+from .harness import MockEnvironment, annotate_paths, result, skipped, quiet
+
+
+def _pick_targets(tree: list, text_ops: int, image_ops: int) -> tuple:
+    nodes = annotate_paths(tree)
+    texts = [n for n in nodes if n.get("kind") == "TEXT"][:text_ops]
+    images = [n for n in nodes if n.get("kind") == "PIXEL" and n["name"] != "背景"][:image_ops]
+    return texts, images
+
+
+def build_strategy(tree: list, output_dir: str, text_ops: int = 4, image_ops: int = 2, renders: int = 1) -> dict:
+    """按 mock 图层树构造执行态策略（与 StrategyParser 输出结构一致）"""
+    texts, images = _pick_targets(tree, text_ops, image_ops)
+    operations = []
+    for i, node in enumerate(texts, 1):
+        operations.append({
+            "type": "update_text_layer", "target_path": node["path"], "group": i,
+            "regex_steps": [{"name": "去空白", "find": r"\s+", "replace": " "}],
+        })
+    for j, node in enumerate(images, 1):
+        operations.append({"type": "replace_image", "target_path": node["path"], "group": len(texts) + j})
+    render_list = []
+    for k in range(renders):
+        render_list.append({
+            "name": f"方案 {k + 1}",
+            "filename": f"bench_{k + 1}_{{index}}",
+            "format": "png" if k % 2 else "jpg",
+            "output_path": output_dir,
+            "root_layers": [],
+            "tiling": {"enabled": False},
+            "filters": [],
+        })
+    return {"version": "1.1.0", "operations": operations, "renders": render_list}
+
+
+def image_path(folder: str, variant: int, slot: int) -> str:
+    """基准用的输入图片（不存在时写出占位图，保证通过图片预检）"""
+    path = os.path.join(folder, "images", f"img_{variant}_{slot}.png")
+    if not os.path.exists(path):
+        write_placeholder(path, "png", label=f"{variant}_{slot}")
+    return path
+
+
+def build_rows(count: int, text_ops: int, image_ops: int, folder: str) -> list:
+    rows = []
+    for r in range(count):
+        row = {str(i): f"第 {r + 1} 行  文本 {i}" for i in range(1, text_ops + 1)}
+        for j in range(1, image_ops + 1):
+            row[str(text_ops + j)] = image_path(folder, r % 7, j)
+        rows.append(row)
+    return rows
+
+
+def _summarize(elapsed: float, row_results: list, rows: int) -> dict:
+    plugin_seconds = [sum((r.get("stage_timings") or {}).values()) for r in row_results if r.get("status") == "ok"]
+    per_row = elapsed / rows if rows else 0.0
+    plugin_avg = sum(plugin_seconds) / len(plugin_seconds) if plugin_seconds else 0.0
+    return result(
+        "rows_per_sec", "higher",
+        rows=rows,
+        ok=sum(1 for r in row_results if r.get("status") == "ok"),
+        seconds=elapsed,
+        rows_per_sec=rows / elapsed if elapsed else 0.0,
+        per_row_ms=per_row * 1000,
+        per_row_overhead_ms=max(per_row - plugin_avg, 0.0) * 1000,
+    )
+
+
+async def bench_batch(rows: int = 50, latency: dict = None, text_ops: int = 4, image_ops: int = 2,
+                      renders: int = 1, verbose: bool = False) -> dict:
+    output_dir = tempfile.mkdtemp(prefix="ice_bench_")
+    try:
+        with quiet(not verbose):
+            async with MockEnvironment(latency=latency) as env:
+                strategy = build_strategy(env.layer_tree, output_dir, text_ops, image_ops, renders)
+                data = build_rows(rows, text_ops, image_ops, output_dir)
+                done = asyncio.get_event_loop().create_future()
+
+                def on_done(res, err):
+                    if not done.done():
+                        done.set_result((res, err))
+
+                started = time.perf_counter()
+                await env.server.execute_batch_with_data(strategy, data, callback=on_done,
+                                                         progress_callback=lambda *args: None)
+                row_results, err = await done
+                elapsed = time.perf_counter() - started
+        if err:
+            return skipped(f"批量执行失败: {err}")
+        return _summarize(elapsed, row_results, rows)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+async def bench_workflow(docs: int = 3, rows_per_doc: int = 20, latency: dict = None, text_ops: int = 4,
+                         image_ops: int = 2, verbose: bool = False) -> dict:
+    output_dir = tempfile.mkdtemp(prefix="ice_bench_")
+    try:
+        with quiet(not verbose):
+            async with MockEnvironment(latency=latency) as env:
+                strategy = build_strategy(env.layer_tree, output_dir, text_ops, image_ops)
+                tasks = [{
+                    "psd_path": f"/mock/工作流{d + 1}.psd",
+                    "strategy": strategy,
+                    "data_table": build_rows(rows_per_doc, text_ops, image_ops, output_dir),
+                } for d in range(docs)]
+                started = time.perf_counter()
+                workflow_results = await env.server.execute_workflow(tasks)
+                elapsed = time.perf_counter() - started
+        row_results = []
+        for item in workflow_results or []:
+            if isinstance(item, dict) and isinstance(item.get("details"), list):
+                row_results.extend(item["details"])
+        summary = _summarize(elapsed, row_results, docs * rows_per_doc)
+        summary["metrics"]["docs"] = docs
+        return summary
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+async def bench_process_queue(rows: int = 30, latency: dict = None, text_ops: int = 2, image_ops: int = 1,
+                              verbose: bool = False) -> dict:
+    """
+    无界面驱动 RapidExportPanel.process_queue
+
+    main.py 依赖 Windows 专属模块（wmi / win32clipboard 等），无法导入时记为跳过。
+    """
+    try:
+        with quiet(not verbose):
+            import main
+    except Exception as e:
+        return skipped(f"无法导入 main.py: {e}")
+
+    panel = main.rapid_export_panel
+    state = main.template_state
+    if panel is None:
+        return skipped("极速出图面板未初始化")
+
+    output_dir = tempfile.mkdtemp(prefix="ice_bench_")
+    try:
+        with quiet(not verbose):
+            async with MockEnvironment(server=main.ps_server, latency=latency) as env:
+                texts, images = _pick_targets(env.layer_tree, text_ops, image_ops)
+                state.reset()
+                state.current_doc = env.plugin.active_doc.name
+                state.layer_tree = env.layer_tree
+                state.text_groups = [f"文字组 {i}" for i in range(1, len(texts) + 1)] or ["文字组 1"]
+                state.image_groups = [f"图片组 {j}" for j in range(1, len(images) + 1)] or ["图片组 1"]
+                state.text_rules = [{"name": n["name"], "path": n["path"], "mapping_key": f"文字组 {i}", "regex_steps": []}
+                                    for i, n in enumerate(texts, 1)]
+                state.image_rules = [{"name": n["name"], "path": n["path"], "mapping_key": f"图片组 {j}"}
+                                     for j, n in enumerate(images, 1)]
+                state.render_presets = [{
+                    "name": "基准", "filename": "{index}_{文字组 1}", "format": "jpg",
+                    "output_path": output_dir, "root_layers": [], "tiling": {"enabled": False},
+                }]
+                panel.export_path = output_dir
+                panel.copy_after_render = False
+                panel.strategy_snapshot = None
+
+                lines = ["\t".join([f"行{r + 1}文本{i}" for i in range(1, len(texts) + 1)] +
+                                   [image_path(output_dir, r % 5, j) for j in range(1, len(images) + 1)])
+                         for r in range(rows)]
+                start_index = len(panel.task_history)
+                started = time.perf_counter()
+                panel.add_to_queue(lines, source="文件 benchmark.csv")
+                tasks = panel.task_history[start_index:]
+                if not tasks:
+                    return skipped("任务未入队（策略或变量组配置无效）")
+                while any(t["status"] in ("waiting", "running") for t in tasks):
+                    if not panel.is_running and not panel.queue:
+                        break
+                    await asyncio.sleep(0.002)
+                elapsed = time.perf_counter() - started
+        row_results = [{"status": "ok" if t["status"] == "success" else t["status"]} for t in tasks]
+        return _summarize(elapsed, row_results, len(tasks))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
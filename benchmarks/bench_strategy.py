@@ -0,0 +1,152 @@
+"""
+策略序列化 / 反序列化与正则管线基准
+
+- strategy.serialize / strategy.deserialize: 约 1 万图层的合成图层树
+- regex.apply_regex_steps / regex.server_regex: 多步正则预处理
+"""
+
+import copy
+
+from .harness import annotate_paths, measure, result, quiet
+from mock_plugin import build_layer_tree
+from server import PSServer
+from strategy import StrategyParser, StrategyLoader, apply_regex_steps
+
+
+class BenchState:
+    """与 TemplateState 字段一致的无界面状态，用于驱动 StrategyParser / StrategyLoader"""
+
+    def __init__(self):
+        self.layer_tree = []
+        self.reset()
+
+    def reset(self):
+        self.text_rules = []
+        self.image_rules = []
+        self.filter_rules = []
+        self.global_filter_steps = []
+        self.global_filter_active = False
+        self.render_presets = []
+        self.text_groups = ["文字组 1"]
+        self.image_groups = ["图片组 1"]
+
+    def ensure_render_preset(self):
+        if not self.render_presets:
+            self.render_presets.append({
+                "name": "默认方案", "filename": "{文字组 1}_{模板名}_{时间}", "format": "jpg",
+                "output_path": "./output", "quality": 85, "root_layers": [], "tiling": {"enabled": False},
+            })
+
+
+def build_large_tree(layers: int = 10000) -> tuple:
+    """按约 60% 文本 / 25% 像素 / 15% 智能对象的比例生成图层树，返回 (tree, nodes)"""
+    smart_objects = max(1, int(layers * 0.15) // 3)
+    groups = max(1, layers // 100)
+    text_layers = int(layers * 0.6)
+    image_layers = max(1, layers - text_layers - smart_objects * 3 - groups - 1)
+    tree = build_layer_tree(text_layers=text_layers, image_layers=image_layers, groups=groups,
+                            smart_objects=smart_objects, seed=7)
+    return tree, annotate_paths(tree)
+
+
+def _spread(items: list, count: int) -> list:
+    """在整棵树上均匀取样，避免规则全部命中靠前的节点"""
+    if count >= len(items):
+        return list(items)
+    step = len(items) / count
+    return [items[int(i * step)] for i in range(count)]
+
+
+def build_state(tree: list, nodes: list, text_rules: int = 400, image_rules: int = 150,
+                filter_rules: int = 50, presets: int = 3, groups: int = 8) -> BenchState:
+    state = BenchState()
+    state.layer_tree = tree
+    state.text_groups = [f"文字组 {i + 1}" for i in range(groups)]
+    state.image_groups = [f"图片组 {i + 1}" for i in range(groups)]
+    texts = _spread([n for n in nodes if n["kind"] == "TEXT"], text_rules)
+    images = _spread([n for n in nodes if n["kind"] == "PIXEL" and n["name"] != "背景"], image_rules)
+    smart_objects = _spread([n for n in nodes if n["kind"] == "SMARTOBJECT"], filter_rules)
+    state.text_rules = [{
+        "name": n["name"], "path": n["path"], "mapping_key": state.text_groups[i % groups],
+        "regex_steps": [{"find": r"^\s+|\s+$", "replace": ""}],
+    } for i, n in enumerate(texts)]
+    state.image_rules = [{"name": n["name"], "path": n["path"], "mapping_key": state.image_groups[i % groups]}
+                         for i, n in enumerate(images)]
+    state.filter_rules = [{
+        "name": n["name"], "path": n["path"],
+        "filter_steps": [{"type": "gaussianBlur", "params": {"radius": 2}}],
+    } for n in smart_objects]
+    top_paths = [n["path"] for n in tree]
+    state.render_presets = [{
+        "name": f"方案 {i + 1}", "filename": f"{{文字组 1}}_{i + 1}", "format": "jpg",
+        "output_path": "./output", "quality": 90, "root_layers": top_paths[i::presets],
+        "tiling": {"enabled": False},
+    } for i in range(presets)]
+    return state
+
+
+def bench_strategy(layers: int = 10000, repeat: int = 5, verbose: bool = False) -> dict:
+    tree, nodes = build_large_tree(layers)
+    state = build_state(tree, nodes)
+    rules = len(state.text_rules) + len(state.image_rules) + len(state.filter_rules)
+
+    with quiet(not verbose):
+        data, errors = StrategyParser.serialize(state, tree)
+    if errors:
+        raise RuntimeError(f"序列化失败: {errors[:3]}")
+
+    with quiet(not verbose):
+        ser = measure(lambda: StrategyParser.serialize(state, tree), repeat=repeat)
+        target = BenchState()
+        de = measure(lambda: StrategyLoader.deserialize(copy.deepcopy(data), target, tree), repeat=repeat)
+        copy_cost = measure(lambda: copy.deepcopy(data), repeat=repeat)
+
+    deserialize_seconds = max(de["median"] - copy_cost["median"], 0.0)
+    common = {"layers": len(nodes), "rules": rules, "operations": len(data["operations"])}
+    return {
+        "strategy.serialize": result("seconds", "lower", seconds=ser["median"], min_seconds=ser["min"],
+                                     **common),
+        "strategy.deserialize": result("seconds", "lower", seconds=deserialize_seconds,
+                                       min_seconds=max(de["min"] - copy_cost["min"], 0.0), **common),
+    }
+
+
+# 常见的文本清洗步骤：去首尾空白、合并空白、全角转半角括号、交换姓名顺序、去除 emoji 等符号
+REGEX_PIPELINE = [
+    {"name": "去首尾空白", "find": r"^\s+|\s+$", "replace": ""},
+    {"name": "合并空白", "find": r"\s{2,}", "replace": " "},
+    {"name": "括号", "find": r"（(.*?)）", "replace": "($1)"},
+    {"name": "交换", "find": r"^(\S+)\s+(\S+)", "replace": "$2 $1"},
+    {"name": "去符号", "find": r"[^\w\s()\-.,，。]", "replace": ""},
+    {"name": "价格", "find": r"(\d+)\.0+\b", "replace": "$1"},
+]
+
+
+def _regex_inputs(count: int) -> list:
+    return [f"  商品{i}   第{i % 13}号（限定款）  ★ 价格 {i % 97}.00 元  " for i in range(count)]
+
+
+def bench_regex(lines: int = 5000, repeat: int = 5, verbose: bool = False) -> dict:
+    texts = _regex_inputs(lines)
+    server = PSServer()
+
+    def run_ui():
+        for text in texts:
+            apply_regex_steps(text, REGEX_PIPELINE)
+
+    def run_server():
+        for text in texts:
+            server._apply_regex_processing(text, REGEX_PIPELINE)
+
+    with quiet(not verbose):
+        ui_stats = measure(run_ui, repeat=repeat)
+        server_stats = measure(run_server, repeat=repeat)
+    steps = len(REGEX_PIPELINE)
+    return {
+        "regex.apply_regex_steps": result("lines_per_sec", "higher", lines=lines, steps=steps,
+                                          seconds=ui_stats["median"],
+                                          lines_per_sec=lines / ui_stats["median"]),
+        "regex.server_regex": result("lines_per_sec", "higher", lines=lines, steps=steps,
+                                     seconds=server_stats["median"],
+                                     lines_per_sec=lines / server_stats["median"]),
+    }
@@ -0,0 +1,247 @@
+"""
+基准测试公共工具
+
+1. 计时：多次重复取中位数
+2. MockEnvironment：在本进程内启动 PSServer 与 mock_plugin，无需 Photoshop
+3. 结果读写与版本间对比
+"""
+
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from server import PSServer  # noqa: E402
+from mock_plugin import MockPlugin  # noqa: E402
+from latency_model import LatencyModel  # noqa: E402
+
+
+# ============================================
+# 结果
+# ============================================
+
+def result(primary: str, better: str = "higher", **metrics) -> dict:
+    """
+    单个用例的结果
+
+    primary: 用于版本对比的主指标名
+    better: "higher" 表示越大越好（吞吐量），"lower" 表示越小越好（耗时）
+    """
+    return {"primary": primary, "better": better, "metrics": metrics}
+
+
+def skipped(reason: str) -> dict:
+    return {"skipped": reason}
+
+
+def failed(reason: str) -> dict:
+    """正确性检查未通过（运行结束时退出码为 1）"""
+    return {"failed": reason}
+
+
+def measure(func, repeat: int = 5, warmup: int = 1) -> dict:
+    """同步函数计时：预热后重复 repeat 次，返回单次耗时统计（秒）"""
+    for _ in range(warmup):
+        func()
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - started)
+    return {"median": statistics.median(runs), "min": min(runs), "max": max(runs)}
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool = True):
+    """屏蔽被测代码的 print 日志（格式化开销仍计入）"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# ============================================
+# 模拟环境
+# ============================================
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def annotate_paths(tree: list, prefix: str = "主文档") -> list:
+    """按 UI 图层树的约定补全每个节点的 path 字段，返回所有节点"""
+    nodes = []
+
+    def walk(items, parent):
+        for node in items:
+            node["path"] = f"{parent} > {node['name']}"
+            nodes.append(node)
+            walk(node.get("children", []), node["path"])
+
+    walk(tree, prefix)
+    return nodes
+
+
+class MockEnvironment:
+    """
+    本进程内的 PSServer + MockPlugin
+
+    用法:
+        async with MockEnvironment(latency={"render": "fixed:0.01"}) as env:
+            await env.server.execute_batch_with_data(...)
+    传入 server 时复用该实例（例如 main.ps_server），仅改写端口。
+    """
+
+    def __init__(self, server: PSServer = None, latency: dict = None, layer_tree_kwargs: dict = None,
+                 write_outputs: bool = True, image_size: tuple = (32, 32), docs: int = 1):
+        self.port = free_port()
+        if server is None:
+            server = PSServer(port=self.port)
+        else:
+            server.port = self.port
+        self.server = server
+        # 模拟延迟不能写入用户的耗时模型：运行期间换成只在内存中学习的模型
+        self._latency_model = server.latency_model
+        server.latency_model = LatencyModel()
+        self.plugin = MockPlugin(
+            url=f"ws://127.0.0.1:{self.port}",
+            latency=latency,
+            write_outputs=write_outputs,
+            image_size=image_size,
+            docs=docs,
+            layer_tree_kwargs=layer_tree_kwargs,
+            seed=1,
+            reconnect=False,
+        )
+        self._task = None
+
+    async def __aenter__(self):
+        await self.server.start()
+        self._task = asyncio.create_task(self.plugin.run())
+        await asyncio.wait_for(self.plugin.connected.wait(), 10)
+        # 等待服务端登记连接
+        for _ in range(200):
+            if self.server.is_connected():
+                break
+            await asyncio.sleep(0.01)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.plugin.stop()
+        if self._task:
+            with contextlib.suppress(Exception):
+                await asyncio.wait_for(self._task, 5)
+        await self.server.stop()
+        self.server.latency_model = self._latency_model
+
+    @property
+    def layer_tree(self) -> list:
+        return self.plugin.active_doc.layers
+
+
+# ============================================
+# 报告与对比
+# ============================================
+
+def environment_info() -> dict:
+    info = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        import config
+        info["app_version"] = config.APP_VERSION
+    except Exception:
+        pass
+    try:
+        info["commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        info["commit"] = None
+    return info
+
+
+def write_report(path: str, results: dict, meta: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+def load_report(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _scale(item: dict) -> dict:
+    return {k: v for k, v in item.get("metrics", {}).items()
+            if isinstance(v, int) and not isinstance(v, bool) and k not in ("ok", "bytes")}
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> tuple:
+    """
+    对比两份报告的主指标
+
+    返回 (rows, regressions)，rows 每项为
+    {"name", "metric", "baseline", "current", "change", "status"}
+    change 为有利方向的相对变化（正数表示变好）；变差超过 threshold 记为 regression；
+    规模参数（整数指标，如 rows / layers）不一致时记为 mismatch，不参与判定
+    """
+    rows = []
+    regressions = []
+    base_results = baseline.get("results", {})
+    for name, cur in current.get("results", {}).items():
+        base = base_results.get(name)
+        if not base or any(key in item for item in (base, cur) for key in ("skipped", "failed")):
+            continue
+        metric = cur["primary"]
+        old = base.get("metrics", {}).get(metric)
+        new = cur["metrics"].get(metric)
+        if not old or new is None:
+            continue
+        if _scale(base) != _scale(cur):
+            rows.append({"name": name, "metric": metric, "baseline": old, "current": new, "change": 0.0,
+                         "status": "mismatch"})
+            continue
+        if cur.get("better") == "lower":
+            change = (old - new) / old
+        else:
+            change = (new - old) / old
+        if change < -threshold:
+            status = "regression"
+        elif change > threshold:
+            status = "improved"
+        else:
+            status = "same"
+        row = {"name": name, "metric": metric, "baseline": old, "current": new, "change": change, "status": status}
+        rows.append(row)
+        if status == "regression":
+            regressions.append(row)
+    return rows, regressions
+
+
+def format_comparison(rows: list) -> str:
+    marks = {"regression": "退化", "improved": "提升", "same": "持平", "mismatch": "规模不同，未比较"}
+    lines = [f"{'用例':<40} {'指标':<22} {'基线':>12} {'当前':>12} {'变化':>8}  结论"]
+    for row in rows:
+        lines.append(
+            f"{row['name']:<40} {row['metric']:<22} {row['baseline']:>12.4g} {row['current']:>12.4g} "
+            f"{row['change'] * 100:>+7.1f}%  {marks[row['status']]}"
+        )
+    return "\n".join(lines)
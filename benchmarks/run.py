@@ -0,0 +1,126 @@
+"""
+基准测试入口
+
+用法:
+    python -m benchmarks                                  # 运行全部用例并打印结果
+    python -m benchmarks --output bench.json              # 写出 JSON 结果
+    python -m benchmarks --compare base.json --threshold 0.15   # 与基线对比，退化时退出码为 1
+    python -m benchmarks --only strategy regex --quick    # 只跑部分用例，缩小规模
+
+filters 用例同时检查滤镜精度，未通过时退出码为 1。
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from .harness import environment_info, write_report, load_report, compare, format_comparison
+from . import bench_pipeline, bench_strategy, bench_import, bench_filters
+from mock_plugin import _parse_latency
+
+SUITES = ("pipeline", "strategy", "regex", "import", "filters")
+
+
+async def _run_pipeline(args) -> dict:
+    latency = _parse_latency(args.latency)
+    return {
+        "batch.execute_batch_with_data": await bench_pipeline.bench_batch(
+            rows=args.rows, latency=latency, renders=args.renders, verbose=args.verbose),
+        "batch.execute_workflow": await bench_pipeline.bench_workflow(
+            docs=3, rows_per_doc=max(1, args.rows // 3), latency=latency, verbose=args.verbose),
+        "batch.rapid_export_process_queue": await bench_pipeline.bench_process_queue(
+            rows=args.rows, latency=latency, verbose=args.verbose),
+    }
+
+
+def run_suites(args) -> dict:
+    results = {}
+    for suite in args.only:
+        started = time.perf_counter()
+        print(f">>> {suite} ...", flush=True)
+        if suite == "pipeline":
+            results.update(asyncio.run(_run_pipeline(args)))
+        elif suite == "strategy":
+            results.update(bench_strategy.bench_strategy(layers=args.layers, repeat=args.repeat, verbose=args.verbose))
+        elif suite == "regex":
+            results.update(bench_strategy.bench_regex(lines=args.lines, repeat=args.repeat, verbose=args.verbose))
+        elif suite == "import":
+            results.update(bench_import.bench_import(rows=args.table_rows, repeat=args.repeat))
+        elif suite == "filters":
+            results.update(bench_filters.bench_filters(size=args.image_size, repeat=args.repeat))
+        print(f"    完成，用时 {time.perf_counter() - started:.1f}s", flush=True)
+    return results
+
+
+def print_results(results: dict):
+    for name, item in results.items():
+        if "skipped" in item:
+            print(f"{name:<40} 跳过: {item['skipped']}")
+            continue
+        if "failed" in item:
+            print(f"{name:<40} 失败: {item['failed']}")
+            continue
+        metrics = item["metrics"]
+        primary = item["primary"]
+        extras = ", ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}"
+                           for k, v in metrics.items() if k != primary)
+        print(f"{name:<40} {primary}={metrics[primary]:.4g}  ({extras})")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="小冰美化助手性能基准测试")
+    parser.add_argument("--only", nargs="*", choices=SUITES, default=list(SUITES), help="只运行指定用例组")
+    parser.add_argument("--rows", type=int, default=60, help="批量管线的数据行数")
+    parser.add_argument("--renders", type=int, default=1, help="批量管线每行的渲染方案数")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="mock 插件延迟分布，格式同 mock_plugin.py，例如 render=fixed:0.05；默认无延迟，只测开销")
+    parser.add_argument("--layers", type=int, default=10000, help="策略序列化用例的图层数")
+    parser.add_argument("--lines", type=int, default=5000, help="正则用例的文本行数")
+    parser.add_argument("--table-rows", type=int, default=5000, help="表格导入用例的行数")
+    parser.add_argument("--image-size", type=int, default=1024, help="滤镜用例的图像边长（像素）")
+    parser.add_argument("--repeat", type=int, default=5, help="微基准重复次数（取中位数）")
+    parser.add_argument("--quick", action="store_true", help="缩小规模，用于快速冒烟")
+    parser.add_argument("--output", "-o", default=None, help="结果 JSON 路径")
+    parser.add_argument("--compare", default=None, help="基线结果 JSON，用于检测退化")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定退化的相对阈值（默认 10%%）")
+    parser.add_argument("--verbose", action="store_true", help="显示被测代码的日志输出")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.rows = min(args.rows, 12)
+        args.layers = min(args.layers, 2000)
+        args.lines = min(args.lines, 1000)
+        args.table_rows = min(args.table_rows, 1000)
+        args.image_size = min(args.image_size, 256)
+        args.repeat = min(args.repeat, 3)
+
+    meta = environment_info()
+    meta["args"] = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    results = run_suites(args)
+    print()
+    print_results(results)
+
+    if args.output:
+        write_report(args.output, results, meta)
+        print(f"\n结果已写入 {args.output}")
+
+    broken = [name for name, item in results.items() if "failed" in item]
+    if broken:
+        print(f"\n{len(broken)} 项检查未通过: {', '.join(broken)}")
+
+    if args.compare:
+        baseline = load_report(args.compare)
+        rows, regressions = compare(baseline, {"results": results}, args.threshold)
+        base_meta = baseline.get("meta", {})
+        print(f"\n对比基线 {args.compare} (commit {base_meta.get('commit')}, {base_meta.get('timestamp')})")
+        print(format_comparison(rows))
+        if regressions:
+            print(f"\n检测到 {len(regressions)} 项性能退化（阈值 {args.threshold:.0%}）")
+            return 1
+        print("\n未检测到性能退化")
+    return 1 if broken else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
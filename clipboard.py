@@ -0,0 +1,391 @@
+"""
+小冰美化助手 - 剪贴板 (clipboard.py)
+
+极速出图「渲染完复制到剪贴板」原本在界面事件循环里等待文件写完（time.sleep 重试）、
+用 PIL 解码整图、转 RGB、编码 BMP 再去掉文件头，每个任务都会让界面与 WebSocket 卡顿数百毫秒。本模块：
+1. 剪贴板后端抽象：Windows 使用 win32clipboard，其它平台使用进程内的 MemoryClipboard
+2. 后台导出线程：submit 把图片放入队列立即返回 Future；线程中等待文件就绪、解码、
+   直接把像素打包为 DIB（BITMAPINFOHEADER + 自下而上的 BGR 行，不经过 BMP 编码），
+   剪贴板被占用时在线程中重试。队列中积压的多张图片只复制最后一张（剪贴板只保留一份内容）
+3. DIB 按 (路径, 修改时间, 大小) 缓存，同一输出再次复制（任务列表中的复制按钮）时不再解码
+4. 由 Python 编码的输出（见 encoder.py），编码器把内存中的像素交给 offer；复制时直接打包，
+   不再等待文件、读盘解码。PS 直接保存的输出仍从文件解码
+
+剪贴板监听（ClipboardWatcher）原本每 0.8 秒打开剪贴板读取全部文本再与上次比较。现在：
+1. 只读取系统的剪贴板序号（GetClipboardSequenceNumber，不占用剪贴板），序号变化且有文本时才读取
+2. 按内容哈希去重（与上次入队相同、或短时间内出现过的内容不再入队）
+3. 防抖：连续多次变化（其它程序分多次写入、快速连续复制）合并为一批再回调
+后端不支持序号时退回按 fallback_interval 定时读取。
+"""
+
+import hashlib
+import os
+import queue
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Optional
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import win32clipboard
+except ImportError:
+    win32clipboard = None
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [clipboard] {message}")
+
+
+# ============================================
+# 后端
+# ============================================
+
+class ClipboardBackend(ABC):
+    """剪贴板后端接口"""
+
+    name = "none"
+
+    @abstractmethod
+    def set_image_dib(self, dib: bytes):
+        ...
+
+    @abstractmethod
+    def set_text(self, text: str):
+        ...
+
+    @abstractmethod
+    def get_text(self) -> Optional[str]:
+        ...
+
+    def sequence_number(self) -> Optional[int]:
+        """剪贴板内容每次变化都会改变的序号；不支持时返回 None"""
+        return None
+
+
+class Win32Clipboard(ClipboardBackend):
+    """Windows 剪贴板（pywin32）"""
+
+    name = "win32"
+
+    def set_image_dib(self, dib: bytes):
+        win32clipboard.OpenClipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            win32clipboard.SetClipboardData(win32clipboard.CF_DIB, dib)
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def set_text(self, text: str):
+        win32clipboard.OpenClipboard()
+        try:
+            win32clipboard.EmptyClipboard()
+            win32clipboard.SetClipboardText(text, win32clipboard.CF_UNICODETEXT)
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def get_text(self) -> Optional[str]:
+        # 没有文本格式时不打开剪贴板（不与其它程序争用）
+        if not win32clipboard.IsClipboardFormatAvailable(win32clipboard.CF_UNICODETEXT):
+            return None
+        win32clipboard.OpenClipboard()
+        try:
+            return win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
+        finally:
+            win32clipboard.CloseClipboard()
+
+    def sequence_number(self) -> Optional[int]:
+        try:
+            return win32clipboard.GetClipboardSequenceNumber()
+        except Exception:
+            return None
+
+
+class MemoryClipboard(ClipboardBackend):
+    """进程内剪贴板：非 Windows 平台使用"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.dib: Optional[bytes] = None
+        self.text: Optional[str] = None
+        self.sequence = 0
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def set_image_dib(self, dib: bytes):
+        with self._lock:
+            self.dib, self.text = dib, None
+            self.sequence += 1
+
+    def set_text(self, text: str):
+        with self._lock:
+            self.dib, self.text = None, text
+            self.sequence += 1
+
+    def get_text(self) -> Optional[str]:
+        with self._lock:
+            self.reads += 1
+            return self.text
+
+    def sequence_number(self) -> Optional[int]:
+        with self._lock:
+            return self.sequence
+
+
+def default_backend() -> ClipboardBackend:
+    return Win32Clipboard() if win32clipboard else MemoryClipboard()
+
+
+# ============================================
+# DIB
+# ============================================
+
+def dib_from_image(img) -> bytes:
+    """把图片像素打包为 CF_DIB 数据：BITMAPINFOHEADER + 自下而上、4 字节对齐的 24 位 BGR 行"""
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    width, height = img.size
+    stride = (width * 3 + 3) & ~3
+    pixels = img.tobytes("raw", ("BGR", stride, -1))
+    header = struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, len(pixels), 3780, 3780, 0, 0)
+    return header + pixels
+
+
+def wait_readable(path: str, attempts: int = 10, interval: float = 0.05) -> bool:
+    """等待文件出现且可读（PS 保存完成前可能被锁定）"""
+    for _ in range(attempts):
+        try:
+            with open(path, "rb") as f:
+                f.read(1)
+            return True
+        except OSError:
+            time.sleep(interval)
+    return False
+
+
+# ============================================
+# 后台导出
+# ============================================
+
+class ClipboardExporter:
+    """
+    剪贴板图片导出（单个后台线程 + 队列）
+
+    参数:
+        backend: 剪贴板后端，默认按平台选择
+        retries: 剪贴板被其它程序占用时的重试次数
+        cache_size: 缓存的 DIB 数量
+        pixel_slots: 保留的编码器像素数量（整图像素占用较大，只保留最近几张）
+    """
+
+    def __init__(self, backend: ClipboardBackend = None, retries: int = 3, cache_size: int = 4, pixel_slots: int = 2):
+        self.backend = backend or default_backend()
+        self.retries = retries
+        self.cache_size = cache_size
+        self.pixel_slots = pixel_slots
+        self._pixels: "OrderedDict[tuple, object]" = OrderedDict()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self.stats = {"copied": 0, "superseded": 0, "failed": 0, "cache_hits": 0, "pixel_hits": 0}
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    @staticmethod
+    def _key(path: str, st) -> tuple:
+        return (os.path.normcase(os.path.abspath(path)), st.st_mtime_ns, st.st_size)
+
+    def offer(self, path: str, image):
+        """编码器回调：path 刚由 image 编码写出；之后复制该文件时直接使用这些像素"""
+        try:
+            key = self._key(path, os.stat(path))
+        except OSError:
+            return
+        with self._lock:
+            self._pixels[key] = image
+            self._pixels.move_to_end(key)
+            while len(self._pixels) > self.pixel_slots:
+                self._pixels.popitem(last=False)
+
+    def submit(self, path: str) -> Future:
+        """
+        复制输出文件的图片到剪贴板（立即返回）。
+        Future 结果为 True（已复制）/ False（被之后提交的图片取代）；失败时为异常
+        """
+        future = Future()
+        self._queue.put((path, future))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="clipboard", daemon=True)
+                self._thread.start()
+        return future
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            # 只复制积压中的最后一张
+            while True:
+                try:
+                    newer = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item[1].set_running_or_notify_cancel():
+                    item[1].set_result(False)
+                self.stats["superseded"] += 1
+                item = newer
+            path, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._copy(path)
+                self.stats["copied"] += 1
+                future.set_result(True)
+            except Exception as e:
+                self.stats["failed"] += 1
+                future.set_exception(e)
+
+    def _copy(self, path: str):
+        dib = self.dib_for(path)
+        for attempt in range(self.retries):
+            try:
+                self.backend.set_image_dib(dib)
+                return
+            except Exception:
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(0.1)
+
+    def dib_for(self, path: str) -> bytes:
+        """输出文件的 DIB（按修改时间与大小缓存；有编码器交来的像素时不读盘）"""
+        if not wait_readable(path):
+            raise FileNotFoundError(f"输出文件不存在或不可读: {path}")
+        key = self._key(path, os.stat(path))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return cached
+            pixels = self._pixels.pop(key, None)
+        if pixels is not None:
+            self.stats["pixel_hits"] += 1
+            dib = dib_from_image(pixels)
+        else:
+            with Image.open(path) as img:
+                dib = dib_from_image(img)
+        with self._lock:
+            self._cache[key] = dib
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return dib
+
+    def copy_text(self, text: str):
+        self.backend.set_text(text)
+
+
+# ============================================
+# 监听
+# ============================================
+
+class ClipboardWatcher:
+    """
+    剪贴板文本监听（由定时器调用 poll；只检查序号，开销可忽略，可以用很短的间隔）
+
+    参数:
+        backend: 剪贴板后端
+        on_batch: 回调 (lines)，一批非空文本行
+        accept: 返回 False 时暂停（未登录、未连接、队列执行中等）；暂停期间的变化在恢复后处理
+        debounce: 最后一次变化后等待的秒数，期间的变化合并为一批
+        dedupe_window: 该时间（秒）内出现过的相同内容不再入队
+        fallback_interval: 后端不支持序号时读取文本的间隔（秒）
+        clock: 单调时钟（秒），默认 time.monotonic
+    """
+
+    def __init__(self, backend: ClipboardBackend, on_batch, accept=None, debounce: float = 0.3,
+                 dedupe_window: float = 5.0, fallback_interval: float = 0.8, clock=time.monotonic):
+        self.backend = backend
+        self.on_batch = on_batch
+        self.accept = accept
+        self.debounce = debounce
+        self.dedupe_window = dedupe_window
+        self.fallback_interval = fallback_interval
+        self.clock = clock
+        self.active = False
+        self._last_sequence = None  # None: 尚未读取过（开启监听时读取一次当前内容）
+        self._last_read = None
+        self._last_hash = None
+        self._recent = OrderedDict()  # 内容哈希 -> 最近出现时间
+        self._pending = []
+        self._last_change = None
+        self.stats = {"changes": 0, "reads": 0, "read_errors": 0, "duplicates": 0, "batches": 0}
+
+    def reset(self):
+        """重新开启监听时调用：下次 poll 会读取当前内容"""
+        self._last_sequence = None
+        self._last_read = None
+
+    def poll(self):
+        if not self.active or (self.accept is not None and not self.accept()):
+            return
+        now = self.clock()
+        sequence = self.backend.sequence_number()
+        if sequence is None:
+            changed = self._last_read is None or now - self._last_read >= self.fallback_interval
+        else:
+            changed = sequence != self._last_sequence
+        if changed:
+            self._last_read = now
+            try:
+                text = self.backend.get_text()
+            except Exception:
+                # 剪贴板仍被写入方占用：不记录序号，下一次 poll 重新读取
+                self.stats["read_errors"] += 1
+            else:
+                self.stats["changes"] += 1
+                self._last_sequence = sequence
+                if text is not None:
+                    self.stats["reads"] += 1
+                    self._ingest(text, now)
+        if self._pending and now - self._last_change >= self.debounce:
+            lines, self._pending = self._pending, []
+            self.stats["batches"] += 1
+            self.on_batch(lines)
+
+    def _ingest(self, text: str, now: float):
+        clean = text.strip()
+        if not clean:
+            return
+        digest = hashlib.sha1(clean.encode("utf-8", "surrogatepass")).hexdigest()
+        while self._recent and now - next(iter(self._recent.values())) > self.dedupe_window:
+            self._recent.popitem(last=False)
+        if digest == self._last_hash or digest in self._recent:
+            self.stats["duplicates"] += 1
+            return
+        self._last_hash = digest
+        self._recent[digest] = now
+        self._recent.move_to_end(digest)
+        lines = [line.strip() for line in clean.split('\n') if line.strip()]
+        if lines:
+            self._pending.extend(lines)
+            self._last_change = now
+
+
+# 全局实例
+clipboard_exporter = ClipboardExporter()
@@ -0,0 +1,262 @@
+"""
+小冰美化助手 - 文档池 (doc_pool.py)
+
+多文档工作流中，打开大型 PSD 是最耗时的一步。DocumentPool 负责：
+1. 记录工作流打开的文档，并通过 get_open_docs 与 PS 实际状态同步（用户手动关闭的文档会被移除）
+2. PS 中已经打开的同路径文档直接复用（这类文档不属于文档池，永远不会被关闭）
+3. 按最近使用顺序（LRU）在数量 / 内存预算内保留文档，超出时关闭最久未使用且未在使用中的文档
+   内存按 PSD 文件大小估算（PS 实际占用通常更高，预算请留余量）
+4. 预取：在当前任务执行期间以低于批量行的优先级打开下一个任务的文档，只占用派发通道的空闲间隙
+
+多个插件连接（多个 PS 实例）各自打开自己的文档：文档按连接分别记录，预算也按连接分别计算。
+所有方法都作用于当前协程绑定的连接（见 PSServer.use_lane）。
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict
+
+from metrics import registry as metrics
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [docs] {message}")
+
+
+def doc_key(path: str) -> str:
+    """文档路径的比较键：统一分隔符并忽略大小写（PS 所在的 Windows / macOS 默认不区分大小写）"""
+    return (path or "").replace("\\", "/").rstrip("/").lower()
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class DocumentPool:
+    """
+    工作流文档池（每个 PSServer 一个，按插件连接分别记录）
+
+    条目: {"doc_id", "name", "path", "bytes", "owned", "in_use"}
+        owned: 是否由文档池打开（只有 owned 的文档会被关闭）
+        in_use: 正在使用该文档的任务数，大于 0 时不会被淘汰
+    """
+
+    def __init__(self, server, max_docs: int = 3, max_bytes: int = 0, priority: int = 10):
+        self.server = server
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes  # 0 表示不限
+        self.priority = priority
+        # 连接序号 -> 规范化路径 -> 条目（最近使用在后）
+        self._connections: Dict[int, "OrderedDict[str, dict]"] = {}
+        self._pending: Dict[tuple, asyncio.Task] = {}
+        self.stats = {"hits": 0, "adopted": 0, "opened": 0, "prefetched": 0, "evicted": 0}
+
+    # --- 查询 ---
+
+    def _conn_id(self) -> int:
+        lane = self.server.current_lane()
+        return lane.conn_id if lane else 0
+
+    @property
+    def entries(self) -> "OrderedDict[str, dict]":
+        """当前连接的文档"""
+        return self._connections.setdefault(self._conn_id(), OrderedDict())
+
+    def snapshot(self) -> list:
+        """全部连接的文档（每个连接内最久未使用在前），条目附带 conn 字段"""
+        return [dict(entry, conn=conn_id) for conn_id, entries in self._connections.items()
+                for entry in entries.values()]
+
+    def total_bytes(self) -> int:
+        return sum(entry["bytes"] for entry in self.entries.values() if entry["owned"])
+
+    def __contains__(self, path: str) -> bool:
+        """当前连接中已打开或正在预取"""
+        return doc_key(path) in self.entries or (self._conn_id(), doc_key(path)) in self._pending
+
+    # --- 获取 / 释放 ---
+
+    async def acquire(self, path: str) -> dict:
+        """
+        确保文档已打开并激活，返回条目副本（额外包含 reused 字段）；调用方用完后必须 release
+
+        命中文档池或 PS 中已打开同路径文档时只切换激活文档，否则打开文件。
+        """
+        key = doc_key(path)
+        pending = self._pending.get((self._conn_id(), key))
+        if pending:
+            # 预取仍在进行：等待其完成（失败时下面会重新打开）
+            await asyncio.wait({pending})
+
+        open_docs = await self._list_open_docs()
+        entry = self.entries.get(key)
+        if entry and open_docs is not None and entry["doc_id"] not in {d.get("id") for d in open_docs}:
+            _log(f"文档已在 PS 中被关闭，重新打开: {entry['name']}")
+            self.entries.pop(key, None)
+            entry = None
+        reused = entry is not None
+        if entry is None:
+            entry = self._adopt(key, path, open_docs)
+            reused = entry is not None
+        if reused:
+            ok, err = await self.server._await_result(self.server.activate_psd, doc_id=entry["doc_id"], priority=self.priority)
+            if not ok or err:
+                self.entries.pop(key, None)
+                reused = False
+        if not reused:
+            entry = await self._open(key, path)
+        else:
+            self.stats["hits"] += 1
+            metrics.inc("ice_document_pool_total", help_text="文档池获取次数", result="hit")
+
+        entry["in_use"] += 1
+        self.entries.move_to_end(key)
+        await self.evict()
+        return dict(entry, reused=reused)
+
+    async def release(self, path: str, close: bool = False):
+        """任务结束：解除占用；close=True 时立即关闭（仅 owned 文档），否则按预算淘汰"""
+        key = doc_key(path)
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry["in_use"] = max(entry["in_use"] - 1, 0)
+        if close and entry["in_use"] == 0:
+            self.entries.pop(key, None)
+            await self._close(entry)
+        else:
+            await self.evict()
+
+    def forget(self, path: str):
+        """任务出错时移出文档池（不关闭），下次使用时重新同步"""
+        self.entries.pop(doc_key(path), None)
+
+    def prefetch(self, path: str) -> Optional[asyncio.Task]:
+        """
+        后台预取文档；已在文档池 / 预取中 / 超出预算时不做任何事
+
+        打开请求的优先级低于批量行，只在当前任务的行之间的空闲间隙派发。
+        """
+        key = doc_key(path)
+        pending_key = (self._conn_id(), key)
+        if key in self.entries or pending_key in self._pending or self.max_docs <= 0:
+            return None
+        if self._free_slots(_file_size(path)) <= 0:
+            return None
+
+        async def run():
+            try:
+                open_docs = await self._list_open_docs()
+                if self._adopt(key, path, open_docs) is None:
+                    await self._open(key, path, priority=self.priority + 1)
+                    self.stats["prefetched"] += 1
+                await self.evict()
+            except Exception as e:
+                _log(f"预取文档失败 {path}: {e}")
+            finally:
+                self._pending.pop(pending_key, None)
+
+        task = asyncio.create_task(run())
+        self._pending[pending_key] = task
+        return task
+
+    # --- 淘汰 ---
+
+    async def evict(self):
+        """关闭最久未使用、未在使用中的 owned 文档，直到满足数量与内存预算"""
+        while self._over_budget():
+            victim_key = next((k for k, e in self.entries.items() if e["in_use"] == 0 and e["owned"]), None)
+            if victim_key is None:
+                break
+            entry = self.entries.pop(victim_key)
+            self.stats["evicted"] += 1
+            _log(f"关闭最久未使用的文档: {entry['name']}")
+            await self._close(entry)
+
+    async def close_all(self) -> int:
+        """关闭所有连接中文档池打开的空闲文档，返回关闭数量；PS 中原本就打开的文档只移出文档池"""
+        count = 0
+        lanes = {lane.conn_id: lane for lane in self.server.lanes.values()}
+        for conn_id, entries in list(self._connections.items()):
+            with self.server.use_lane(lanes.get(conn_id)):
+                for key, entry in list(entries.items()):
+                    if entry["in_use"]:
+                        continue
+                    entries.pop(key, None)
+                    if entry["owned"] and conn_id in lanes:
+                        await self._close(entry)
+                        count += 1
+        return count
+
+    def drop_connection(self, conn_id: int):
+        """连接断开：该连接的文档状态已无法确认，直接丢弃记录"""
+        self._connections.pop(conn_id, None)
+
+    def _owned_count(self) -> int:
+        return sum(1 for entry in self.entries.values() if entry["owned"])
+
+    def _over_budget(self) -> bool:
+        if self._owned_count() > max(self.max_docs, 0):
+            return True
+        return bool(self.max_bytes) and self.total_bytes() > self.max_bytes
+
+    def _free_slots(self, incoming_bytes: int) -> int:
+        """再放入一个 incoming_bytes 大小的文档后，是否仍能不淘汰在用文档"""
+        idle = sum(1 for e in self.entries.values() if e["owned"] and e["in_use"] == 0)
+        slots = self.max_docs - self._owned_count() + idle
+        if self.max_bytes:
+            idle_bytes = sum(e["bytes"] for e in self.entries.values() if e["owned"] and e["in_use"] == 0)
+            if self.total_bytes() - idle_bytes + incoming_bytes > self.max_bytes:
+                return 0
+        return slots
+
+    # --- 内部 ---
+
+    def _adopt(self, key: str, path: str, open_docs: Optional[list]) -> Optional[dict]:
+        """PS 中已打开的同路径文档：纳入文档池但不归其所有"""
+        for doc in open_docs or []:
+            if doc.get("path") and doc_key(doc["path"]) == key:
+                entry = {"doc_id": doc.get("id"), "name": doc.get("name"), "path": path,
+                         "bytes": _file_size(path), "owned": False, "in_use": 0}
+                self.entries[key] = entry
+                self.stats["adopted"] += 1
+                metrics.inc("ice_document_pool_total", help_text="文档池获取次数", result="adopted")
+                return entry
+        return None
+
+    async def _open(self, key: str, path: str, priority: int = None) -> dict:
+        started = time.time()
+        result, err = await self.server._await_result(self.server.open_psd, path, priority=priority or self.priority)
+        if err or not result:
+            raise Exception(err or "打开文档失败")
+        metrics.observe("ice_document_open_seconds", time.time() - started, help_text="打开文档耗时")
+        metrics.inc("ice_document_pool_total", help_text="文档池获取次数", result="opened")
+        self.stats["opened"] += 1
+        info = result if isinstance(result, dict) else {}
+        entry = {"doc_id": info.get("doc_id"), "name": info.get("name") or path.replace("\\", "/").split("/")[-1],
+                 "path": path, "bytes": _file_size(path), "owned": True, "in_use": 0}
+        self.entries[key] = entry
+        return entry
+
+    async def _close(self, entry: dict):
+        if not entry["owned"]:
+            return
+        _, err = await self.server._await_result(self.server.close_psd, doc_id=entry["doc_id"], name=entry["name"],
+                                                 save=False, priority=self.priority)
+        if err:
+            _log(f"关闭文档失败 {entry['name']}: {err}")
+
+    async def _list_open_docs(self) -> Optional[list]:
+        docs, err = await self.server._await_result(self.server.list_open_documents)
+        return None if err else (docs or [])
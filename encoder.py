@@ -0,0 +1,473 @@
+"""
+小冰美化助手 - 输出编码 (encoder.py)
+
+同一策略的多个渲染方案常常只有输出格式 / 质量不同（网页用 JPG、印刷用 PNG），
+插件却要为每个方案重复复制工作副本、设置可见性、平铺、滤镜并保存。本模块：
+1. 规划：找出除编码参数外完全相同的渲染方案，合并为一次渲染，由 PS 输出无损中间文件（PNG）
+2. 编码：收到插件结果后，在后台执行器中用 Pillow 从中间文件编码出各方案的格式与质量，
+   再删除中间文件；结果按原方案顺序写回 rendered_files
+
+只合并 Pillow 能够等价编码的格式（JPG / PNG / WEBP / BMP）；PSD、GIF 等仍由 PS 直接保存。
+执行器的选择同 image_prep：界面进程使用线程池，命令行批处理可改用进程池。
+Pillow 未安装时不做合并。
+
+渲染方案可带编码参数（encoding，见 DEFAULT_ENCODING）：渐进式 / 优化 JPEG、PNG 压缩级别、
+WebP 无损、去除元数据。PS 的保存对话框无法表达这些参数，带 encoding 的方案即使只有一个
+也走「PNG 中间文件 + Python 编码」；只设置 quality 的方案由插件按比例换算为 PS 的品质直接保存。
+EncodingReport 按方案汇总每批输出的文件数、大小与画质（PSNR），用于调整方案参数。
+
+平铺与全局滤镜也在编码前完成（见 tiling.py、image_filters.py）：可编码格式、且滤镜全部有
+Python 实现的方案由 PS 输出未平铺、未加滤镜的中间文件，平铺与滤镜参数不参与合并判断，
+只差平铺尺寸或滤镜的方案也共用一次 PS 渲染；其余方案仍由 PS 平铺并执行滤镜。
+"""
+
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+import image_filters
+import tiling
+from metrics import registry as metrics
+
+try:
+    from PIL import Image, ImageChops, ImageStat, PngImagePlugin
+except ImportError:
+    Image = None
+    ImageChops = None
+    ImageStat = None
+    PngImagePlugin = None
+
+
+# 可由 Pillow 编码的输出格式 -> Pillow 格式名
+ENCODABLE_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "webp": "WEBP", "bmp": "BMP"}
+
+# 只影响编码、不影响 PS 渲染结果的字段（其余字段相同的方案可以合并渲染）
+ENCODING_FIELDS = {"name", "filename", "file_name", "folder", "output_path", "format", "quality", "encoding"}
+
+MASTER_FORMAT = "png"
+
+# 可在 Python 端完成时不影响 PS 渲染结果的字段（平铺与滤镜）
+POST_FIELDS = set(tiling.TILING_FIELDS) | {"filters"}
+
+# 渲染方案的编码参数默认值（方案中的 encoding 只需写与默认不同的项）
+DEFAULT_ENCODING = {
+    "progressive": False,     # JPEG 渐进式
+    "optimize": True,         # JPEG / PNG 额外一遍优化编码表，文件更小、编码稍慢
+    "png_compress": 6,        # PNG 压缩级别 0-9
+    "webp_lossless": False,   # WebP 无损
+    "strip_metadata": False,  # 去除 EXIF / XMP（ICC 配置文件始终保留，保证颜色一致）
+}
+
+# 有损格式默认质量（与 PS 保存的默认值接近）
+DEFAULT_QUALITY = {"JPEG": 95, "WEBP": 75}
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [encoder] {message}")
+
+
+def render_signature(render: dict) -> str:
+    """渲染方案中影响 PS 渲染结果的部分（可见根图层，以及由 PS 完成时的平铺与滤镜）"""
+    skipped = ENCODING_FIELDS.union(POST_FIELDS) if python_postprocess(render) else ENCODING_FIELDS
+    return json.dumps({k: v for k, v in render.items() if k not in skipped},
+                      sort_keys=True, ensure_ascii=False, default=str)
+
+
+def encoding_options(render: dict) -> dict:
+    """方案的编码参数（补全默认值）"""
+    options = dict(DEFAULT_ENCODING)
+    options.update({k: v for k, v in (render.get("encoding") or {}).items() if k in DEFAULT_ENCODING})
+    return options
+
+
+def python_encoded(render: dict) -> bool:
+    """方案是否需要由 Python 端编码（带 encoding 参数的可编码格式）"""
+    return (Image is not None and isinstance(render.get("encoding"), dict)
+            and str(render.get("format", "")).lower() in ENCODABLE_FORMATS)
+
+
+def python_postprocess(render: dict) -> bool:
+    """
+    方案的平铺与滤镜能否在 Python 端完成：可编码格式，且滤镜全部有 Python 实现
+    （PS 的滤镜作用在平铺之后，两者必须在同一端按同样顺序执行）
+    """
+    return (Image is not None and tiling.available() and image_filters.supported(render.get("filters"))
+            and str(render.get("format", "")).lower() in ENCODABLE_FORMATS)
+
+
+def post_steps(render: dict) -> dict:
+    """编码前的后处理参数：{"tile": (宽, 高), "ppi": 分辨率, "filters": 滤镜步骤}；不需要后处理时为空"""
+    if not python_postprocess(render):
+        return {}
+    steps = {}
+    size = tiling.tiling_size(render)
+    if size:
+        steps.update(tile=size, ppi=int(render.get("resolution") or 300))
+    if render.get("filters"):
+        steps["filters"] = list(render["filters"])
+    return steps
+
+
+def output_path(render: dict) -> str:
+    """与插件 saveExportFile 一致的输出路径：folder/file_name.format"""
+    return f"{render.get('folder', '.')}/{render.get('file_name')}.{str(render.get('format', 'jpg')).lower()}"
+
+
+# ============================================
+# 规划
+# ============================================
+
+class RenderPlan:
+    """
+    一次原子任务的渲染计划
+
+    original: 原渲染方案列表
+    renders: 发给插件的渲染列表（合并后的方案替换为一个 PNG 中间文件）
+    members: 与 renders 对齐；合并项为其对应的原方案列表，其余为 None
+    """
+
+    def __init__(self, original: list, renders: list, members: list):
+        self.original = original
+        self.renders = renders
+        self.members = members
+
+    @property
+    def merged(self) -> bool:
+        return any(members for members in self.members)
+
+    @property
+    def saved_renders(self) -> int:
+        """合并后少执行的 PS 渲染次数"""
+        return sum(len(members) - 1 for members in self.members if members)
+
+
+def plan_renders(renders: list) -> RenderPlan:
+    """
+    把只有编码参数不同的渲染方案合并为一次渲染；带 encoding 参数的方案即使不能合并也改为中间文件。
+    没有需要 Python 编码的方案时原样返回
+    """
+    if Image is None:
+        return RenderPlan(list(renders or []), list(renders or []), [None] * len(renders or []))
+    groups = {}
+    for render in renders or []:
+        if str(render.get("format", "")).lower() in ENCODABLE_FORMATS:
+            groups.setdefault(render_signature(render), []).append(render)
+
+    sent, members, placed = [], [], set()
+    for render in renders or []:
+        group = groups.get(render_signature(render)) if str(render.get("format", "")).lower() in ENCODABLE_FORMATS else None
+        if not group or (len(group) < 2 and not python_encoded(render) and not post_steps(render)):
+            sent.append(render)
+            members.append(None)
+            continue
+        key = id(group)
+        if key in placed:
+            continue  # 已由该组第一个方案的位置代表
+        placed.add(key)
+        master = dict(render, format=MASTER_FORMAT,
+                      file_name=f"{render.get('file_name')}.ice_master_{uuid.uuid4().hex[:8]}")
+        master.pop("quality", None)
+        master.pop("encoding", None)
+        if python_postprocess(render):
+            master.update(tiling=False, width=0, height=0, filters=[])  # 平铺与滤镜在编码前完成
+        sent.append(master)
+        members.append(list(group))
+    return RenderPlan(list(renders or []), sent, members)
+
+
+# ============================================
+# 编码（可在子进程中执行，必须是模块级函数）
+# ============================================
+
+XMP_JPEG_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+
+
+def _xmp_packet(info: dict) -> Optional[bytes]:
+    """中间文件中的 XMP（PS 存储的 PNG 为 iTXt 「XML:com.adobe.xmp」）"""
+    xmp = info.get("xmp") or info.get("XML:com.adobe.xmp")
+    if isinstance(xmp, str):
+        xmp = xmp.encode("utf-8")
+    return xmp or None
+
+
+def _metadata_args(pil_format: str, xmp: bytes) -> dict:
+    """按格式写入 XMP 的保存参数；JPEG 直接写 APP1 段（Pillow 10 的 JPEG 编码器不支持 xmp 参数）"""
+    if pil_format == "JPEG":
+        if len(XMP_JPEG_HEADER) + len(xmp) > 65533:
+            return {}  # 超出单个 APP 段，放弃 XMP（PS 在这种情况下使用扩展 XMP）
+        size = (2 + len(XMP_JPEG_HEADER) + len(xmp)).to_bytes(2, "big")
+        return {"extra": b"\xff\xe1" + size + XMP_JPEG_HEADER + xmp}
+    if pil_format == "WEBP":
+        return {"xmp": xmp}
+    if pil_format == "PNG":
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_itxt("XML:com.adobe.xmp", xmp.decode("utf-8", "replace"), zip=False)
+        return {"pnginfo": pnginfo}
+    return {}
+
+def encode_file(source: str, dest: str, fmt: str, quality: int = None, options: dict = None,
+                measure: bool = True, post: dict = None) -> Tuple[int, Optional[float]]:
+    """
+    从无损中间文件编码出目标格式，返回 (输出文件大小, PSNR)；先写临时文件再替换
+
+    options 为编码参数（见 DEFAULT_ENCODING），post 为编码前的后处理（见 post_steps）。
+    measure 为 True 时对有损输出解码比对编码前的图像，计算 PSNR（dB，无损输出为 None）。
+    """
+    size, psnr, _ = encode_pixels(source, dest, fmt, quality, options, measure, post)
+    return size, psnr
+
+
+def encode_pixels(source: str, dest: str, fmt: str, quality: int = None, options: dict = None,
+                  measure: bool = True, post: dict = None) -> tuple:
+    """同 encode_file，额外返回编码前的图像（已平铺、加滤镜，供同一进程内复用，不必再读盘解码）"""
+    pil_format = ENCODABLE_FORMATS[fmt.lower()]
+    options = dict(DEFAULT_ENCODING, **(options or {}))
+    q = max(1, min(int(quality) if quality is not None else DEFAULT_QUALITY.get(pil_format, 95), 100))
+    post = post or {}
+    with Image.open(source) as img:
+        img.load()
+        icc_profile = img.info.get("icc_profile")
+        save_args = {"icc_profile": icc_profile} if icc_profile else {}
+        exif = img.info.get("exif")
+        xmp = _xmp_packet(img.info)
+        dpi = img.info.get("dpi")
+        if dpi:
+            # 保留文档分辨率（PS 直接保存的文件同样带有分辨率）；平铺时下面改用方案的 ppi
+            save_args["dpi"] = tuple(round(float(v)) for v in dpi)
+        if post.get("tile"):
+            img = tiling.tile_image(img, *post["tile"])
+            save_args["dpi"] = (post["ppi"], post["ppi"])
+        if post.get("filters"):
+            img = image_filters.apply_filters(img, post["filters"])
+        if exif and not options["strip_metadata"] and pil_format != "BMP":
+            save_args["exif"] = exif
+        if xmp and not options["strip_metadata"]:
+            save_args.update(_metadata_args(pil_format, xmp))
+        if pil_format == "JPEG":
+            # 与 PS 存储 JPEG 一致：透明区域合成到白色背景
+            if img.mode in ("RGBA", "LA", "P"):
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            save_args.update(quality=q, subsampling=0 if q >= 90 else 2,
+                             progressive=bool(options["progressive"]), optimize=bool(options["optimize"]))
+        elif pil_format == "WEBP":
+            lossless = bool(options["webp_lossless"])
+            save_args.update(lossless=lossless, quality=100 if lossless else q)
+        elif pil_format == "PNG":
+            level = max(0, min(int(options["png_compress"]), 9))
+            # optimize 会强制最高压缩级别，只在级别本来就是 9 时附加
+            save_args.update(compress_level=level, optimize=bool(options["optimize"]) and level == 9)
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        img.save(tmp, pil_format, **save_args)
+        lossy = pil_format == "JPEG" or (pil_format == "WEBP" and not options["webp_lossless"])
+        psnr = _psnr(img, tmp) if measure and lossy else None
+    os.replace(tmp, dest)
+    return os.path.getsize(dest), psnr, img
+
+
+def _psnr(reference, encoded_path: str) -> Optional[float]:
+    """编码结果与中间文件的峰值信噪比（dB）；完全相同时记为 100"""
+    with Image.open(encoded_path) as encoded:
+        ref = reference.convert("RGB")
+        out = encoded.convert("RGB")
+        if out.size != ref.size:
+            return None
+        rms = ImageStat.Stat(ImageChops.difference(ref, out)).rms
+    mse = sum(value * value for value in rms) / len(rms)
+    return 100.0 if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+
+# ============================================
+# 编码器
+# ============================================
+
+class Encoder:
+    """
+    后台编码执行器
+
+    参数:
+        max_workers: 并发编码数
+        processes: 使用进程池（仅在入口脚本有 __main__ 保护时开启，见 image_prep）
+        measure_quality: 有损编码后计算 PSNR 写入结果（多一次解码，关闭可提高吞吐）
+
+    pixel_sink: (输出路径, 图像) 回调；设置后每个输出编码完成时把内存中的像素交给调用方
+    （界面进程中为剪贴板导出，复制时不再读盘解码）。只在线程池模式下调用，进程池不回传像素。
+    """
+
+    def __init__(self, max_workers: int = None, processes: bool = False, measure_quality: bool = True):
+        self.max_workers = max_workers or max(1, min(4, os.cpu_count() or 1))
+        self.processes = processes
+        self.measure_quality = measure_quality
+        self.pixel_sink: Optional[Callable[[str, object], None]] = None
+        self._executor: Optional[Executor] = None
+        self.stats = {"merged_renders": 0, "encoded": 0, "failed": 0}
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            if self.processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="encoder")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def encode(self, source: str, render: dict) -> dict:
+        """编码单个方案，返回 rendered_files 条目"""
+        dest = output_path(render)
+        loop = asyncio.get_running_loop()
+        keep = self.pixel_sink is not None and not self.processes
+        try:
+            encoded = await loop.run_in_executor(self._pool(), encode_pixels if keep else encode_file, source, dest,
+                                                 str(render.get("format")), render.get("quality"),
+                                                 encoding_options(render), self.measure_quality,
+                                                 post_steps(render))
+        except BrokenProcessPool as e:
+            _log(f"进程池不可用，改用线程池: {e}")
+            self._executor, self.processes = None, False
+            return await self.encode(source, render)
+        except Exception as e:
+            self.stats["failed"] += 1
+            _log(f"编码失败 {dest}: {e}")
+            return {"name": render.get("file_name"), "status": "error", "error": f"编码失败: {e}"}
+        size, psnr = encoded[:2]
+        if keep:
+            try:
+                self.pixel_sink(dest, encoded[2])
+            except Exception as e:
+                _log(f"像素回调异常 {dest}: {e}")
+        self.stats["encoded"] += 1
+        entry = {"name": render.get("file_name"), "path": dest, "status": "ok", "bytes": size}
+        if psnr is not None:
+            entry["psnr"] = round(psnr, 2)
+        return entry
+
+    async def finish(self, plan: RenderPlan, rendered_files: list) -> Tuple[List[dict], float]:
+        """
+        把插件返回的结果（与 plan.renders 对齐）展开为原方案的结果，返回 (rendered_files, 编码耗时)
+
+        取消时插件只返回已完成的部分，未返回的合并项不再编码。
+        """
+        started = time.time()
+        by_render = {}
+        for entry, sent, members in zip(rendered_files or [], plan.renders, plan.members):
+            if not members:
+                by_render[id(sent)] = entry
+                continue
+            ok = str(entry.get("status", "")).lower() in ("ok", "success") and entry.get("path")
+            if not ok:
+                error = entry.get("error") or "渲染失败"
+                for m in members:
+                    by_render[id(m)] = {"name": m.get("file_name"), "status": "error", "error": error}
+                continue
+            source = entry["path"]
+            encoded = await asyncio.gather(*(self.encode(source, m) for m in members))
+            by_render.update((id(m), result) for m, result in zip(members, encoded))
+            try:
+                os.remove(source)
+            except OSError as e:
+                _log(f"删除中间文件失败 {source}: {e}")
+        self.stats["merged_renders"] += plan.saved_renders
+        # 按原方案顺序返回
+        results = [by_render[id(r)] for r in plan.original if id(r) in by_render]
+        return results, time.time() - started
+
+
+# ============================================
+# 批量报告
+# ============================================
+
+def _preset_label(render: dict) -> str:
+    fmt = str(render.get("format", "")).lower()
+    name = render.get("name") or fmt
+    quality = f" q{render.get('quality')}" if render.get("quality") is not None and fmt in ("jpg", "jpeg", "webp") else ""
+    return f"{name} ({fmt}{quality})"
+
+
+def _format_bytes(size: float) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f} MB"
+    return f"{size / 1024:.0f} KB"
+
+
+class EncodingReport:
+    """
+    按渲染方案汇总一批输出：文件数、总大小 / 平均大小、平均 PSNR（仅 Python 编码的有损输出）
+
+    add 的 renders 与 rendered_files 按方案一一对应（execute_strategy_atomic 的回调保证顺序）。
+    PS 直接保存的文件没有 bytes 字段时读取文件大小（插件与服务器在同一台机器上）。
+    """
+
+    def __init__(self):
+        self.presets = {}  # 方案标签 -> 汇总
+
+    def add(self, renders: list, rendered_files: list):
+        for render, entry in zip(renders or [], rendered_files or []):
+            if str(entry.get("status", "")).lower() not in ("ok", "success"):
+                continue
+            size = entry.get("bytes")
+            if size is None and entry.get("path"):
+                try:
+                    size = os.path.getsize(entry["path"])
+                except OSError:
+                    size = None
+            label = _preset_label(render)
+            item = self.presets.setdefault(label, {
+                "preset": label, "format": str(render.get("format", "")).lower(), "quality": render.get("quality"),
+                "engine": "python" if python_encoded(render) or "bytes" in entry else "ps",
+                "files": 0, "bytes": 0, "sized": 0, "psnr_sum": 0.0, "psnr_count": 0})
+            item["files"] += 1
+            if size is not None:
+                item["bytes"] += size
+                item["sized"] += 1
+                metrics.inc("ice_output_bytes_total", size, help_text="输出文件总字节数", format=item["format"])
+            if entry.get("psnr") is not None:
+                item["psnr_sum"] += entry["psnr"]
+                item["psnr_count"] += 1
+
+    def rows(self) -> List[dict]:
+        """每个方案一行：preset, format, quality, engine, files, bytes, avg_bytes, avg_psnr"""
+        rows = []
+        for item in self.presets.values():
+            rows.append({
+                "preset": item["preset"], "format": item["format"], "quality": item["quality"],
+                "engine": item["engine"], "files": item["files"], "bytes": item["bytes"],
+                "avg_bytes": item["bytes"] / item["sized"] if item["sized"] else None,
+                "avg_psnr": round(item["psnr_sum"] / item["psnr_count"], 2) if item["psnr_count"] else None,
+            })
+        return rows
+
+    def lines(self) -> List[str]:
+        """日志 / 界面用的文本行"""
+        lines = []
+        for row in self.rows():
+            text = f"{row['preset']}: {row['files']} 个文件"
+            if row["avg_bytes"] is not None:
+                text += f", 共 {_format_bytes(row['bytes'])}, 平均 {_format_bytes(row['avg_bytes'])}"
+            if row["avg_psnr"] is not None:
+                text += f", PSNR {row['avg_psnr']:.1f} dB"
+            lines.append(text)
+        return lines
+
+
+# 全局实例
+encoder = Encoder()
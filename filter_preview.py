@@ -0,0 +1,235 @@
+"""
+小冰美化助手 - 滤镜实时预览 (filter_preview.py)
+
+FilterEditor 调整参数时原本看不到效果，确认模糊半径只能做一次完整的 PS 渲染。本模块：
+1. 代理图：向 PS 请求一次当前文档的整体渲染，缩小到 max_size 以内并按文档缓存（LRU），
+   同时生成由粗到细的若干级缩略图；同一文档再次打开编辑器时直接复用
+2. 预览：滑块变化后防抖，在线程池中用 image_filters 的 NumPy 实现对代理图执行滤镜；
+   先在最粗一级出一帧，再逐级细化。每帧按耗时模型（每像素秒数，按滤镜组合分别记录）
+   只选择预计在帧预算（默认 50ms）内完成的级别
+3. 半径、高度等以像素为单位的参数按代理图相对原图的缩放比例换算，预览与最终输出的观感一致
+
+只有 image_filters 中有实现的滤镜可以预览；NumPy / Pillow 未安装时不可用。
+"""
+
+import asyncio
+import base64
+import io
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+
+import image_filters
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# 以像素为单位、需要按代理图缩放比例换算的滤镜参数
+SPATIAL_PARAMS = {"gaussianBlur": ("radius",), "emboss": ("height",)}
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [filter_preview] {message}")
+
+
+def scale_steps(steps: list, factor: float) -> list:
+    """把滤镜步骤中的像素参数按 factor 缩放（代理图 / 原图）"""
+    scaled = []
+    for step in steps or []:
+        params = dict(step.get("params") or {})
+        for name in SPATIAL_PARAMS.get(step.get("type"), ()):
+            if isinstance(params.get(name), (int, float)):
+                params[name] = params[name] * factor
+        scaled.append(dict(step, params=params))
+    return scaled
+
+
+def to_data_url(img, quality: int = 85) -> str:
+    """预览帧编码为 data URL（JPEG；有透明通道时用 PNG）"""
+    buf = io.BytesIO()
+    if img.mode in ("RGBA", "LA"):
+        img.save(buf, "PNG", compress_level=1)
+        mime = "image/png"
+    else:
+        img.convert("RGB").save(buf, "JPEG", quality=quality)
+        mime = "image/jpeg"
+    return f"data:{mime};base64,{base64.b64encode(buf.getvalue()).decode('ascii')}"
+
+
+class Proxy:
+    """一份文档的代理图：levels 为由粗到细的缩略图，full_size 为原图尺寸"""
+
+    def __init__(self, image, full_size: tuple, coarse_size: int):
+        self.full_size = full_size
+        self.levels = []
+        size = max(image.size)
+        while size > coarse_size:
+            size //= 2
+        while size < max(image.size):
+            ratio = size / max(image.size)
+            self.levels.append(image.resize((max(1, round(image.width * ratio)), max(1, round(image.height * ratio))),
+                                            Image.BILINEAR))
+            size *= 2
+        self.levels.append(image)
+
+    def factor(self, level) -> float:
+        return level.width / self.full_size[0]
+
+
+class FilterPreview:
+    """
+    滤镜预览引擎（代理图缓存 + 耗时模型）
+
+    参数:
+        max_size: 代理图长边像素
+        coarse_size: 最粗一级的长边像素（首帧）
+        frame_budget: 单帧耗时预算（秒）
+        cache_docs: 最多缓存的文档代理图数量
+    """
+
+    def __init__(self, max_size: int = 512, coarse_size: int = 128, frame_budget: float = 0.05, cache_docs: int = 4):
+        self.max_size = max_size
+        self.coarse_size = coarse_size
+        self.frame_budget = frame_budget
+        self.cache_docs = cache_docs
+        self._proxies: "OrderedDict[str, Proxy]" = OrderedDict()
+        self._pending = {}  # 文档 -> 正在获取代理图的 Future
+        self._cost = {}  # 滤镜组合 -> 每像素耗时（秒，指数平均）
+
+    @property
+    def enabled(self) -> bool:
+        return image_filters.available()
+
+    # --- 代理图 ---
+
+    def cached(self, doc: str) -> Optional[Proxy]:
+        proxy = self._proxies.get(doc)
+        if proxy is not None:
+            self._proxies.move_to_end(doc)
+        return proxy
+
+    def invalidate(self, doc: str = None):
+        if doc is None:
+            self._proxies.clear()
+        else:
+            self._proxies.pop(doc, None)
+
+    async def proxy(self, doc: str, fetch: Callable[[], Awaitable[Optional[str]]]) -> Optional[Proxy]:
+        """返回文档的代理图；没有缓存时调用 fetch 由 PS 渲染整图（返回文件路径），同一文档只请求一次"""
+        cached = self.cached(doc)
+        if cached is not None:
+            return cached
+        pending = self._pending.get(doc)
+        if pending is None:
+            pending = self._pending[doc] = asyncio.ensure_future(self._load(doc, fetch))
+            pending.add_done_callback(lambda _: self._pending.pop(doc, None))
+        return await asyncio.shield(pending)
+
+    async def _load(self, doc: str, fetch) -> Optional[Proxy]:
+        path = await fetch()
+        if not path:
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            proxy = await loop.run_in_executor(None, self._build, path)
+        except Exception as e:
+            _log(f"代理图读取失败 {path}: {e}")
+            return None
+        self._proxies[doc] = proxy
+        while len(self._proxies) > self.cache_docs:
+            self._proxies.popitem(last=False)
+        _log(f"代理图已缓存: {doc} {proxy.full_size[0]}x{proxy.full_size[1]} -> {proxy.levels[-1].size[0]}x{proxy.levels[-1].size[1]}")
+        return proxy
+
+    def _build(self, path: str) -> Proxy:
+        with Image.open(path) as img:
+            full_size = img.size
+            img.draft("RGB", (self.max_size, self.max_size))
+            img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info else "RGB")
+            img.thumbnail((self.max_size, self.max_size), Image.LANCZOS)
+        return Proxy(img, full_size, self.coarse_size)
+
+    # --- 渲染 ---
+
+    def _key(self, steps: list) -> str:
+        return "+".join(step.get("type", "") for step in steps)
+
+    def estimate(self, steps: list, level) -> Optional[float]:
+        """预计耗时（秒）；没有样本时返回 None"""
+        per_pixel = self._cost.get(self._key(steps))
+        return per_pixel * level.width * level.height if per_pixel is not None else None
+
+    def plan(self, proxy: Proxy, steps: list) -> list:
+        """本次预览要渲染的级别：最粗一级总是渲染，之后逐级细化到预计超出帧预算为止"""
+        levels = [proxy.levels[0]]
+        for level in proxy.levels[1:]:
+            estimate = self.estimate(steps, level)
+            if estimate is not None and estimate > self.frame_budget:
+                break
+            levels.append(level)
+        return levels
+
+    def render(self, proxy: Proxy, level, steps: list) -> tuple:
+        """在 level 上执行滤镜并编码，返回 (data URL, 耗时)；在线程池中调用"""
+        started = time.perf_counter()
+        frame = image_filters.apply_filters(level, scale_steps(steps, proxy.factor(level)))
+        url = to_data_url(frame)
+        elapsed = time.perf_counter() - started
+        key = self._key(steps)
+        per_pixel = elapsed / max(1, level.width * level.height)
+        previous = self._cost.get(key)
+        self._cost[key] = per_pixel if previous is None else previous * 0.7 + per_pixel * 0.3
+        return url, elapsed
+
+
+class PreviewSession:
+    """
+    一个编辑器弹窗的预览会话：update 在防抖后由粗到细渲染，新的参数到来时取消尚未完成的渲染
+
+    on_frame(data_url, info): info 含 level（级别序号）、size、elapsed、final（是否为本次最后一帧）
+    """
+
+    def __init__(self, engine: FilterPreview, proxy: Proxy, on_frame: Callable, debounce: float = 0.08):
+        self.engine = engine
+        self.proxy = proxy
+        self.on_frame = on_frame
+        self.debounce = debounce
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, steps: List[dict]):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = asyncio.ensure_future(self._run([dict(step) for step in steps]))
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, steps: list):
+        await asyncio.sleep(self.debounce)
+        loop = asyncio.get_running_loop()
+        levels = self.engine.plan(self.proxy, steps)
+        for i, level in enumerate(levels):
+            url, elapsed = await loop.run_in_executor(None, self.engine.render, self.proxy, level, steps)
+            # 首次使用某个滤镜组合时耗时模型还没有样本，每帧之后重新判断下一级是否在预算内
+            final = i == len(levels) - 1 or self.engine.estimate(steps, levels[i + 1]) > self.engine.frame_budget
+            try:
+                self.on_frame(url, {"level": i, "size": level.size, "elapsed": elapsed, "final": final})
+            except Exception as e:
+                _log(f"预览帧回调异常: {e}")
+            if final:
+                break
+
+
+# 全局实例：代理图按文档在各编辑器弹窗间共享
+filter_preview = FilterPreview()
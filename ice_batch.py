@@ -0,0 +1,454 @@
+"""
+小冰美化助手 - 命令行批量出图 (ice_batch.py)
+
+不启动 NiceGUI 界面，直接启动 PSServer、等待插件连接并执行 execute_batch_with_data。
+
+功能：
+1. 策略来源：JSON 文件（--strategy），或当前/指定 PSD 内的 XMP 策略（--from-psd / --psd）
+2. 数据来源：CSV / XLSX / JSONL；表格按列顺序对应变量组 1..N（文字组在前、图片组在后）
+3. 终端进度条：行进度、当前阶段、吞吐量与剩余时间
+4. 断点续跑：每行结果（含实际输出文件的路径、大小、修改时间与哈希）追加写入日志文件，
+   --resume 时跳过已成功的行，输出文件名保持不变
+5. 结束后输出 JSON 报告；Ctrl+C 会取消插件端正在执行的任务并保留日志
+
+用法:
+    python -m ice_batch --strategy strategy.json --data rows.csv --report report.json
+    python -m ice_batch --psd D:/模板/海报.psd --from-psd --data rows.xlsx --header --output-dir D:/输出
+    python -m ice_batch --strategy strategy.json --data rows.jsonl --resume
+
+退出码: 0 全部成功 / 1 存在失败行 / 2 参数或连接错误 / 130 被中断
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import signal
+import sys
+import time
+from datetime import datetime
+from typing import List, Dict, Optional
+
+from server import get_server, PRIORITY_BATCH
+from table_import import parse_table, table_to_rows
+from progress import format_duration
+from image_prep import image_prep
+from encoder import encoder
+from output_index import OutputIndex
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [batch] {message}", file=sys.stderr)
+
+
+class BatchError(Exception):
+    """参数、数据或连接错误（退出码 2）"""
+
+
+# ============================================
+# 数据读取
+# ============================================
+
+def load_rows(path: str, skip_header: bool = False) -> List[Dict[str, str]]:
+    """
+    读取数据文件，返回 execute_batch_with_data 所需的行字典（键为变量组序号字符串）
+
+    - CSV / XLSX：第 i 列对应变量组 i；--header 时跳过首行，首行中名为 output_filename 的列作为输出文件名
+    - JSONL：每行一个对象（键为组序号）或数组（按位置对应组序号）
+    """
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        return _load_jsonl(path)
+
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    try:
+        file_type, table = parse_table(os.path.basename(path), file_bytes)
+    except ImportError:
+        raise BatchError("未安装 openpyxl，无法解析 Excel，请改用 CSV 或运行 'pip install openpyxl'")
+    if file_type is None:
+        raise BatchError(f"无法识别数据文件格式: {path}")
+
+    return table_to_rows(table, skip_header)
+
+
+def _load_jsonl(path: str) -> List[Dict[str, str]]:
+    rows = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise BatchError(f"JSONL 第 {line_no} 行解析失败: {e}")
+            if isinstance(item, list):
+                rows.append({str(i): "" if v is None else str(v) for i, v in enumerate(item, 1)})
+            elif isinstance(item, dict):
+                rows.append({str(k): "" if v is None else str(v) for k, v in item.items()})
+            else:
+                raise BatchError(f"JSONL 第 {line_no} 行必须是对象或数组")
+    return rows
+
+
+def _fingerprint(value) -> str:
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+# ============================================
+# 断点续跑日志
+# ============================================
+
+class Journal:
+    """
+    逐行结果日志（JSON Lines）
+
+    首行记录数据与策略指纹；续跑时指纹不一致说明数据或策略已变化，拒绝续跑以免输出错位。
+    每行的 outputs 为输出索引条目（路径、大小、修改时间、哈希，见 output_index.py），
+    读取日志时一并恢复到 index，按行号查找输出不需要扫描导出目录。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[int, dict] = {}
+        self.index = OutputIndex()
+
+    def load(self, fingerprint: dict) -> bool:
+        """读取已有日志，返回是否可续跑"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        if not lines:
+            return False
+        header = json.loads(lines[0])
+        if header.get("fingerprint") != fingerprint:
+            raise BatchError(f"日志 {self.path} 对应的数据或策略已变化，无法续跑（去掉 --resume 可重新开始）")
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 中断时可能写了半行
+            self.entries[entry["index"]] = entry
+            self.index.load(entry["index"], entry.get("outputs"))
+        return True
+
+    def start(self, fingerprint: dict):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"fingerprint": fingerprint, "created": _get_timestamp()}, ensure_ascii=False) + "\n")
+        self.entries = {}
+        self.index = OutputIndex()
+
+    def record(self, entry: dict):
+        self.entries[entry["index"]] = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def output_path(self, index: int) -> Optional[str]:
+        """第 index 行的第一个输出文件（索引查询，不扫描目录）"""
+        return self.index.resolve(index)
+
+    def done_indices(self) -> set:
+        return {index for index, entry in self.entries.items() if entry.get("status") == "ok"}
+
+
+# ============================================
+# 进度条
+# ============================================
+
+class ProgressBar:
+    """终端进度条：TTY 下单行刷新，否则每行结束输出一行"""
+
+    def __init__(self, total: int, done: int = 0, width: int = 28, stream=None):
+        self.total = total
+        self.done = done
+        self.failed = 0
+        self.width = width
+        self.stream = stream or sys.stderr
+        self.is_tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.started_at = time.time()
+        self.message = ""
+
+    def update(self, message: str = None):
+        if message is not None:
+            self.message = message
+        if not self.is_tty:
+            return
+        self._draw()
+
+    def row_finished(self, ok: bool, message: str = ""):
+        self.done += 1
+        if not ok:
+            self.failed += 1
+        if self.is_tty:
+            self._draw()
+        else:
+            print(f"[{self.done}/{self.total}] {message}", file=self.stream, flush=True)
+
+    def _draw(self):
+        ratio = self.done / self.total if self.total else 1.0
+        filled = int(self.width * ratio)
+        bar = "#" * filled + "-" * (self.width - filled)
+        failed = f" 失败 {self.failed}" if self.failed else ""
+        elapsed = format_duration(time.time() - self.started_at)
+        line = f"\r[{bar}] {self.done}/{self.total}{failed} {elapsed} {self.message}"
+        columns = 120
+        try:
+            columns = os.get_terminal_size(self.stream.fileno()).columns
+        except (OSError, ValueError, AttributeError):
+            pass
+        self.stream.write(line[:columns - 1].ljust(columns - 1))
+        self.stream.flush()
+
+    def close(self):
+        if self.is_tty:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+# ============================================
+# 执行
+# ============================================
+
+async def _call(server, method, *args, **kwargs):
+    """把 (result, error) 回调式接口转换为 await"""
+    future = asyncio.get_running_loop().create_future()
+
+    def on_done(result=None, error=None):
+        if not future.done():
+            future.set_result((result, error))
+
+    await method(*args, callback=on_done, **kwargs)
+    return await future
+
+
+async def wait_for_plugin(server, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while not server.is_connected():
+        if time.time() >= deadline:
+            return False
+        await asyncio.sleep(0.2)
+    return True
+
+
+async def load_strategy(server, args) -> dict:
+    if args.psd:
+        _log(f"打开文档: {args.psd}")
+        _, err = await _call(server, server.open_psd, args.psd, priority=PRIORITY_BATCH)
+        if err:
+            raise BatchError(f"打开文档失败: {err}")
+    if args.strategy:
+        with open(args.strategy, "r", encoding="utf-8") as f:
+            strategy = json.load(f)
+    else:
+        strategy, err = await _call(server, server.read_strategy)
+        if err:
+            raise BatchError(f"读取文档策略失败: {err}")
+        if not strategy:
+            raise BatchError("当前文档没有保存编辑策略，请先在模板工作台中保存，或使用 --strategy 指定 JSON")
+    if not strategy.get("renders"):
+        raise BatchError("策略中没有渲染方案")
+    if args.output_dir:
+        for render in strategy["renders"]:
+            render["output_path"] = os.path.abspath(args.output_dir)
+    return strategy
+
+
+async def run_batch(args) -> int:
+    rows = load_rows(args.data, skip_header=args.header)
+    if not rows:
+        raise BatchError("数据文件中没有可处理的行")
+
+    server = get_server()
+    server.host = args.host
+    server.port = args.port
+    await server.start()
+    try:
+        _log(f"等待插件连接 ws://{args.host}:{args.port} ...")
+        if not await wait_for_plugin(server, args.wait):
+            raise BatchError(f"{args.wait:.0f}s 内插件未连接")
+        _log("插件已连接")
+        strategy = await load_strategy(server, args)
+        return await _execute(server, strategy, rows, args)
+    finally:
+        await server.stop()
+
+
+async def _execute(server, strategy: dict, rows: list, args) -> int:
+    journal_path = args.journal or f"{os.path.splitext(args.data)[0]}.ice_batch.journal"
+    journal = Journal(journal_path)
+    fingerprint = {"data": _fingerprint(rows), "strategy": _fingerprint(strategy)}
+    resumed = args.resume and journal.load(fingerprint)
+    if not resumed:
+        journal.start(fingerprint)
+
+    done = journal.done_indices()
+    indices = [i for i in range(1, len(rows) + 1) if i not in done]
+    if resumed:
+        _log(f"续跑: 已完成 {len(done)} 行，剩余 {len(indices)} 行（日志 {journal_path}）")
+    started_at = time.time()
+    bar = ProgressBar(len(rows), done=len(done))
+    interrupted = False
+    batch_results = []
+
+    if indices:
+        pending_rows = [rows[i - 1] for i in indices]
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def on_progress(current, total, status, message):
+            index = indices[current - 1] if 0 < current <= len(indices) else None
+            if status == "stage":
+                bar.update(message)
+            elif status == "processing" and index is not None:
+                bar.update(f"第 {index} 行")
+            elif status in ("success", "error", "cancelled") and index is not None:
+                # 服务器消息中的行号是本次提交内的序号，这里换成数据文件中的行号
+                label = {"success": "成功", "error": "失败", "cancelled": "已取消"}[status]
+                detail = message.split(": ", 1)[1] if status == "error" and ": " in message else ""
+                text = f"第 {index} 行{label}" + (f": {detail}" if detail else "")
+                entry = {"index": index, "status": "ok" if status == "success" else status,
+                         "message": text, "finished_at": _get_timestamp()}
+                if status != "error":
+                    entry["outputs"] = journal.index.outputs(index)
+                journal.record(entry)
+                bar.row_finished(status == "success", text)
+
+        async def on_row(result):
+            # 在 success / cancelled 进度之前调用：stat 与哈希在线程池中进行，随后写入日志
+            await loop.run_in_executor(None, journal.index.record, result["index"], result.get("rendered_files"))
+
+        def on_done(results, error):
+            if not finished.done():
+                finished.set_result((results, error))
+
+        batch = asyncio.create_task(server.execute_batch_with_data(
+            strategy, pending_rows, callback=on_done, progress_callback=on_progress, indices=indices,
+            row_callback=on_row))
+
+        def on_interrupt():
+            nonlocal interrupted
+            interrupted = True
+            batch.cancel()
+
+        try:
+            loop.add_signal_handler(signal.SIGINT, on_interrupt)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows 下由 KeyboardInterrupt 处理
+        try:
+            await batch
+            results, error = await finished
+            if error:
+                raise BatchError(f"批量执行失败: {error}")
+            batch_results = results or []
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            interrupted = True
+            await _cancel_in_flight(server)
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGINT)
+            except (NotImplementedError, RuntimeError):
+                pass
+            bar.close()
+
+    # 本次运行的详细结果（含输出文件）覆盖日志中的摘要
+    rows_report = {index: dict(entry) for index, entry in journal.entries.items()}
+    for item in batch_results:
+        rows_report[item["index"]] = dict(item, outputs=journal.index.outputs(item["index"]))
+    ok = sum(1 for entry in rows_report.values() if entry.get("status") == "ok")
+    failed = sorted(index for index, entry in rows_report.items() if entry.get("status") != "ok")
+    elapsed = time.time() - started_at
+    processed = len(rows_report) - len(done)
+    report = {
+        "data": os.path.abspath(args.data),
+        "strategy": os.path.abspath(args.strategy) if args.strategy else "xmp",
+        "journal": os.path.abspath(journal_path),
+        "total": len(rows),
+        "ok": ok,
+        "failed": failed,
+        "skipped_resumed": len(done),
+        "interrupted": interrupted,
+        "elapsed_seconds": elapsed,
+        "rows_per_minute": processed / elapsed * 60 if elapsed > 0 and processed else None,
+        "encoding": server.last_encoding_report,  # 按渲染方案汇总的输出大小与画质
+        "rows": [rows_report[index] for index in sorted(rows_report)],
+    }
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        _log(f"报告已写入 {args.report}")
+
+    _log(f"完成: 成功 {ok}/{len(rows)}，失败 {len(failed)}，用时 {format_duration(elapsed)}")
+    if interrupted:
+        _log(f"已中断，可使用 --resume 从日志 {journal_path} 续跑")
+        return 130
+    return 0 if ok == len(rows) else 1
+
+
+async def _cancel_in_flight(server):
+    """中断时取消插件端正在执行的原子任务，避免 PS 继续占用模态"""
+    for lane in list(server.lanes.values()):
+        for req_id, request in list(lane.in_flight.items()):
+            if request["type"] == "execute_atomic":
+                await server.cancel(req_id)
+    await asyncio.sleep(0.5)
+
+
+# ============================================
+# 命令行入口
+# ============================================
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m ice_batch", description="命令行批量出图（无界面）")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--strategy", help="策略 JSON 文件（编辑策略规范 v1.1.0）")
+    source.add_argument("--from-psd", action="store_true", help="从文档 XMP 读取策略（默认当前活动文档，可配合 --psd）")
+    parser.add_argument("--psd", help="先打开该 PSD 再执行")
+    parser.add_argument("--data", required=True, help="数据文件：CSV / XLSX / JSONL")
+    parser.add_argument("--header", action="store_true", help="CSV/XLSX 首行为表头（跳过）")
+    parser.add_argument("--output-dir", help="覆盖策略中的输出目录")
+    parser.add_argument("--report", help="JSON 结果报告路径")
+    parser.add_argument("--journal", help="断点续跑日志路径（默认与数据文件同名 .ice_batch.journal）")
+    parser.add_argument("--resume", action="store_true", help="从日志续跑，跳过已成功的行")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--wait", type=float, default=120.0, help="等待插件连接的秒数")
+    parser.add_argument("--verbose", action="store_true", help="显示服务器日志")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    devnull = None
+    if not args.verbose:
+        # 服务器日志写 stdout，进度与结果写 stderr
+        devnull = open(os.devnull, "w", encoding="utf-8")
+        sys.stdout = devnull
+    # 命令行入口有 __main__ 保护，替换图片与输出编码可以在进程池中处理
+    image_prep.processes = True
+    encoder.processes = True
+    try:
+        return asyncio.run(run_batch(args))
+    except BatchError as e:
+        _log(f"错误: {e}")
+        return 2
+    except KeyboardInterrupt:
+        _log("已中断")
+        return 130
+    finally:
+        image_prep.shutdown()
+        encoder.shutdown()
+        if devnull:
+            sys.stdout = sys.__stdout__
+            devnull.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""
+小冰美化助手 - 替换图片预处理 (image_prep.py)
+
+插件换图时把源图原样复制进智能对象，PS 每一行都要在智能对象内把几千万像素的相机原图缩小。
+本模块在 Python 端按目标智能对象的尺寸提前处理：
+1. 目标尺寸取自图层树：智能对象内容画布尺寸（content_size），没有时用图层外框（bounds）
+2. 源图大于目标尺寸时等比缩小到恰好放入目标框（与 PS 置入时的适配方式一致），
+   同时把调色板 / 灰度 / 灰度透明等模式统一为 RGB(A)，按 EXIF 方向摆正后重新编码
+   （有透明通道输出 PNG，否则输出 JPEG）；不需要缩小的图片原样使用
+3. 结果保存在内容寻址的缓存仓库（见 image_store）：同一内容、同一目标尺寸只处理一次，
+   仓库中的文件由插件直接置入
+4. 处理在后台执行器中进行：界面进程使用线程池（Pillow 解码、缩放、编码时释放 GIL；
+   界面入口在子进程中会被重新执行，不能使用进程池），命令行批处理可改用进程池
+
+Pillow 未安装时所有图片原样使用。
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from image_store import ImageStore, store_key
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+
+# 只处理这些格式；PSD / PDF / GIF 等交给 PS 原样置入
+PREPARABLE_FORMATS = ("JPEG", "PNG", "WEBP", "BMP", "TIFF", "MPO")
+
+# 16 位 / 浮点等高位深图片交给 PS 处理（Pillow 转 8 位会截断而不是缩放）
+PREPARABLE_MODES = ("1", "L", "LA", "P", "PA", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr")
+
+# 缩小比例不足该值时不值得重新编码（避免对接近目标尺寸的图片做有损编码）
+MIN_SCALE_GAIN = 0.9
+
+JPEG_QUALITY = 95
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [image_prep] {message}")
+
+
+def default_cache_dir() -> str:
+    from local_config import local_config
+    return os.path.join(local_config.config_dir, "image_cache")
+
+
+# ============================================
+# 目标尺寸
+# ============================================
+
+def find_layer(tree: list, layer_id, parent_chain: list = None) -> Optional[dict]:
+    """按父级智能对象链在图层树中查找图层（嵌套文档中的图层 ID 可能与外层重复）"""
+    nodes = tree or []
+    for parent_id in parent_chain or []:
+        parent = _find_in(nodes, parent_id)
+        if parent is None:
+            return None
+        nodes = parent.get("children") or []
+    return _find_in(nodes, layer_id)
+
+
+def _find_in(nodes: list, layer_id) -> Optional[dict]:
+    stack = list(nodes)
+    while stack:
+        node = stack.pop(0)
+        if node.get("id") == layer_id:
+            return node
+        # 只在图层组中继续查找；智能对象内容属于另一个文档
+        if node.get("kind") == "GROUP":
+            stack[0:0] = node.get("children") or []
+    return None
+
+
+def target_size(node: Optional[dict]) -> Optional[Tuple[int, int]]:
+    """智能对象的目标像素尺寸：优先内容画布，其次图层外框；未知时返回 None"""
+    if not node:
+        return None
+    for field in ("content_size", "bounds"):
+        box = node.get(field) or {}
+        try:
+            width, height = int(round(float(box.get("width")))), int(round(float(box.get("height"))))
+        except (TypeError, ValueError):
+            continue
+        if width > 0 and height > 0:
+            return width, height
+    return None
+
+
+# ============================================
+# 处理（可在子进程中执行，必须是模块级函数）
+# ============================================
+
+def plan_size(size: Tuple[int, int], box: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+    """等比缩小到放入 box 的尺寸；不需要缩小（或收益太小）时返回 None"""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height)
+    if scale >= MIN_SCALE_GAIN:
+        return None
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_file(source: str, dest_base: str, box: Tuple[int, int]) -> Optional[str]:
+    """
+    把 source 缩小到 box 以内并写到 dest_base + 扩展名，返回输出路径；不需要处理时返回 None
+
+    先写临时文件再替换，多个执行器同时处理同一张图时也不会读到半个文件。
+    """
+    with Image.open(source) as img:
+        if img.format not in PREPARABLE_FORMATS or img.mode not in PREPARABLE_MODES:
+            return None
+        oriented_size = img.size
+        orientation = (img.getexif() or {}).get(0x0112, 1)
+        if orientation in (5, 6, 7, 8):
+            oriented_size = (img.size[1], img.size[0])
+        new_size = plan_size(oriented_size, box)
+        if new_size is None:
+            return None
+        icc_profile = img.info.get("icc_profile")
+        if img.format == "JPEG":
+            # JPEG 在解码阶段按 1/2、1/4、1/8 缩小，大图省去大部分解码时间
+            draft_size = new_size if orientation not in (5, 6, 7, 8) else (new_size[1], new_size[0])
+            img.draft(img.mode, draft_size)
+        img = ImageOps.exif_transpose(img)
+
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        if img.mode == "CMYK":
+            target_mode = "CMYK"  # 保持 CMYK，由 PS 按嵌入的配置文件做色彩管理
+        else:
+            target_mode = "RGBA" if has_alpha else "RGB"
+        if img.mode != target_mode:
+            img = img.convert(target_mode)
+        img = img.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+
+        ext = ".png" if has_alpha else ".jpg"
+        dest = dest_base + ext
+        tmp = f"{dest_base}.{os.getpid()}.{threading.get_ident()}.tmp"
+        save_args = {"icc_profile": icc_profile} if icc_profile else {}
+        if has_alpha:
+            img.save(tmp, "PNG", compress_level=1, **save_args)
+        else:
+            img.save(tmp, "JPEG", quality=JPEG_QUALITY, subsampling=0, **save_args)
+    os.replace(tmp, dest)
+    return dest
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# ============================================
+# 预处理器
+# ============================================
+
+class ImagePrep:
+    """
+    替换图片预处理（缓存仓库 + 后台执行器）
+
+    参数:
+        cache_dir: 缓存仓库目录；默认为配置目录下的 image_cache
+        max_workers: 并发处理数
+        processes: 使用进程池（仅在入口脚本有 __main__ 保护、不会在子进程中重新启动界面时开启）
+        max_bytes: 缓存仓库的总大小预算（字节），超出时按 LRU 淘汰
+    """
+
+    # 输出格式策略（缓存键的一部分）：有透明通道输出 PNG，否则 JPEG
+    output_format = "auto"
+
+    def __init__(self, cache_dir: str = None, max_workers: int = None, processes: bool = False,
+                 max_bytes: int = 2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers or max(1, min(4, os.cpu_count() or 1))
+        self.processes = processes
+        self.max_bytes = max_bytes
+        self.enabled = Image is not None
+        self._executor: Optional[Executor] = None
+        self._store: Optional[ImageStore] = None
+        self._digests: Dict[str, tuple] = {}  # 路径 -> ((mtime, size), 内容哈希)
+        self._passthrough = set()  # 不需要处理的缓存键（原样使用）
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {"prepared": 0, "reused": 0, "passthrough": 0, "failed": 0}
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            if self.processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image_prep")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def store(self) -> ImageStore:
+        if self._store is None:
+            self._store = ImageStore(self.cache_dir or default_cache_dir(), max_bytes=self.max_bytes)
+        return self._store
+
+    def in_store(self, path: str) -> bool:
+        """路径是否为缓存仓库中的文件（插件可直接置入，无需复制）"""
+        if self._store is None or not path:
+            return False
+        root = os.path.normcase(os.path.abspath(self._store.root))
+        return os.path.normcase(os.path.dirname(os.path.abspath(path))) == root
+
+    def digest(self, path: str) -> str:
+        """源图内容哈希（按修改时间与大小缓存，文件未变化时不重复读取）"""
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        key = os.path.normcase(os.path.abspath(path))
+        with self._lock:
+            cached = self._digests.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        value = file_digest(path)
+        with self._lock:
+            self._digests[key] = (stamp, value)
+        return value
+
+    async def prepare(self, path: str, box: Optional[Tuple[int, int]]) -> str:
+        """返回供插件置入的图片路径：缓存仓库中的文件，或（无需处理 / 处理失败时）原路径"""
+        if not self.enabled or not box or not path:
+            return path
+        loop = asyncio.get_running_loop()
+        try:
+            digest = await loop.run_in_executor(None, self.digest, path)
+        except OSError:
+            return path  # 文件问题由图片预检报告
+        key = store_key(digest, tuple(box), self.output_format)
+        if key in self._passthrough:
+            return path
+        cached = self.store.get(key)
+        if cached:
+            self.stats["reused"] += 1
+            return cached
+
+        # 同一内容正在处理（不同路径指向同一文件、或多个批量同时运行）：等待同一结果
+        pending = self._inflight.get(key)
+        if pending is None:
+            pending = self._inflight[key] = asyncio.ensure_future(self._produce(key, path, tuple(box)))
+            pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+        prepared = await asyncio.shield(pending)
+        return prepared or path
+
+    async def _produce(self, key: str, path: str, box: Tuple[int, int]) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        dest_base = self.store.path_for(key, "")
+        try:
+            prepared = await loop.run_in_executor(self._pool(), prepare_file, path, dest_base, box)
+        except BrokenProcessPool as e:
+            _log(f"进程池不可用，改用线程池: {e}")
+            self._executor, self.processes = None, False
+            return await self._produce(key, path, box)
+        except Exception as e:
+            _log(f"预处理失败，使用原图 {path}: {e}")
+            self.stats["failed"] += 1
+            return None
+        if prepared:
+            self.stats["prepared"] += 1
+            await loop.run_in_executor(None, self.store.put, key, prepared)
+        else:
+            self.stats["passthrough"] += 1
+            self._passthrough.add(key)
+        return prepared
+
+    def schedule(self, items: List[Tuple[str, Optional[Tuple[int, int]]]]) -> Dict[tuple, asyncio.Future]:
+        """
+        后台开始处理一批 (路径, 目标尺寸)，返回 (路径, 目标尺寸) -> Future
+
+        批量执行时逐行 await 对应的 Future：处理与前面行的出图同时进行，不会推迟第一行。
+        """
+        futures = {}
+        for path, box in items:
+            key = (path, tuple(box) if box else None)
+            if key not in futures:
+                futures[key] = asyncio.ensure_future(self.prepare(path, key[1]))
+        return futures
+
+
+# 全局实例：服务器批量执行与极速出图共享同一缓存
+image_prep = ImagePrep()
@@ -0,0 +1,203 @@
+"""
+小冰美化助手 - 图片缓存仓库 (image_store.py)
+
+同一批源图会在不同的行、会话与模板之间反复替换。ImageStore 按内容寻址保存处理后的图片：
+1. 键 = 源图内容哈希 + 目标尺寸 + 输出格式，内容相同的文件无论路径如何都命中同一条目
+2. 条目索引（大小、最近使用时间）保存在仓库目录的 index.json，跨会话生效
+3. 总大小超出预算时按最近使用顺序（LRU）删除最久未用的文件
+4. 统计命中 / 未命中 / 淘汰次数
+
+仓库中的文件名只含十六进制字符，插件可以直接置入，不必再复制到插件数据目录。
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+
+from metrics import registry as metrics
+
+INDEX_FILE = "index.json"
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [image_store] {message}")
+
+
+def store_key(digest: str, box: Tuple[int, int], fmt: str) -> str:
+    return f"{digest[:40]}_{box[0]}x{box[1]}_{fmt}"
+
+
+class ImageStore:
+    """
+    内容寻址的图片缓存仓库
+
+    条目: {"file": 文件名, "bytes": 大小, "last_used": 最近使用时间戳}
+
+    参数:
+        root: 仓库目录
+        max_bytes: 总大小预算（字节），0 表示不限
+    """
+
+    def __init__(self, root: str, max_bytes: int = 2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()  # 最近使用在后
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    # --- 索引 ---
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.root, exist_ok=True)
+        index = {}
+        try:
+            with open(os.path.join(self.root, INDEX_FILE), "r", encoding="utf-8") as f:
+                index = json.load(f).get("entries") or {}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            _log(f"读取缓存索引失败，将按目录内容重建: {e}")
+
+        entries = []
+        known = set()
+        for key, entry in index.items():
+            path = os.path.join(self.root, entry.get("file", ""))
+            if entry.get("file") and os.path.isfile(path):
+                entries.append((key, {"file": entry["file"], "bytes": os.path.getsize(path),
+                                      "last_used": float(entry.get("last_used") or 0)}))
+                known.add(entry["file"])
+        # 索引之外的文件（旧版本缓存、索引写入前中断等）：纳入并优先淘汰
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name in known or name == INDEX_FILE or name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            entries.append((name, {"file": name, "bytes": st.st_size, "last_used": 0.0}))
+        entries.sort(key=lambda item: item[1]["last_used"])
+        self.entries = OrderedDict(entries)
+        self._evict()  # 预算可能比上次运行时小
+
+    def save(self):
+        """写入索引；先写临时文件再替换"""
+        with self._lock:
+            if not self._loaded:
+                return
+            data = {"version": 1, "entries": dict(self.entries)}
+        tmp_path = os.path.join(self.root, INDEX_FILE + ".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(self.root, INDEX_FILE))
+        except OSError as e:
+            _log(f"保存缓存索引失败: {e}")
+
+    # --- 查询 / 写入 ---
+
+    def get(self, key: str) -> Optional[str]:
+        """命中时返回文件路径并更新最近使用时间；文件已被删除时视为未命中"""
+        with self._lock:
+            self._load()
+            entry = self.entries.get(key)
+            path = os.path.join(self.root, entry["file"]) if entry else None
+            if entry and not os.path.isfile(path):
+                self.entries.pop(key, None)
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                metrics.inc("ice_image_store_total", help_text="图片缓存查询次数", result="miss")
+                return None
+            entry["last_used"] = time.time()
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+        metrics.inc("ice_image_store_total", help_text="图片缓存查询次数", result="hit")
+        return path
+
+    def path_for(self, key: str, ext: str) -> str:
+        """新条目的目标路径（写入完成后调用 put 登记）"""
+        with self._lock:
+            self._load()
+        return os.path.join(self.root, key + ext)
+
+    def put(self, key: str, path: str) -> str:
+        """登记已写入仓库目录的文件，超出预算时淘汰最久未用的条目"""
+        with self._lock:
+            self._load()
+            self.entries[key] = {"file": os.path.basename(path), "bytes": os.path.getsize(path),
+                                 "last_used": time.time()}
+            self.entries.move_to_end(key)
+            self.stats["stored"] += 1
+            self._evict(keep=key)
+        self.save()
+        return path
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            self._load()
+            return key in self.entries
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            self._load()
+            return sum(entry["bytes"] for entry in self.entries.values())
+
+    # --- 淘汰 ---
+
+    def _evict(self, keep: str = None):
+        if not self.max_bytes:
+            return
+        total = sum(entry["bytes"] for entry in self.entries.values())
+        for key in list(self.entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self.entries.pop(key)
+            total -= entry["bytes"]
+            self.stats["evicted"] += 1
+            try:
+                os.remove(os.path.join(self.root, entry["file"]))
+            except OSError:
+                pass
+
+    def evict(self):
+        with self._lock:
+            self._load()
+            self._evict()
+        self.save()
+
+    def clear(self) -> int:
+        """删除全部缓存文件，返回删除数量"""
+        with self._lock:
+            self._load()
+            count = 0
+            for entry in self.entries.values():
+                try:
+                    os.remove(os.path.join(self.root, entry["file"]))
+                    count += 1
+                except OSError:
+                    pass
+            self.entries.clear()
+        self.save()
+        return count
+
+    def snapshot(self) -> dict:
+        """条目数、总大小、预算与命中统计（性能面板 / 调试用）"""
+        with self._lock:
+            self._load()
+            total = sum(entry["bytes"] for entry in self.entries.values())
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries=len(self.entries), bytes=total, max_bytes=self.max_bytes,
+                        hit_rate=(self.stats["hits"] / lookups) if lookups else 0.0)
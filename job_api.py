@@ -0,0 +1,696 @@
+"""
+小冰美化助手 - 本地任务接口 (job_api.py)
+
+供订单系统等外部程序以 HTTP 提交批量出图任务，由 PSServer 按优先级依次执行。
+
+功能：
+1. JobStore：SQLite 持久化任务队列（数值越小越先执行，同优先级先进先出），进程重启后未完成的任务自动续跑
+2. 幂等键：同一 Idempotency-Key 重复提交返回原任务，不会重复出图；键相同但内容不同返回 409
+3. JobRunner：在插件连接后逐个消费队列，逐行记录结果，已成功的行在续跑时跳过
+4. 接口：提交 / 查询 / 列表 / 行结果（分页）/ 取消 / SSE 进度流
+5. 随 main.py 挂载到 NiceGUI 的 app，也可独立运行（固定端口，无界面）：
+
+    python job_api.py --port 8780 --ws-port 8765
+
+接口（前缀 /api/jobs）:
+    POST   /api/jobs                 提交任务，返回 201（新任务）或 200（幂等命中）
+    GET    /api/jobs                 任务列表，?status=queued&limit=50
+    GET    /api/jobs/{id}            任务状态与行统计
+    GET    /api/jobs/{id}/results    行结果，?offset=0&limit=500
+    POST   /api/jobs/{id}/cancel     取消排队中或执行中的任务
+    GET    /api/jobs/{id}/events     SSE 进度流（status / row / stage 事件）
+
+提交内容:
+    {
+        "strategy": {...} | "strategy_path": "D:/策略.json" | "psd": "D:/模板.psd",
+        "rows": [{"1": "标题", "2": "D:/图.png", "output_filename": "A001"}, ["标题", "D:/图.png"]],
+        "output_dir": "D:/输出",          # 可选，覆盖策略中的输出目录
+        "priority": 10,                   # 可选，数值越小越先执行
+        "idempotency_key": "order-1001"   # 可选，也可使用请求头 Idempotency-Key
+    }
+    仅提供 psd 时，执行前打开该文档并读取其中保存的策略（XMP）。
+
+设置环境变量 ICE_JOB_API_TOKEN 后，请求需携带 Authorization: Bearer <token>（SSE 可用 ?token=）。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional, List, Dict
+
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from server import get_server, PSServer, PRIORITY_BATCH
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [jobs] {message}")
+
+
+DEFAULT_PRIORITY = 10
+
+# 任务状态：queued -> running -> succeeded / failed / cancelled
+FINAL_STATUSES = {"succeeded", "failed", "cancelled"}
+
+# SSE 心跳间隔（秒），防止代理或客户端判定连接空闲
+SSE_KEEPALIVE = 15.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    idempotency_key TEXT UNIQUE,
+    request_hash TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    message TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, seq);
+CREATE TABLE IF NOT EXISTS job_rows (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+
+class JobError(Exception):
+    """任务提交内容无效，或执行前的准备（打开文档、读取策略）失败"""
+
+
+def default_db_path() -> str:
+    from local_config import local_config
+    return os.path.join(local_config.config_dir, "jobs.sqlite3")
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
+
+
+# ============================================
+# 提交内容校验
+# ============================================
+
+def normalize_rows(rows) -> List[Dict[str, str]]:
+    """
+    行数据 -> execute_batch_with_data 所需的行字典（键为变量组序号字符串）
+
+    每行可以是对象（键为组序号或 output_filename）或数组（按位置对应组 1..N）
+    """
+    if not isinstance(rows, list) or not rows:
+        raise JobError("rows 必须是非空数组")
+    result = []
+    for i, row in enumerate(rows, 1):
+        if isinstance(row, list):
+            row = {str(col): value for col, value in enumerate(row, 1)}
+        if not isinstance(row, dict):
+            raise JobError(f"第 {i} 行必须是对象或数组")
+        result.append({str(k): "" if v is None else str(v) for k, v in row.items()})
+    return result
+
+
+def build_spec(body: dict) -> dict:
+    """校验提交内容并固化策略：strategy_path 在提交时读取，之后修改文件不影响已排队的任务"""
+    if not isinstance(body, dict):
+        raise JobError("请求体必须是 JSON 对象")
+    strategy = body.get("strategy")
+    strategy_path = body.get("strategy_path")
+    psd = body.get("psd")
+    if strategy is None and strategy_path:
+        try:
+            with open(strategy_path, "r", encoding="utf-8") as f:
+                strategy = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise JobError(f"读取策略文件失败: {e}")
+    if strategy is None and not psd:
+        raise JobError("需要提供 strategy、strategy_path 或 psd 之一")
+    if strategy is not None and (not isinstance(strategy, dict) or not strategy.get("renders")):
+        raise JobError("策略中没有渲染方案")
+    priority = body.get("priority", DEFAULT_PRIORITY)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise JobError("priority 必须是整数")
+    return {
+        "strategy": strategy,
+        "strategy_path": strategy_path,
+        "psd": psd,
+        "output_dir": body.get("output_dir"),
+        "priority": priority,
+    }
+
+
+def request_hash(body: dict) -> str:
+    """幂等比较用的请求摘要（不含幂等键本身）"""
+    content = {k: v for k, v in body.items() if k != "idempotency_key"}
+    return hashlib.sha1(json.dumps(content, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# ============================================
+# 持久化队列
+# ============================================
+
+class JobStore:
+    """
+    SQLite 任务队列
+
+    jobs 表保存任务本身（策略快照与行数据），job_rows 表逐行保存结果：
+    每完成一行只写一条记录，续跑时据此跳过已成功的行。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or default_db_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def recover(self) -> int:
+        """上次进程退出时仍在执行的任务重新排队（已成功的行会被跳过）"""
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', message = '进程重启，等待续跑' WHERE status = 'running'")
+            return cur.rowcount
+
+    def submit(self, body: dict, idempotency_key: str = None) -> tuple:
+        """
+        新建任务，返回 (job, created)
+
+        幂等键已存在时：内容一致返回原任务（created=False），不一致抛出 KeyError
+        """
+        spec = build_spec(body)
+        rows = normalize_rows(body.get("rows"))
+        digest = request_hash(body)
+        with self._lock, self._conn:
+            if idempotency_key:
+                existing = self._conn.execute(
+                    "SELECT * FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+                if existing:
+                    if existing["request_hash"] != digest:
+                        raise KeyError(idempotency_key)
+                    return self._to_dict(existing), False
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, idempotency_key, request_hash, priority, status, spec, rows, total, message, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, '排队中', ?)",
+                (job_id, idempotency_key, digest, spec["priority"], json.dumps(spec, ensure_ascii=False),
+                 json.dumps(rows, ensure_ascii=False), len(rows), time.time()))
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._to_dict(row), True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._to_dict(row) if row else None
+
+    def list(self, status: str = None, limit: int = 50) -> List[dict]:
+        with self._lock:
+            if status:
+                rows = self._conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY seq DESC LIMIT ?",
+                                          (status, limit)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT * FROM jobs ORDER BY seq DESC LIMIT ?", (limit,)).fetchall()
+            return [self._to_dict(row) for row in rows]
+
+    def next_queued(self) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority, seq LIMIT 1").fetchone()
+            return self._to_dict(row, full=True) if row else None
+
+    def set_status(self, job_id: str, status: str, message: str = None, error: str = None):
+        now = time.time()
+        with self._lock, self._conn:
+            if status == "running":
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, message = ?, error = NULL, started_at = COALESCE(started_at, ?) WHERE id = ?",
+                    (status, message, now, job_id))
+            elif status in FINAL_STATUSES:
+                self._conn.execute("UPDATE jobs SET status = ?, message = ?, error = ?, finished_at = ? WHERE id = ?",
+                                   (status, message, error, now, job_id))
+            else:
+                self._conn.execute("UPDATE jobs SET status = ?, message = ? WHERE id = ?", (status, message, job_id))
+
+    def record_row(self, job_id: str, index: int, status: str, data: dict):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO job_rows (job_id, idx, status, data) VALUES (?, ?, ?, ?)",
+                               (job_id, index, status, json.dumps(data, ensure_ascii=False)))
+
+    def done_indices(self, job_id: str) -> set:
+        with self._lock:
+            rows = self._conn.execute("SELECT idx FROM job_rows WHERE job_id = ? AND status = 'ok'", (job_id,)).fetchall()
+            return {row["idx"] for row in rows}
+
+    def row_counts(self, job_id: str) -> Dict[str, int]:
+        with self._lock:
+            return self._row_counts(job_id)
+
+    def _row_counts(self, job_id: str) -> Dict[str, int]:
+        rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM job_rows WHERE job_id = ? GROUP BY status",
+                                  (job_id,)).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 500) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, status, data FROM job_rows WHERE job_id = ? ORDER BY idx LIMIT ? OFFSET ?",
+                (job_id, limit, offset)).fetchall()
+        return [dict(json.loads(row["data"]), index=row["idx"], status=row["status"]) for row in rows]
+
+    def _to_dict(self, row: sqlite3.Row, full: bool = False) -> dict:
+        spec = json.loads(row["spec"])
+        counts = self._row_counts(row["id"])
+        job = {
+            "id": row["id"],
+            "status": row["status"],
+            "priority": row["priority"],
+            "idempotency_key": row["idempotency_key"],
+            "source": "psd" if spec.get("psd") and not spec.get("strategy") else
+                      ("strategy_path" if spec.get("strategy_path") else "strategy"),
+            "psd": spec.get("psd"),
+            "total": row["total"],
+            "done": sum(counts.values()),
+            "ok": counts.get("ok", 0),
+            "failed": counts.get("error", 0),
+            "message": row["message"],
+            "error": row["error"],
+            "created_at": _iso(row["created_at"]),
+            "started_at": _iso(row["started_at"]),
+            "finished_at": _iso(row["finished_at"]),
+        }
+        if full:
+            job["spec"] = spec
+            job["rows"] = json.loads(row["rows"])
+        return job
+
+
+# ============================================
+# 执行
+# ============================================
+
+class JobRunner:
+    """
+    队列消费者：插件连接后按优先级逐个执行任务
+
+    任务以 PRIORITY_BATCH 逐行提交，界面上的交互请求仍然优先派发。
+    """
+
+    def __init__(self, store: JobStore, server: PSServer = None):
+        self.store = store
+        self.server = server or get_server()
+        self.current_job: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._job_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._cancel_requested: set = set()
+        self._stopping = False
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._event_seq: Dict[str, int] = {}
+
+    async def start(self):
+        if self._task:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        recovered = self.store.recover()
+        if recovered:
+            _log(f"{recovered} 个未完成的任务重新排队")
+        self._task = asyncio.create_task(self._loop())
+        _log(f"任务队列已启动（{self.store.path}）")
+
+    async def stop(self):
+        """停止消费；执行中的任务重新排队，下次启动时续跑"""
+        if not self._task:
+            return
+        self._stopping = True
+        self._task.cancel()
+        try:
+            await self._task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self._task = None
+
+    def notify(self):
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        if job["status"] == "queued":
+            self.store.set_status(job_id, "cancelled", "已取消")
+            await self._emit_status(job_id)
+        elif job["status"] == "running" and self.current_job == job_id and self._job_task:
+            self._cancel_requested.add(job_id)
+            task = self._job_task
+            task.cancel()
+            # 等待插件端中止当前行，返回的状态即为最终状态
+            await asyncio.wait({task}, timeout=10.0)
+        return self.store.get(job_id)
+
+    # --- 事件订阅（SSE） ---
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1000)
+        self._subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self._subscribers.pop(job_id, None)
+
+    def _emit(self, job_id: str, event: str, data: dict):
+        seq = self._event_seq.get(job_id, 0) + 1
+        self._event_seq[job_id] = seq
+        for queue in self._subscribers.get(job_id, []):
+            try:
+                queue.put_nowait({"id": seq, "event": event, "data": data})
+            except asyncio.QueueFull:
+                pass  # 客户端读取过慢时丢弃事件；最终状态可通过查询接口获取
+        if event == "status" and data.get("status") in FINAL_STATUSES:
+            self._event_seq.pop(job_id, None)
+
+    async def _emit_status(self, job_id: str):
+        job = self.store.get(job_id)
+        if job:
+            self._emit(job_id, "status", job)
+
+    # --- 消费循环 ---
+
+    async def _loop(self):
+        while True:
+            job = self.store.next_queued()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # 插件未连接时任务保持排队，连接后再开始
+            while not self.server.is_connected():
+                await asyncio.sleep(1.0)
+            job = self.store.next_queued()
+            if job is None:
+                continue
+            self.current_job = job["id"]
+            self._job_task = asyncio.create_task(self._run(job))
+            try:
+                # 用 wait 而不是直接 await：取消单个任务不应结束消费循环
+                await asyncio.wait({self._job_task})
+                if not self._job_task.cancelled() and self._job_task.exception():
+                    _log(f"任务 {job['id']} 执行异常: {self._job_task.exception()}")
+            except asyncio.CancelledError:
+                self._job_task.cancel()
+                try:
+                    await self._job_task
+                except (asyncio.CancelledError, Exception):
+                    pass
+                raise
+            finally:
+                self.current_job = None
+                self._job_task = None
+
+    async def _run(self, job: dict):
+        job_id = job["id"]
+        done = self.store.done_indices(job_id)
+        indices = [i for i in range(1, job["total"] + 1) if i not in done]
+        self.store.set_status(job_id, "running", f"执行中: 剩余 {len(indices)}/{job['total']} 行")
+        await self._emit_status(job_id)
+        _log(f"开始任务 {job_id}（优先级 {job['priority']}，{len(indices)}/{job['total']} 行）")
+        try:
+            strategy = await self._resolve_strategy(job["spec"])
+            if indices:
+                await self._execute(job_id, strategy, job["rows"], indices)
+        except asyncio.CancelledError:
+            if job_id in self._cancel_requested:
+                self._cancel_requested.discard(job_id)
+                self.store.set_status(job_id, "cancelled", "已取消")
+                await self._emit_status(job_id)
+                _log(f"任务 {job_id} 已取消")
+            elif self._stopping:
+                self.store.set_status(job_id, "queued", "程序退出，等待续跑")
+            raise
+        except JobError as e:
+            self.store.set_status(job_id, "failed", "执行失败", error=str(e))
+            await self._emit_status(job_id)
+            _log(f"任务 {job_id} 失败: {e}")
+            return
+        except Exception as e:
+            # 意外异常（数据库错误、结果格式异常等）：同样结束任务，/events 客户端收到最终状态
+            self.store.set_status(job_id, "failed", "执行异常", error=str(e))
+            await self._emit_status(job_id)
+            _log(f"任务 {job_id} 执行异常: {e}")
+            return
+
+        counts = self.store.row_counts(job_id)
+        ok = counts.get("ok", 0)
+        status = "succeeded" if ok == job["total"] else "failed"
+        self.store.set_status(job_id, status, f"完成: 成功 {ok}/{job['total']}")
+        await self._emit_status(job_id)
+        _log(f"任务 {job_id} 完成: 成功 {ok}/{job['total']}")
+
+    async def _call(self, method, *args, **kwargs):
+        """把 (result, error) 回调式接口转换为 await"""
+        future = asyncio.get_running_loop().create_future()
+
+        def on_done(result=None, error=None):
+            if not future.done():
+                future.set_result((result, error))
+
+        await method(*args, callback=on_done, **kwargs)
+        return await future
+
+    async def _resolve_strategy(self, spec: dict) -> dict:
+        if spec.get("psd"):
+            _, err = await self._call(self.server.open_psd, spec["psd"], priority=PRIORITY_BATCH)
+            if err:
+                raise JobError(f"打开文档失败: {err}")
+        strategy = spec.get("strategy")
+        if strategy is None:
+            strategy, err = await self._call(self.server.read_strategy)
+            if err:
+                raise JobError(f"读取文档策略失败: {err}")
+            if not strategy or not strategy.get("renders"):
+                raise JobError("文档中没有保存可用的编辑策略")
+        if spec.get("output_dir"):
+            for render in strategy["renders"]:
+                render["output_path"] = spec["output_dir"]
+        return strategy
+
+    async def _execute(self, job_id: str, strategy: dict, rows: list, indices: List[int]):
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def on_progress(current, total, status, message):
+            # current 为本次提交内的序号，换成任务中的原始行号
+            index = indices[current - 1] if 0 < current <= len(indices) else None
+            if status == "stage":
+                self._emit(job_id, "stage", {"index": index, "message": message})
+            elif status in ("success", "error", "cancelled") and index is not None:
+                row_status = "ok" if status == "success" else status
+                detail = message.split(": ", 1)[1] if status == "error" and ": " in message else None
+                data = {"error": detail} if detail else {}
+                self.store.record_row(job_id, index, row_status, data)
+                self._emit(job_id, "row", dict(data, index=index, status=row_status))
+
+        def on_done(results, error):
+            if not finished.done():
+                finished.set_result((results, error))
+
+        await self.server.execute_batch_with_data(
+            strategy, [rows[i - 1] for i in indices], callback=on_done, progress_callback=on_progress,
+            indices=indices)
+        results, error = await finished
+        if error:
+            raise JobError(f"批量执行失败: {error}")
+        # 完整结果（含输出文件与阶段耗时）覆盖进度回调中记录的摘要
+        for item in results or []:
+            data = {k: v for k, v in item.items() if k not in ("index", "status")}
+            self.store.record_row(job_id, item["index"], item.get("status", "error"), data)
+
+
+# ============================================
+# HTTP 接口
+# ============================================
+
+def _check_token(authorization: Optional[str] = Header(None), token: Optional[str] = Query(None)):
+    expected = os.environ.get("ICE_JOB_API_TOKEN")
+    if not expected:
+        return
+    if authorization == f"Bearer {expected}" or token == expected:
+        return
+    raise HTTPException(status_code=401, detail="未授权")
+
+
+def _sse(event: str, data: dict, event_id: int = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def create_router(runner: JobRunner) -> APIRouter:
+    store = runner.store
+    router = APIRouter(prefix="/api/jobs", dependencies=[Depends(_check_token)])
+
+    def _get_or_404(job_id: str) -> dict:
+        job = store.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        return job
+
+    @router.post("")
+    async def submit_job(request: Request, idempotency_key: Optional[str] = Header(None)):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="请求体不是有效的 JSON")
+        key = idempotency_key or (body.get("idempotency_key") if isinstance(body, dict) else None)
+        if key is not None and (not isinstance(key, str) or not key or len(key) > 255):
+            raise HTTPException(status_code=400, detail="幂等键必须是 1~255 个字符的字符串")
+        try:
+            job, created = store.submit(body, key)
+        except JobError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except KeyError:
+            raise HTTPException(status_code=409, detail="幂等键已被内容不同的任务使用")
+        if created:
+            _log(f"收到任务 {job['id']}（{job['total']} 行，优先级 {job['priority']}）")
+            runner.notify()
+        return JSONResponse(job, status_code=201 if created else 200)
+
+    @router.get("")
+    async def list_jobs(status: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+        return {"jobs": store.list(status, limit)}
+
+    @router.get("/{job_id}")
+    async def get_job(job_id: str):
+        return _get_or_404(job_id)
+
+    @router.get("/{job_id}/results")
+    async def get_results(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(500, ge=1, le=5000)):
+        job = _get_or_404(job_id)
+        return {"id": job_id, "status": job["status"], "total": job["total"], "offset": offset,
+                "rows": store.results(job_id, offset, limit)}
+
+    @router.post("/{job_id}/cancel")
+    async def cancel_job(job_id: str):
+        _get_or_404(job_id)
+        return await runner.cancel(job_id)
+
+    @router.get("/{job_id}/events")
+    async def job_events(job_id: str):
+        _get_or_404(job_id)
+        queue = runner.subscribe(job_id)
+
+        async def stream():
+            try:
+                # 先发送当前状态快照，之后是实时事件；任务结束后关闭流
+                job = store.get(job_id)
+                yield _sse("status", job)
+                if job["status"] in FINAL_STATUSES:
+                    return
+                while True:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+                        continue
+                    yield _sse(item["event"], item["data"], item["id"])
+                    if item["event"] == "status" and item["data"].get("status") in FINAL_STATUSES:
+                        return
+            finally:
+                runner.unsubscribe(job_id, queue)
+
+        return StreamingResponse(stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    return router
+
+
+def mount(app, server: PSServer = None, db_path: str = None) -> JobRunner:
+    """
+    挂载到 NiceGUI 的 app（main.py）：注册路由，并随 app 启动/关闭任务队列
+
+    任务只在插件连接后执行；服务器的启动与连接仍由宿主程序负责。
+    """
+    runner = JobRunner(JobStore(db_path), server)
+    app.include_router(create_router(runner))
+    app.on_startup(runner.start)
+    app.on_shutdown(runner.stop)
+    return runner
+
+
+def create_app(server: PSServer = None, db_path: str = None) -> FastAPI:
+    """独立运行：由本进程启动 PSServer 并等待插件连接"""
+    server = server or get_server()
+    runner = JobRunner(JobStore(db_path), server)
+
+    @asynccontextmanager
+    async def lifespan(_app):
+        await server.start()
+        await runner.start()
+        try:
+            yield
+        finally:
+            await runner.stop()
+            await server.stop()
+            runner.store.close()
+
+    app = FastAPI(title="ice美化助手 任务接口", lifespan=lifespan)
+    app.include_router(create_router(runner))
+    app.state.runner = runner
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地任务接口（独立运行，无界面）")
+    parser.add_argument("--host", default="127.0.0.1", help="HTTP 监听地址（默认仅本机）")
+    parser.add_argument("--port", type=int, default=8780, help="HTTP 端口")
+    parser.add_argument("--ws-host", default="127.0.0.1", help="插件 WebSocket 监听地址")
+    parser.add_argument("--ws-port", type=int, default=8765, help="插件 WebSocket 端口")
+    parser.add_argument("--db", help="任务数据库路径（默认位于配置目录 jobs.sqlite3）")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    server = get_server()
+    server.host = args.ws_host
+    server.port = args.ws_port
+    uvicorn.run(create_app(server, args.db), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
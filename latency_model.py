@@ -0,0 +1,179 @@
+"""
+小冰美化助手 - 请求耗时模型 (latency_model.py)
+
+固定超时对大 PSD 太短（误报超时），对卡死的小文档又太长。本模块按
+(文档, 消息类型, 渲染方案数) 记录最近完成请求的耗时，用滚动 p99 推算超时与 ETA：
+
+    超时 = clamp(p99 × headroom, floor, ceiling)
+
+样本不足时逐级退回更粗的键（任意文档 → 任意渲染数），仍不足则使用调用方给出的默认值。
+其它文档汇总的样本只能放宽超时、不能把它压到默认值以下：没见过的大 PSD 不会套用小文件学到的超时。
+学到的样本保存在配置目录（latency_model.json），跨会话生效。
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+
+ANY = "*"
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [latency] {message}")
+
+
+def default_latency_path() -> str:
+    from local_config import local_config
+    return os.path.join(local_config.config_dir, "latency_model.json")
+
+
+def percentile(samples, q: float) -> float:
+    """最近邻法分位数（q 取 0~1）"""
+    ordered = sorted(samples)
+    rank = max(math.ceil(q * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class LatencyModel:
+    """
+    按 (文档, 消息类型, 渲染方案数) 学习请求耗时
+
+    参数:
+        path: 持久化文件路径；None 表示只在内存中学习（基准测试、回放等）
+        window: 每个键保留的最近样本数
+        min_samples: 样本数达到后才使用学到的值
+        headroom: p99 之上的余量倍数
+        floor / ceiling: 超时的上下限（秒）
+    """
+
+    def __init__(self, path: str = None, window: int = 200, min_samples: int = 5, headroom: float = 2.0,
+                 floor: float = 5.0, ceiling: float = 1800.0):
+        self.path = path
+        self.window = window
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.floor = floor
+        self.ceiling = ceiling
+        self.samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = 0.0
+
+    @staticmethod
+    def key(doc: Optional[str], msg_type: str, renders: Optional[int]) -> str:
+        return f"{doc or ANY}|{msg_type}|{ANY if renders is None else renders}"
+
+    def _candidates(self, doc, msg_type, renders):
+        """由细到粗的查找键"""
+        keys = [self.key(doc, msg_type, renders), self.key(None, msg_type, renders)]
+        if renders is not None:
+            keys += [self.key(doc, msg_type, None), self.key(None, msg_type, None)]
+        return [k for i, k in enumerate(keys) if k not in keys[:i]]
+
+    # --- 学习 ---
+
+    def record(self, doc: Optional[str], msg_type: str, renders: Optional[int], seconds: float):
+        """记录一次完成的请求；同时计入更粗的键，供新文档 / 新渲染数冷启动"""
+        if seconds is None or seconds < 0:
+            return
+        with self._lock:
+            for key in self._candidates(doc, msg_type, renders):
+                bucket = self.samples.get(key)
+                if bucket is None:
+                    bucket = self.samples[key] = deque(maxlen=self.window)
+                bucket.append(round(seconds, 3))
+            self._dirty = True
+        if self.path and time.time() - self._saved_at > 30:
+            self.save()
+
+    # --- 查询 ---
+
+    def _lookup(self, doc, msg_type, renders):
+        """返回 (命中的键, 样本)；样本都不足时返回 (None, None)"""
+        for key in self._candidates(doc, msg_type, renders):
+            bucket = self.samples.get(key)
+            if bucket and len(bucket) >= self.min_samples:
+                return key, bucket
+        return None, None
+
+    def _bucket(self, doc, msg_type, renders) -> Optional[deque]:
+        return self._lookup(doc, msg_type, renders)[1]
+
+    def p99(self, doc: Optional[str], msg_type: str, renders: Optional[int] = None) -> Optional[float]:
+        with self._lock:
+            bucket = self._bucket(doc, msg_type, renders)
+            return percentile(bucket, 0.99) if bucket else None
+
+    def expected(self, doc: Optional[str], msg_type: str, renders: Optional[int] = None) -> Optional[float]:
+        """典型耗时（中位数），用于 ETA 先验；没有足够样本时返回 None"""
+        with self._lock:
+            bucket = self._bucket(doc, msg_type, renders)
+            return percentile(bucket, 0.5) if bucket else None
+
+    def timeout(self, doc: Optional[str], msg_type: str, renders: Optional[int] = None,
+                default: float = None) -> float:
+        """
+        学到的超时（已按上下限截断）；样本不足时返回 default（同样截断到上限以内）
+
+        命中的是其它文档汇总的键（文档本身没有足够样本）时，结果不低于 default
+        """
+        with self._lock:
+            key, bucket = self._lookup(doc, msg_type, renders)
+            p99 = percentile(bucket, 0.99) if bucket else None
+        fallback = min(default, self.ceiling) if default else self.floor
+        if p99 is None:
+            return fallback
+        learned = min(max(p99 * self.headroom, self.floor), self.ceiling)
+        if doc and not key.startswith(f"{doc}|"):
+            return max(learned, fallback)
+        return learned
+
+    def snapshot(self) -> dict:
+        """各键的样本数、中位数与 p99（调试 / 指标展示用）"""
+        with self._lock:
+            return {key: {"count": len(bucket), "p50": percentile(bucket, 0.5), "p99": percentile(bucket, 0.99)}
+                    for key, bucket in self.samples.items() if bucket}
+
+    # --- 持久化 ---
+
+    def load(self, path: str = None) -> "LatencyModel":
+        """从文件加载样本并开启持久化；文件不存在或损坏时从空模型开始"""
+        self.path = path or self.path
+        if not self.path or not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            with self._lock:
+                for key, values in (data.get("samples") or {}).items():
+                    self.samples[key] = deque((float(v) for v in values), maxlen=self.window)
+        except (OSError, ValueError, TypeError) as e:
+            _log(f"读取耗时模型失败，将重新学习: {e}")
+        return self
+
+    def save(self):
+        """写入样本（仅在有新样本时）；先写临时文件再替换，避免中断时损坏"""
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            data = {"version": 1, "samples": {key: list(bucket) for key, bucket in self.samples.items()}}
+            self._dirty = False
+            self._saved_at = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            _log(f"保存耗时模型失败: {e}")
@@ -2,17 +2,16 @@ from __future__ import annotations
 from time import sleep
 
 from nicegui import ui, app
+from fastapi.responses import PlainTextResponse
 import json
 import asyncio
 import webbrowser
 import os
 import html
-import glob
 import json
 import re
 import datetime
 import copy
-from io import BytesIO
 try:
     from PIL import Image
 except ImportError:
@@ -21,7 +20,20 @@ try:
     import win32clipboard
 except ImportError:
     win32clipboard = None
-from server import get_server
+from server import get_server, PRIORITY_INTERACTIVE
+from progress import BatchProgress, STAGE_LABELS
+from metrics import registry as metrics_registry
+from table_import import parse_table
+from preflight import preflight
+from image_prep import image_prep, find_layer, target_size
+from encoder import DEFAULT_ENCODING, encoder as output_encoder
+from filter_preview import filter_preview, PreviewSession
+from clipboard import clipboard_exporter, ClipboardWatcher
+from output_index import OutputIndex
+from image_filters import FILTERS as PREVIEWABLE_FILTERS
+from strategy import StrategyParser, StrategyLoader, apply_regex_steps
+from workflow_plan import build_workflow_plan
+import job_api
 from auth_logic import auth_client
 import config as cfg
 from about_info import ABOUT_INFO
@@ -56,6 +68,20 @@ app.add_static_files(f'/{TEMP_PREVIEW_DIR}', TEMP_PREVIEW_DIR)
 # 1. 获取服务器单例
 ps_server = get_server()
 
+# 2. 本地性能指标接口：JSON 供性能面板/脚本使用，Prometheus 文本供外部采集
+@app.get('/metrics')
+def metrics_prometheus():
+    return PlainTextResponse(metrics_registry.to_prometheus(), media_type='text/plain; version=0.0.4')
+
+@app.get('/metrics.json')
+def metrics_json():
+    data = metrics_registry.to_dict()
+    data['queue'] = ps_server.get_queue_stats()
+    return data
+
+# 3. 本地任务接口：供订单系统提交批量出图任务（插件连接后按优先级执行，见 job_api.py）
+job_runner = job_api.mount(app, ps_server)
+
 # --- 登录状态 ---
 # 用于控制“未登录时不触发 PS/策略/剪贴板相关提示”
 auth_logged_in: bool = False
@@ -82,6 +108,36 @@ def format_multiline_text(text: str) -> str:
     # 将单换行符替换为 Markdown 的硬换行（两个空格+换行）
     return text.replace('\n', '  \n')
 
+async def pick_directory(initial: str, title: str) -> str:
+    """选择文件夹：优先系统原生对话框（tkinter），避免依赖 pywebview 注入 API；失败时回退到 pywebview"""
+    try:
+        import tkinter as tk
+        from tkinter import filedialog
+
+        def pick_dir_sync():
+            root = tk.Tk()
+            # 隐藏图标（创建透明1x1图标）
+            try:
+                root.iconbitmap(default='')
+            except Exception:
+                pass
+            root.withdraw()
+            root.attributes('-topmost', True)
+            path = filedialog.askdirectory(initialdir=initial or os.getcwd(), title=title)
+            try:
+                root.destroy()
+            except Exception:
+                pass
+            return path
+
+        return await asyncio.to_thread(pick_dir_sync)
+    except Exception:
+        pass
+    try:
+        return await ui.run_javascript("window.pywebview.api.pick_folder()")
+    except Exception:
+        return ''
+
 async def show_message_dialog(
     title: str = '系统公告',
     content: str = '',
@@ -831,299 +887,6 @@ ui.add_css('''
   .ice-rounded-input .q-field__control { border-radius: 12px !important; }
 ''')
 
-# --- 策略解析与加载逻辑 ---
-
-class StrategyParser:
-    """
-    负责将 TemplateState 转换为符合《编辑策略规范 v1.1.0》的 JSON 数据
-    """
-    @staticmethod
-    def serialize(state, current_layer_tree):
-        # 1. 基础校验：必须有渲染方案
-        if not state.render_presets:
-            return None, [("system", "至少需要一个渲染方案")]
-
-        # 2. 变量组标号映射 (文字层优先)
-        group_mapping = {}
-        next_group_idx = 1
-        
-        # 文字组标号
-        for key in state.text_groups:
-            if any(r['mapping_key'] == key for r in state.text_rules):
-                group_mapping[key] = next_group_idx
-                next_group_idx += 1
-        
-        # 图片组标号
-        for key in state.image_groups:
-            if any(r['mapping_key'] == key for r in state.image_rules):
-                group_mapping[key] = next_group_idx
-                next_group_idx += 1
-
-        # 3. 构建 operations
-        operations = []
-        invalid_rules = [] # 记录失效的规则路径
-        
-        # 辅助函数：校验路径并提取 ID
-        def resolve(path):
-            return ps_server._resolve_layer_path(current_layer_tree, path)
-
-        # 文本操作
-        for r in state.text_rules:
-            layer_id, parent_chain, _ = resolve(r['path'])
-            if layer_id is None:
-                invalid_rules.append(('text', r['path']))
-                continue
-            
-            op = {
-                "type": "update_text_layer",
-                "layer_id": layer_id,
-                "parent_chain": parent_chain,
-                "target_path": r['path'],
-                "group": group_mapping.get(r['mapping_key']),
-                "regex_steps": r.get('regex_steps', [])
-            }
-            operations.append(op)
-            
-        # 图片操作
-        for r in state.image_rules:
-            layer_id, parent_chain, _ = resolve(r['path'])
-            if layer_id is None:
-                invalid_rules.append(('image', r['path']))
-                continue
-            
-            op = {
-                "type": "replace_image",
-                "layer_id": layer_id,
-                "parent_chain": parent_chain,
-                "target_path": r['path'],
-                "group": group_mapping.get(r['mapping_key'])
-            }
-            operations.append(op)
-            
-        # 滤镜操作
-        for r in state.filter_rules:
-            layer_id, parent_chain, kind = resolve(r['path'])
-            if layer_id is None:
-                invalid_rules.append(('filter', r['path']))
-                continue
-            
-            # 安全性校验：局部滤镜仅支持智能对象
-            if kind != "SMARTOBJECT":
-                # 虽然 UI 层会限制只有 SO 才有滤镜按钮，但 serialize 阶段还是校验一下更稳
-                continue
-            
-            for step in r.get('filter_steps', []):
-                op = {
-                    "type": "apply_filter",
-                    "layer_id": layer_id,
-                    "parent_chain": parent_chain,
-                    "target_path": r['path'],
-                    "filter_type": step['type'],
-                    "params": step['params']
-                }
-                operations.append(op)
-
-        # 4. 构建 renders (不再对 root_layers 进行阻塞式校验)
-        renders = []
-        filename_set = set()
-        duplicate_filenames = []
-        
-        for p in state.render_presets:
-            full_filename = f"{p['filename']}.{p['format']}"
-            if full_filename in filename_set:
-                duplicate_filenames.append(full_filename)
-            else:
-                filename_set.add(full_filename)
-
-            # 解析 root_layers 路径为 root_ids
-            root_layers = [path for path in p.get('root_layers', []) if isinstance(path, str) and path.strip()]
-            root_ids = []
-            for path in root_layers:
-                rid, _, _ = resolve(path)
-                if rid: root_ids.append(rid)
-
-            render_config = {
-                "name": p['name'],
-                "description": p.get('description', ''),
-                "output_path": os.path.abspath(p.get('output_path', './output')),
-                "filename": p['filename'],
-                "format": p['format'],
-                "quality": p.get('quality', 100),
-                "root_ids": root_ids, # 插件端需要数字 ID
-                "root_layers": root_layers, # 持久化路径，供反序列化还原勾选
-                "tiling": p.get('tiling', {"enabled": False}),
-                "filters": state.global_filter_steps if state.global_filter_active else []
-            }
-            renders.append(render_config)
-
-        if duplicate_filenames:
-            # 这里的 info 是给用户看的重复文件名列表
-            return None, [("system", f"检测到重复的渲染输出路径: {', '.join(duplicate_filenames)}。请修改渲染方案的命名模板或格式。")]
-
-        if invalid_rules:
-            return None, invalid_rules
-
-        return {
-            "version": "1.1.0",
-            "created": datetime.datetime.now().isoformat(),
-            "modified": datetime.datetime.now().isoformat(),
-            "operations": operations,
-            "renders": renders
-        }, None
-
-    @staticmethod
-    def _resolve_path_exists(tree, path_str):
-        if not tree: return False
-        # 统一格式化：去除两端空格
-        parts = [p.strip() for p in path_str.split('>')]
-        if not parts or parts[0] != '主文档':
-            return False
-        
-        if len(parts) == 1: 
-            return True
-            
-        current_level = tree
-        for i, part in enumerate(parts[1:]):
-            found_node = None
-            # 严格匹配每一级名称
-            for node in current_level:
-                if node['name'].strip() == part:
-                    found_node = node
-                    break
-            
-            if found_node:
-                # 如果已经是路径最后一级，匹配成功
-                if i == len(parts) - 2:
-                    return True
-                # 否则继续向子节点查找
-                current_level = found_node.get('children', [])
-            else:
-                return False
-        return False
-
-class StrategyLoader:
-    """
-    负责将 JSON 策略数据还原为 TemplateState
-    """
-    @staticmethod
-    def deserialize(data, state, current_layer_tree):
-        state.reset()
-
-        # 兼容历史策略：当仅保存了 root_ids 时，尽量还原回 root_layers 路径
-        id_to_path = {}
-        def _walk(nodes):
-            for node in nodes or []:
-                node_id = node.get('id')
-                node_path = node.get('path')
-                if node_id is not None and node_path:
-                    id_to_path[node_id] = node_path
-                _walk(node.get('children', []))
-        _walk(current_layer_tree or [])
-        
-        ops = data.get('operations', [])
-        text_ops = [op for op in ops if op['type'] == 'update_text_layer']
-        img_ops = [op for op in ops if op['type'] == 'replace_image']
-        filter_ops = [op for op in ops if op['type'] == 'apply_filter']
-        
-        # 1. 确定文字组分界
-        all_text_groups = sorted(list(set(op.get('group') for op in text_ops if op.get('group'))))
-        max_text_group = all_text_groups[-1] if all_text_groups else 0
-        
-        # 2. 还原文字规则
-        for op in text_ops:
-            path = op['target_path']
-            group_idx = op.get('group', 1)
-            group_name = f"文字组 {group_idx}"
-            if group_name not in state.text_groups:
-                while len(state.text_groups) < group_idx:
-                    state.text_groups.append(f"文字组 {len(state.text_groups) + 1}")
-            
-            rule = {
-                "name": path.split(' > ')[-1],
-                "path": path,
-                "mapping_key": group_name,
-                "regex_steps": op.get('regex_steps', [])
-            }
-            state.text_rules.append(rule)
-
-        # 3. 还原图片规则
-        for op in img_ops:
-            path = op['target_path']
-            group_idx = op.get('group', 1)
-            img_group_idx = max(1, group_idx - max_text_group)
-            group_name = f"图片组 {img_group_idx}"
-            
-            if group_name not in state.image_groups:
-                while len(state.image_groups) < img_group_idx:
-                    state.image_groups.append(f"图片组 {len(state.image_groups) + 1}")
-
-            rule = {
-                "name": path.split(' > ')[-1],
-                "path": path,
-                "mapping_key": group_name
-            }
-            state.image_rules.append(rule)
-
-        # 4. 还原滤镜规则
-        path_to_filter_rule = {}
-        for op in filter_ops:
-            path = op['target_path']
-            if path not in path_to_filter_rule:
-                path_to_filter_rule[path] = {
-                    "name": path.split(' > ')[-1],
-                    "path": path,
-                    "filter_steps": []
-                }
-            
-            path_to_filter_rule[path]['filter_steps'].append({
-                "type": op['filter_type'],
-                "params": op['params']
-            })
-        state.filter_rules = list(path_to_filter_rule.values())
-
-        # 5. 还原渲染方案
-        if data.get('renders'):
-            first_render = data['renders'][0]
-            if first_render.get('filters'):
-                state.global_filter_steps = first_render['filters']
-                state.global_filter_active = True
-            
-            for r in data['renders']:
-                root_layers = r.get('root_layers', [])
-                if not root_layers and r.get('root_ids'):
-                    root_layers = [id_to_path.get(rid) for rid in r.get('root_ids', []) if id_to_path.get(rid)]
-
-                raw_tiling = r.get('tiling', {"enabled": False})
-                if isinstance(raw_tiling, dict):
-                    tiling = {
-                        "enabled": bool(raw_tiling.get("enabled", False)),
-                        "width": int(raw_tiling.get("width", 1920) or 1920),
-                        "height": int(raw_tiling.get("height", 1080) or 1080),
-                        "ppi": int(raw_tiling.get("ppi", 300) or 300),
-                    }
-                else:
-                    # 兼容执行态结构：tiling(bool) + width/height/resolution
-                    tiling = {
-                        "enabled": bool(raw_tiling),
-                        "width": int(r.get("width", 1920) or 1920),
-                        "height": int(r.get("height", 1080) or 1080),
-                        "ppi": int(r.get("resolution", 300) or 300),
-                    }
-
-                preset = {
-                    "name": r['name'],
-                    "filename": r['filename'],
-                    "format": r['format'],
-                    "root_layers": root_layers,
-                    "tiling": tiling,
-                    "output_path": r.get('output_path', './output'),
-                    "quality": r.get('quality', 100)
-                }
-                state.render_presets.append(preset)
-        
-        # 6. 核心改进：确保文档加载后始终拥有至少一个渲染方案
-        state.ensure_render_preset()
-
 # --- 制作模板模式状态管理 ---
 
 class TemplateState:
@@ -1237,7 +1000,7 @@ class TemplateState:
             "output_path": "./output",
             "filename": defaults.get('filename_template', "{文字组 1}_{模板名}_{时间}"),
             "format": defaults.get('format', "jpg"),
-            "quality": 85,
+            "quality": defaults.get('quality', 85),
             "root_layers": [],
             "tiling": copy.deepcopy(defaults.get('tiling', {
                 "enabled": False,
@@ -1246,6 +1009,8 @@ class TemplateState:
                 "ppi": 300
             }))
         }
+        if defaults.get('encoding'):
+            new_preset['encoding'] = copy.deepcopy(defaults['encoding'])
         
         # 3. 核心：根据图层树当前的可见性自动勾选根图层
         if self.layer_tree:
@@ -1272,6 +1037,10 @@ class FilterEditor:
         self.on_save = on_save
         self.container = container
         self.dialog = None
+        # 实时预览：当前文档的缩小代理图 + Python 端滤镜（见 filter_preview.py）
+        self.preview_session = None
+        self.preview_image = None
+        self.preview_status = None
 
     def _get_default_params(self):
         """从配置中获取默认参数字典"""
@@ -1292,7 +1061,13 @@ class FilterEditor:
                         with ui.column().classes('gap-0'):
                             ui.label(f"{self.config['name']} 设置").classes('text-sm font-bold text-slate-800 leading-tight')
                             ui.label(f"Filter: {self.config['type']}").classes('text-[10px] text-slate-400 font-medium')
-                    ui.icon('close', size='20px').classes('cursor-pointer text-slate-300 hover:text-red-500 transition-colors').on('click', self.dialog.close)
+                    ui.icon('close', size='20px').classes('cursor-pointer text-slate-300 hover:text-red-500 transition-colors').on('click', self.close)
+
+                # 预览区（缩小的代理图）
+                with ui.column().classes('w-full px-8 pt-5 gap-1.5'):
+                    with ui.element('div').classes('w-full h-[200px] rounded-xl border border-slate-200 bg-slate-50 flex items-center justify-center overflow-hidden'):
+                        self.preview_image = ui.image().classes('w-full h-full').props('fit=contain no-spinner no-transition')
+                    self.preview_status = ui.label('正在准备预览...').classes('text-[10px] text-slate-400 font-medium')
 
                 # Body (参数调节区)
                 with ui.column().classes('w-full px-8 py-6 gap-6'):
@@ -1306,12 +1081,14 @@ class FilterEditor:
                                     val_input = ui.number(value=self.params[p_def['internal_name']], precision=2) \
                                         .props('outlined dense hide-bottom-space').classes('w-16 bg-white text-xs')
                                     val_input.bind_value(self.params, p_def['internal_name'])
+                                    val_input.on_value_change(lambda _: self.update_preview())
                                     ui.label(p_def['unit']).classes('text-[10px] text-slate-400 font-bold ml-0.5')
 
                             # 滑动条主控件
                             slider = ui.slider(min=p_def['min'], max=p_def['max'], step=0.1 if isinstance(p_def['min'], float) else 1) \
                                 .props('label').classes('w-full')
                             slider.bind_value(self.params, p_def['internal_name'])
+                            slider.on_value_change(lambda _: self.update_preview())
                             # 设置滑动条颜色以符合紫色滤镜主题
                             slider.props('color="purple-5" selection-color="purple-5"')
 
@@ -1321,43 +1098,89 @@ class FilterEditor:
                     ui.button('恢复默认', on_click=self.reset_to_default).props('flat no-caps dense').classes('text-purple-600 font-bold text-xs hover:bg-purple-50 rounded-lg px-3')
                     
                     with ui.row().classes('items-center gap-3'):
-                        ui.button('取消', on_click=self.dialog.close).props('flat no-caps dense').classes('text-slate-500 font-medium text-xs hover:bg-slate-100 rounded-lg px-4')
+                        ui.button('取消', on_click=self.close).props('flat no-caps dense').classes('text-slate-500 font-medium text-xs hover:bg-slate-100 rounded-lg px-4')
                         with ui.button(on_click=self.handle_save).props('unelevated no-caps dense').classes('bg-purple-500 hover:bg-purple-600 text-white rounded-lg px-5 py-1.5 shadow-md shadow-purple-200 transition-all'):
                             ui.icon('check', size='14px').classes('mr-1.5')
                             ui.label('保存参数').classes('text-xs font-bold')
 
             self.dialog.open()
+        asyncio.create_task(self.start_preview())
+
+    async def start_preview(self):
+        """获取（或复用）当前文档的代理图并渲染首帧"""
+        doc = template_state.current_doc
+        if not filter_preview.enabled or self.config['type'] not in PREVIEWABLE_FILTERS:
+            self.preview_status.set_text('该滤镜暂不支持实时预览')
+            return
+        if not doc or not ps_server.is_connected():
+            self.preview_status.set_text('未连接 Photoshop 或未选择文档，无法预览')
+            return
+
+        async def fetch():
+            # 不带规则与滤镜的整图渲染；交互优先级，插队到批量行之前
+            done = asyncio.get_running_loop().create_future()
+
+            def on_done(data, err):
+                if not done.done():
+                    done.set_result((data, err))
+            await ps_server.execute_strategy_atomic(
+                operations=[],
+                renders=[{
+                    "file_name": f"proxy_{datetime.datetime.now().strftime('%H%M%S_%f')}",
+                    "format": "png",
+                    "folder": os.path.abspath(TEMP_PREVIEW_DIR),
+                    "root_ids": [],
+                    "tiling": False,
+                    "filters": []
+                }],
+                target_document=doc,
+                callback=on_done,
+                priority=PRIORITY_INTERACTIVE
+            )
+            data, err = await done
+            files = (data.get('rendered_files') or []) if isinstance(data, dict) else []
+            if err or not files or files[0].get('status') not in ('ok', 'success'):
+                return None
+            return files[0].get('path')
+
+        if filter_preview.cached(doc) is None:
+            self.preview_status.set_text('正在从 Photoshop 获取预览底图...')
+        proxy = await filter_preview.proxy(doc, fetch)
+        if proxy is None:
+            self.preview_status.set_text('获取预览底图失败')
+            return
+        if self.preview_session is None and self.dialog is not None and self.dialog.value:
+            self.preview_session = PreviewSession(filter_preview, proxy, self._show_preview_frame)
+            self.update_preview()
+
+    def _show_preview_frame(self, data_url, info):
+        self.preview_image.set_source(data_url)
+        width, height = info['size']
+        state = '' if info['final'] else '，细化中...'
+        self.preview_status.set_text(f"预览 {width}×{height} · {info['elapsed'] * 1000:.0f} ms{state}")
+
+    def update_preview(self):
+        """参数变化时刷新预览（会话内防抖，由粗到细）"""
+        if self.preview_session is not None:
+            self.preview_session.update([{"type": self.config['type'], "params": dict(self.params)}])
+
+    def close(self):
+        if self.preview_session is not None:
+            self.preview_session.close()
+            self.preview_session = None
+        self.dialog.close()
 
     def reset_to_default(self):
         """恢复所有参数为默认值"""
         defaults = self._get_default_params()
         self.params.update(defaults)
+        self.update_preview()
         ui.notify(f"参数已重置为默认", type='info')
 
     def handle_save(self):
         if self.on_save:
             self.on_save(self.params)
-        self.dialog.close()
-
-def apply_regex_steps(text, steps):
-    """
-    统一的正则处理引擎
-    支持 JS 风格的 $1 捕获组语法
-    """
-    import re
-    result = text
-    for step in steps:
-        find_pattern = step.get('find', '')
-        replace_pattern = step.get('replace', '')
-        if not find_pattern:
-            continue
-        try:
-            # 兼容性处理：将 JS 风格的 $1, $2 转换为 Python 风格的 \1, \2
-            py_replace = re.sub(r'\$(\d+)', r'\\\1', replace_pattern)
-            result = re.sub(find_pattern, py_replace, result)
-        except Exception as e:
-            print(f"正则应用失败: {e}")
-    return result
+        self.close()
 
 class RegexEditor:
     """
@@ -1565,6 +1388,10 @@ class RenderPresetEditor:
         self.layer_tree = layer_tree
         self.workbench = workbench
         self.dialog = None
+        # 编码参数：开启精细编码时由 Python 端按这些参数编码（见 encoder.py），否则由 PS 按质量直接保存
+        self.data.setdefault('quality', 85)
+        self.fine_encoding = {'enabled': bool(self.data.get('encoding'))}
+        self.encoding = dict(DEFAULT_ENCODING, **(self.data.get('encoding') or {}))
 
     def open(self):
         """打开编辑器弹窗"""
@@ -1681,6 +1508,34 @@ class RenderPresetEditor:
                                         ui.number(value=self.data['tiling'].get('height', 1080), precision=0).classes('w-full bg-white shadow-sm ice-rounded-input').props('outlined dense') \
                                             .bind_value(self.data['tiling'], 'height')
 
+                            # 4. 编码参数
+                            with ui.column().classes('w-full gap-2'):
+                                with ui.row().classes('w-full justify-between items-center'):
+                                    with ui.row().classes('items-center gap-2'):
+                                        ui.icon('tune', size='16px', color='indigo-400')
+                                        ui.label('编码参数').classes('text-xs font-bold text-slate-500 uppercase tracking-wider')
+                                    with ui.row().classes('items-center gap-1'):
+                                        ui.label('质量').classes('text-[10px] font-bold text-slate-400')
+                                        ui.number(min=1, max=100, precision=0).props('outlined dense hide-bottom-space').classes('w-16 bg-white text-xs') \
+                                            .bind_value(self.data, 'quality')
+                                ui.slider(min=1, max=100, step=1).props('color="indigo-5"').classes('w-full').bind_value(self.data, 'quality')
+
+                                with ui.row().classes('w-full h-[40px] items-center px-3 bg-slate-50 rounded-xl border border-slate-200'):
+                                    fine_switch = ui.switch().bind_value(self.fine_encoding, 'enabled').props('color="indigo-5" size="sm"')
+                                    ui.label('精细编码').classes('text-[11px] text-slate-600 font-medium ml-1')
+                                    ui.label('JPG / PNG / WEBP / BMP 由本地编码，支持以下选项').classes('text-[10px] text-slate-400 ml-auto')
+
+                                with ui.grid().classes('w-full grid-cols-2 gap-x-4 gap-y-1') as encoding_area:
+                                    ui.switch('渐进式 JPEG').bind_value(self.encoding, 'progressive').props('dense color="indigo-5" size="sm"').classes('text-[11px] text-slate-600')
+                                    ui.switch('优化编码表').bind_value(self.encoding, 'optimize').props('dense color="indigo-5" size="sm"').classes('text-[11px] text-slate-600')
+                                    ui.switch('WebP 无损').bind_value(self.encoding, 'webp_lossless').props('dense color="indigo-5" size="sm"').classes('text-[11px] text-slate-600')
+                                    ui.switch('去除元数据').bind_value(self.encoding, 'strip_metadata').props('dense color="indigo-5" size="sm"').classes('text-[11px] text-slate-600')
+                                    with ui.row().classes('items-center gap-2 col-span-2'):
+                                        ui.label('PNG 压缩级别 (0-9)').classes('text-[11px] text-slate-600')
+                                        ui.number(min=0, max=9, precision=0).props('outlined dense hide-bottom-space').classes('w-16 bg-white text-xs') \
+                                            .bind_value(self.encoding, 'png_compress')
+                                encoding_area.bind_visibility_from(fine_switch, 'value')
+
                     # ---------------- FOOTER ----------------
                     with ui.row().classes('w-full justify-end items-center px-6 py-4 bg-slate-50/50 border-t border-slate-100 gap-3 mt-auto'):
                         ui.button('取消', on_click=self.dialog.close).props('flat no-caps dense').classes('text-slate-500 font-medium text-xs hover:bg-slate-100 rounded-lg px-4')
@@ -1813,6 +1668,15 @@ class RenderPresetEditor:
         render_defaults['filename_template'] = filename
         render_defaults['format'] = self.data.get('format', 'jpg')
         render_defaults['tiling'] = copy.deepcopy(self.data.get('tiling', {"enabled": False}))
+        # 编码参数：质量限制在 1-100，精细编码关闭时不写 encoding（由 PS 直接保存）
+        self.data['quality'] = max(1, min(int(self.data.get('quality') or 85), 100))
+        if self.fine_encoding['enabled']:
+            self.encoding['png_compress'] = max(0, min(int(self.encoding.get('png_compress') or 0), 9))
+            self.data['encoding'] = dict(self.encoding)
+        else:
+            self.data.pop('encoding', None)
+        render_defaults['quality'] = self.data['quality']
+        render_defaults['encoding'] = copy.deepcopy(self.data.get('encoding'))
         local_config.save_to_disk()
         
         self.dialog.close()
@@ -1834,21 +1698,34 @@ class RapidExportPanel:
         # 任务队列引擎状态
         self.queue = []  # 等待执行的原始数据列表
         self.task_history = []  # 所有任务的完整记录（含状态和元数据）
+        self.output_index = OutputIndex()  # 任务序号 -> 实际输出文件（路径、大小、修改时间、哈希）
         self.is_running = False
         self.strategy_snapshot = None
         self.processed_count = 0
         self.total_count = 0
         self.abort_requested = False
+        # 当前在 PS 中执行的原子请求 ID（用于终止时取消）
+        self.current_req_id = None
+        # 吞吐量 / ETA 统计
+        self.batch_progress = None
         
         # 持久化配置缓存
         settings = local_config.data.get('settings', {}).get('rapid_export', {})
         self.copy_after_render = settings.get('copy_after_render', False)
+        # 相同图片合并执行：图片输入相同的任务连续执行，插件复用已换图的底稿
+        self.group_images = settings.get('group_images', False)
         self.export_path = settings.get('export_path', './output')
         self.ignore_header = settings.get('ignore_header', True)
         # 注意：剪贴板监听在“未登录/未连接”时不应启动，否则会在启动阶段误触发提示
         self.clipboard_monitor_active = False
         self._clipboard_monitor_saved = bool(settings.get('clipboard_monitor', False))
-        self.last_clipboard_text = ""
+        # 剪贴板监听：只检查剪贴板序号，内容变化时才读取；按内容哈希去重、连续变化合并为一批（见 clipboard.py）
+        self.clipboard_watcher = ClipboardWatcher(
+            clipboard_exporter.backend,
+            on_batch=lambda lines: self.add_to_queue(lines, source="剪贴板嗅探"),
+            accept=self._clipboard_accepting,
+        )
+        self._sync_pixel_sink()
         
         # UI 元素引用
         self.progress_label = None
@@ -1865,17 +1742,16 @@ class RapidExportPanel:
         
         self._build_ui()
         
-        # 剪贴板监听定时器
-        self.clipboard_timer = ui.timer(0.8, self._poll_clipboard, active=self.clipboard_monitor_active)
+        # 剪贴板监听定时器（每次只读取序号，间隔可以很短）
+        self.clipboard_timer = ui.timer(0.1, self.clipboard_watcher.poll, active=self.clipboard_monitor_active)
         # 初始化终止按钮状态
         self._update_terminate_btn_state()
 
     def on_logged_in(self):
         """登录成功后调用：恢复剪贴板监听开关（若用户之前开启过）。"""
         if self._clipboard_monitor_saved:
-            self.clipboard_monitor_active = True
             try:
-                self.clipboard_timer.active = True
+                self._set_clipboard_monitor(True)
             except Exception:
                 pass
             if self.clipboard_switch:
@@ -1886,6 +1762,7 @@ class RapidExportPanel:
         settings = local_config.data.setdefault('settings', {})
         rapid_export = settings.setdefault('rapid_export', {})
         rapid_export['copy_after_render'] = self.copy_after_render
+        rapid_export['group_images'] = self.group_images
         rapid_export['export_path'] = self.export_path
         rapid_export['ignore_header'] = self.ignore_header
         rapid_export['clipboard_monitor'] = self.clipboard_monitor_active
@@ -1972,6 +1849,10 @@ class RapidExportPanel:
                             ui.label('渲染完复制到剪贴板').classes('text-xs font-bold text-slate-600')
                             self.copy_after_render_switch = ui.switch(value=self.copy_after_render) \
                                 .props('dense').on_value_change(self._on_copy_after_render_change)
+                        with ui.row().classes('w-full items-center justify-between'):
+                            ui.label('相同图片合并执行').classes('text-xs font-bold text-slate-600') \
+                                .tooltip('图片相同的任务排在一起连续执行，跳过重复换图；输出序号与文件名不变')
+                            ui.switch(value=self.group_images).props('dense').on_value_change(self._on_group_images_change)
 
                 # 6. 进度区域
                 with ui.column().classes('w-full gap-4 pt-6 border-t border-slate-100'):
@@ -2000,9 +1881,8 @@ class RapidExportPanel:
             ui.notify("请先登录并连接 Photoshop 后再开启剪贴板监听", type='warning')
             return
 
-        self.clipboard_monitor_active = e.value
         self._clipboard_monitor_saved = bool(e.value)
-        self.clipboard_timer.active = e.value
+        self._set_clipboard_monitor(e.value)
         self._save_settings()
         ui.notify(f"剪贴板监听已{'开启' if e.value else '关闭'}")
 
@@ -2012,8 +1892,25 @@ class RapidExportPanel:
 
     def _on_copy_after_render_change(self, e):
         self.copy_after_render = e.value
+        self._sync_pixel_sink()
         self._save_settings()
 
+    def _sync_pixel_sink(self):
+        """开启「渲染完复制到剪贴板」时，Python 编码的输出把内存中的像素交给剪贴板导出，复制时不再读盘解码"""
+        enabled = self.copy_after_render and win32clipboard and clipboard_exporter.available
+        output_encoder.pixel_sink = clipboard_exporter.offer if enabled else None
+
+    def _on_group_images_change(self, e):
+        self.group_images = e.value
+        self._save_settings()
+
+    def _next_queue_position(self, last_images) -> int:
+        """相同图片合并执行：优先取图片输入与上一任务相同的排队任务，否则取队首"""
+        if last_images is None:
+            return 0
+        text_vars, _ = self._get_active_group_counts()
+        return next((i for i, data in enumerate(self.queue) if tuple(data[text_vars:]) == last_images), 0)
+
     def _extract_upload_filename(self, e):
         valid_exts = ('.csv', '.xlsx', '.xlsm', '.txt')
         generic_names = {'smallfileupload', 'file', 'blob', 'upload', 'object', 'bytesio', 'content'}
@@ -2127,54 +2024,6 @@ class RapidExportPanel:
             return data if isinstance(data, bytes) else (str(data).encode('utf-8') if data is not None else None)
         return str(content).encode('utf-8')
 
-    def _decode_csv_bytes(self, file_bytes):
-        for enc in ('utf-8-sig', 'utf-8', 'gb18030', 'gbk'):
-            try:
-                return file_bytes.decode(enc)
-            except Exception:
-                continue
-        return file_bytes.decode('utf-8', errors='ignore')
-
-    def _looks_like_xlsx(self, file_bytes):
-        if not file_bytes or len(file_bytes) < 4 or file_bytes[:2] != b'PK':
-            return False
-        try:
-            import zipfile
-            with zipfile.ZipFile(BytesIO(file_bytes)) as zf:
-                names = set(zf.namelist())
-                return '[Content_Types].xml' in names and any(name.startswith('xl/') for name in names)
-        except Exception:
-            return False
-
-    def _looks_like_csv(self, file_bytes):
-        if not file_bytes:
-            return False
-        text = self._decode_csv_bytes(file_bytes[:16384])
-        if not text:
-            return False
-        sample_lines = [ln for ln in text.splitlines() if ln.strip()][:5]
-        if not sample_lines and text.strip():
-            sample_lines = [text.strip()]
-        if not sample_lines:
-            return False
-        delimiters = [',', '\t', ';', '|']
-        for delim in delimiters:
-            if any(delim in line for line in sample_lines):
-                return True
-        return False
-
-    def _detect_table_format(self, filename, file_bytes):
-        suffix = os.path.splitext((filename or '').lower())[1]
-        if self._looks_like_xlsx(file_bytes):
-            return 'xlsx'
-        if suffix in ('.xlsx', '.xlsm'):
-            return 'xlsx'
-        if suffix in ('.csv', '.txt'):
-            return 'csv'
-        if self._looks_like_csv(file_bytes):
-            return 'csv'
-        return None
-
     def _open_table_file_dialog(self):
         if not self.file_uploader:
             return
@@ -2192,48 +2041,18 @@ class RapidExportPanel:
     async def _handle_file_upload(self, e):
         """处理上传的表格文件：解析 -> 预览 -> 用户确认后入队。"""
         try:
-            import io
             filename = self._extract_upload_filename(e)
             file_bytes = await self._extract_upload_bytes(e)
             if not file_bytes:
                 ui.notify("读取上传文件失败，请重试拖拽或点击上传", type='negative')
                 return
 
-            file_type = self._detect_table_format(filename, file_bytes)
-            parsed_rows = []
+            try:
+                file_type, parsed_rows = parse_table(filename, file_bytes)
+            except ImportError:
+                ui.notify("未安装 openpyxl，无法解析 Excel。请使用 CSV 或运行 'pip install openpyxl'", type='warning')
+                return
             if file_type is None:
-                # 容错：部分系统上传事件无法给出可靠后缀，尝试按 CSV 直接解析。
-                import csv
-                try:
-                    probe_stream = io.StringIO(self._decode_csv_bytes(file_bytes))
-                    probe_reader = csv.reader(probe_stream)
-                    probe_rows = [r for r in probe_reader if r]
-                    if probe_rows:
-                        file_type = 'csv'
-                except Exception:
-                    pass
-            if file_type == 'csv':
-                import csv
-                text_stream = io.StringIO(self._decode_csv_bytes(file_bytes))
-                reader = csv.reader(text_stream)
-                for row in reader:
-                    if row:
-                        normalized = [str(cell).strip() if cell is not None else "" for cell in row]
-                        if any(cell != "" for cell in normalized):
-                            parsed_rows.append(normalized)
-            elif file_type == 'xlsx':
-                try:
-                    from openpyxl import load_workbook
-                    wb = load_workbook(filename=io.BytesIO(file_bytes))
-                    ws = wb.active
-                    for row in ws.iter_rows(values_only=True):
-                        if any(row):
-                            str_row = [str(cell) if cell is not None else "" for cell in row]
-                            parsed_rows.append(str_row)
-                except ImportError:
-                    ui.notify("未安装 openpyxl，无法解析 Excel。请使用 CSV 或运行 'pip install openpyxl'", type='warning')
-                    return
-            else:
                 ui.notify("无法识别文件格式，请上传 CSV 或 XLSX", type='warning')
                 return
 
@@ -2276,6 +2095,12 @@ class RapidExportPanel:
                 ui.notify("没有识别到可导入的数据，请检查文件内容", type='warning')
                 return
 
+            # 图片预检：并发检查所有行引用的图片，有问题的行在预览中标出且不能入队
+            image_issues = {}
+            if img_vars > 0:
+                row_errors = await preflight.check_rows_async([item['cells'][text_vars:] for item in all_candidates])
+                image_issues = {all_candidates[i]['source_idx']: err for i, err in row_errors.items()}
+
             # 弹出预览对话框：列表选择、默认全选、手动勾选、一键入队或放弃
             async def show_preview_dialog():
                 selected_rows = {}
@@ -2303,7 +2128,7 @@ class RapidExportPanel:
                                 def select_all():
                                     candidates, _ = build_preview_candidates(preview_ignore_header.value, preview_filter_empty.value)
                                     for item in candidates:
-                                        selected_rows[item['source_idx']] = True
+                                        selected_rows[item['source_idx']] = item['source_idx'] not in image_issues
                                     render_list()
                                 def deselect_all():
                                     candidates, _ = build_preview_candidates(preview_ignore_header.value, preview_filter_empty.value)
@@ -2322,11 +2147,15 @@ class RapidExportPanel:
                         def render_list():
                             list_inner.clear()
                             candidates, invalid_count = build_preview_candidates(preview_ignore_header.value, preview_filter_empty.value)
-                            status_label.set_text(f'已识别 {len(candidates)} 条，因空项跳过 {invalid_count} 条')
+                            bad_count = sum(1 for item in candidates if item['source_idx'] in image_issues)
+                            status_text = f'已识别 {len(candidates)} 条，因空项跳过 {invalid_count} 条'
+                            if bad_count:
+                                status_text += f'，图片异常 {bad_count} 条（不会入队）'
+                            status_label.set_text(status_text)
 
                             for item in candidates:
                                 if item['source_idx'] not in selected_rows:
-                                    selected_rows[item['source_idx']] = True
+                                    selected_rows[item['source_idx']] = item['source_idx'] not in image_issues
 
                             with list_inner:
                                 with ui.row().classes('w-full ice-preview-grid-row ice-preview-table-header').style(grid_template):
@@ -2349,10 +2178,19 @@ class RapidExportPanel:
                                     with ui.row().classes('w-full ice-preview-grid-row ice-preview-table-row').style(grid_template):
                                         def on_check(e, oi=source_idx):
                                             selected_rows[oi] = e.value
+                                        issue = image_issues.get(source_idx)
                                         with ui.element('div').classes('ice-preview-cell ice-preview-col-check justify-center'):
-                                            ui.checkbox(value=selected_rows.get(source_idx, True)).props('dense size="xs"').on_value_change(on_check)
+                                            checkbox = ui.checkbox(value=selected_rows.get(source_idx, True) and not issue).props('dense size="xs"').on_value_change(on_check)
+                                            if issue:
+                                                checkbox.props('disable')
                                         with ui.element('div').classes('ice-preview-cell ice-preview-col-serial justify-center'):
-                                            ui.label(str(display_i)).classes('text-[10px] text-slate-500 font-semibold')
+                                            if issue:
+                                                with ui.row().classes('items-center gap-1 no-wrap'):
+                                                    ui.icon('broken_image', size='14px').classes('text-red-400')
+                                                    ui.label(str(display_i)).classes('text-[10px] text-red-400 font-semibold')
+                                                    ui.tooltip(issue).classes('text-xs')
+                                            else:
+                                                ui.label(str(display_i)).classes('text-[10px] text-slate-500 font-semibold')
                                         for col_idx in range(total_vars):
                                             value = cells[col_idx] if col_idx < len(cells) else ''
                                             ui.element('div').classes('ice-preview-cell ice-preview-col-var').add_slot(
@@ -2370,7 +2208,7 @@ class RapidExportPanel:
                             lines_to_add = []
                             candidates, _ = build_preview_candidates(preview_ignore_header.value, preview_filter_empty.value)
                             for item in candidates:
-                                if selected_rows.get(item['source_idx'], False):
+                                if selected_rows.get(item['source_idx'], False) and item['source_idx'] not in image_issues:
                                     lines_to_add.append(item['line'])
                             if not lines_to_add:
                                 ui.notify("请至少选择一条数据", type='warning')
@@ -2394,49 +2232,13 @@ class RapidExportPanel:
 
     async def _pick_export_path(self):
         """选择导出路径"""
-        # 优先使用系统原生对话框（tkinter），避免依赖 pywebview 注入 API
-        try:
-            import tkinter as tk
-            from tkinter import filedialog
-
-            def pick_dir_sync():
-                root = tk.Tk()
-                # 隐藏图标（创建透明1x1图标）
-                try:
-                    root.iconbitmap(default='')
-                except Exception:
-                    pass
-                root.withdraw()
-                root.attributes('-topmost', True)
-                initial = os.path.abspath(self.export_path) if self.export_path else os.getcwd()
-                path = filedialog.askdirectory(initialdir=initial, title="选择导出文件夹")
-                try:
-                    root.destroy()
-                except Exception:
-                    pass
-                return path
-
-            path = await asyncio.to_thread(pick_dir_sync)
-            if path:
-                self.export_path = path
-                self.export_path_label.set_text(path)
-                self._save_settings()
-                ui.notify(f"导出路径已更新: {path}", type='positive')
-                return
-        except Exception:
-            pass
-
-        # 兜底：尝试通过 pywebview JS API
-        try:
-            path = await ui.run_javascript("window.pywebview.api.pick_folder()")
-            if path:
-                self.export_path = path
-                self.export_path_label.set_text(path)
-                self._save_settings()
-                ui.notify(f"导出路径已更新: {path}", type='positive')
-                return
-        except Exception:
-            pass
+        initial = os.path.abspath(self.export_path) if self.export_path else os.getcwd()
+        path = await pick_directory(initial, "选择导出文件夹")
+        if path:
+            self.export_path = path
+            self.export_path_label.set_text(path)
+            self._save_settings()
+            ui.notify(f"导出路径已更新: {path}", type='positive')
 
     def _pick_table_file(self):
         """打开文件选择器解析表格"""
@@ -2452,36 +2254,20 @@ class RapidExportPanel:
         self.add_to_queue(lines)
         self.manual_textarea.set_value("")
 
-    def _poll_clipboard(self):
-        """轮询剪贴板"""
+    def _set_clipboard_monitor(self, active):
+        """开启 / 关闭剪贴板监听；开启时读取一次当前内容"""
+        self.clipboard_monitor_active = bool(active)
+        self.clipboard_watcher.active = bool(active)
+        if active:
+            self.clipboard_watcher.reset()
+        self.clipboard_timer.active = bool(active)
+
+    def _clipboard_accepting(self):
+        """剪贴板监听是否接收新内容；不接收期间的变化在恢复后处理"""
         # 未登录/未连接时不嗅探，避免启动阶段误提示
         if not auth_logged_in or not ps_server.is_connected():
-            return
-        if not self.clipboard_monitor_active or self.is_running or not win32clipboard:
-            return
-        
-        clipboard_opened = False
-        try:
-            win32clipboard.OpenClipboard()
-            clipboard_opened = True
-            # 仅在包含文本格式时尝试嗅探，防止与图片复制冲突
-            if win32clipboard.IsClipboardFormatAvailable(win32clipboard.CF_UNICODETEXT):
-                data = win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
-                # 严格对比去除首尾空格后的内容，防止重复入队
-                clean_data = data.strip() if data else ""
-                if clean_data and clean_data != self.last_clipboard_text:
-                    self.last_clipboard_text = clean_data
-                    lines = [line.strip() for line in clean_data.split('\n') if line.strip()]
-                    if lines:
-                        self.add_to_queue(lines, source="剪贴板嗅探")
-        except Exception:
-            pass
-        finally:
-            if clipboard_opened:
-                try:
-                    win32clipboard.CloseClipboard()
-                except Exception:
-                    pass
+            return False
+        return self.clipboard_monitor_active and not self.is_running and bool(win32clipboard)
 
     def _get_active_group_counts(self):
         """计算策略中实际使用的变量组数量 (与 StrategyParser 逻辑保持一致)"""
@@ -2615,11 +2401,16 @@ class RapidExportPanel:
 
         self.processed_count = 0
         self.total_count = len(self.queue) + self.processed_count
+        self.batch_progress = BatchProgress(self.total_count, expected_row_seconds=ps_server.expected_row_seconds(
+            len(self.strategy_snapshot.get('renders', []))))
+        group_images = self.group_images
+        last_images = None
         
         try:
             while self.queue and not self.abort_requested:
-                # 找到当前要处理的任务在 task_history 中的索引
-                current_task_data = self.queue[0]
+                # 找到当前要处理的任务在 task_history 中的索引（输出序号仍按入队顺序）
+                position = self._next_queue_position(last_images) if group_images else 0
+                current_task_data = self.queue[position]
                 current_task_idx = None
                 for idx, t in enumerate(self.task_history):
                     if t['data'] == current_task_data and t['status'] == 'waiting':
@@ -2629,20 +2420,37 @@ class RapidExportPanel:
                     self.task_history[current_task_idx]['status'] = 'running'
                 
                 # 取出任务
-                task_data = self.queue.pop(0)
+                task_data = self.queue.pop(position)
+                last_images = tuple(task_data[self._get_active_group_counts()[0]:])
                 self.processed_count += 1
+
+                # 图片预检：引用的图片有问题时直接记为失败，不发送到 PS
+                image_errors = await preflight.check_rows_async([list(last_images)])
+                if image_errors:
+                    if current_task_idx is not None:
+                        self.task_history[current_task_idx]['status'] = 'failed'
+                        self.task_history[current_task_idx]['error'] = image_errors[0]
+                    self._update_render_list_ui()
+                    continue
                 
                 # 更新 UI 进度
                 percent = int((self.processed_count / self.total_count) * 100) if self.total_count > 0 else 0
-                self.progress_label.set_text(f"正在处理 {self.processed_count} / {self.total_count}")
+                self.batch_progress.total = self.total_count
+                self.batch_progress.row_started()
+                self.progress_label.set_text(self.batch_progress.status_text())
                 self.percent_label.set_text(f"{percent}%")
                 self.progress_bar.style(f"width: {percent}%")
                 
                 # 更新列表 UI
                 self._update_render_list_ui()
                 
-                # 2. 构造操作包
+                # 2. 构造操作包（替换图片按目标智能对象尺寸预先缩小）
                 operations = self._prepare_operations(task_data)
+                for op in operations:
+                    if op['type'] == 'replace_image' and op.get('image_path'):
+                        box = target_size(find_layer(template_state.layer_tree, op.get('layer_id'), op.get('parent_chain')))
+                        op['image_path'] = await image_prep.prepare(op['image_path'], box)
+                        op['cached'] = image_prep.in_store(op['image_path'])
                 
                 # 3. 构造渲染包 (使用持久化的导出路径)
                 timestamp = datetime.datetime.now().strftime('%H%M%S')
@@ -2670,15 +2478,32 @@ class RapidExportPanel:
                 def on_done(success, err):
                     if not fut.done(): fut.set_result((success, err))
                 
-                await ps_server.execute_strategy_atomic(
+                self.current_req_id = await ps_server.execute_strategy_atomic(
                     operations=operations,
                     renders=renders,
                     debug=False,
                     target_document=template_state.current_doc,
-                    callback=on_done
+                    callback=on_done,
+                    reuse_stage=group_images
                 )
-                
-                success, err = await fut
+                self._update_terminate_btn_state()
+
+                # 订阅阶段进度：实时刷新阶段、吞吐量与剩余时间
+                def on_progress(event):
+                    if event.get('done'):
+                        return
+                    self.batch_progress.update(event)
+                    self.progress_label.set_text(self.batch_progress.status_text())
+
+                unsubscribe = ps_server.subscribe_progress(on_progress, self.current_req_id) if self.current_req_id else None
+                try:
+                    success, err = await fut
+                finally:
+                    if unsubscribe:
+                        unsubscribe()
+                self.batch_progress.row_finished(success.get('stage_timings') if isinstance(success, dict) else None)
+                self.current_req_id = None
+                cancelled = (err == "Cancelled")
                 result_status = success.get('status') if isinstance(success, dict) else None
                 rendered_files = success.get('rendered_files', []) if isinstance(success, dict) else []
                 file_errors = [r.get('error') for r in rendered_files if str(r.get('status', '')).lower() not in ('success', 'ok')]
@@ -2687,33 +2512,30 @@ class RapidExportPanel:
 
                 # 更新 task_history 中的任务状态
                 if current_task_idx is not None:
-                    if atomic_failed:
+                    if cancelled:
+                        # 取消：记录已完成的部分输出
+                        done_files = [r for r in rendered_files if str(r.get('status', '')).lower() in ('success', 'ok')]
+                        self.task_history[current_task_idx]['status'] = 'cancelled'
+                        self.task_history[current_task_idx]['error'] = f"已取消（已输出 {len(done_files)}/{len(renders)} 个文件）"
+                        if done_files:
+                            await self._record_task_outputs(self.task_history[current_task_idx], done_files)
+                    elif atomic_failed:
                         self.task_history[current_task_idx]['status'] = 'failed'
                         first_file_error = next((str(e) for e in file_errors if e), None)
                         status_error = None if not status_failed else f"返回状态: {result_status}"
                         self.task_history[current_task_idx]['error'] = str(err) if err else (first_file_error or status_error or "渲染失败")
                     else:
                         self.task_history[current_task_idx]['status'] = 'success'
-                        first_success_file = next((r for r in rendered_files if str(r.get('status', '')).lower() in ('success', 'ok')), None)
-                        if first_success_file:
-                            resolved_path = self._resolve_rendered_file_path(first_success_file)
-                            if resolved_path:
-                                self.task_history[current_task_idx]['output_name'] = os.path.basename(resolved_path)
-                                self.task_history[current_task_idx]['output_path'] = resolved_path
-                            elif first_success_file.get('name'):
-                                self.task_history[current_task_idx]['output_name'] = str(first_success_file.get('name'))
+                        await self._record_task_outputs(self.task_history[current_task_idx], rendered_files)
                 
                 # 更新列表 UI 状态
                 self._update_render_list_ui()
                 
                 # 如果开启了复制到剪贴板，寻找第一个成功的渲染文件并复制其内容
-                if (not atomic_failed) and self.copy_after_render:
-                    for r_res in rendered_files:
-                        if str(r_res.get('status', '')).lower() in ('success', 'ok'):
-                            file_path = self._resolve_rendered_file_path(r_res)
-                            if file_path:
-                                self._copy_image_to_clipboard(file_path)
-                                break
+                if (not atomic_failed) and self.copy_after_render and current_task_idx is not None:
+                    file_path = self._resolve_task_output_path(self.task_history[current_task_idx])
+                    if file_path:
+                        self._copy_image_to_clipboard(file_path)
 
         except Exception as e:
             ui.notify(f"任务循环异常: {e}", type='negative')
@@ -2725,6 +2547,9 @@ class RapidExportPanel:
                     break
             self._update_render_list_ui()
         finally:
+            self.current_req_id = None
+            if group_images:
+                await ps_server.release_stage()
             self._cleanup_after_run()
 
     def _prepare_operations(self, task_data):
@@ -2775,56 +2600,33 @@ class RapidExportPanel:
             res = f"output_{index_value}"
         return res
 
-    def _resolve_rendered_file_path(self, render_result):
-        """从渲染结果中尽可能解析出真实文件路径。"""
-        if not isinstance(render_result, dict):
-            return None
-
-        raw_path = render_result.get('path')
-        if raw_path:
-            normalized = os.path.abspath(os.path.normpath(str(raw_path)))
-            if os.path.exists(normalized):
-                return normalized
-
-        name = str(render_result.get('name') or '').strip()
-        if not name:
-            return None
-
-        # 1) name 本身是绝对路径
-        if os.path.isabs(name) and os.path.exists(name):
-            return os.path.abspath(os.path.normpath(name))
-
-        # 2) 导出目录 + name
-        joined = os.path.abspath(os.path.join(self.export_path, name))
-        if os.path.exists(joined):
-            return joined
-
-        # 3) name 可能不带扩展名，尝试 name.*
-        base, ext = os.path.splitext(name)
-        if not ext:
-            pattern = os.path.join(os.path.abspath(self.export_path), f"{name}.*")
-            matches = sorted(glob.glob(pattern), key=lambda p: os.path.getmtime(p), reverse=True)
-            if matches:
-                return os.path.abspath(matches[0])
-
-            if base:
-                pattern2 = os.path.join(os.path.abspath(self.export_path), f"{base}.*")
-                matches2 = sorted(glob.glob(pattern2), key=lambda p: os.path.getmtime(p), reverse=True)
-                if matches2:
-                    return os.path.abspath(matches2[0])
-
-        return None
+    async def _record_task_outputs(self, task, rendered_files):
+        """把插件返回的实际输出路径记入输出索引（stat 与哈希在线程池中进行），并更新任务的输出名"""
+        loop = asyncio.get_running_loop()
+        try:
+            items = await loop.run_in_executor(None, self.output_index.record, task['index'], rendered_files)
+        except Exception as e:
+            print(f"记录输出索引失败: {e}")
+            items = []
+        if items:
+            task['output_name'] = os.path.basename(items[0]['path'])
+            task['output_path'] = items[0]['path']
+        else:
+            first = next((r for r in rendered_files or [] if str(r.get('status', '')).lower() in ('success', 'ok')), None)
+            if first and first.get('name'):
+                task['output_name'] = str(first.get('name'))
 
     def _resolve_task_output_path(self, task):
+        """任务的输出文件：查输出索引（一次字典查询 + 一次 stat），不扫描导出目录"""
+        path = self.output_index.resolve(task.get('index'))
+        if path:
+            return path
         direct = task.get('output_path')
         if direct:
             normalized = os.path.abspath(os.path.normpath(str(direct)))
             if os.path.exists(normalized):
                 return normalized
-        return self._resolve_rendered_file_path({
-            'path': task.get('output_path'),
-            'name': task.get('output_name'),
-        })
+        return None
 
     def _open_task_output(self, task):
         path = self._resolve_task_output_path(task)
@@ -2866,70 +2668,32 @@ class RapidExportPanel:
         self._copy_image_to_clipboard(path)
 
     def _copy_image_to_clipboard(self, file_path):
-        """将生成的图片文件内容复制到剪贴板 (仅限 Windows)"""
-        if not win32clipboard:
+        """将生成的图片复制到剪贴板 (仅限 Windows)：由后台线程解码并写入（见 clipboard.py），不阻塞界面"""
+        if not win32clipboard or not clipboard_exporter.available:
             return
+        future = clipboard_exporter.submit(file_path)
 
-        try:
-            import time
-            # 等待文件写入完成，避免复制到半截文件
-            for _ in range(5):
-                if os.path.exists(file_path):
-                    try:
-                        # 尝试用只读打开确认文件可用
-                        with open(file_path, 'rb') as f:
-                            f.read(1)
-                        break
-                    except Exception:
-                        pass
-                time.sleep(0.1)
-
-            if not Image or not os.path.exists(file_path):
-                return
-
-            # 使用 PIL 读取并转换为 Windows 剪贴板识别的 DIB 格式
-            dib_data = None
-            with Image.open(file_path) as img:
-                output = BytesIO()
-                img.convert("RGB").save(output, "BMP")
-                dib_data = output.getvalue()[14:]  # DIB = BMP 去掉 14 字节文件头
-                output.close()
-
-            if not dib_data:
+        async def notify():
+            try:
+                copied = await asyncio.wrap_future(future)
+            except Exception as e:
+                print(f"复制图片到剪贴板失败: {e}")
                 return
+            if not copied:
+                return  # 已被之后的渲染结果取代
+            try:
+                with self.container:
+                    ui.notify("已将渲染结果复制到剪贴板", type='positive')
+            except Exception:
+                # 通知失败不应影响复制结果
+                pass
 
-            # Windows剪贴板经常被占用，重试3次
-            for attempt in range(3):
-                try:
-                    win32clipboard.OpenClipboard()
-                    try:
-                        win32clipboard.EmptyClipboard()
-                        win32clipboard.SetClipboardData(win32clipboard.CF_DIB, dib_data)
-                        try:
-                            with self.container:
-                                ui.notify("已将渲染结果复制到剪贴板", type='positive')
-                        except Exception:
-                            # 通知失败不应影响复制结果
-                            pass
-                        break
-                    finally:
-                        win32clipboard.CloseClipboard()
-                except Exception as e:
-                    if attempt < 2:
-                        time.sleep(0.1)
-                    else:
-                        print(f"复制图片到剪贴板失败（已重试3次）: {e}")
-
-        except Exception as e:
-            print(f"复制图片到剪贴板失败: {e}")
+        asyncio.create_task(notify())
 
     def _copy_to_clipboard(self, text):
         if not win32clipboard: return
         try:
-            win32clipboard.OpenClipboard()
-            win32clipboard.EmptyClipboard()
-            win32clipboard.SetClipboardText(text, win32clipboard.CF_UNICODETEXT)
-            win32clipboard.CloseClipboard()
+            clipboard_exporter.copy_text(text)
         except Exception:
             pass
 
@@ -2969,12 +2733,14 @@ class RapidExportPanel:
                     'running': 'ice-history-dot-running',
                     'success': 'ice-history-dot-success',
                     'failed': 'ice-history-dot-failed',
+                    'cancelled': 'ice-history-dot-waiting',
                 }
                 text_to_class = {
                     'waiting': 'text-slate-500',
                     'running': 'text-cyan-600',
                     'success': 'text-emerald-600',
                     'failed': 'text-red-500',
+                    'cancelled': 'text-amber-500',
                 }
 
                 display_name = task.get('output_name') or task.get('display_name', '未命名任务')
@@ -2982,31 +2748,30 @@ class RapidExportPanel:
                     ui.element('div').classes(f"ice-history-dot {status_to_class.get(status, 'ice-history-dot-waiting')}")
                     ui.label(f"[{task.get('index', 0):03d}] {display_name}") \
                         .classes(f"text-[10px] {text_to_class.get(status, 'text-slate-500')} truncate flex-grow whitespace-nowrap overflow-hidden")
-                    if status == 'success':
+                    if status == 'success' or (status == 'cancelled' and task.get('output_path')):
                         with ui.context_menu().classes('ice-context-menu'):
                             ui.menu_item('打开文件', on_click=lambda t=task: self._open_task_output(t)).classes('ice-context-item')
                             ui.menu_item('打开所在目录', on_click=lambda t=task: self._open_task_output_folder(t)).classes('ice-context-item')
                             ui.menu_item('复制到剪贴板', on_click=lambda t=task: self._copy_task_output_to_clipboard(t)).classes('ice-context-item')
-                    if status == 'failed':
+                    if status in ('failed', 'cancelled'):
                         err_text = task.get('error') or '任务失败'
                         with ui.element('div').classes('ice-history-error-pill'):
                             ui.label('i').classes('text-[9px] leading-none')
                             ui.tooltip(err_text).classes('ice-error-tooltip')
 
     def _update_terminate_btn_state(self):
-        """终止按钮仅在队列仍有剩余任务时可用。"""
+        """终止按钮在任务运行期间可用（可清除排队并取消当前任务）。"""
         if not self.terminate_btn:
             return
-        enabled = bool(self.is_running and len(self.queue) > 0)
+        enabled = bool(self.is_running and (len(self.queue) > 0 or self.current_req_id))
         if enabled:
             self.terminate_btn.classes(remove='opacity-40 pointer-events-none')
         else:
             self.terminate_btn.classes(add='opacity-40 pointer-events-none')
 
     def terminate(self):
-        """终止当前任务队列（仅清除后续排队，不强杀当前正在渲染的任务）"""
-        # 只有“还有排队任务”时才允许点击
-        if not self.is_running or len(self.queue) == 0:
+        """终止当前任务队列：清除后续排队，并取消 PS 中正在执行的任务（在下一个操作/渲染之间生效）"""
+        if not self.is_running:
             return
         
         async def do_terminate():
@@ -3014,12 +2779,15 @@ class RapidExportPanel:
             with self.container:
                 confirmed = await show_confirm_dialog(
                     title='终止任务？',
-                    message='将清除后续排队任务，当前正在渲染的任务会尝试完成。确定继续吗？',
-                    confirm_text='清除排队',
+                    message='将清除后续排队任务，并取消当前正在渲染的任务（已输出的文件会保留）。确定继续吗？',
+                    confirm_text='终止',
                     cancel_text='继续渲染',
                     icon_type='warning'
                 )
             if confirmed:
+                self.abort_requested = True
+                if self.current_req_id:
+                    await ps_server.cancel(self.current_req_id)
                 # 仅保留已执行/执行中的记录，移除被终止后未开始的 waiting 任务
                 self.task_history = [t for t in self.task_history if t.get('status') != 'waiting']
                 self.queue.clear()
@@ -3028,10 +2796,10 @@ class RapidExportPanel:
                     self.total_count = self.processed_count
                     self.percent_label.set_text("100%")
                     self.progress_bar.style("width: 100%")
-                self.progress_label.set_text("已清除后续排队任务")
+                self.progress_label.set_text("已终止任务")
                 self._update_render_list_ui()
                 self._update_terminate_btn_state()
-                ui.notify("已清除后续排队任务", type='info')
+                ui.notify("已终止任务，当前任务将在下一步之前停止", type='info')
         
         asyncio.create_task(do_terminate())
 
@@ -4052,7 +3820,7 @@ class TemplateWorkbench:
             "output_path": "./output",
             "filename": defaults.get('filename_template', "{文字组 1}_{模板名}_{时间}"),
             "format": defaults.get('format', "jpg"),
-            "quality": 85,
+            "quality": defaults.get('quality', 85),
             "root_layers": [],
             "tiling": copy.deepcopy(defaults.get('tiling', {
                 "enabled": False,
@@ -4061,6 +3829,8 @@ class TemplateWorkbench:
                 "ppi": 300
             }))
         }
+        if defaults.get('encoding'):
+            new_preset['encoding'] = copy.deepcopy(defaults['encoding'])
         # 默认根据 PS 中的可见性勾选根图层
         if template_state.layer_tree:
             visible_paths = [
@@ -4342,7 +4112,8 @@ class TemplateWorkbench:
                         operations=operations,
                         renders=renders,
                         debug=False,
-                        callback=on_preview
+                        callback=on_preview,
+                        priority=PRIORITY_INTERACTIVE  # 预览属于交互请求，插队到批量行之前
                     )
 
                 await ps_server.activate_psd(name=template_state.current_doc, callback=on_activated)
@@ -4438,6 +4209,462 @@ class TemplateWorkbench:
 
 # --- 状态显示组件 (Reusable Status Overlay) ---
 
+class PerformancePanel:
+    """
+    性能监控面板：展示派发队列状态与各阶段/操作/格式的延迟统计（数据来自 metrics 注册表）
+    """
+    # (指标名, 标题, 标签字段)
+    SECTIONS = [
+        ('ice_stage_seconds', '原子任务阶段耗时（每个任务合计）', 'stage'),
+        ('ice_operation_seconds', '编辑操作耗时', 'op_type'),
+        ('ice_render_seconds', '渲染准备耗时（按格式）', 'format'),
+        ('ice_save_seconds', '保存耗时（按格式）', 'format'),
+        ('ice_request_duration_seconds', '请求往返耗时（按消息类型）', 'type'),
+        ('ice_queue_wait_seconds', '派发排队时间（按消息类型）', 'type'),
+    ]
+
+    COLUMNS = [
+        {'name': 'label', 'label': '名称', 'field': 'label', 'align': 'left'},
+        {'name': 'count', 'label': '次数', 'field': 'count'},
+        {'name': 'avg', 'label': '平均', 'field': 'avg'},
+        {'name': 'p50', 'label': 'P50', 'field': 'p50'},
+        {'name': 'p95', 'label': 'P95', 'field': 'p95'},
+        {'name': 'max', 'label': '最大', 'field': 'max'},
+    ]
+
+    def __init__(self, parent_container):
+        self.container = parent_container
+        self.queue_label = None
+        self.record_btn = None
+        self.tables = {}
+
+    def render(self):
+        with self.container:
+            with ui.element('div').classes('ice-top-bar'):
+                ui.icon('speed', color='primary').classes('text-lg')
+                ui.label('性能监控').classes('ice-doc-name')
+                ui.space()
+                self.record_btn = ui.button(on_click=self.toggle_recording).props('flat dense size=sm')
+                ui.button('重置统计', on_click=self.reset).props('flat dense size=sm color=grey-6')
+
+            with ui.column().classes('w-full gap-3 p-4 overflow-auto'):
+                self.queue_label = ui.label('').classes('text-xs text-slate-500')
+                for metric_name, title, _ in self.SECTIONS:
+                    ui.label(title).classes('text-[11px] font-bold text-slate-500 uppercase tracking-wider')
+                    self.tables[metric_name] = ui.table(columns=self.COLUMNS, rows=[], row_key='label') \
+                        .props('dense flat bordered hide-bottom').classes('w-full text-xs')
+
+            self.refresh()
+            ui.timer(2.0, self.refresh)
+
+    def refresh(self):
+        self._update_record_btn()
+        stats = ps_server.get_queue_stats()
+        self.queue_label.set_text(
+            f"连接 {stats['connections']} · 执行中 {stats['in_flight']} · "
+            f"排队 {stats['queued']}（交互 {stats['queued_interactive']} / 批量 {stats['queued_batch']}） · "
+            f"最长等待 {stats['oldest_wait']:.1f}s"
+        )
+        histograms = metrics_registry.to_dict().get('histograms', {})
+        for metric_name, _, label_key in self.SECTIONS:
+            rows = []
+            for series in histograms.get(metric_name, []):
+                labels = series['labels']
+                label = labels.get(label_key, '-')
+                if label_key == 'stage':
+                    label = STAGE_LABELS.get(label, label)
+                if metric_name == 'ice_request_duration_seconds' and labels.get('status') not in (None, 'success'):
+                    label = f"{label} ({labels.get('status')})"
+                rows.append({
+                    'label': label,
+                    'count': series['count'],
+                    'avg': f"{series['avg']:.2f}s",
+                    'p50': f"{series['p50']:.2f}s",
+                    'p95': f"{series['p95']:.2f}s",
+                    'max': f"{series['max']:.2f}s",
+                })
+            rows.sort(key=lambda r: r['label'])
+            table = self.tables.get(metric_name)
+            if table is not None:
+                table.rows = rows
+                table.update()
+
+    def _update_record_btn(self):
+        if not self.record_btn:
+            return
+        if ps_server.recorder:
+            self.record_btn.set_text('停止录制')
+            self.record_btn.props('color=red-5 icon=stop_circle')
+        else:
+            self.record_btn.set_text('录制通信')
+            self.record_btn.props('color=grey-6 icon=fiber_manual_record')
+
+    def toggle_recording(self):
+        """开始/停止录制与插件的通信，录制文件可用 replay.py 离线回放"""
+        if ps_server.recorder:
+            path = ps_server.stop_recording()
+            ui.notify(f'通信录制已保存: {os.path.abspath(path)}', type='positive', multi_line=True)
+        else:
+            ps_server.start_recording()
+            ui.notify('开始录制通信（包含请求中的文本与路径，请注意数据安全）', type='info')
+        self._update_record_btn()
+
+    def reset(self):
+        metrics_registry.reset()
+        self.refresh()
+        ui.notify('性能统计已重置', type='info')
+
+class BatchWorkbench:
+    """
+    批量出图工作台：文件夹中的多个 PSD（各自保存了 XMP 策略）+ 数据表 -> 多文档工作流
+
+    - 生成计划：直接从文件读取策略，按同名规则匹配数据表，执行前即可看到每个文档的行数与问题
+    - 执行：PSServer.execute_workflow，最近使用的文档保持打开（LRU），连接了多个 PS 时各文档并行执行，按文档与按行显示进度
+    - 结果：按行分页显示，可只看失败行
+
+    实例在切换模式后保留（执行中的工作流不受影响），render 时重新绑定到新的内容区域。
+    """
+    PLAN_COLUMNS = [
+        {'name': 'name', 'label': '文档', 'field': 'name', 'align': 'left'},
+        {'name': 'strategy', 'label': '策略', 'field': 'strategy', 'align': 'left'},
+        {'name': 'data', 'label': '数据表', 'field': 'data', 'align': 'left'},
+        {'name': 'rows', 'label': '行数', 'field': 'rows'},
+        {'name': 'progress', 'label': '进度', 'field': 'progress'},
+        {'name': 'status', 'label': '状态', 'field': 'status', 'align': 'left'},
+    ]
+    RESULT_COLUMNS = [
+        {'name': 'psd', 'label': '文档', 'field': 'psd', 'align': 'left'},
+        {'name': 'index', 'label': '行', 'field': 'index'},
+        {'name': 'status', 'label': '结果', 'field': 'status'},
+        {'name': 'detail', 'label': '输出 / 错误', 'field': 'detail', 'align': 'left'},
+    ]
+    PAGE_SIZE = 50
+
+    def __init__(self, parent_container=None):
+        self.container = parent_container
+        settings = local_config.data.get('settings', {}).get('batch_workbench', {})
+        self.folder = settings.get('folder', '')
+        self.shared_table = settings.get('shared_table', '')
+        self.output_dir = settings.get('output_dir', '')
+        self.ignore_header = settings.get('ignore_header', True)
+        self.recursive = settings.get('recursive', False)
+        self.keep_open = int(settings.get('keep_open', 3))
+        self.doc_budget_mb = int(settings.get('doc_budget_mb', 0))  # 保持打开文档的内存预算，0 表示不限
+        self.group_documents = settings.get('group_documents', True)
+
+        self.plan = []
+        self.doc_progress = {}  # 计划序号 -> {"done", "total", "status"}
+        self.results = []  # 按行展开的结果
+        self.result_filter = '全部'
+        self.page = 1
+        self.is_running = False
+        self.workflow_task = None
+        self.batch_progress = None
+        self.current_message = ''
+        self._notice = None  # (消息, 类型)：由定时刷新弹出，切换模式期间也不会丢失
+        self._dirty = False
+
+        self.plan_table = None
+        self.summary_label = None
+        self.progress_bar = None
+        self.progress_label = None
+        self.run_btn = None
+        self.stop_btn = None
+        self.result_table = None
+        self.pagination = None
+        self.cache_label = None
+
+    def _save_settings(self):
+        settings = local_config.data.setdefault('settings', {})
+        settings['batch_workbench'] = {
+            'folder': self.folder,
+            'shared_table': self.shared_table,
+            'output_dir': self.output_dir,
+            'ignore_header': self.ignore_header,
+            'recursive': self.recursive,
+            'keep_open': self.keep_open,
+            'doc_budget_mb': self.doc_budget_mb,
+            'group_documents': self.group_documents,
+        }
+        local_config.save_to_disk()
+
+    def render(self, parent_container=None):
+        if parent_container is not None:
+            self.container = parent_container
+        with self.container:
+            with ui.element('div').classes('ice-top-bar'):
+                ui.icon('view_list', color='primary').classes('text-lg')
+                ui.label('批量出图').classes('ice-doc-name')
+                ui.space()
+                self.cache_label = ui.label('').classes('text-xs text-slate-400')
+                ui.button('关闭缓存文档', on_click=self.close_cached_documents).props('flat dense size=sm color=grey-6')
+
+            with ui.column().classes('w-full gap-3 p-4 overflow-auto'):
+                # 1. 输入
+                with ui.row().classes('w-full items-center gap-2 no-wrap'):
+                    folder_input = ui.input('PSD 文件夹', value=self.folder).props('dense outlined').classes('flex-grow text-xs')
+                    folder_input.on_value_change(lambda e: setattr(self, 'folder', e.value.strip()))
+                    ui.button(icon='folder_open', on_click=lambda: self._pick_into(folder_input, '选择 PSD 文件夹')).props('flat dense')
+                with ui.row().classes('w-full items-center gap-2 no-wrap'):
+                    table_input = ui.input('共享数据表（可选，无同名表格时使用）', value=self.shared_table).props('dense outlined').classes('flex-grow text-xs')
+                    table_input.on_value_change(lambda e: setattr(self, 'shared_table', e.value.strip()))
+                    output_input = ui.input('输出目录（可选，覆盖策略设置）', value=self.output_dir).props('dense outlined').classes('flex-grow text-xs')
+                    output_input.on_value_change(lambda e: setattr(self, 'output_dir', e.value.strip()))
+                    ui.button(icon='folder_open', on_click=lambda: self._pick_into(output_input, '选择输出文件夹')).props('flat dense')
+                with ui.row().classes('w-full items-center gap-4'):
+                    ui.switch('首行为表头', value=self.ignore_header,
+                              on_change=lambda e: setattr(self, 'ignore_header', e.value)).props('dense size=sm')
+                    ui.switch('包含子文件夹', value=self.recursive,
+                              on_change=lambda e: setattr(self, 'recursive', e.value)).props('dense size=sm')
+                    ui.number('保持打开文档数', value=self.keep_open, min=0, max=20, step=1,
+                              on_change=lambda e: setattr(self, 'keep_open', int(e.value or 0))).props('dense outlined').classes('w-32 text-xs')
+                    ui.number('内存预算 (MB，0 不限)', value=self.doc_budget_mb, min=0, step=256,
+                              on_change=lambda e: setattr(self, 'doc_budget_mb', int(e.value or 0))).props('dense outlined').classes('w-36 text-xs') \
+                        .tooltip('按 PSD 文件大小估算，超出时关闭最久未使用的文档')
+                    ui.switch('同文档任务合并执行', value=self.group_documents,
+                              on_change=lambda e: setattr(self, 'group_documents', e.value)).props('dense size=sm')
+                    ui.space()
+                    ui.button('生成计划', icon='playlist_add_check', on_click=self.build_plan).props('unelevated dense size=sm color=primary')
+                    self.run_btn = ui.button('开始执行', icon='play_arrow', on_click=self.start).props('unelevated dense size=sm color=positive')
+                    self.stop_btn = ui.button('停止', icon='stop', on_click=self.stop).props('flat dense size=sm color=red-5')
+
+                # 2. 计划与进度
+                self.summary_label = ui.label('请选择 PSD 文件夹并生成计划').classes('text-xs text-slate-500')
+                self.progress_bar = ui.linear_progress(value=0, show_value=False).props('rounded color=primary').classes('w-full')
+                self.progress_label = ui.label('').classes('text-xs text-slate-500')
+                self.plan_table = ui.table(columns=self.PLAN_COLUMNS, rows=[], row_key='key') \
+                    .props('dense flat bordered hide-bottom').classes('w-full text-xs')
+
+                # 3. 结果（分页）
+                with ui.row().classes('w-full items-center gap-2'):
+                    ui.label('执行结果').classes('text-[11px] font-bold text-slate-500 uppercase tracking-wider')
+                    ui.space()
+                    ui.toggle(['全部', '失败'], value=self.result_filter,
+                              on_change=lambda e: self._set_filter(e.value)).props('dense size=sm')
+                self.result_table = ui.table(columns=self.RESULT_COLUMNS, rows=[], row_key='key') \
+                    .props('dense flat bordered hide-bottom').classes('w-full text-xs')
+                self.pagination = ui.pagination(1, 1, direction_links=True, value=1,
+                                                on_change=lambda e: self._set_page(e.value)).props('dense size=sm')
+
+            self._update_buttons()
+            self._refresh_cache_label()
+            self._dirty = True
+            self._flush()
+            ui.timer(0.5, self._flush)
+
+    # --- 输入 ---
+
+    async def _pick_into(self, input_el, title: str):
+        path = await pick_directory(input_el.value, title)
+        if path:
+            input_el.set_value(path)
+
+    # --- 计划 ---
+
+    async def build_plan(self):
+        if self.is_running:
+            return
+        if not self.folder or not os.path.isdir(self.folder):
+            ui.notify('请先选择有效的 PSD 文件夹', type='warning')
+            return
+        if self.shared_table and not os.path.isfile(self.shared_table):
+            ui.notify('共享数据表不存在', type='warning')
+            return
+        self._save_settings()
+        self.summary_label.set_text('正在扫描文件夹...')
+        # 读取 PSD 元数据与表格都是磁盘 IO，放到线程中执行，避免阻塞界面
+        self.plan = await asyncio.to_thread(
+            build_workflow_plan, self.folder, self.shared_table or None, self.ignore_header,
+            self.recursive, self.output_dir or None)
+        self.doc_progress = {}
+        self.results = []
+        self.page = 1
+        ready = [item for item in self.plan if item.ready]
+        self.summary_label.set_text(
+            f"共 {len(self.plan)} 个文档，可执行 {len(ready)} 个，合计 {sum(len(i.rows) for i in ready)} 行"
+            if self.plan else '文件夹中没有 PSD / PSB 文件')
+        self.progress_bar.set_value(0)
+        self.progress_label.set_text('')
+        self._dirty = True
+        self._flush()
+
+    def _plan_rows(self) -> list:
+        rows = []
+        for i, item in enumerate(self.plan):
+            row = item.summary()
+            progress = self.doc_progress.get(i)
+            row['key'] = i
+            row['progress'] = f"{progress['done']}/{progress['total']}" if progress else '-'
+            if progress and progress.get('status'):
+                row['status'] = progress['status']
+            rows.append(row)
+        return rows
+
+    # --- 执行 ---
+
+    def _update_buttons(self):
+        if self.run_btn:
+            self.run_btn.set_enabled(not self.is_running)
+        if self.stop_btn:
+            self.stop_btn.set_enabled(self.is_running)
+
+    async def start(self):
+        if self.is_running:
+            return
+        if not ps_server.is_connected():
+            ui.notify('Photoshop 未连接', type='warning')
+            return
+        ready = [(i, item) for i, item in enumerate(self.plan) if item.ready]
+        if not ready:
+            ui.notify('没有可执行的文档，请先生成计划', type='warning')
+            return
+        self._save_settings()
+
+        self.is_running = True
+        self._update_buttons()
+        self.results = []
+        self.page = 1
+        self.doc_progress = {i: {'done': 0, 'total': len(item.rows), 'status': '等待中'} for i, item in ready}
+        plan_index = [i for i, _ in ready]
+        total_rows = sum(len(item.rows) for _, item in ready)
+        self.batch_progress = BatchProgress(total_rows, expected_row_seconds=ps_server.expected_row_seconds())
+        self._dirty = True
+
+        def on_event(event):
+            i = plan_index[event['doc'] - 1]
+            progress = self.doc_progress[i]
+            status = event['status']
+            if status == 'doc_started':
+                progress['status'] = f"执行中（{event['message']}）"
+            elif status == 'processing':
+                self.batch_progress.row_started()
+            elif status == 'stage':
+                progress['status'] = '执行中'
+                self.current_message = f"[{event['doc']}/{event['docs']}] {event['psd']} · {event['message']}"
+            elif status in ('success', 'error', 'cancelled'):
+                progress['done'] += 1
+                self.batch_progress.row_finished()
+                self.current_message = f"[{event['doc']}/{event['docs']}] {event['psd']} · {event['message']}"
+            elif status == 'doc_finished':
+                progress['status'] = f"完成（{event['message']}）"
+            elif status == 'doc_requeued':
+                # 连接断开：该文档将由其他连接从头重试，已计入的行退回
+                progress['status'] = '等待重试'
+                self.batch_progress.completed -= progress['done']
+                progress['done'] = 0
+            elif status in ('doc_error', 'doc_skipped'):
+                progress['status'] = f"{'失败' if status == 'doc_error' else '跳过'}: {event['message']}"
+                # 文档级失败：其余行计入已处理，保证总进度与 ETA 正确
+                self.batch_progress.completed += progress['total'] - progress['done']
+                self.batch_progress.current_row_started_at = None
+                progress['done'] = progress['total']
+            self._dirty = True
+
+        ps_server.document_pool.max_bytes = self.doc_budget_mb * 1024 * 1024
+        self.workflow_task = asyncio.create_task(ps_server.execute_workflow(
+            [item.to_task() for _, item in ready], keep_open=self.keep_open, event_callback=on_event,
+            reorder=self.group_documents))
+        try:
+            workflow_results = await self.workflow_task
+            self._collect_results(workflow_results)
+            failed = sum(1 for r in self.results if r['status'] != 'ok')
+            self._notice = (f"批量出图完成：{len(self.results) - failed} 行成功，{failed} 行失败",
+                            'positive' if not failed else 'warning')
+        except asyncio.CancelledError:
+            self._notice = ('批量出图已停止', 'info')
+        except Exception as e:
+            self._notice = (f'批量出图失败: {e}', 'negative')
+        finally:
+            self.is_running = False
+            self.workflow_task = None
+            self.current_message = ''
+            for progress in self.doc_progress.values():
+                if progress['status'] == '等待中' or progress['status'].startswith('执行中'):
+                    progress['status'] = '已停止'
+            self._dirty = True
+
+    async def stop(self):
+        """停止工作流：取消任务时服务器会同时中止插件端正在执行的行"""
+        if self.workflow_task and not self.workflow_task.done():
+            self.workflow_task.cancel()
+
+    async def close_cached_documents(self):
+        if self.is_running:
+            ui.notify('执行中，暂不能关闭文档', type='warning')
+            return
+        count = await ps_server.close_cached_documents()
+        self._refresh_cache_label()
+        ui.notify(f'已关闭 {count} 个缓存文档', type='info')
+
+    def _refresh_cache_label(self):
+        if self.cache_label:
+            cached = ps_server.get_cached_documents()
+            size_mb = sum(doc['bytes'] for doc in cached if doc['owned']) / 1024 / 1024
+            self.cache_label.set_text(f"保持打开 {len(cached)} 个文档（约 {size_mb:.0f} MB）" if cached else '')
+
+    # --- 结果 ---
+
+    def _collect_results(self, workflow_results: list):
+        self.results = []
+        for doc in workflow_results or []:
+            if doc.get('status') != 'ok':
+                self.results.append({'psd': doc['psd'], 'index': '-', 'status': 'error', 'detail': doc.get('error', '')})
+                continue
+            for row in doc.get('details') or []:
+                if row.get('status') == 'ok':
+                    files = [f.get('path') or f.get('name', '') for f in row.get('rendered_files', [])]
+                    detail = '；'.join(files)
+                else:
+                    detail = row.get('error', row.get('status', ''))
+                self.results.append({'psd': doc['psd'], 'index': row.get('index'), 'status': row.get('status'), 'detail': detail})
+
+    def _set_filter(self, value: str):
+        self.result_filter = value
+        self.page = 1
+        self._render_results()
+
+    def _set_page(self, page: int):
+        if page and page != self.page:
+            self.page = page
+            self._render_results()
+
+    def _render_results(self):
+        """只把当前页的行发送到前端，大批量结果也不会拖慢界面"""
+        results = self.results if self.result_filter == '全部' else [r for r in self.results if r['status'] != 'ok']
+        pages = max(1, (len(results) + self.PAGE_SIZE - 1) // self.PAGE_SIZE)
+        self.page = min(self.page, pages)
+        start = (self.page - 1) * self.PAGE_SIZE
+        page_rows = [dict(r, key=start + i, status='成功' if r['status'] == 'ok' else r['status'])
+                     for i, r in enumerate(results[start:start + self.PAGE_SIZE])]
+        self.result_table.rows = page_rows
+        self.result_table.update()
+        self.pagination.max = pages
+        self.pagination.set_value(self.page)
+
+    def _flush(self):
+        """
+        定时把进度刷新到界面（事件可能很密集，合并后每 0.5 秒更新一次）
+
+        工作流回调只修改状态，界面元素只在这里更新。
+        """
+        if self._notice:
+            message, notice_type = self._notice
+            self._notice = None
+            ui.notify(message, type=notice_type)
+        if not self._dirty or self.plan_table is None:
+            return
+        self._dirty = False
+        self._update_buttons()
+        self._refresh_cache_label()
+        self.plan_table.rows = self._plan_rows()
+        self.plan_table.update()
+        if self.batch_progress and self.batch_progress.total:
+            self.progress_bar.set_value(self.batch_progress.completed / self.batch_progress.total)
+            if self.is_running:
+                self.summary_label.set_text(self.batch_progress.status_text())
+        self.progress_label.set_text(self.current_message)
+        self._render_results()
+
 class ConnectionOverlay:
     """
     连接状态遮罩层：提供加载、成功、失败三种状态的平滑切换
@@ -4541,6 +4768,12 @@ class WorkspaceSidebar:
             <path d="M8 6h13M8 12h13M8 18h13M3 6h.01M3 12h.01M3 18h.01" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"/>
         </svg>'''
     
+    def _get_perf_icon(self):
+        """性能监控图标（折线）"""
+        return '''<svg viewBox="0 0 24 24" fill="none" xmlns="http://www.w3.org/2000/svg">
+            <path d="M3 12h4l3-8 4 16 3-8h4" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"/>
+        </svg>'''
+
     def _get_calendar_icon(self):
         """日历图标"""
         return '''<svg viewBox="0 0 24 24" fill="none" xmlns="http://www.w3.org/2000/svg">
@@ -4568,6 +4801,7 @@ class WorkspaceSidebar:
                 self._create_mode_button('template', '制作模板', self._get_template_icon())
                 self._create_mode_button('quick', '快速出图', self._get_quick_icon())
                 self._create_mode_button('batch', '批量出图', self._get_batch_icon())
+                self._create_mode_button('perf', '性能监控', self._get_perf_icon())
             
             # 底部：系统与品牌组
             with ui.column().classes('ice-dock-bottom'):
@@ -4708,6 +4942,14 @@ class WorkspaceSidebar:
                             connection_overlay.close()
                     except:
                         pass
+
+            # 已连接时显示派发队列深度
+            if is_connected:
+                stats = ps_server.get_queue_stats()
+                if stats['queued'] or stats['in_flight']:
+                    self.ps_text.set_text(f"已连接 · 执行中 {stats['in_flight']} · 排队 {stats['queued']}")
+                else:
+                    self.ps_text.set_text('已连接')
         
         # 每秒检查一次
         self.ps_monitor_timer = ui.timer(1.0, check_status)
@@ -4722,6 +4964,7 @@ current_workspace_content = None
 login_shell_container = None  # 登录界面容器引用
 template_workbench = None # 制作模板工作台实例
 rapid_export_panel = None # 极速出图面板全局引用
+batch_workbench = None # 批量出图工作台（切换模式后保留执行状态）
 
 def create_workspace_view():
     """
@@ -4732,6 +4975,7 @@ def create_workspace_view():
     
     def on_mode_change(mode: str):
         """模式切换回调"""
+        global batch_workbench
         print(f"切换到模式: {mode}")
         
         # 切换内容区域
@@ -4739,6 +4983,12 @@ def create_workspace_view():
         if mode == 'template':
             template_workbench = TemplateWorkbench(content_area)
             template_workbench.render()
+        elif mode == 'batch':
+            if batch_workbench is None:
+                batch_workbench = BatchWorkbench()
+            batch_workbench.render(content_area)
+        elif mode == 'perf':
+            PerformancePanel(content_area).render()
         else:
             with content_area:
                 ui.label(f'{mode} 模式正在开发中...').classes('text-xl text-gray-400 italic m-auto')
@@ -5179,5 +5429,6 @@ app.native.window_args.update({
     'min_size': (960, 720)
 })
 
-# 运行
-ui.run(title="ice美化助手", port=0, native=True, reload=False, frameless=True, window_size=(960, 720))
\ No newline at end of file
+# 运行（被基准测试等脚本导入时不启动窗口）
+if __name__ in {"__main__", "__mp_main__"}:
+    ui.run(title="ice美化助手", port=0, native=True, reload=False, frameless=True, window_size=(960, 720))
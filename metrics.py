@@ -0,0 +1,180 @@
+"""
+小冰美化助手 - 性能指标 (metrics.py)
+
+功能：
+1. 计数器 (Counter) 与延迟直方图 (Histogram)，支持标签
+2. 导出为 JSON（供性能面板使用）与 Prometheus 文本格式
+3. 全局实例 registry，由 server.py 在请求派发/响应与进度帧中写入
+"""
+
+import bisect
+import threading
+import time
+from typing import Dict, Tuple
+
+
+# 默认延迟桶（秒）：覆盖从毫秒级消息到数分钟的原子任务
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _label_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: dict = None) -> str:
+    items = list(key) + sorted((extra or {}).items())
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """带标签的单调计数器"""
+
+    def __init__(self, name: str, help_text: str = ""):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, value: float = 1.0, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0.0) + value
+
+    def to_dict(self) -> list:
+        return [{"labels": dict(key), "value": value} for key, value in self.values.items()]
+
+    def to_prometheus(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """带标签的延迟直方图（累计桶 + sum/count，兼容 Prometheus）"""
+
+    def __init__(self, name: str, help_text: str = "", buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # key -> {"counts": [...], "sum": float, "count": int, "max": float}
+        self.series: Dict[tuple, dict] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0, "max": 0.0}
+        idx = bisect.bisect_left(self.buckets, value)
+        if idx < len(self.buckets):
+            series["counts"][idx] += 1
+        series["sum"] += value
+        series["count"] += 1
+        series["max"] = max(series["max"], value)
+
+    def quantile(self, series: dict, q: float) -> float:
+        """按桶线性插值估算分位数"""
+        if not series["count"]:
+            return 0.0
+        target = q * series["count"]
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, series["counts"]):
+            if cumulative + count >= target and count:
+                fraction = (target - cumulative) / count
+                return min(lower + (bound - lower) * fraction, series["max"])
+            cumulative += count
+            lower = bound
+        return series["max"]
+
+    def to_dict(self) -> list:
+        result = []
+        for key, series in self.series.items():
+            count = series["count"]
+            result.append({
+                "labels": dict(key),
+                "count": count,
+                "sum": series["sum"],
+                "avg": series["sum"] / count if count else 0.0,
+                "p50": self.quantile(series, 0.5),
+                "p95": self.quantile(series, 0.95),
+                "p99": self.quantile(series, 0.99),
+                "max": series["max"],
+            })
+        return result
+
+    def to_prometheus(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': f'{bound:g}'})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Counter(name, help_text)
+            return metric
+
+    def histogram(self, name: str, help_text: str = "", buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Histogram(name, help_text, buckets)
+            return metric
+
+    def inc(self, name: str, value: float = 1.0, help_text: str = "", **labels):
+        counter = self.counter(name, help_text)
+        with self._lock:
+            counter.inc(value, **labels)
+
+    def observe(self, name: str, value: float, help_text: str = "", **labels):
+        histogram = self.histogram(name, help_text)
+        with self._lock:
+            histogram.observe(value, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+            self.started_at = time.time()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "uptime": time.time() - self.started_at,
+                "counters": {name: m.to_dict() for name, m in self._metrics.items() if isinstance(m, Counter)},
+                "histograms": {name: m.to_dict() for name, m in self._metrics.items() if isinstance(m, Histogram)},
+            }
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            lines = []
+            for metric in self._metrics.values():
+                lines.extend(metric.to_prometheus())
+            return "\n".join(lines) + "\n"
+
+
+# ============================================
+# 全局实例
+# ============================================
+registry = MetricsRegistry()
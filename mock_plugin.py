@@ -0,0 +1,714 @@
+"""
+小冰美化助手 - 模拟 Photoshop 插件 (mock_plugin.py)
+
+功能：
+1. 以 WebSocket 客户端身份连接 PSServer，协议与 Plugin_UXP/index.js 保持一致
+2. 生成合成图层树（文本/像素/组/智能对象，可指定规模）
+3. 可配置的延迟分布（fixed / uniform / normal / lognormal，按步骤分别配置）
+4. 故障注入：请求失败、单个渲染失败、丢弃响应（触发超时）
+5. 渲染时写出占位图片（Pillow 可用时生成真实图片）
+
+无需 Photoshop 即可在 Linux 上压测批量/队列逻辑。
+
+用法:
+    python mock_plugin.py
+    python mock_plugin.py --latency operation=lognormal:0.05:0.4 --latency render=uniform:0.2:0.6 --fail-rate 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import struct
+import zlib
+from datetime import datetime
+from typing import Optional, Dict, List
+
+import websockets
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+    ImageDraw = None
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [mock] {message}")
+
+
+# 插件端通过 executeAsModal 串行执行的消息类型（与 index.js 一致）
+MODAL_TYPES = {
+    "execute_atomic", "get_layers", "update_text_layer", "update_text_layers", "batchPlay",
+    "replace_image", "render_output", "read_strategy", "write_strategy", "apply_filter",
+    "restore_snapshot", "open_doc", "close_doc", "activate_doc", "fix_environment", "release_stage",
+}
+
+
+# ============================================
+# 延迟分布
+# ============================================
+
+class Latency:
+    """
+    延迟分布（秒）
+
+    规格字符串:
+        fixed:0.1               固定 0.1s
+        uniform:0.05:0.2        均匀分布
+        normal:0.1:0.02         正态分布（均值, 标准差），截断到 >= 0
+        lognormal:0.1:0.5       对数正态（中位数, sigma），模拟长尾
+        0.1                     等同 fixed:0.1
+    """
+
+    def __init__(self, spec: str = "fixed:0", rng: random.Random = None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        parts = str(spec).split(":")
+        if len(parts) == 1:
+            parts = ["fixed", parts[0]]
+        self.kind = parts[0].lower()
+        self.args = [float(p) for p in parts[1:]]
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.args[0] if self.args else 0.0
+        if self.kind == "uniform":
+            return self.rng.uniform(self.args[0], self.args[1])
+        if self.kind == "normal":
+            return max(self.rng.gauss(self.args[0], self.args[1]), 0.0)
+        # lognormal: 以中位数参数化
+        median, sigma = self.args[0], self.args[1]
+        return median * math.exp(self.rng.gauss(0.0, sigma))
+
+
+# ============================================
+# 合成图层树
+# ============================================
+
+def build_layer_tree(text_layers: int = 6, image_layers: int = 3, groups: int = 2,
+                     smart_objects: int = 2, so_depth: int = 1, seed: int = None,
+                     start_id: int = 1) -> list:
+    """
+    生成与插件 serializeLayers 结构一致的合成图层树
+
+    - 顶层包含 groups 个组，文本层/像素层在组之间轮流分配
+    - 每个智能对象内含一个文本层和一个像素层，并按 so_depth 继续嵌套
+    """
+    rng = random.Random(seed)
+    next_id = [start_id]
+
+    def new_id():
+        value = next_id[0]
+        next_id[0] += 1
+        return value
+
+    def text_node(name):
+        return {
+            "id": new_id(), "name": name, "visible": True, "kind": "TEXT", "opacity": 100,
+            "editable": {"text": f"{name} 内容", "font": "MockSans", "size": rng.choice([12, 18, 24, 36]), "color": "000000"},
+        }
+
+    def pixel_node(name):
+        return {"id": new_id(), "name": name, "visible": True, "kind": "PIXEL", "opacity": 100}
+
+    def smart_object(name, depth):
+        node = {"id": new_id(), "name": name, "visible": True, "kind": "SMARTOBJECT", "opacity": 100,
+                "bounds": {"width": 800, "height": 600}, "content_size": {"width": 1200, "height": 900}}
+        children = [text_node(f"{name} 文本"), pixel_node(f"{name} 图片")]
+        if depth > 1:
+            children.append(smart_object(f"{name} 内层", depth - 1))
+        node["children"] = children
+        node["isSmartObjectContent"] = True
+        return node
+
+    containers = [
+        {"id": new_id(), "name": f"组 {i + 1}", "visible": True, "kind": "GROUP", "opacity": 100, "children": []}
+        for i in range(groups)
+    ]
+    tree = list(containers)
+
+    def place(node, i):
+        if containers:
+            containers[i % len(containers)]["children"].append(node)
+        else:
+            tree.append(node)
+
+    for i in range(text_layers):
+        place(text_node(f"文本 {i + 1}"), i)
+    for i in range(image_layers):
+        place(pixel_node(f"图片 {i + 1}"), i)
+    for i in range(smart_objects):
+        tree.append(smart_object(f"智能对象 {i + 1}", so_depth))
+
+    # 空组在插件端会被识别为像素层
+    for group in containers:
+        if not group["children"]:
+            group["kind"] = "PIXEL"
+            del group["children"]
+    tree.append(pixel_node("背景"))
+    return tree
+
+
+def iter_layers(nodes: list):
+    for node in nodes:
+        yield node
+        yield from iter_layers(node.get("children", []))
+
+
+# ============================================
+# 占位图片
+# ============================================
+
+def _minimal_png(width: int, height: int, rgb: tuple) -> bytes:
+    """不依赖 Pillow 的纯色 PNG"""
+    raw = b"".join(b"\x00" + bytes(rgb) * width for _ in range(height))
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+def write_placeholder(path: str, fmt: str, width: int = 64, height: int = 64, label: str = "") -> str:
+    """写出占位输出文件，返回实际路径"""
+    fmt = (fmt or "jpg").lower().replace("jpeg", "jpg")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    seed = zlib.crc32(label.encode("utf-8")) if label else 0
+    color = (64 + seed % 160, 64 + (seed >> 8) % 160, 64 + (seed >> 16) % 160)
+
+    if fmt == "psd":
+        with open(path, "wb") as f:
+            f.write(b"8BPS" + b"\x00" * 22)
+        return path
+
+    if Image is not None:
+        mode = "RGBA" if fmt in ("png", "webp") else "RGB"
+        img = Image.new(mode, (width, height), color + ((255,) if mode == "RGBA" else ()))
+        if ImageDraw is not None and label:
+            ImageDraw.Draw(img).text((2, 2), label[:12], fill=(255, 255, 255))
+        pil_format = {"jpg": "JPEG", "png": "PNG", "gif": "GIF", "webp": "WEBP", "bmp": "BMP", "tif": "TIFF"}.get(fmt, "PNG")
+        if pil_format == "GIF":
+            img = img.convert("P")
+        img.save(path, pil_format)
+    else:
+        # 无 Pillow 时统一写 PNG 字节（扩展名保持请求格式）
+        with open(path, "wb") as f:
+            f.write(_minimal_png(width, height, color))
+    return path
+
+
+# ============================================
+# 模拟文档与插件
+# ============================================
+
+class _AtomicCancelled(Exception):
+    """原子任务被 cancel 消息中止"""
+
+
+class MockDocument:
+    def __init__(self, doc_id: int, name: str, path: str = "unsaved", layers: list = None, strategy: dict = None):
+        self.id = doc_id
+        self.name = name
+        self.path = path
+        self.layers = layers if layers is not None else build_layer_tree(seed=doc_id)
+        self.strategy = strategy
+
+    def find_layer(self, layer_id) -> Optional[dict]:
+        for node in iter_layers(self.layers):
+            if node.get("id") == layer_id:
+                return node
+        return None
+
+
+class MockPlugin:
+    """
+    模拟插件
+
+    参数:
+        url: PSServer 地址
+        latency: 步骤 -> 延迟规格，步骤包括 default / 各消息类型 / duplicate / operation / render / save
+        fail_rate: 请求整体失败概率
+        render_fail_rate: execute_atomic 中单个渲染失败概率
+        drop_rate: 丢弃响应（不回复）的概率，用于触发超时
+        fail_types: 仅对这些消息类型注入故障（None 表示全部）
+        write_outputs: 是否写出占位图片
+        image_size: 占位图片尺寸
+        docs: 初始打开的文档数量
+        layer_tree_kwargs: 传给 build_layer_tree 的参数
+        strategy: 初始文档内的编辑策略（模拟 XMP）
+        seed: 随机种子，保证可复现
+    """
+
+    def __init__(self, url: str = "ws://127.0.0.1:8765", latency: Dict[str, str] = None,
+                 fail_rate: float = 0.0, render_fail_rate: float = 0.0, drop_rate: float = 0.0,
+                 fail_types: Optional[set] = None, write_outputs: bool = True, image_size: tuple = (64, 64),
+                 docs: int = 1, layer_tree_kwargs: dict = None, strategy: dict = None, seed: int = None,
+                 reconnect: bool = True):
+        self.url = url
+        self.rng = random.Random(seed)
+        self.latency = {k: Latency(v, self.rng) for k, v in (latency or {}).items()}
+        self.fail_rate = fail_rate
+        self.render_fail_rate = render_fail_rate
+        self.drop_rate = drop_rate
+        self.fail_types = set(fail_types) if fail_types else None
+        self.write_outputs = write_outputs
+        self.image_size = image_size
+        self.layer_tree_kwargs = layer_tree_kwargs or {}
+        self.reconnect = reconnect
+
+        self.ws = None
+        self.connected = asyncio.Event()
+        self._stopping = False
+        self._modal_lock: Optional[asyncio.Lock] = None
+        self._next_doc_id = 1
+        self.documents: List[MockDocument] = []
+        self.active_doc: Optional[MockDocument] = None
+        self.snapshots: Dict[int, list] = {}
+        self.active_atomic_ids = set()
+        self.cancelled = set()
+        self.stats: Dict[str, int] = {}
+        # 换图底稿（reuse_stage）：与 index.js 相同，按 (源文档, 图片操作) 判断能否复用
+        self.stage_key: Optional[str] = None
+
+        for i in range(docs):
+            doc = self._new_document(f"模板{i + 1}.psd", f"/mock/模板{i + 1}.psd")
+            doc.strategy = strategy
+
+    # --- 文档 ---
+
+    def _new_document(self, name: str, path: str = "unsaved") -> MockDocument:
+        doc_id = self._next_doc_id
+        self._next_doc_id += 1
+        kwargs = dict(self.layer_tree_kwargs)
+        kwargs.setdefault("seed", doc_id)
+        doc = MockDocument(doc_id, name, path, build_layer_tree(**kwargs))
+        self.documents.append(doc)
+        self.active_doc = doc
+        return doc
+
+    def _find_document(self, doc_id=None, name=None) -> Optional[MockDocument]:
+        for doc in self.documents:
+            if (doc_id is not None and doc.id == doc_id) or (name is not None and doc.name == name):
+                return doc
+        return None
+
+    # --- 运行 ---
+
+    async def run(self):
+        """连接并处理消息；断线后按插件的行为 1.2s 后重连"""
+        self._modal_lock = asyncio.Lock()
+        while not self._stopping:
+            try:
+                async with websockets.connect(self.url, max_size=None) as ws:
+                    self.ws = ws
+                    self.connected.set()
+                    _log(f"已连接 {self.url}")
+                    async for message in ws:
+                        asyncio.create_task(self._on_message(message))
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                if not self.reconnect or self._stopping:
+                    break
+                _log(f"连接失败/断开: {e}")
+            finally:
+                self.ws = None
+                self.connected.clear()
+            if not self.reconnect or self._stopping:
+                break
+            await asyncio.sleep(1.2)
+
+    async def stop(self):
+        self._stopping = True
+        if self.ws:
+            await self.ws.close()
+
+    async def _send(self, data: dict):
+        if self.ws:
+            try:
+                await self.ws.send(json.dumps(data, ensure_ascii=False))
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+    async def _delay(self, step: str):
+        model = self.latency.get(step) or self.latency.get("default")
+        if model:
+            seconds = model.sample()
+            if seconds > 0:
+                await asyncio.sleep(seconds)
+
+    def _should_inject(self, msg_type: str, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        if self.fail_types is not None and msg_type not in self.fail_types:
+            return False
+        return self.rng.random() < rate
+
+    async def _on_message(self, message: str):
+        try:
+            msg = json.loads(message)
+        except json.JSONDecodeError:
+            return
+        msg_type = msg.get("type")
+        self.stats[msg_type] = self.stats.get(msg_type, 0) + 1
+
+        if msg_type == "cancel":
+            await self._handle_cancel(msg)
+            return
+        if msg_type == "execute_atomic":
+            self.active_atomic_ids.add(msg.get("id"))
+
+        if self._should_inject(msg_type, self.drop_rate):
+            _log(f"[故障注入] 丢弃响应 [ID: {msg.get('id')}, 类型: {msg_type}]")
+            self.active_atomic_ids.discard(msg.get("id"))
+            return
+
+        handler = getattr(self, f"_handle_{msg_type}", None)
+        if handler is None:
+            _log(f"未知消息类型: {msg_type}")
+            return
+
+        try:
+            if msg_type in MODAL_TYPES:
+                # 模拟 executeAsModal：同一时间只有一个模态操作
+                async with self._modal_lock:
+                    await self._delay(msg_type)
+                    await handler(msg)
+            else:
+                await self._delay(msg_type)
+                await handler(msg)
+        except Exception as e:
+            _log(f"处理消息异常 [{msg_type}]: {e}")
+            await self._send({"id": msg.get("id"), "status": "error", "error": str(e)})
+
+    def _injected_error(self, msg: dict) -> Optional[str]:
+        if self._should_inject(msg.get("type"), self.fail_rate):
+            _log(f"[故障注入] 请求失败 [ID: {msg.get('id')}, 类型: {msg.get('type')}]")
+            return "Injected failure"
+        return None
+
+    # --- 消息处理（与 index.js 的响应格式一致） ---
+
+    async def _handle_get_layers(self, msg):
+        error = self._injected_error(msg)
+        if error or not self.active_doc:
+            await self._send({"id": msg["id"], "type": "layers_response", "status": "error", "error": error or "没有打开的文档"})
+            return
+        await self._send({"id": msg["id"], "type": "layers_response", "status": "success", "data": self.active_doc.layers})
+
+    def _apply_text(self, layer_id, text) -> bool:
+        node = self.active_doc.find_layer(layer_id) if self.active_doc else None
+        if not node or node.get("kind") != "TEXT":
+            return False
+        node.setdefault("editable", {})["text"] = text
+        return True
+
+    async def _handle_update_text_layer(self, msg):
+        error = self._injected_error(msg)
+        ok = not error and self._apply_text(msg.get("layer_id"), msg.get("text", ""))
+        result = {"id": msg.get("layer_id"), "status": "ok"} if ok else \
+            {"id": msg.get("layer_id"), "status": "error", "error": error or "图层不存在或不是文本层"}
+        await self._send({"id": msg["id"], "type": "update_response", "results": [result]})
+
+    async def _handle_update_text_layers(self, msg):
+        error = self._injected_error(msg)
+        results = []
+        for item in msg.get("updates", []):
+            ok = not error and self._apply_text(item.get("layer_id"), item.get("text", ""))
+            results.append({"id": item.get("layer_id"), "status": "ok"} if ok else
+                           {"id": item.get("layer_id"), "status": "error", "error": error or "图层不存在或不是文本层"})
+        await self._send({"id": msg["id"], "type": "update_response", "results": results})
+
+    async def _handle_status(self, msg):
+        """通用 {id, status} 响应"""
+        error = self._injected_error(msg)
+        if error:
+            await self._send({"id": msg["id"], "status": "error", "error": error})
+        else:
+            await self._send({"id": msg["id"], "status": "success"})
+
+    _handle_batchPlay = _handle_status
+    _handle_apply_filter = _handle_status
+    _handle_fix_environment = _handle_status
+
+    async def _handle_replace_image(self, msg):
+        error = self._injected_error(msg)
+        path = msg.get("path", "")
+        if not error and path and not os.path.exists(path) and not path.startswith("/mock/"):
+            error = f"文件不存在: {path}"
+        await self._send({"id": msg["id"], "status": "error", "error": error} if error else {"id": msg["id"], "status": "success"})
+
+    async def _handle_show_dialog(self, msg):
+        _log(f"对话框: [{msg.get('style')}] {msg.get('title')} - {msg.get('message')}")
+
+    async def _handle_create_snapshot(self, msg):
+        if self.active_doc:
+            self.snapshots[self.active_doc.id] = json.loads(json.dumps(self.active_doc.layers))
+            await self._send({"id": msg["id"], "status": "success"})
+
+    async def _handle_restore_snapshot(self, msg):
+        doc = self.active_doc
+        if doc and doc.id in self.snapshots:
+            doc.layers = self.snapshots.pop(doc.id)
+            await self._send({"id": msg["id"], "status": "success"})
+        else:
+            await self._send({"id": msg["id"], "status": "error", "error": "未找到快照"})
+
+    async def _handle_get_open_docs(self, msg):
+        docs = [{"id": d.id, "name": d.name, "path": d.path,
+                 "active": self.active_doc is not None and d.id == self.active_doc.id} for d in self.documents]
+        await self._send({"id": msg["id"], "type": "get_open_docs_response", "status": "success", "data": docs})
+
+    async def _handle_open_doc(self, msg):
+        error = self._injected_error(msg)
+        if error:
+            await self._send({"id": msg["id"], "status": "error", "error": error})
+            return
+        path = str(msg.get("path", "")).replace("\\", "/")
+        name = path.split("/")[-1] or "未命名.psd"
+        doc = self._find_document(name=name) or self._new_document(name, path)
+        self.active_doc = doc
+        await self._send({"id": msg["id"], "status": "success", "doc_id": doc.id, "name": doc.name})
+
+    async def _handle_close_doc(self, msg):
+        doc = self._find_document(msg.get("doc_id"), msg.get("name"))
+        if not doc:
+            await self._send({"id": msg["id"], "status": "error", "error": "未找到目标文档"})
+            return
+        self.documents.remove(doc)
+        if self.active_doc is doc:
+            self.active_doc = self.documents[-1] if self.documents else None
+        await self._send({"id": msg["id"], "status": "success"})
+
+    async def _handle_activate_doc(self, msg):
+        doc = self._find_document(msg.get("doc_id"), msg.get("name"))
+        if not doc:
+            await self._send({"id": msg["id"], "status": "error", "error": "未找到目标文档"})
+            return
+        self.active_doc = doc
+        await self._send({"id": msg["id"], "status": "success"})
+
+    async def _handle_read_strategy(self, msg):
+        error = self._injected_error(msg)
+        if error:
+            await self._send({"id": msg["id"], "type": "read_strategy_response", "error": error})
+            return
+        strategy = self.active_doc.strategy if self.active_doc else None
+        await self._send({"id": msg["id"], "type": "read_strategy_response", "strategy": strategy})
+
+    async def _handle_write_strategy(self, msg):
+        error = self._injected_error(msg)
+        if error or not self.active_doc:
+            await self._send({"id": msg["id"], "type": "write_strategy_response", "status": "error",
+                              "error": error or "没有打开的文档"})
+            return
+        self.active_doc.strategy = msg.get("strategy")
+        await self._send({"id": msg["id"], "type": "write_strategy_response", "status": "success"})
+
+    def _output_path(self, folder: str, file_name: str, fmt: str) -> str:
+        fmt = (fmt or "jpg").lower().replace("jpeg", "jpg")
+        return f"{str(folder or '.').rstrip('/')}/{file_name}.{fmt}"
+
+    async def _handle_render_output(self, msg):
+        error = self._injected_error(msg)
+        if error:
+            await self._send({"id": msg["id"], "status": "error", "error": error})
+            return
+        path = self._output_path(msg.get("folder"), msg.get("file_name"), msg.get("format"))
+        await self._delay("render")
+        if self.write_outputs:
+            write_placeholder(path, msg.get("format"), *self._render_size(msg), label=msg.get("file_name", ""))
+        await self._delay("save")
+        await self._send({"id": msg["id"], "status": "success"})
+
+    def _render_size(self, render: dict) -> tuple:
+        if render.get("tiling") and render.get("width") and render.get("height"):
+            # 平铺输出按目标尺寸缩小，避免占位文件过大
+            scale = max(render["width"], render["height"]) / max(self.image_size)
+            return (max(1, int(render["width"] / max(scale, 1))), max(1, int(render["height"] / max(scale, 1))))
+        return self.image_size
+
+    async def _handle_cancel(self, msg):
+        target_id = msg.get("target_id")
+        found = target_id in self.active_atomic_ids
+        if found:
+            self.cancelled.add(target_id)
+        response = {"id": msg["id"], "type": "cancel_response", "status": "success" if found else "error", "target_id": target_id}
+        if not found:
+            response["error"] = "任务不存在或已结束"
+        await self._send(response)
+
+    async def _handle_release_stage(self, msg):
+        self.stage_key = None
+        await self._send({"id": msg["id"], "status": "success"})
+
+    async def _handle_execute_atomic(self, msg):
+        req_id = msg["id"]
+        rendered_files = []
+
+        async def progress(step, current, total, message, **extra):
+            await self._send({"id": req_id, "type": "atomic_progress", "step": step, "current": current,
+                              "total": total, "message": message, **extra})
+
+        def check_cancelled():
+            if req_id in self.cancelled:
+                raise _AtomicCancelled()
+
+        try:
+            check_cancelled()
+            target = msg.get("target_document")
+            if target:
+                doc = self._find_document(target if isinstance(target, int) else None, target)
+                if not doc:
+                    raise RuntimeError(f"未找到目标文档: {target}")
+                self.active_doc = doc
+            if not self.active_doc:
+                raise RuntimeError("没有打开的文档")
+
+            error = self._injected_error(msg)
+            if error:
+                raise RuntimeError(error)
+
+            await progress("init", 0, 1, "正在创建工作副本...")
+            await self._delay("duplicate")
+
+            ops = msg.get("operations") or []
+            if msg.get("reuse_stage"):
+                image_ops = [op for op in ops if op.get("type") == "replace_image"]
+                key = json.dumps([self.active_doc.id, [[op.get("layer_id"), op.get("parent_chain") or [], op.get("image_path")]
+                                                       for op in image_ops]])
+                if key != self.stage_key:
+                    self.stage_key = None
+                    await progress("init", 0, 1, "正在准备换图底稿...")
+                    await self._delay("duplicate")
+                    for i, op in enumerate(image_ops):
+                        check_cancelled()
+                        await progress("operation", i + 1, len(image_ops), "正在执行: replace_image...", op_type="replace_image")
+                        await self._delay("replace_image")
+                        await self._delay("operation")
+                        self.stats["replace_image_op"] = self.stats.get("replace_image_op", 0) + 1
+                    self.stage_key = key
+                ops = [op for op in ops if op.get("type") != "replace_image"]
+            for i, op in enumerate(ops):
+                check_cancelled()
+                if op.get("type") == "replace_image":
+                    self.stats["replace_image_op"] = self.stats.get("replace_image_op", 0) + 1
+                await progress("operation", i + 1, len(ops), f"正在执行: {op.get('type')}...", op_type=op.get("type"))
+                await self._delay(op.get("type") or "operation")
+                await self._delay("operation")
+
+            renders = msg.get("renders") or []
+            for i, render in enumerate(renders):
+                check_cancelled()
+                file_name = render.get("file_name", f"render_{i + 1}")
+                fmt = render.get("format", "jpg")
+                await progress("render", i + 1, len(renders), f"正在渲染: {file_name}...", format=fmt)
+                await self._delay("render")
+                self.stats["render"] = self.stats.get("render", 0) + 1
+                if render.get("tiling"):
+                    await self._delay("tiling")
+                for _ in render.get("filters") or []:
+                    await self._delay("filter")
+                await progress("save", i + 1, len(renders), f"正在保存: {file_name}.{fmt}...", format=fmt)
+                await self._delay("save")
+                if self._should_inject("execute_atomic", self.render_fail_rate):
+                    rendered_files.append({"name": file_name, "status": "error", "error": "Injected render failure"})
+                    continue
+                path = self._output_path(render.get("folder"), file_name, fmt)
+                try:
+                    if self.write_outputs:
+                        write_placeholder(path, fmt, *self._render_size(render), label=file_name)
+                    rendered_files.append({"name": file_name, "path": path, "status": "ok"})
+                except Exception as e:
+                    rendered_files.append({"name": file_name, "status": "error", "error": str(e)})
+
+            await self._send({"id": req_id, "type": "execute_atomic_response", "status": "success",
+                              "rendered_files": rendered_files})
+        except _AtomicCancelled:
+            await self._send({"id": req_id, "type": "execute_atomic_response", "status": "cancelled",
+                              "error": "Cancelled", "rendered_files": rendered_files})
+        except Exception as e:
+            await self._send({"id": req_id, "type": "execute_atomic_response", "status": "error",
+                              "error": str(e), "rendered_files": rendered_files})
+        finally:
+            self.active_atomic_ids.discard(req_id)
+            self.cancelled.discard(req_id)
+
+
+# ============================================
+# 命令行入口
+# ============================================
+
+def _parse_latency(values: list) -> dict:
+    latency = {}
+    for item in values or []:
+        if "=" in item:
+            step, spec = item.split("=", 1)
+        else:
+            step, spec = "default", item
+        Latency(spec)  # 提前校验
+        latency[step.strip()] = spec.strip()
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 Photoshop 插件（用于离线压测 PSServer）")
+    parser.add_argument("--url", default="ws://127.0.0.1:8765")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="延迟分布，格式 [步骤=]分布，例如 render=lognormal:0.3:0.5；步骤: default/duplicate/operation/render/save/tiling/filter/消息类型")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="请求失败概率")
+    parser.add_argument("--render-fail-rate", type=float, default=0.0, help="单个渲染失败概率")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="丢弃响应概率（触发超时）")
+    parser.add_argument("--fail-types", nargs="*", default=None, help="仅对这些消息类型注入故障")
+    parser.add_argument("--docs", type=int, default=1, help="初始打开的文档数")
+    parser.add_argument("--text-layers", type=int, default=6)
+    parser.add_argument("--image-layers", type=int, default=3)
+    parser.add_argument("--groups", type=int, default=2)
+    parser.add_argument("--smart-objects", type=int, default=2)
+    parser.add_argument("--strategy", default=None, help="初始文档的编辑策略 JSON 文件")
+    parser.add_argument("--image-size", default="64x64", help="占位图片尺寸，如 256x256")
+    parser.add_argument("--no-output", action="store_true", help="不写出占位图片")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    strategy = None
+    if args.strategy:
+        with open(args.strategy, "r", encoding="utf-8") as f:
+            strategy = json.load(f)
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+
+    plugin = MockPlugin(
+        url=args.url,
+        latency=_parse_latency(args.latency),
+        fail_rate=args.fail_rate,
+        render_fail_rate=args.render_fail_rate,
+        drop_rate=args.drop_rate,
+        fail_types=set(args.fail_types) if args.fail_types else None,
+        write_outputs=not args.no_output,
+        image_size=(width, height),
+        docs=args.docs,
+        layer_tree_kwargs={
+            "text_layers": args.text_layers, "image_layers": args.image_layers,
+            "groups": args.groups, "smart_objects": args.smart_objects,
+        },
+        strategy=strategy,
+        seed=args.seed,
+    )
+    try:
+        asyncio.run(plugin.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+小冰美化助手 - 输出文件索引 (output_index.py)
+
+任务完成后原本按文件名在导出目录中查找输出（export_path/name.* 通配后按修改时间排序），
+每次成功、复制到剪贴板、点击「打开文件 / 打开目录」都要列目录，导出目录有十万个文件时很慢。现在：
+1. 插件返回实际保存的本地路径（fileEntry.nativePath），不再由调用方拼接或猜测扩展名
+2. 任务完成时记录 任务 -> [路径, 大小, 修改时间, 内容哈希]；批量日志中逐行保存（见 ice_batch.py），
+   续跑与报告直接读取，不再扫描目录
+3. 查找只做一次字典查询和一次 stat；文件已被删除时返回 None，大小或修改时间变化时视为已被覆盖（stale）
+"""
+
+import hashlib
+import os
+from typing import Dict, Hashable, List, Optional
+
+
+def _is_ok(entry) -> bool:
+    return isinstance(entry, dict) and str(entry.get("status", "")).lower() in ("ok", "success")
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """文件内容的 SHA-1（分块读取）"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe(path: str, with_hash: bool = True) -> Optional[dict]:
+    """输出文件的索引条目 {path, size, mtime, sha1}；文件不存在时返回 None"""
+    path = os.path.abspath(os.path.normpath(str(path)))
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    item = {"path": path, "size": st.st_size, "mtime": st.st_mtime}
+    if with_hash:
+        try:
+            item["sha1"] = file_hash(path)
+        except OSError:
+            pass  # PS 仍占用文件时只记录大小与修改时间
+    return item
+
+
+class OutputIndex:
+    """
+    任务 -> 输出文件索引
+
+    参数:
+        with_hash: 记录时是否计算内容哈希（大文件会读一遍，应在线程池中调用 record）
+    """
+
+    def __init__(self, with_hash: bool = True):
+        self.with_hash = with_hash
+        self._entries: Dict[Hashable, List[dict]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def record(self, key, rendered_files: list) -> List[dict]:
+        """记录一个任务的输出（插件 / 编码器返回的 rendered_files 中成功的条目），返回索引条目"""
+        items = []
+        for entry in rendered_files or []:
+            if not _is_ok(entry) or not entry.get("path"):
+                continue
+            item = describe(entry["path"], self.with_hash)
+            if item is not None:
+                item["name"] = entry.get("name")
+                items.append(item)
+        if items:
+            self._entries[key] = items
+        else:
+            self._entries.pop(key, None)
+        return items
+
+    def load(self, key, items: list):
+        """从日志恢复一个任务的索引条目（不访问磁盘）"""
+        items = [dict(item) for item in items or [] if isinstance(item, dict) and item.get("path")]
+        if items:
+            self._entries[key] = items
+
+    def forget(self, key):
+        self._entries.pop(key, None)
+
+    def outputs(self, key) -> List[dict]:
+        return list(self._entries.get(key, ()))
+
+    def resolve(self, key, position: int = 0) -> Optional[str]:
+        """任务的第 position 个输出的路径；未记录或文件已不存在时返回 None"""
+        items = self._entries.get(key)
+        if not items or position >= len(items):
+            return None
+        path = items[position]["path"]
+        return path if os.path.exists(path) else None
+
+    def is_stale(self, key, position: int = 0) -> bool:
+        """输出文件在记录之后是否被修改或覆盖（大小或修改时间不同）；未记录或已删除也算 stale"""
+        items = self._entries.get(key)
+        if not items or position >= len(items):
+            return True
+        item = items[position]
+        try:
+            st = os.stat(item["path"])
+        except OSError:
+            return True
+        return st.st_size != item.get("size") or st.st_mtime != item.get("mtime")
@@ -0,0 +1,203 @@
+"""
+小冰美化助手 - 图片输入预检 (preflight.py)
+
+数据表中的图片路径原本要等到 PS 放置图片时才会被检查：文件缺失或损坏时，
+internalReplaceImage 在原子任务深处失败，白白占用一次模态执行。本模块在批量开始前：
+1. 用线程池并发检查所有引用的图片：是否存在、可读、按文件头识别格式、用 Pillow 读取像素尺寸
+2. 结果按 (路径, 修改时间, 大小) 缓存，文件未变化时重复导入不再读盘
+3. 按行汇总问题，有问题的行在导入预览中标出，且不会发送到 PS
+
+Pillow 未安装时跳过尺寸检查（仍检查存在性、可读性与格式）。
+"""
+
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from metrics import registry as metrics
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# PS 单边像素上限
+MAX_DIMENSION = 300000
+
+# 文件头 -> 格式（PS 可直接置入的常见格式）
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"8BPS", "psd"),
+    (b"%PDF", "pdf"),
+)
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [preflight] {message}")
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """按文件头识别图片格式，无法识别时返回 None"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+def _result(path: str, error: str = None, **info) -> dict:
+    result = {"path": path, "ok": error is None, "error": error,
+              "format": None, "width": None, "height": None, "bytes": 0}
+    result.update(info)
+    return result
+
+
+class ImagePreflight:
+    """
+    图片输入预检（线程池并发 + 按修改时间失效的缓存）
+
+    参数:
+        max_workers: 检查线程数（以等待磁盘 / 网络盘为主，可高于 CPU 核数）
+        cache_size: 最多缓存的文件数（最近使用的保留）
+    """
+
+    def __init__(self, max_workers: int = None, cache_size: int = 10000):
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats = {"checked": 0, "cached": 0, "failed": 0}
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="preflight")
+        return self._executor
+
+    # --- 单个文件 ---
+
+    def check(self, path: str) -> dict:
+        """检查单个图片文件，返回 {"path", "ok", "error", "format", "width", "height", "bytes"}"""
+        if not path or not str(path).strip():
+            return _result(path, "未填写图片路径")
+        full_path = os.path.abspath(str(path).strip())
+        try:
+            st = os.stat(full_path)
+        except FileNotFoundError:
+            return _result(path, f"图片不存在: {full_path}")
+        except OSError as e:
+            return _result(path, f"无法访问图片: {e}")
+        if not os.path.isfile(full_path):
+            return _result(path, f"不是文件: {full_path}")
+
+        key = os.path.normcase(full_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == stamp:
+                self._cache.move_to_end(key)
+                self.stats["cached"] += 1
+                return dict(cached[1], path=path)
+
+        result = self._inspect(path, full_path, st.st_size)
+        with self._lock:
+            self.stats["checked"] += 1
+            if not result["ok"]:
+                self.stats["failed"] += 1
+            self._cache[key] = (stamp, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _inspect(self, path: str, full_path: str, size: int) -> dict:
+        if size == 0:
+            return _result(path, f"图片为空文件: {full_path}")
+        try:
+            with open(full_path, "rb") as f:
+                head = f.read(32)
+        except OSError as e:
+            return _result(path, f"图片不可读: {e}", bytes=size)
+
+        fmt = sniff_format(head)
+        if fmt is None:
+            return _result(path, f"无法识别的图片格式: {os.path.basename(full_path)}", bytes=size)
+        if Image is None or fmt == "pdf":
+            return _result(path, format=fmt, bytes=size)
+
+        try:
+            with Image.open(full_path) as img:
+                width, height = img.size
+        except Image.DecompressionBombError:
+            # 超大图片 Pillow 拒绝解析，PS 仍可置入，由 PS 判断
+            return _result(path, format=fmt, bytes=size)
+        except Exception as e:
+            return _result(path, f"图片已损坏或无法解析: {os.path.basename(full_path)} ({e})", format=fmt, bytes=size)
+        if width <= 0 or height <= 0:
+            return _result(path, f"图片尺寸无效: {width}x{height}", format=fmt, bytes=size)
+        if max(width, height) > MAX_DIMENSION:
+            return _result(path, f"图片尺寸超出 PS 上限: {width}x{height}", format=fmt,
+                           width=width, height=height, bytes=size)
+        return _result(path, format=fmt, width=width, height=height, bytes=size)
+
+    # --- 批量 ---
+
+    def check_many(self, paths: List[str]) -> Dict[str, dict]:
+        """并发检查多个路径（自动去重），返回 路径 -> 结果"""
+        unique = list(dict.fromkeys(paths))
+        if len(unique) <= 1:
+            return {path: self.check(path) for path in unique}
+        return dict(zip(unique, self._pool().map(self.check, unique)))
+
+    async def check_many_async(self, paths: List[str]) -> Dict[str, dict]:
+        """check_many 的异步版本：检查在线程池中进行，不阻塞事件循环"""
+        unique = list(dict.fromkeys(paths))
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(loop.run_in_executor(self._pool(), self.check, path) for path in unique))
+        return dict(zip(unique, results))
+
+    def row_errors(self, rows_paths: List[List[str]], results: Dict[str, dict]) -> Dict[int, str]:
+        """按行汇总：rows_paths[i] 为第 i 行引用的图片；返回 有问题的行下标 -> 错误说明"""
+        errors = {}
+        for i, paths in enumerate(rows_paths):
+            problems = [results[p]["error"] for p in paths if not results[p]["ok"]]
+            if problems:
+                errors[i] = "；".join(dict.fromkeys(problems))
+        ok_count = sum(1 for r in results.values() if r["ok"])
+        metrics.inc("ice_image_preflight_total", ok_count, help_text="图片预检次数", result="ok")
+        metrics.inc("ice_image_preflight_total", len(results) - ok_count, help_text="图片预检次数", result="error")
+        return errors
+
+    def check_rows(self, rows_paths: List[List[str]]) -> Dict[int, str]:
+        """检查每行引用的图片，返回 有问题的行下标 -> 错误说明"""
+        results = self.check_many([p for paths in rows_paths for p in paths])
+        return self.row_errors(rows_paths, results)
+
+    async def check_rows_async(self, rows_paths: List[List[str]]) -> Dict[int, str]:
+        results = await self.check_many_async([p for paths in rows_paths for p in paths])
+        return self.row_errors(rows_paths, results)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# 全局实例：服务器批量执行与界面导入预览共享同一缓存
+preflight = ImagePreflight()
@@ -0,0 +1,259 @@
+"""
+小冰美化助手 - 进度事件聚合 (progress.py)
+
+功能：
+1. RequestProgress：把插件的 atomic_progress 帧聚合为单个原子请求的阶段耗时
+   (duplicate / operations / render / save)
+2. ProgressStream：按请求 ID 订阅进度事件的异步迭代器
+3. BatchProgress：按行统计吞吐量并估算剩余时间 (ETA)
+"""
+
+import asyncio
+import time
+from typing import Optional, Dict, List
+
+
+# 插件 step -> 阶段名
+STAGE_BY_STEP = {
+    "init": "duplicate",
+    "duplicate": "duplicate",
+    "operation": "operations",
+    "render": "render",
+    "save": "save",
+}
+
+# 阶段的中文显示名（供 UI 使用）
+STAGE_LABELS = {
+    "queued": "排队中",
+    "duplicate": "创建副本",
+    "operations": "编辑操作",
+    "render": "渲染",
+    "save": "保存",
+    "encode": "编码",
+    "done": "完成",
+}
+
+# 每个请求最多缓存的事件数（供迟到的订阅者回放）
+_MAX_BUFFERED_EVENTS = 256
+
+
+class RequestProgress:
+    """
+    单个原子请求的进度聚合
+
+    on_segment: 每一帧到下一帧之间视为一个片段，片段结束时回调 (stage, seconds, labels)，
+    labels 取自帧上的 op_type / format，用于按操作类型、渲染格式统计耗时
+    """
+
+    def __init__(self, req_id: int, started_at: float = None, on_segment=None):
+        self.req_id = req_id
+        self.started_at = started_at or time.time()
+        self.stage: Optional[str] = None
+        self.stage_started_at: Optional[float] = None
+        # 阶段 -> 累计耗时（秒）；render/save 会在多个渲染之间交替，按阶段累加
+        self.stage_timings: Dict[str, float] = {}
+        self.current = 0
+        self.total = 0
+        self.message = ""
+        self.finished = False
+        self.status: Optional[str] = None
+        self.events: List[dict] = []
+        self.on_segment = on_segment
+        self._segment: Optional[tuple] = None  # (stage, labels, started_at)
+
+    def _close_segment(self, now: float):
+        if self._segment and self.on_segment:
+            stage, labels, started = self._segment
+            try:
+                self.on_segment(stage, now - started, labels)
+            except Exception:
+                pass
+        self._segment = None
+
+    def _close_stage(self, now: float):
+        if self.stage and self.stage_started_at is not None:
+            self.stage_timings[self.stage] = self.stage_timings.get(self.stage, 0.0) + (now - self.stage_started_at)
+        self.stage_started_at = now
+
+    def feed(self, frame: dict, now: float = None) -> dict:
+        """输入一帧 atomic_progress，返回结构化事件"""
+        now = now or time.time()
+        step = frame.get("step")
+        stage = STAGE_BY_STEP.get(step, step or "unknown")
+        if stage != self.stage:
+            self._close_stage(now)
+            self.stage = stage
+        self._close_segment(now)
+        self._segment = (stage, {k: frame[k] for k in ("op_type", "format") if frame.get(k)}, now)
+        self.current = frame.get("current") or 0
+        self.total = frame.get("total") or 0
+        self.message = frame.get("message") or ""
+        event = self.snapshot(now)
+        event["step"] = step
+        for key in ("op_type", "format"):
+            if key in frame:
+                event[key] = frame[key]
+        self._buffer(event)
+        return event
+
+    def finish(self, status: str, now: float = None) -> dict:
+        """请求结束（成功/失败/取消/超时），返回最终事件"""
+        now = now or time.time()
+        if not self.finished:
+            self._close_stage(now)
+            self._close_segment(now)
+            self.finished = True
+            self.status = status
+            self.stage = "done"
+        event = self.snapshot(now)
+        self._buffer(event)
+        return event
+
+    def snapshot(self, now: float = None) -> dict:
+        now = now or time.time()
+        timings = dict(self.stage_timings)
+        # 包含当前进行中阶段的已用时间
+        if not self.finished and self.stage and self.stage_started_at is not None:
+            timings[self.stage] = timings.get(self.stage, 0.0) + (now - self.stage_started_at)
+        return {
+            "id": self.req_id,
+            "stage": self.stage,
+            "current": self.current,
+            "total": self.total,
+            "message": self.message,
+            "elapsed": now - self.started_at,
+            "stage_timings": timings,
+            "done": self.finished,
+            "status": self.status,
+        }
+
+    def _buffer(self, event: dict):
+        self.events.append(event)
+        if len(self.events) > _MAX_BUFFERED_EVENTS:
+            del self.events[: len(self.events) - _MAX_BUFFERED_EVENTS]
+
+
+class ProgressStream:
+    """
+    单个请求的进度事件异步迭代器
+
+    用法:
+        async for event in server.progress_events(req_id):
+            print(event["stage"], event["current"], event["total"])
+    请求结束后迭代自动停止。
+    """
+
+    def __init__(self, req_id: int, on_close=None):
+        self.req_id = req_id
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._on_close = on_close
+        self._closed = False
+
+    def push(self, event: dict):
+        if not self._closed:
+            self._queue.put_nowait(event)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        event = await self._queue.get()
+        if event is None:
+            if self._on_close:
+                self._on_close(self)
+            raise StopAsyncIteration
+        return event
+
+
+class BatchProgress:
+    """
+    批量任务的吞吐量与 ETA 估算
+
+    - 已完成行的平均耗时给出吞吐量
+    - 当前行按已用时间 / 平均行耗时折算为小数进度（上限 95%，避免 ETA 提前归零）
+    - 尚无完成行时可用 expected_row_seconds 作为先验
+    """
+
+    def __init__(self, total: int, expected_row_seconds: float = None):
+        self.total = total
+        self.started_at = time.time()
+        self.completed = 0
+        self.row_durations: List[float] = []
+        self.stage_totals: Dict[str, float] = {}
+        self.expected_row_seconds = expected_row_seconds
+        self.current_row_started_at: Optional[float] = None
+        self.current_event: Optional[dict] = None
+
+    def row_started(self):
+        self.current_row_started_at = time.time()
+        self.current_event = None
+
+    def update(self, event: dict):
+        """记录当前行的最新进度事件"""
+        self.current_event = event
+
+    def row_finished(self, stage_timings: dict = None):
+        now = time.time()
+        if self.current_row_started_at is not None:
+            self.row_durations.append(now - self.current_row_started_at)
+        for stage, seconds in (stage_timings or {}).items():
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0.0) + seconds
+        self.completed += 1
+        self.current_row_started_at = None
+        self.current_event = None
+
+    def average_row_seconds(self) -> Optional[float]:
+        if self.row_durations:
+            # 只看最近的行，适应模板/数据变化
+            recent = self.row_durations[-20:]
+            return sum(recent) / len(recent)
+        return self.expected_row_seconds
+
+    def throughput(self) -> Optional[float]:
+        """每分钟完成行数"""
+        avg = self.average_row_seconds()
+        if not avg:
+            return None
+        return 60.0 / avg
+
+    def eta_seconds(self) -> Optional[float]:
+        avg = self.average_row_seconds()
+        if not avg:
+            return None
+        remaining = max(self.total - self.completed, 0)
+        if self.current_row_started_at is not None and remaining > 0:
+            partial = min((time.time() - self.current_row_started_at) / avg, 0.95)
+            remaining -= partial
+        return max(remaining * avg, 0.0)
+
+    def status_text(self) -> str:
+        """进度标签文本，例如: 正在处理 3 / 10 · 渲染 1/2 · 4.2 张/分 · 剩余 01:40"""
+        current_index = min(self.completed + (1 if self.current_row_started_at is not None else 0), self.total)
+        parts = [f"正在处理 {current_index} / {self.total}"]
+        event = self.current_event
+        if event and event.get("stage") and not event.get("done"):
+            label = STAGE_LABELS.get(event["stage"], event["stage"])
+            if event.get("total"):
+                label += f" {event.get('current', 0)}/{event['total']}"
+            parts.append(label)
+        rate = self.throughput()
+        if rate:
+            parts.append(f"{rate:.1f} 张/分")
+        eta = self.eta_seconds()
+        if eta is not None:
+            parts.append(f"剩余 {format_duration(eta)}")
+        return " · ".join(parts)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
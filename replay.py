@@ -0,0 +1,413 @@
+"""
+小冰美化助手 - 通信回放 (replay.py)
+
+功能：
+1. 读取 traffic.py 录制的会话，按原始时间间隔向 PSServer 重新发出相同的请求
+2. ReplayPlugin 扮演插件：按类型与顺序匹配录制的请求，以录制的延迟回放响应与进度帧
+3. 也可改为对接 mock_plugin.MockPlugin（--mock），用合成响应代替录制响应
+4. 输出每类请求的录制耗时 / 回放耗时 / Python 端开销，可配合 cProfile 定位退化
+
+回放只依赖录制文件，不需要客户的 PSD 或 Photoshop。请求 ID 会在回放时重新生成，
+插件端按消息类型 + 出现顺序匹配（派发顺序由 PSServer 决定，与录制时一致）。
+
+用法:
+    python replay.py info recordings/ice_traffic_20260101_120000.jsonl.gz
+    python replay.py run recordings/ice_traffic_20260101_120000.jsonl.gz --report replay.json
+    python replay.py run session.jsonl.gz --speed 0 --profile replay.prof   # 不等待，测纯 Python 吞吐
+    python replay.py run session.jsonl.gz --mock
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import statistics
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Optional, Dict, List
+
+import websockets
+
+from traffic import load_session
+from server import PSServer
+
+
+def _get_timestamp() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _log(message: str):
+    timestamp = _get_timestamp()
+    print(f"[{timestamp}] [replay] {message}")
+
+
+# ============================================
+# 会话解析
+# ============================================
+
+class Exchange:
+    """一次录制的请求及其全部响应帧（进度帧 + 最终响应）"""
+
+    def __init__(self, req_id: int, msg_type: str, conn: int, payload: dict, priority: int, timeout: float,
+                 enqueued_t: float):
+        self.req_id = req_id
+        self.type = msg_type
+        self.conn = conn
+        self.payload = payload
+        self.priority = priority
+        self.timeout = timeout
+        self.enqueued_t = enqueued_t
+        self.sent_t: Optional[float] = None
+        # [(相对派发时刻的秒数, 消息)]
+        self.responses: List[tuple] = []
+
+    @property
+    def service_time(self) -> Optional[float]:
+        """插件端耗时：派发到最后一帧响应"""
+        return self.responses[-1][0] if self.responses else None
+
+    @property
+    def recorded_latency(self) -> Optional[float]:
+        """录制时的总耗时：入队到最后一帧响应（含排队）"""
+        if self.sent_t is None or not self.responses:
+            return None
+        return self.sent_t + self.responses[-1][0] - self.enqueued_t
+
+
+def build_exchanges(session: dict) -> tuple:
+    """返回 (exchanges, direct_sends, cancels)，均按录制时间排序"""
+    exchanges = []
+    by_id: Dict[int, Exchange] = {}
+    direct_sends = []
+    cancels = []
+    for ev in session["events"]:
+        kind = ev.get("ev")
+        if kind == "enqueue":
+            try:
+                payload = json.loads(ev["raw"])
+            except (KeyError, json.JSONDecodeError):
+                continue
+            exchange = Exchange(ev["id"], ev.get("type"), ev.get("conn", 0), payload, ev.get("priority"),
+                                ev.get("timeout"), ev["t"])
+            by_id[exchange.req_id] = exchange
+            exchanges.append(exchange)
+        elif kind == "send":
+            if "id" in ev and ev["id"] in by_id:
+                by_id[ev["id"]].sent_t = ev["t"]
+            elif ev.get("raw"):
+                direct_sends.append((ev["t"], ev["raw"]))
+        elif kind == "recv":
+            try:
+                data = json.loads(ev["raw"])
+            except (KeyError, json.JSONDecodeError):
+                continue
+            exchange = by_id.get(data.get("id")) if isinstance(data, dict) else None
+            if exchange and exchange.sent_t is not None:
+                exchange.responses.append((ev["t"] - exchange.sent_t, data))
+        elif kind == "cancel":
+            cancels.append((ev["t"], ev.get("id")))
+    return exchanges, direct_sends, cancels
+
+
+def describe_session(session: dict) -> dict:
+    exchanges, direct_sends, cancels = build_exchanges(session)
+    events = session["events"]
+    by_type = defaultdict(list)
+    for ex in exchanges:
+        if ex.service_time is not None:
+            by_type[ex.type].append(ex.service_time)
+    return {
+        "started_at": session["header"].get("started_at"),
+        "duration": events[-1]["t"] if events else 0.0,
+        "events": len(events),
+        "connections": len({ev.get("conn") for ev in events if ev.get("ev") == "connect"}),
+        "requests": len(exchanges),
+        "unanswered": sum(1 for ex in exchanges if not ex.responses),
+        "direct_sends": len(direct_sends),
+        "cancels": len(cancels),
+        "service_time_by_type": {t: _stats(v) for t, v in sorted(by_type.items())},
+    }
+
+
+def _stats(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": len(values),
+        "avg": sum(values) / len(values),
+        "p50": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+# ============================================
+# 回放插件
+# ============================================
+
+class ReplayPlugin:
+    """
+    按录制内容应答的假插件
+
+    speed: 回放速度倍数（2 表示延迟减半）；0 表示不等待，立即回复
+    """
+
+    def __init__(self, url: str, exchanges: List[Exchange], speed: float = 1.0):
+        self.url = url
+        self.speed = speed
+        self.by_type: Dict[str, deque] = defaultdict(deque)
+        for ex in sorted((e for e in exchanges if e.sent_t is not None), key=lambda e: e.sent_t):
+            self.by_type[ex.type].append(ex)
+        self.ws = None
+        self.connected = asyncio.Event()
+        self.served = 0
+        self.unmatched = 0
+        self._stopping = False
+
+    async def run(self):
+        async with websockets.connect(self.url, max_size=None) as ws:
+            self.ws = ws
+            self.connected.set()
+            with contextlib.suppress(websockets.exceptions.ConnectionClosed):
+                async for message in ws:
+                    asyncio.create_task(self._on_message(message))
+        self.ws = None
+        self.connected.clear()
+
+    async def stop(self):
+        self._stopping = True
+        if self.ws:
+            await self.ws.close()
+
+    async def _send(self, data: dict):
+        if self.ws:
+            with contextlib.suppress(websockets.exceptions.ConnectionClosed):
+                await self.ws.send(json.dumps(data, ensure_ascii=False))
+
+    async def _on_message(self, message: str):
+        loop = asyncio.get_running_loop()
+        received = loop.time()
+        try:
+            msg = json.loads(message)
+        except json.JSONDecodeError:
+            return
+        if not msg.get("id"):
+            # 无 ID 的直接消息（如弹窗）不需要应答
+            return
+        queue = self.by_type.get(msg.get("type"))
+        if not queue:
+            self.unmatched += 1
+            await self._send({"id": msg["id"], "status": "error", "error": "回放: 录制中没有对应的请求"})
+            return
+        exchange = queue.popleft()
+        self.served += 1
+        for offset, frame in exchange.responses:
+            if self.speed > 0:
+                wait = received + offset / self.speed - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            frame = dict(frame)
+            frame["id"] = msg.get("id")
+            if "target_id" in frame and "target_id" in msg:
+                frame["target_id"] = msg["target_id"]
+            await self._send(frame)
+
+
+# ============================================
+# 回放驱动
+# ============================================
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def replay_session(session: dict, speed: float = 1.0, use_mock: bool = False, mock_kwargs: dict = None,
+                         server: PSServer = None) -> dict:
+    """
+    回放一次录制会话，返回报告
+
+    录制中的取消通过 PSServer.cancel 重新发起（对应的 cancel 消息由其自动发送，不再单独回放）。
+    """
+    exchanges, direct_sends, cancels = build_exchanges(session)
+    header = session["header"]
+    server = server or PSServer(port=_free_port())
+    server.max_in_flight = header.get("max_in_flight", server.max_in_flight)
+    server.type_timeouts.update(header.get("type_timeouts") or {})
+    server.default_timeout = header.get("default_timeout", server.default_timeout)
+
+    await server.start()
+    url = f"ws://127.0.0.1:{server.port}"
+    if use_mock:
+        from mock_plugin import MockPlugin
+        plugin = MockPlugin(url=url, reconnect=False, seed=1, **(mock_kwargs or {}))
+    else:
+        plugin = ReplayPlugin(url, exchanges, speed)
+    plugin_task = asyncio.create_task(plugin.run())
+    await asyncio.wait_for(plugin.connected.wait(), 10)
+    while not server.is_connected():
+        await asyncio.sleep(0.01)
+
+    _log(f"开始回放: {len(exchanges)} 个请求，速度 {speed}x，对象 {'mock' if use_mock else '录制响应'}")
+    loop = asyncio.get_running_loop()
+    timeline = [(ex.enqueued_t, 0, "enqueue", ex) for ex in exchanges if ex.type != "cancel"]
+    timeline += [(t, 1, "direct", raw) for t, raw in direct_sends]
+    timeline += [(t, 2, "cancel", req_id) for t, req_id in cancels]
+    timeline.sort(key=lambda item: (item[0], item[1]))
+
+    id_map = {}
+    tracked = []
+    started = loop.time()
+    for t, _, kind, item in timeline:
+        if speed > 0:
+            wait = started + t / speed - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        if kind == "enqueue":
+            payload = dict(item.payload)
+            payload.pop("id", None)
+            future = loop.create_future()
+
+            def on_done(*args, future=future):
+                if not future.done():
+                    future.set_result((loop.time(), args[1] if len(args) > 1 else None))
+
+            issued = loop.time()
+            new_id = await server._send_payload(payload, on_done, priority=item.priority, timeout=item.timeout)
+            id_map[item.req_id] = new_id
+            tracked.append((item, issued, future))
+        elif kind == "direct" and server.websocket:
+            await server.websocket.send(item)
+        elif kind == "cancel" and item in id_map:
+            await server.cancel(id_map[item])
+
+    # 等待全部请求结束（超时由 PSServer 负责，这里只留出余量）
+    pending = [future for _, _, future in tracked if not future.done()]
+    if pending:
+        longest = max((ex.timeout or server.default_timeout) for ex, _, _ in tracked)
+        await asyncio.wait(pending, timeout=longest + 5)
+    wall = loop.time() - started
+    _log(f"回放结束，用时 {wall:.2f}s")
+
+    await plugin.stop()
+    with contextlib.suppress(Exception):
+        await asyncio.wait_for(plugin_task, 5)
+    await server.stop()
+
+    requests = []
+    for ex, issued, future in tracked:
+        entry = {"type": ex.type, "recorded_latency": ex.recorded_latency, "service_time": ex.service_time}
+        if future.done():
+            finished, error = future.result()
+            entry["replay_latency"] = finished - issued
+            entry["status"] = "error" if error else "ok"
+            if error:
+                entry["error"] = str(error)
+        else:
+            entry["status"] = "pending"
+        requests.append(entry)
+    return _build_report(session, requests, wall, speed, use_mock, plugin)
+
+
+def _build_report(session: dict, requests: list, wall: float, speed: float, use_mock: bool, plugin) -> dict:
+    by_type = defaultdict(list)
+    for entry in requests:
+        by_type[entry["type"]].append(entry)
+    summary = {}
+    for msg_type, entries in sorted(by_type.items()):
+        recorded = [e["recorded_latency"] for e in entries if e.get("recorded_latency") is not None]
+        replayed = [e["replay_latency"] for e in entries if e.get("replay_latency") is not None]
+        item = {"count": len(entries), "recorded": _stats(recorded), "replay": _stats(replayed),
+                "errors": sum(1 for e in entries if e["status"] != "ok")}
+        if not use_mock and speed > 0:
+            # Python 端开销 = 回放耗时 - 按速度缩放后的插件耗时
+            overheads = [e["replay_latency"] - e["service_time"] / speed for e in entries
+                         if e.get("replay_latency") is not None and e.get("service_time") is not None]
+            item["python_overhead"] = _stats(overheads)
+        summary[msg_type] = item
+    events = session["events"]
+    return {
+        "recorded_at": session["header"].get("started_at"),
+        "recorded_duration": events[-1]["t"] if events else 0.0,
+        "replay_wall_seconds": wall,
+        "speed": speed,
+        "target": "mock" if use_mock else "recorded",
+        "requests": len(requests),
+        "errors": sum(1 for e in requests if e["status"] != "ok"),
+        "unmatched": getattr(plugin, "unmatched", 0),
+        "by_type": summary,
+    }
+
+
+def print_report(report: dict):
+    print(f"回放 {report['requests']} 个请求，用时 {report['replay_wall_seconds']:.2f}s "
+          f"(录制时长 {report['recorded_duration']:.2f}s，速度 {report['speed']}x，对象 {report['target']})")
+    print(f"错误/超时 {report['errors']}，未匹配 {report['unmatched']}")
+    print(f"{'类型':<24} {'次数':>5} {'录制均值':>10} {'回放均值':>10} {'回放P95':>10} {'Python开销':>10}")
+    for msg_type, item in report["by_type"].items():
+        rec = item["recorded"].get("avg")
+        rep = item["replay"].get("avg")
+        p95 = item["replay"].get("p95")
+        overhead = item.get("python_overhead", {}).get("avg")
+        fmt = lambda v: f"{v * 1000:>8.1f}ms" if v is not None else f"{'-':>10}"
+        print(f"{msg_type:<24} {item['count']:>5} {fmt(rec)} {fmt(rep)} {fmt(p95)} {fmt(overhead)}")
+
+
+# ============================================
+# 命令行入口
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description="回放 PSServer 通信录制（无需 Photoshop）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    info = sub.add_parser("info", help="查看录制文件概况")
+    info.add_argument("path")
+
+    run = sub.add_parser("run", help="回放录制会话")
+    run.add_argument("path")
+    run.add_argument("--speed", type=float, default=1.0, help="回放速度倍数；0 表示不等待（测纯 Python 吞吐）")
+    run.add_argument("--mock", action="store_true", help="用 mock_plugin 代替录制的响应")
+    run.add_argument("--report", default=None, help="结果 JSON 路径")
+    run.add_argument("--profile", default=None, help="用 cProfile 采样并写出 .prof 文件")
+    run.add_argument("--verbose", action="store_true", help="显示服务器日志")
+    args = parser.parse_args()
+
+    session = load_session(args.path)
+    if args.command == "info":
+        print(json.dumps(describe_session(session), ensure_ascii=False, indent=2))
+        return
+
+    def execute():
+        return asyncio.run(replay_session(session, speed=args.speed, use_mock=args.mock))
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            devnull = stack.enter_context(open(os.devnull, "w", encoding="utf-8"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        if args.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            report = profiler.runcall(execute)
+            profiler.dump_stats(args.profile)
+            report["profiled_seconds"] = time.perf_counter() - started
+        else:
+            report = execute()
+
+    print_report(report)
+    if args.profile:
+        print(f"性能采样已写入 {args.profile}（python -m pstats {args.profile}）")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.report}")
+
+
+if __name__ == "__main__":
+    main()
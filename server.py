@@ -10,13 +10,29 @@
 """
 
 import asyncio
+import contextlib
+import contextvars
 import json
 import re
 import websockets
 from typing import Optional, Callable, List, Dict, Any
 from datetime import datetime
+import os
 import time
 import inspect
+import heapq
+import itertools
+from collections import OrderedDict
+
+from progress import RequestProgress, ProgressStream, BatchProgress
+from metrics import registry as metrics
+from traffic import TrafficRecorder, default_recording_path
+from doc_pool import DocumentPool, doc_key
+from workflow_dag import TaskGraph
+from latency_model import LatencyModel, default_latency_path
+from preflight import preflight
+from image_prep import image_prep, find_layer, target_size
+from encoder import EncodingReport, encoder, plan_renders
 
 
 def _get_timestamp() -> str:            
@@ -28,6 +44,74 @@ def _log(message: str):
     print(f"[{timestamp}] [server] {message}")
 
 
+# ============================================
+# 请求优先级通道
+# ============================================
+# 数值越小越优先：交互请求（界面刷新、读取策略等）总是排在批量行之前
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# 插件端不进入 executeAsModal 的消息：随时直接发送，不占用模态通道
+NON_MODAL_TYPES = {"get_open_docs", "create_snapshot", "show_dialog", "cancel"}
+
+# 未显式指定优先级时，按批量通道派发的消息类型
+BATCH_TYPES = {"execute_atomic"}
+
+# 当前协程绑定的派发通道：工作流把每个任务固定在一个插件连接上执行，
+# 任务内部发出的所有请求（打开文档、读取图层、原子任务…）都走同一连接；
+# 连接自身的消息循环也绑定该连接，响应回调中发出的后续请求不会串到其他连接
+_current_lane: "contextvars.ContextVar[Optional[ConnectionLane]]" = contextvars.ContextVar("ice_current_lane", default=None)
+
+
+def group_order(keys: list) -> list:
+    """
+    把键相同的项排在一起的执行顺序（下标列表）
+
+    稳定排序：各组按键首次出现的位置排列，组内保持原顺序。
+    """
+    first_seen = {}
+    for i, key in enumerate(keys):
+        first_seen.setdefault(key, i)
+    return sorted(range(len(keys)), key=lambda i: first_seen[keys[i]])
+
+
+class ConnectionLane:
+    """
+    单个插件连接的派发通道
+
+    插件端的模态操作 (core.executeAsModal) 只能串行执行，批量行在 PS 内部可能占用模态长达数分钟。
+    如果把请求直接发过去，排在后面的请求会在 PS 内部等待，而超时计时早已开始，最终误报超时。
+    因此在 Python 端按优先级排队：同一连接上最多 max_in_flight 个模态请求在途，
+    超时计时从请求真正派发给插件时才开始。
+    """
+
+    def __init__(self, websocket, max_in_flight: int = 1, conn_id: int = 0):
+        self.websocket = websocket
+        self.max_in_flight = max_in_flight
+        # 连接序号（用于通信录制区分连接）
+        self.conn_id = conn_id
+        # 待派发请求堆：(priority, seq, request)
+        self.pending: list = []
+        # 已派发、等待插件响应的请求：req_id -> request
+        self.in_flight: Dict[int, dict] = {}
+        self.connected_at = time.time()
+        # 该连接（PS 实例）中的文档：ID -> 名称，以及当前激活文档名称（耗时模型按文档区分）
+        self.documents: Dict[Any, str] = {}
+        self.active_document: Optional[str] = None
+
+    def document_label(self, target=None) -> Optional[str]:
+        """请求针对的文档名称：显式目标（ID 或名称）优先，否则为当前激活文档"""
+        if target is not None:
+            return self.documents.get(target, target if isinstance(target, str) else None)
+        return self.active_document
+
+    def modal_in_flight(self) -> int:
+        return sum(1 for r in self.in_flight.values() if r["modal"])
+
+    def has_free_slot(self) -> bool:
+        return self.modal_in_flight() < self.max_in_flight
+
+
 class PSServer:
     """
     Photoshop 通信服务器
@@ -42,6 +126,38 @@ class PSServer:
         self.callbacks: dict[int, Callable] = {}
         # 所有请求的默认超时时间（秒），用于防止无限等待前端响应
         self.default_timeout: float = 10.0
+        # 按消息类型覆盖的超时时间（秒），计时均从派发时开始；
+        # 耗时模型积累足够样本后改用学到的超时（见 latency_model.py），这里的值只用于冷启动
+        self.type_timeouts: Dict[str, float] = {
+            "execute_atomic": 120.0,
+            "open_doc": 30.0,
+            "render_output": 60.0,
+        }
+        # 每个插件连接一个派发通道
+        self.lanes: Dict[Any, ConnectionLane] = {}
+        self.max_in_flight: int = 1
+        # 超时后请求仍占用模态槽位（插件还在 executeAsModal 中），直到迟到的响应或取消结果到达；
+        # 插件始终不响应时，超过该时间（秒）后强制释放，避免通道永久阻塞
+        self.timeout_grace: float = 120.0
+        self._seq = itertools.count()
+        self._last_req_id = 0
+        # 进度事件：进行中的请求聚合、异步迭代器、订阅者（键 None 表示订阅全部请求）
+        self._progress: Dict[int, RequestProgress] = {}
+        self._progress_streams: Dict[int, List[ProgressStream]] = {}
+        self._progress_subscribers: Dict[Optional[int], List[Callable]] = {}
+        # 最近结束的请求进度（用于把阶段耗时附加到响应、供迟到的订阅者回放）
+        self._recent_progress: "OrderedDict[int, RequestProgress]" = OrderedDict()
+        # 通信录制（见 traffic.py / replay.py）；设置环境变量 ICE_TRAFFIC_LOG 可在启动时自动开启
+        self.recorder: Optional[TrafficRecorder] = None
+        self._conn_seq = itertools.count(1)
+        # 工作流文档池：复用已打开的文档、按 LRU 在预算内保持打开、预取下一个任务的文档
+        self.document_pool = DocumentPool(self, max_docs=3, priority=PRIORITY_BATCH)
+        # 请求耗时模型：按 (文档, 类型, 渲染数) 学习 p99，用于超时与 ETA；默认只在内存中学习，
+        # get_server() 创建的应用实例会从配置目录加载并持久化
+        self.latency_model = LatencyModel()
+        # 合并渲染后的编码任务（在消息循环之外执行，这里保留引用直到完成）
+        self._encode_tasks = set()
+        self.last_encoding_report = []  # 最近一次批量的输出汇总（见 EncodingReport.rows）
     
     async def start(self):
         """启动服务器（仅使用固定端口；若被占用则直接报错）"""
@@ -64,6 +180,10 @@ class PSServer:
 
         self.is_running = True
         _log(f"服务器已启动 ws://{self.host}:{self.port}，等待插件连接")
+
+        record_path = os.environ.get("ICE_TRAFFIC_LOG")
+        if record_path and not self.recorder:
+            self.start_recording(None if record_path == "1" else record_path)
     
     async def stop(self):
         """停止服务器"""
@@ -78,24 +198,81 @@ class PSServer:
             self.server.close()
             await self.server.wait_closed()
         
+        # 清理所有连接通道中的排队/在途请求
+        for lane in list(self.lanes.values()):
+            await self._drop_lane(lane, "Server Stopped")
+
         # 清理所有待处理的回调
         if self.callbacks:
             _log(f"清理 {len(self.callbacks)} 个待处理的回调")
             self.callbacks.clear()
         
+        self.stop_recording()
+        self.latency_model.save()
         self.is_running = False
         _log("服务器已停止")
+
+    # --- 通信录制 ---
+
+    def start_recording(self, path: str = None) -> str:
+        """
+        开始录制收发的 WebSocket 消息（gzip JSONL），返回文件路径
+
+        用于复现线上性能问题：录制文件可通过 replay.py 回放，无需客户的 PSD 或 Photoshop。
+        """
+        self.stop_recording()
+        path = path or default_recording_path()
+        self.recorder = TrafficRecorder(path, meta={"host": self.host, "port": self.port,
+                                                    "max_in_flight": self.max_in_flight,
+                                                    "type_timeouts": self.type_timeouts,
+                                                    "default_timeout": self.default_timeout})
+        for lane in self.lanes.values():
+            self.recorder.on_connect(lane.conn_id)
+        _log(f"开始录制通信: {path}")
+        return path
+
+    def stop_recording(self) -> Optional[str]:
+        """停止录制，返回录制文件路径（未在录制时返回 None）"""
+        recorder, self.recorder = self.recorder, None
+        if not recorder:
+            return None
+        recorder.close()
+        _log(f"通信录制已保存: {recorder.path}（{recorder.events} 条）")
+        return recorder.path
     
     def is_connected(self) -> bool:
         return self.websocket is not None
+
+    def current_lane(self) -> Optional[ConnectionLane]:
+        """当前协程发出请求时使用的派发通道"""
+        lane = _current_lane.get()
+        if lane is None and self.websocket:
+            lane = self.lanes.get(self.websocket)
+        return lane
+
+    @contextlib.contextmanager
+    def use_lane(self, lane: Optional[ConnectionLane]):
+        """在 with 块内（及其中创建的任务）把请求固定发往指定连接"""
+        token = _current_lane.set(lane)
+        try:
+            yield lane
+        finally:
+            _current_lane.reset(token)
     
     async def _handle_client(self, websocket):
         """处理客户端连接与消息分发"""
         _log("Photoshop 插件已连接")
         self.websocket = websocket
+        lane = ConnectionLane(websocket, self.max_in_flight, next(self._conn_seq))
+        self.lanes[websocket] = lane
+        _current_lane.set(lane)
+        if self.recorder:
+            self.recorder.on_connect(lane.conn_id)
         
         try:
             async for message in websocket:
+                if self.recorder:
+                    self.recorder.on_receive(lane.conn_id, message)
                 # 记录收到的原始消息
                 _log(f"收到消息: {message}")
                 
@@ -109,6 +286,10 @@ class PSServer:
                 msg_id = data.get("id")
                 
                 _log(f"解析消息 - 类型: {msg_type}, ID: {msg_id}")
+
+                # 任何带 ID 的最终响应都释放通道占用（进度通知除外）
+                if msg_id and msg_type != "atomic_progress":
+                    await self._release_request(lane, msg_id, data.get("status"))
                 
                 # --- 1. 图层数据响应 ---
                 if msg_type == "layers_response":
@@ -197,24 +378,40 @@ class PSServer:
                     total = data.get("total")
                     message = data.get("message")
                     _log(f"原子任务进度 [ID: {msg_id}] - [{step}] {current}/{total}: {message}")
+                    await self._on_progress_frame(msg_id, data)
                 
                 # --- 8. 原子化最终结果响应 ---
                 elif msg_type == "execute_atomic_response":
-                    success = (data.get("status") == "success")
-                    _log(f"原子化任务完成 [ID: {msg_id}] - 状态: {'成功' if success else '失败'}")
-                    await self._execute_callback(msg_id, data, data.get("error"))
+                    status = data.get("status")
+                    status_text = {"success": "成功", "cancelled": "已取消"}.get(status, "失败")
+                    _log(f"原子化任务完成 [ID: {msg_id}] - 状态: {status_text}, 输出文件: {len(data.get('rendered_files') or [])}")
+                    # 附加阶段耗时 (duplicate / operations / render / save)
+                    finished = self._recent_progress.get(msg_id)
+                    if finished:
+                        data["stage_timings"] = dict(finished.stage_timings)
+                    # 取消时统一以 "Cancelled" 作为错误信息，data 中仍携带部分输出
+                    error_info = "Cancelled" if status == "cancelled" else data.get("error")
+                    await self._execute_callback(msg_id, data, error_info)
 
                 # --- 9. 多文档列表响应 ---
                 elif msg_type == "get_open_docs_response":
                     docs = data.get("data", [])
                     _log(f"获取文档列表成功 [ID: {msg_id}] - 数量: {len(docs)}")
+                    lane.documents = {d.get("id"): d.get("name") for d in docs}
+                    lane.active_document = next((d.get("name") for d in docs if d.get("active")), None)
                     await self._execute_callback(msg_id, docs, None)
 
                 # --- 10. 通用状态响应 ---
                 elif msg_id and "status" in data:
                     success = (data.get("status") == "success")
                     error_info = data.get("error")
-                    await self._execute_callback(msg_id, success, error_info)
+                    if success and "doc_id" in data:
+                        # 打开文档的响应：返回文档 ID 与名称，供工作流按 ID 切换/关闭
+                        lane.documents[data["doc_id"]] = data.get("name")
+                        lane.active_document = data.get("name")
+                        await self._execute_callback(msg_id, {"doc_id": data["doc_id"], "name": data.get("name")}, None)
+                    else:
+                        await self._execute_callback(msg_id, success, error_info)
                 
                 else:
                     _log(f"收到其他消息类型: {msg_type}, 完整数据: {json.dumps(data, ensure_ascii=False)}")
@@ -222,7 +419,11 @@ class PSServer:
         except websockets.exceptions.ConnectionClosed:
             _log("连接断开")
         finally:
-            self.websocket = None
+            if self.recorder:
+                self.recorder.on_disconnect(lane.conn_id)
+            await self._drop_lane(lane, "Connection Lost")
+            # 若仍有其他连接，切换到最近建立的那个
+            self.websocket = list(self.lanes)[-1] if self.lanes else None
             _log("等待下次连接")
 
     async def _execute_callback(self, req_id, *args):
@@ -244,18 +445,22 @@ class PSServer:
     async def send_dialog(self, title: str, message: str, style: str = "default"):
         """发送弹窗"""
         if not self.websocket: return
-        await self.websocket.send(json.dumps({
+        raw = json.dumps({
             "type": "show_dialog", "title": title, "message": message, "style": style
-        }, ensure_ascii=False))
+        }, ensure_ascii=False)
+        if self.recorder:
+            lane = self.lanes.get(self.websocket)
+            self.recorder.on_send(lane.conn_id if lane else 0, raw=raw)
+        await self.websocket.send(raw)
     
-    async def request_layers(self, callback=None) -> int:
+    async def request_layers(self, callback=None, priority: int = None) -> int:
         """
         获取图层结构（统一获取所有结构，包含智能对象内部）
         """
         return await self._send_payload({
             "type": "get_layers",
             "include_smart_object_contents": True  # 统一获取所有结构
-        }, callback)
+        }, callback, priority=priority)
 
     async def update_text_layer(self, layer_id: int, text: str, parent_chain: list = [], callback=None) -> int:
         """
@@ -299,9 +504,34 @@ class PSServer:
             "parent_chain": parent_chain
         }, callback)
 
-    async def _send_payload(self, payload: dict, callback=None) -> int:
+    def _next_request_id(self) -> int:
+        """生成请求 ID（毫秒时间戳，同一毫秒内排队的多个请求顺延，保证唯一）"""
+        req_id = max(int(time.time() * 1000), self._last_req_id + 1)
+        self._last_req_id = req_id
+        return req_id
 
-        if not self.websocket:
+    async def _send_payload(self, payload: dict, callback=None, priority: int = None, timeout: float = None,
+                            lane: ConnectionLane = None) -> int:
+        """
+        将请求放入当前连接的派发通道
+
+        参数:
+            payload: 消息体（会自动写入 id）
+            callback: 响应回调 (result, error)
+            priority: 优先级，默认按消息类型决定（PRIORITY_INTERACTIVE / PRIORITY_BATCH）
+            timeout: 超时时间（秒），从真正派发时开始计时；默认取 type_timeouts 或 default_timeout
+            lane: 指定派发通道（默认当前协程绑定的连接，否则为当前主连接）
+        """
+        if lane is None:
+            lane = _current_lane.get()
+            if lane is not None and self.lanes.get(lane.websocket) is not lane:
+                # 绑定的连接已断开：不能改发到其他连接（文档与状态都不同）
+                _log(f"错误: 连接 #{lane.conn_id} 已断开，无法发送消息")
+                await self._notify_progress(callback, None, "Connection Lost")
+                return 0
+        if lane is None and self.websocket:
+            lane = self.lanes.get(self.websocket)
+        if not lane:
             _log("错误: 未连接，无法发送消息")
             if callback: 
                 # 简单处理未连接回调
@@ -312,7 +542,7 @@ class PSServer:
                     _log(f"回调执行异常: {e}")
             return 0
         
-        req_id = int(time.time() * 1000)
+        req_id = self._next_request_id()
         if callback: 
             self.callbacks[req_id] = callback
             _log(f"已注册回调函数 [ID: {req_id}]")
@@ -322,45 +552,34 @@ class PSServer:
         
         # 记录发送的消息
         msg_type = payload.get("type", "unknown")
-        _log(f"发送消息 [ID: {req_id}, 类型: {msg_type}]")
+        if priority is None:
+            priority = PRIORITY_BATCH if msg_type in BATCH_TYPES else PRIORITY_INTERACTIVE
+        if msg_type == "open_doc":
+            doc_label = os.path.basename(str(payload.get("path", "")).replace("\\", "/")) or None
+        elif msg_type in ("activate_doc", "close_doc"):
+            doc_label = lane.document_label(payload["doc_id"] if payload.get("doc_id") is not None else payload.get("name"))
+        else:
+            doc_label = lane.document_label(payload.get("target_document"))
+        renders = len(payload["renders"]) if isinstance(payload.get("renders"), list) else None
+        if timeout is None:
+            timeout = self.latency_model.timeout(doc_label, msg_type, renders,
+                                                 default=self.type_timeouts.get(msg_type, self.default_timeout))
 
-        # 为该请求启动一个超时检测任务，避免永远等待前端响应
-        if callback and self.default_timeout and self.default_timeout > 0:
-            async def _timeout_watch(req_id=req_id, cb=callback, msg_type=msg_type):
-                try:
-                    await asyncio.sleep(self.default_timeout)
-                    if req_id in self.callbacks:
-                        # 超时仍未收到前端响应，触发超时回调
-                        self.callbacks.pop(req_id, None)
-                        _log(f"请求超时 [ID: {req_id}, 类型: {msg_type}]，默认超时: {self.default_timeout}s")
-                        try:
-                            sig = inspect.signature(cb)
-                            param_count = len(sig.parameters)
-                            # 0 个参数：仅调用，不传错误信息
-                            if param_count == 0:
-                                if asyncio.iscoroutinefunction(cb):
-                                    await cb()
-                                else:
-                                    cb()
-                            # 1 个参数：传递错误字符串
-                            elif param_count == 1:
-                                if asyncio.iscoroutinefunction(cb):
-                                    await cb("Timeout")
-                                else:
-                                    cb("Timeout")
-                            # >=2 个参数：按照 (result, error) 约定，传递 (None, "Timeout")
-                            else:
-                                if asyncio.iscoroutinefunction(cb):
-                                    await cb(None, "Timeout")
-                                else:
-                                    cb(None, "Timeout")
-                        except Exception as e:
-                            _log(f"超时回调执行异常 [ID: {req_id}]: {e}")
-                except Exception as e:
-                    _log(f"超时监控任务异常 [ID: {req_id}]: {e}")
+        request = {
+            "id": req_id,
+            "type": msg_type,
+            "payload_str": payload_str,
+            "priority": priority,
+            "timeout": timeout,
+            "doc": doc_label,
+            "renders": renders,
+            "modal": msg_type not in NON_MODAL_TYPES,
+            "enqueued_at": time.time(),
+            "dispatched_at": None,
+            "timer": None,
+        }
+        _log(f"请求入队 [ID: {req_id}, 类型: {msg_type}, 优先级: {priority}]")
 
-            asyncio.create_task(_timeout_watch())
-        
         # 根据消息类型显示详细信息（不做长度限制）
         if msg_type == "get_layers":
             _log(f"  获取图层结构（统一获取所有结构，包含智能对象内部）")
@@ -399,10 +618,307 @@ class PSServer:
             # 对于其他类型，显示完整 payload（不做长度限制）
             _log(f"  完整消息: {payload_str}")
         
-        await self.websocket.send(payload_str)
-        _log(f"消息已发送 [ID: {req_id}]")
+        if self.recorder:
+            self.recorder.on_enqueue(lane.conn_id, request)
+
+        if request["modal"]:
+            heapq.heappush(lane.pending, (priority, next(self._seq), request))
+            await self._pump_lane(lane)
+        else:
+            await self._dispatch(lane, request)
         return req_id
 
+    async def _pump_lane(self, lane: ConnectionLane):
+        """在通道有空闲槽位时，按优先级派发排队中的请求"""
+        while lane.pending and lane.has_free_slot():
+            _, _, request = heapq.heappop(lane.pending)
+            await self._dispatch(lane, request)
+
+    async def _dispatch(self, lane: ConnectionLane, request: dict):
+        """真正把请求发给插件，并从此刻开始超时计时"""
+        req_id = request["id"]
+        request["dispatched_at"] = time.time()
+        lane.in_flight[req_id] = request
+        if request["type"] == "execute_atomic":
+            self._progress[req_id] = RequestProgress(req_id, request["dispatched_at"], on_segment=self._record_segment)
+        metrics.inc("ice_requests_total", help_text="已派发给插件的请求数", type=request["type"])
+        metrics.observe("ice_queue_wait_seconds", request["dispatched_at"] - request["enqueued_at"],
+                        help_text="请求在派发通道中的排队时间", type=request["type"])
+
+        if request["timeout"] and request["timeout"] > 0:
+            request["timer"] = asyncio.create_task(self._timeout_watch(lane, request))
+
+        if self.recorder:
+            self.recorder.on_send(lane.conn_id, req_id)
+
+        try:
+            await lane.websocket.send(request["payload_str"])
+        except websockets.exceptions.ConnectionClosed:
+            _log(f"发送失败，连接已断开 [ID: {req_id}]")
+            lane.in_flight.pop(req_id, None)
+            if request["timer"]:
+                request["timer"].cancel()
+            await self._finish_progress(req_id, "error")
+            await self._fail_callback(req_id, "Connection Lost")
+            return
+
+        waited = request["dispatched_at"] - request["enqueued_at"]
+        _log(f"消息已发送 [ID: {req_id}] (排队 {waited:.2f}s)")
+
+    async def _timeout_watch(self, lane: ConnectionLane, request: dict):
+        """
+        超时检测：避免永远等待前端响应
+
+        超时后立即以 "Timeout" 回调调用方并向插件发送 cancel，但请求仍留在 in_flight 中占用模态槽位：
+        插件此时还在 executeAsModal 中执行该请求，若马上派发下一个模态请求，它的计时会在 PS 忙碌时开始，
+        重新造成误报超时。槽位在插件返回迟到的响应（或取消结果）时由 _release_request 释放。
+        """
+        req_id = request["id"]
+        try:
+            await asyncio.sleep(request["timeout"])
+            if req_id not in lane.in_flight:
+                return
+            if not request["modal"]:
+                # 非模态请求不占用槽位，直接结束
+                lane.in_flight.pop(req_id, None)
+                _log(f"请求超时 [ID: {req_id}, 类型: {request['type']}]，超时: {request['timeout']}s")
+                metrics.inc("ice_request_timeouts_total", help_text="超时的请求数", type=request["type"])
+                await self._fail_callback(req_id, "Timeout")
+                return
+            request["timed_out"] = True
+            _log(f"请求超时 [ID: {req_id}, 类型: {request['type']}]，超时: {request['timeout']}s，等待插件结束后释放通道")
+            metrics.inc("ice_request_timeouts_total", help_text="超时的请求数", type=request["type"])
+            await self._finish_progress(req_id, "timeout")
+            await self._fail_callback(req_id, "Timeout")
+            if not request.get("cancel_requested"):
+                request["cancel_requested"] = True
+                await self._send_payload({"type": "cancel", "target_id": req_id}, lane=lane)
+
+            await asyncio.sleep(self.timeout_grace)
+            if lane.in_flight.pop(req_id, None) is None:
+                return
+            _log(f"插件在超时后 {self.timeout_grace:.0f}s 内仍未响应 [ID: {req_id}]，强制释放通道")
+            # 真实耗时至少为超时值：按下限样本计入模型，误判的超时会逐步放宽（不超过 ceiling）
+            self.latency_model.record(request["doc"], request["type"], request["renders"], request["timeout"])
+            await self._pump_lane(lane)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            _log(f"超时监控任务异常 [ID: {req_id}]: {e}")
+
+    async def _release_request(self, lane: ConnectionLane, req_id, status: str = None):
+        """收到响应：结束在途请求并派发下一个"""
+        request = lane.in_flight.pop(req_id, None)
+        if not request:
+            return
+        if request["timer"]:
+            request["timer"].cancel()
+        status = status or "success"
+        elapsed = time.time() - request["dispatched_at"]
+        if request.get("timed_out"):
+            # 超时请求的迟到响应：调用方已收到超时，这里只释放槽位并记录真实耗时
+            _log(f"超时请求已结束 [ID: {req_id}, 状态: {status}]，实际耗时 {elapsed:.1f}s，释放通道")
+            if status == "success":
+                self.latency_model.record(request["doc"], request["type"], request["renders"], elapsed)
+            else:
+                # 被取消或失败：真实耗时至少为超时值，按下限样本计入
+                self.latency_model.record(request["doc"], request["type"], request["renders"], request["timeout"])
+            await self._pump_lane(lane)
+            return
+        metrics.observe("ice_request_duration_seconds", elapsed,
+                        help_text="从派发到收到响应的耗时", type=request["type"], status=status)
+        if status == "success":
+            self.latency_model.record(request["doc"], request["type"], request["renders"], elapsed)
+            if request["type"] == "activate_doc" and request["doc"]:
+                lane.active_document = request["doc"]
+        await self._finish_progress(req_id, status)
+        await self._pump_lane(lane)
+
+    async def _drop_lane(self, lane: ConnectionLane, reason: str):
+        """连接断开：以错误结束该通道上所有排队/在途的请求"""
+        if self.lanes.get(lane.websocket) is lane:
+            del self.lanes[lane.websocket]
+        self.document_pool.drop_connection(lane.conn_id)
+        requests = [r for _, _, r in lane.pending] + list(lane.in_flight.values())
+        lane.pending.clear()
+        lane.in_flight.clear()
+        if requests:
+            _log(f"连接通道关闭，结束 {len(requests)} 个未完成请求: {reason}")
+        for request in requests:
+            if request["timer"]:
+                request["timer"].cancel()
+            await self._finish_progress(request["id"], "error")
+            await self._fail_callback(request["id"], reason)
+
+    async def _fail_callback(self, req_id, error: str):
+        """按回调签名传递错误信息"""
+        cb = self.callbacks.pop(req_id, None)
+        if not cb:
+            return
+        try:
+            sig = inspect.signature(cb)
+            param_count = len(sig.parameters)
+            # 0 个参数：仅调用，不传错误信息
+            if param_count == 0:
+                args = ()
+            # 1 个参数：传递错误字符串
+            elif param_count == 1:
+                args = (error,)
+            # >=2 个参数：按照 (result, error) 约定，传递 (None, error)
+            else:
+                args = (None, error)
+            if asyncio.iscoroutinefunction(cb):
+                await cb(*args)
+            else:
+                cb(*args)
+        except Exception as e:
+            _log(f"错误回调执行异常 [ID: {req_id}]: {e}")
+
+    async def cancel(self, req_id: int, callback=None) -> bool:
+        """
+        取消请求
+
+        - 仍在排队：直接出队，回调收到 (None, "Cancelled")
+        - 已派发：向插件发送 cancel 消息，插件在下一个操作/渲染之间中止，
+          并以 (data, "Cancelled") 回调，data["rendered_files"] 为已完成的部分输出
+
+        返回: 是否找到该请求
+        """
+        if self.recorder:
+            self.recorder.on_cancel(req_id)
+        for lane in self.lanes.values():
+            for i, (_, _, request) in enumerate(lane.pending):
+                if request["id"] == req_id:
+                    lane.pending.pop(i)
+                    heapq.heapify(lane.pending)
+                    _log(f"已取消排队中的请求 [ID: {req_id}]")
+                    await self._fail_callback(req_id, "Cancelled")
+                    return True
+
+            request = lane.in_flight.get(req_id)
+            if request:
+                request["cancel_requested"] = True
+                _log(f"请求取消在途任务 [ID: {req_id}, 类型: {request['type']}]")
+                await self._send_payload({"type": "cancel", "target_id": req_id}, callback, lane=lane)
+                return True
+
+        _log(f"取消失败: 未找到请求 [ID: {req_id}]")
+        return False
+
+    # --- 进度事件流 ---
+
+    def subscribe_progress(self, callback: Callable, req_id: int = None) -> Callable:
+        """
+        订阅原子任务进度事件
+
+        参数:
+            callback: (event) -> None，可为协程函数；event 结构见 progress.RequestProgress.snapshot
+            req_id: 只订阅指定请求；None 表示订阅全部请求
+
+        返回: 取消订阅函数
+        """
+        self._progress_subscribers.setdefault(req_id, []).append(callback)
+
+        def unsubscribe():
+            subscribers = self._progress_subscribers.get(req_id, [])
+            if callback in subscribers:
+                subscribers.remove(callback)
+            if not subscribers:
+                self._progress_subscribers.pop(req_id, None)
+        return unsubscribe
+
+    def progress_events(self, req_id: int) -> ProgressStream:
+        """
+        获取指定请求的进度事件异步迭代器（会先回放已收到的事件，请求结束后迭代停止）
+        """
+        def on_close(stream):
+            streams = self._progress_streams.get(req_id, [])
+            if stream in streams:
+                streams.remove(stream)
+            if not streams:
+                self._progress_streams.pop(req_id, None)
+
+        stream = ProgressStream(req_id, on_close=on_close)
+        progress = self._progress.get(req_id) or self._recent_progress.get(req_id)
+        if progress:
+            for event in progress.events:
+                stream.push(event)
+            if progress.finished:
+                stream.close()
+                return stream
+        self._progress_streams.setdefault(req_id, []).append(stream)
+        return stream
+
+    def get_request_progress(self, req_id: int) -> Optional[dict]:
+        """获取请求当前的进度快照（含阶段耗时）"""
+        progress = self._progress.get(req_id) or self._recent_progress.get(req_id)
+        return progress.snapshot() if progress else None
+
+    def _record_segment(self, stage: str, seconds: float, labels: dict):
+        """进度片段 -> 指标：按操作类型 / 渲染格式的单项耗时（阶段合计在 _finish_progress 中记录）"""
+        if stage == "operations" and labels.get("op_type"):
+            metrics.observe("ice_operation_seconds", seconds, help_text="单个编辑操作耗时", op_type=labels["op_type"])
+        elif stage in ("render", "save") and labels.get("format"):
+            metrics.observe(f"ice_{stage}_seconds", seconds, help_text="单个渲染准备/保存耗时", format=str(labels["format"]).lower())
+
+    async def _on_progress_frame(self, req_id, frame: dict):
+        progress = self._progress.get(req_id)
+        if progress is None:
+            progress = self._progress[req_id] = RequestProgress(req_id, on_segment=self._record_segment)
+        await self._emit_progress(req_id, progress.feed(frame))
+
+    async def _finish_progress(self, req_id, status: str):
+        progress = self._progress.pop(req_id, None)
+        if progress is None:
+            return
+        event = progress.finish(status)
+        if status == "success":
+            # 每个请求每个阶段一个样本（阶段内各片段之和），不是单个操作 / 渲染的耗时
+            for stage, seconds in progress.stage_timings.items():
+                metrics.observe("ice_stage_seconds", seconds, help_text="原子任务各阶段耗时", stage=stage)
+        self._recent_progress[req_id] = progress
+        while len(self._recent_progress) > 64:
+            self._recent_progress.popitem(last=False)
+        await self._emit_progress(req_id, event)
+        for stream in list(self._progress_streams.get(req_id, [])):
+            stream.close()
+
+    async def _emit_progress(self, req_id, event: dict):
+        for stream in self._progress_streams.get(req_id, []):
+            stream.push(event)
+        subscribers = self._progress_subscribers.get(req_id, []) + self._progress_subscribers.get(None, [])
+        for cb in subscribers:
+            try:
+                if asyncio.iscoroutinefunction(cb):
+                    await cb(event)
+                else:
+                    cb(event)
+            except Exception as e:
+                _log(f"进度订阅回调异常 [ID: {req_id}]: {e}")
+
+    def get_queue_stats(self) -> dict:
+        """
+        获取派发队列状态（供 UI 显示）
+
+        返回:
+            {"connections": int, "queued": int, "queued_interactive": int,
+             "queued_batch": int, "in_flight": int, "oldest_wait": float}
+        """
+        now = time.time()
+        queued = [r for lane in self.lanes.values() for _, _, r in lane.pending]
+        return {
+            "connections": len(self.lanes),
+            "queued": len(queued),
+            "queued_interactive": sum(1 for r in queued if r["priority"] < PRIORITY_BATCH),
+            "queued_batch": sum(1 for r in queued if r["priority"] >= PRIORITY_BATCH),
+            "in_flight": sum(len(lane.in_flight) for lane in self.lanes.values()),
+            "oldest_wait": max((now - r["enqueued_at"] for r in queued), default=0.0),
+        }
+
+    def get_queue_depth(self) -> int:
+        """排队中（尚未派发）的请求数"""
+        return sum(len(lane.pending) for lane in self.lanes.values())
+
     async def replace_layer_image(self, layer_id: int, image_path: str, parent_chain: list = [], callback=None) -> int:
         """
         替换图层图片
@@ -443,25 +959,10 @@ class PSServer:
             output_height: 输出画布高度 (仅当 tiling=True 时生效)
             filters: 滤镜配置列表，例如 [{"type": "emboss", "params": {...}}]
         """
-        if not self.websocket:  
-            _log("错误: 未连接，无法发送渲染请求")
-            if callback: 
-                try:
-                    if asyncio.iscoroutinefunction(callback): 
-                        await callback(None, "Not Connected")
-                    else: 
-                        callback(None, "Not Connected")
-                except Exception as e:
-                    _log(f"回调执行异常: {e}")
-            return 0
-        
         # 路径标准化
         clean_folder = output_folder.replace("\\", "/")
         format = format.lower().replace("jpeg", "jpg")
         
-        req_id = int(time.time() * 1000)
-        if callback: self.callbacks[req_id] = callback
-        
         # 处理root_ids：None或空列表表示渲染全部，非空列表表示只渲染指定的图层
         if root_ids is None:
             root_ids_to_send = []  # 空列表表示渲染全部
@@ -472,7 +973,6 @@ class PSServer:
         filters_to_send = filters if isinstance(filters, list) else []
         
         payload = {
-            "id": req_id,
             "type": "render_output",
             "folder": clean_folder,
             "file_name": file_name,
@@ -484,8 +984,9 @@ class PSServer:
             "filters": filters_to_send
         }
         
-        await self.websocket.send(json.dumps(payload, ensure_ascii=False))
-        _log(f"发送渲染指令 [ID:{req_id}] -> {file_name}.{format}, root_ids: {root_ids_to_send}, filters: {len(filters_to_send)}")
+        req_id = await self._send_payload(payload, callback)
+        if req_id:
+            _log(f"发送渲染指令 [ID:{req_id}] -> {file_name}.{format}, root_ids: {root_ids_to_send}, filters: {len(filters_to_send)}")
         return req_id
 
     # ============================================
@@ -661,32 +1162,33 @@ class PSServer:
         """获取当前 PS 中所有打开的文档列表"""
         return await self._send_payload({"type": "get_open_docs"}, callback)
 
-    async def open_psd(self, file_path: str, callback=None) -> int:
-        """打开指定路径的 PSD 文件"""
-        return await self._send_payload({"type": "open_doc", "path": file_path}, callback)
+    async def open_psd(self, file_path: str, callback=None, priority: int = None) -> int:
+        """打开指定路径的 PSD 文件，成功时回调结果为 {"doc_id", "name"}"""
+        return await self._send_payload({"type": "open_doc", "path": file_path}, callback, priority=priority)
 
-    async def close_psd(self, doc_id: int = None, name: str = None, save: bool = False, callback=None) -> int:
+    async def close_psd(self, doc_id: int = None, name: str = None, save: bool = False, callback=None, priority: int = None) -> int:
         """关闭指定文档"""
         return await self._send_payload({
             "type": "close_doc", 
             "doc_id": doc_id, 
             "name": name, 
             "save": save
-        }, callback)
+        }, callback, priority=priority)
 
-    async def activate_psd(self, doc_id: int = None, name: str = None, callback=None) -> int:
+    async def activate_psd(self, doc_id: int = None, name: str = None, callback=None, priority: int = None) -> int:
         """激活/切换到指定文档"""
         return await self._send_payload({
             "type": "activate_doc", 
             "doc_id": doc_id, 
             "name": name
-        }, callback)
+        }, callback, priority=priority)
 
     async def fix_ps_environment(self, callback=None) -> int:
         """优化 PS 环境设置（关闭标签页模式，解决空间不足报错）"""
         return await self._send_payload({"type": "fix_environment"}, callback)
 
-    async def execute_strategy_atomic(self, operations: list, renders: list, debug: bool = False, target_document: str = None, callback=None) -> int:
+    async def execute_strategy_atomic(self, operations: list, renders: list, debug: bool = False, target_document: str = None, callback=None,
+                                      priority: int = None, timeout: float = None, reuse_stage: bool = False) -> int:
         """
         原子化执行完整策略包
         
@@ -695,14 +1197,55 @@ class PSServer:
             renders: 渲染配置列表
             debug: 是否处于调试模式（调试模式下不关闭中间副本）
             target_document: 目标文档名称或ID（可选，用于工作流自动切换）
+            priority: 派发优先级，默认 PRIORITY_BATCH；界面预览等交互场景传 PRIORITY_INTERACTIVE
+            timeout: 超时时间（秒），从派发时开始计时，默认由耗时模型给出（见 request_timeout）
+            reuse_stage: 插件保留「换图底稿」（已置入本行图片的文档副本）；下一行图片输入完全相同时
+                直接复制底稿、跳过 replace_image。批量结束后调用 release_stage 关闭底稿
+
+        只有输出格式 / 质量不同的渲染方案会合并为一次 PS 渲染（PNG 中间文件），带编码参数（encoding）
+        的方案也改为中间文件，均由 Python 端编码（见 encoder.py）；可在 Python 端完成的平铺与全局滤镜在编码前进行
+        （见 tiling.py、image_filters.py），PS 只输出基础图像。回调中的 rendered_files 仍按原方案一一对应。
         """
-        return await self._send_payload({
+        plan = plan_renders(renders)
+        if plan.merged:
+            callback = self._encoding_callback(plan, callback)
+        payload = {
             "type": "execute_atomic",
             "operations": operations,
-            "renders": renders,
+            "renders": plan.renders,
             "debug": debug,
             "target_document": target_document
-        }, callback)
+        }
+        if reuse_stage:
+            payload["reuse_stage"] = True
+        return await self._send_payload(payload, callback, priority=priority, timeout=timeout)
+
+    def _encoding_callback(self, plan, callback):
+        """合并渲染的回调包装：编码出各方案的文件后再回调；编码在后台任务中进行，不阻塞连接的消息循环"""
+        async def finish(data, error):
+            if isinstance(data, dict) and isinstance(data.get("rendered_files"), list):
+                files, seconds = await encoder.finish(plan, data["rendered_files"])
+                timings = dict(data.get("stage_timings") or {})
+                timings["encode"] = timings.get("encode", 0.0) + seconds
+                data = dict(data, rendered_files=files, stage_timings=timings)
+            if callback:
+                try:
+                    if asyncio.iscoroutinefunction(callback):
+                        await callback(data, error)
+                    else:
+                        callback(data, error)
+                except Exception as e:
+                    _log(f"回调执行异常: {e}")
+
+        def on_done(data, error=None):
+            task = asyncio.ensure_future(finish(data, error))
+            self._encode_tasks.add(task)
+            task.add_done_callback(self._encode_tasks.discard)
+        return on_done
+
+    async def release_stage(self, callback=None, priority: int = None) -> int:
+        """关闭插件保留的换图底稿（见 execute_strategy_atomic 的 reuse_stage）"""
+        return await self._send_payload({"type": "release_stage"}, callback, priority=priority)
 
     # ============================================
     # 策略自动化相关 (Strategy Automation)
@@ -761,7 +1304,9 @@ class PSServer:
             
         return requirements
 
-    async def execute_batch_with_data(self, strategy: dict, data_table: List[Dict[str, Any]], callback=None, progress_callback=None) -> int:
+    async def execute_batch_with_data(self, strategy: dict, data_table: List[Dict[str, Any]], callback=None, progress_callback=None,
+                                      indices: List[int] = None, target_document=None, group_images: bool = False,
+                                      check_images: bool = True, prepare_images: bool = True, row_callback=None) -> int:
         """
         使用预处理好的数据执行批量处理任务
         
@@ -770,6 +1315,19 @@ class PSServer:
             data_table: UI解析好的数据列表，每项是一个包含字段映射的字典
             callback: 任务完成后的回调 (results, error)
             progress_callback: 进度回调 (current, total, status, message)
+                status: started / processing / stage / success / error / cancelled / completed
+                stage 事件来自插件 atomic_progress 帧，message 含当前阶段、吞吐量与 ETA
+            indices: 每行的原始行号（用于文件名 {index} 与结果中的 index）；默认按 1..N 编号，
+                断点续跑只提交部分行时传入，保证输出文件名与首次运行一致
+            target_document: 每行原子任务的目标文档（名称或 ID）；多文档工作流中保证
+                即使激活文档被切换，也始终基于该文档出图。图层结构仍读取自当前激活文档
+            group_images: 把图片输入相同的行排在一起执行，并让插件复用换图底稿（跳过重复的换图）；
+                输出文件名与结果顺序不变，进度中的行号为执行顺序
+            check_images: 开始前并发预检各行引用的图片（存在、可读、格式、尺寸），
+                有问题的行直接记为失败，不发送到 PS
+            prepare_images: 按目标智能对象尺寸在后台预先缩小替换图片（见 image_prep），插件收到处理后的路径
+            row_callback: 每行出图结束（成功或取消）后以该行结果调用 (result)，result 含 index 与
+                rendered_files（插件返回的实际保存路径），在该行的 success / cancelled 进度之前调用
         """
         if not self.websocket:
             _log("错误: 未连接，无法执行批量处理")
@@ -794,9 +1352,10 @@ class PSServer:
             if err: layer_tree_future.set_exception(Exception(err))
             else: layer_tree_future.set_result(tree)
             
-        await self.request_layers(callback=on_layers)
+        # 超时由派发通道负责（从派发时计时），这里不再叠加包含排队时间的等待上限
+        await self.request_layers(callback=on_layers, priority=PRIORITY_BATCH)
         try:
-            layer_tree = await asyncio.wait_for(layer_tree_future, timeout=10.0)
+            layer_tree = await layer_tree_future
         except Exception as e:
             _log(f"获取图层结构失败: {e}")
             if callback:
@@ -832,7 +1391,29 @@ class PSServer:
             op_template["parent_chain"] = parent_chain
             op_templates.append(op_template)
 
-        # 3. 循环执行每一行数据
+        # 3. 预检图片输入：只检查由数据行提供的路径（未提供时沿用策略中的原图）
+        image_groups = [str(t["group"]) for t in op_templates if t["type"] == "replace_image" and t.get("group") is not None]
+        image_errors = {}
+        if check_images and image_groups:
+            rows_paths = [[str(row[g]) for g in image_groups if g in row] for row in data_table]
+            image_errors = await preflight.check_rows_async(rows_paths)
+            if image_errors:
+                _log(f"图片预检：{len(image_errors)} 行引用的图片有问题，这些行不会发送到 PS")
+
+        # 4. 后台预处理替换图片（与前面行的出图同时进行），目标尺寸取自智能对象
+        template_boxes = [None] * len(op_templates)
+        prepared = {}
+        if prepare_images and image_groups and image_prep.enabled:
+            for i, t in enumerate(op_templates):
+                if t["type"] == "replace_image" and t.get("group") is not None:
+                    template_boxes[i] = target_size(find_layer(layer_tree, t["layer_id"], t.get("parent_chain")))
+            prepared = image_prep.schedule([
+                (str(row[str(t["group"])]).replace("\\", "/"), box)
+                for position, row in enumerate(data_table) if position not in image_errors
+                for t, box in zip(op_templates, template_boxes) if box and str(t["group"]) in row
+            ])
+
+        # 5. 循环执行每一行数据
         total = len(data_table)
         _log(f"开始执行批量队列，共 {total} 组数据")
         
@@ -846,9 +1427,26 @@ class PSServer:
             except Exception as e:
                 _log(f"进度回调异常: {e}")
         
-        results = []
-        for idx, row in enumerate(data_table, 1):
+        order = list(range(total))
+        if group_images:
+            image_keys = [tuple(str(row.get(g, "")) for g in image_groups) for row in data_table]
+            order = group_order(image_keys)
+            _log(f"按图片输入分组执行：{len(set(image_keys))} 组图片")
+
+        results: Dict[int, dict] = {}  # 行在 data_table 中的位置 -> 结果（每行恰好一条，分组执行时顺序不受影响）
+        tracker = BatchProgress(total, expected_row_seconds=self.expected_row_seconds(
+            len(strategy.get("renders", [])), target_document))
+        encoding_report = EncodingReport()
+        for idx, position in enumerate(order, 1):
+            row = data_table[position]
+            row_index = indices[position] if indices else position + 1
+            if position in image_errors:
+                error = image_errors[position]
+                results[position] = {"index": row_index, "status": "error", "error": error}
+                await self._notify_progress(progress_callback, idx, total, "error", f"第 {idx} 行处理失败: {error}")
+                continue
             _log(f"--- 处理第 {idx}/{total} 组数据 ---")
+            tracker.row_started()
             
             # 报告当前进度
             if progress_callback:
@@ -861,9 +1459,9 @@ class PSServer:
                     _log(f"进度回调异常: {e}")
             
             try:
-                # 3.1 构建当前行的操作列表
+                # 5.1 构建当前行的操作列表
                 current_ops = []
-                for template in op_templates:
+                for template, box in zip(op_templates, template_boxes):
                     op = template.copy()
                     group = op.get("group")
                     group_key = str(group) if group is not None else None
@@ -878,16 +1476,21 @@ class PSServer:
                     elif op["type"] == "replace_image" and group_key and group_key in row:
                         # 统一路径为正斜杠
                         op["image_path"] = str(row[group_key]).replace("\\", "/")
+                        future = prepared.get((op["image_path"], box))
+                        if future:
+                            op["image_path"] = (await future).replace("\\", "/")
+                            # 缓存仓库中的文件由插件直接置入，不再复制到插件数据目录
+                            op["cached"] = image_prep.in_store(op["image_path"])
                     
                     current_ops.append(op)
                 
-                # 3.2 准备渲染配置
+                # 5.2 准备渲染配置
                 current_renders = []
                 for render_config in strategy.get("renders", []):
                     # 文件名处理
                     filename = row.get("output_filename")
                     if not filename:
-                        filename = render_config.get("filename", "export_{index}").replace("{index}", str(idx))
+                        filename = render_config.get("filename", "export_{index}").replace("{index}", str(row_index))
                     
                     # 确定 root_ids
                     root_layers_paths = render_config.get("root_layers", [])
@@ -899,35 +1502,88 @@ class PSServer:
                     # 统一路径为正斜杠
                     output_folder = render_config.get("output_path", ".").replace("\\", "/")
                     
-                    current_renders.append({
+                    render = {
+                        "name": render_config.get("name"),
                         "folder": output_folder,
                         "file_name": filename,
                         "format": render_config.get("format", "jpg"),
+                        "quality": render_config.get("quality", 100),
                         "root_ids": root_ids,
                         "tiling": render_config.get("tiling", {}).get("enabled", False),
                         "width": render_config.get("tiling", {}).get("width", 0),
                         "height": render_config.get("tiling", {}).get("height", 0),
                         "resolution": render_config.get("tiling", {}).get("ppi", 300),
                         "filters": render_config.get("filters", [])
-                    })
+                    }
+                    if render_config.get("encoding"):
+                        render["encoding"] = render_config["encoding"]
+                    current_renders.append(render)
 
-                # 3.3 原子化发送任务包
+                # 5.3 原子化发送任务包
                 # 使用 Future 等待当前行的原子任务完成
                 loop = asyncio.get_event_loop()
                 atomic_future = loop.create_future()
-                async def on_atomic_done(success, err):
-                    if err: atomic_future.set_exception(Exception(err))
-                    else: atomic_future.set_result(success)
-
-                await self.execute_strategy_atomic(
+                async def on_atomic_done(data, err):
+                    if atomic_future.done(): return
+                    if err == "Cancelled":
+                        atomic_future.set_result((data, err))
+                    elif err: atomic_future.set_exception(Exception(err))
+                    else: atomic_future.set_result((data, None))
+
+                req_id = await self.execute_strategy_atomic(
                     operations=current_ops,
                     renders=current_renders,
                     debug=False, # 批量处理默认不开启调试
-                    callback=on_atomic_done
-                )
-                
-                await asyncio.wait_for(atomic_future, timeout=120.0) # 每行原子任务包给 120s
-                results.append({"index": idx, "status": "ok"})
+                    target_document=target_document,
+                    callback=on_atomic_done,
+                    priority=PRIORITY_BATCH,
+                    reuse_stage=group_images,
+                )  # 超时由耗时模型按文档与渲染数给出（从派发时计时）
+
+                # 阶段级进度：转发为 status="stage"，消息中包含吞吐量与 ETA
+                async def on_stage(event, idx=idx):
+                    if event.get("done"):
+                        return
+                    tracker.update(event)
+                    await self._notify_progress(progress_callback, idx, total, "stage", tracker.status_text())
+
+                unsubscribe = self.subscribe_progress(on_stage, req_id) if (req_id and progress_callback) else None
+                try:
+                    atomic_data, atomic_err = await atomic_future
+                except asyncio.CancelledError:
+                    # 外层任务被取消（命令行中断、任务接口取消等）：同时中止插件端的在途任务
+                    if req_id:
+                        await self.cancel(req_id)
+                    for future in prepared.values():
+                        future.cancel()
+                    if group_images:
+                        await self.release_stage(priority=PRIORITY_BATCH)
+                    raise
+                finally:
+                    if unsubscribe: unsubscribe()
+                tracker.row_finished((atomic_data or {}).get("stage_timings") if isinstance(atomic_data, dict) else None)
+                if atomic_err == "Cancelled":
+                    partial = (atomic_data or {}).get("rendered_files", []) if isinstance(atomic_data, dict) else []
+                    _log(f"第 {idx} 组数据已取消，部分输出: {len(partial)}")
+                    results[position] = {"index": row_index, "status": "cancelled", "rendered_files": partial}
+                    await self._notify_progress(row_callback, results[position])
+                    if progress_callback:
+                        try:
+                            if asyncio.iscoroutinefunction(progress_callback):
+                                await progress_callback(idx, total, "cancelled", f"第 {idx} 行已取消")
+                            else:
+                                progress_callback(idx, total, "cancelled", f"第 {idx} 行已取消")
+                        except Exception as e:
+                            _log(f"进度回调异常: {e}")
+                    continue
+                results[position] = {"index": row_index, "status": "ok",
+                                     "rendered_files": (atomic_data or {}).get("rendered_files", []) if isinstance(atomic_data, dict) else [],
+                                     "stage_timings": (atomic_data or {}).get("stage_timings", {}) if isinstance(atomic_data, dict) else {}}
+                try:
+                    encoding_report.add(current_renders, results[position]["rendered_files"])
+                except Exception as e:
+                    _log(f"输出汇总统计失败（不影响该行结果）: {e}")
+                await self._notify_progress(row_callback, results[position])
                 
                 # 报告成功
                 if progress_callback:
@@ -941,7 +1597,9 @@ class PSServer:
                         
             except Exception as e:
                 _log(f"第 {idx} 组数据处理失败: {e}")
-                results.append({"index": idx, "status": "error", "error": str(e)})
+                if tracker.current_row_started_at is not None:
+                    tracker.row_finished()
+                results[position] = {"index": row_index, "status": "error", "error": str(e)}
                 
                 # 报告错误
                 if progress_callback:
@@ -953,8 +1611,19 @@ class PSServer:
                     except Exception as e:
                         _log(f"进度回调异常: {e}")
 
+        if group_images:
+            await self.release_stage(priority=PRIORITY_BATCH)
+        # 结果按原始行顺序返回
+        results = [results[position] for position in sorted(results)]
         success_count = sum(1 for r in results if r['status']=='ok')
         _log(f"批量处理完成，成功: {success_count}/{total}")
+        if tracker.stage_totals:
+            stage_text = ", ".join(f"{k} {v:.1f}s" for k, v in tracker.stage_totals.items())
+            _log(f"阶段耗时合计: {stage_text}")
+        # 按渲染方案汇总输出大小与画质，用于调整方案的格式 / 质量参数
+        self.last_encoding_report = encoding_report.rows()
+        for line in encoding_report.lines():
+            _log(f"输出汇总 {line}")
         
         # 报告完成
         if progress_callback:
@@ -976,74 +1645,262 @@ class PSServer:
         
         return 0
 
-    async def execute_workflow(self, tasks: list, progress_callback=None) -> list:
+    def request_timeout(self, msg_type: str, doc: str = None, renders: int = None) -> float:
+        """某类请求当前使用的超时（秒）：耗时模型学到的值，样本不足时为 type_timeouts / default_timeout"""
+        return self.latency_model.timeout(doc, msg_type, renders,
+                                          default=self.type_timeouts.get(msg_type, self.default_timeout))
+
+    def expected_row_seconds(self, renders: int = None, target_document=None) -> Optional[float]:
+        """
+        单行原子任务的典型耗时（秒），供 BatchProgress 在尚无完成行时估算 ETA；没有样本时返回 None
+
+        target_document: 文档名称或 ID（ID 按当前连接的文档列表换算为名称）
+        """
+        lane = self.current_lane()
+        doc = lane.document_label(target_document) if lane else target_document
+        return self.latency_model.expected(doc if isinstance(doc, str) else None, "execute_atomic", renders)
+
+    def workflow_task_timeout(self, task: dict, strategy: dict = None, doc: str = None) -> float:
+        """
+        工作流单个任务的出图超时（秒），随行数增长：读取图层 + 每行一个原子任务包的超时之和
+        （均来自耗时模型，按文档与渲染数区分）
+
+        任务中显式给出 "timeout" 时以其为准。
+        """
+        if task.get("timeout"):
+            return float(task["timeout"])
+        rows = len(task.get("data_table") or [])
+        renders = len((strategy or {}).get("renders", [])) if strategy else None
+        return self.request_timeout("get_layers", doc) + rows * self.request_timeout("execute_atomic", doc, renders)
+
+    async def execute_workflow(self, tasks: list, progress_callback=None, keep_open: int = None,
+                               event_callback=None, reorder: bool = False, prefetch: bool = True,
+                               parallel: bool = True) -> list:
         """
         执行多文档工作流
         
         参数:
             tasks: 任务列表，每一项包含:
                 - "psd_path": PSD文件路径
-                - "strategy": 策略字典
+                - "strategy": 策略字典；为 None 时在打开文档后读取其 XMP 中保存的策略
                 - "data_table": 数据表
+                - "output_dir": 可选，覆盖策略中所有渲染方案的输出目录
+                - "id" / "depends_on" / "priority": 可选，任务依赖与优先级（见 workflow_dag.py）
+                - "timeout": 可选，出图超时（秒），默认按行数计算（见 workflow_task_timeout）
+            progress_callback: (psd_index, psd_total, status, message)，兼容旧接口
+            keep_open: 文档池保持打开的文档数（LRU），None 表示沿用 document_pool.max_docs。
+                0 表示每个任务结束后关闭文档；PS 中原本就打开的文档只复用、不关闭
+            event_callback: (event) -> None，结构化进度事件:
+                {"doc": 序号, "docs": 总数, "psd": 文件名, "row": 当前行, "rows": 行数,
+                 "status": doc_started / 批量进度状态 / doc_finished / doc_error / doc_skipped / doc_requeued,
+                 "message": ...,
+                 "worker": 执行该任务的连接序号, "docs_done": 已结束任务数,
+                 "rows_done": 全部任务已处理行数, "rows_total": 全部任务总行数}
+            reorder: 允许调整执行顺序，把使用同一文档的任务排在一起（稳定排序，按首次出现的顺序），
+                同优先级的就绪任务优先交给已打开该文档的连接
+            prefetch: 当前任务开始出图后，在后台预取下一个任务的文档
+            parallel: 有多个插件连接时，把互不依赖的任务同时分派到各个连接执行
+
+        返回值与事件中的 "doc" 均对应原始任务顺序；依赖失败而未执行的任务 status 为 "skipped"。
+        任务依赖无效（id 重复、依赖不存在、存在循环）时抛出 ValueError。
         """
-        _log(f"开始执行工作流，共 {len(tasks)} 个 PSD 任务")
-        results = []
-        loop = asyncio.get_event_loop()
-
-        for idx, task in enumerate(tasks, 1):
+        pool = self.document_pool
+        if keep_open is not None:
+            pool.max_docs = max(int(keep_open), 0)
+        order = group_order([doc_key(task["psd_path"]) for task in tasks]) if reorder else list(range(len(tasks)))
+        graph = TaskGraph(tasks, order)
+
+        lanes = list(self.lanes.values()) if parallel else [self.current_lane()]
+        lanes = lanes or [None]
+        _log(f"开始执行工作流，共 {len(tasks)} 个 PSD 任务，{len(lanes)} 个连接（每个连接保持打开 {pool.max_docs} 个）")
+        results = [None] * len(tasks)
+        totals = {"docs_done": 0, "rows_done": 0,
+                  "rows_total": sum(len(task.get("data_table") or []) for task in tasks)}
+        retried = set()
+        changed = asyncio.Condition()
+
+        def psd_name_of(index):
+            return tasks[index]["psd_path"].replace("\\", "/").split("/")[-1]
+
+        def rows_of(index):
+            return len(tasks[index].get("data_table") or [])
+
+        def is_open(index):
+            return tasks[index]["psd_path"] in pool
+
+        async def emit(index, event):
+            lane = self.current_lane()
+            event = dict({"doc": index + 1, "docs": len(tasks), "psd": psd_name_of(index)}, **event,
+                         worker=lane.conn_id if lane else 0, **totals)
+            await self._notify_progress(event_callback, event)
+
+        async def finish(index, result):
+            """记录任务结果；失败时跳过所有下游任务"""
+            results[index] = result
+            totals["docs_done"] += 1
+            for child in graph.complete(index, result["status"] == "ok"):
+                results[child] = {"psd": psd_name_of(child), "status": "skipped",
+                                  "error": f"依赖的任务失败: {psd_name_of(index)}"}
+                totals["docs_done"] += 1
+                totals["rows_done"] += rows_of(child)
+                await emit(child, {"row": 0, "rows": rows_of(child), "status": "doc_skipped",
+                                   "message": results[child]["error"]})
+
+        async def run_task(index):
+            task = tasks[index]
+            idx = index + 1
             psd_path = task["psd_path"]
-            psd_name = psd_path.replace("\\", "/").split("/")[-1]
+            psd_name = psd_name_of(index)
+            rows_total = rows_of(index)
             _log(f"--- [Workflow {idx}/{len(tasks)}] 处理文件: {psd_name} ---")
-            
+            doc = None
+            released = False
+            rows_reported = 0
+
             try:
-                # 1. 打开文件
-                open_future = loop.create_future()
-                async def on_open(res, err):
-                    if err: open_future.set_exception(Exception(err))
-                    else: open_future.set_result(res)
-                
-                await self.open_psd(psd_path, callback=on_open)
-                await asyncio.wait_for(open_future, timeout=30.0)
+                # 1. 获取文档（命中文档池 / PS 中已打开时只切换激活文档）
+                doc = await pool.acquire(psd_path)
+                await emit(index, {"row": 0, "rows": rows_total, "status": "doc_started",
+                                   "message": "复用已打开的文档" if doc["reused"] else "已打开文档"})
+
+                strategy = task.get("strategy")
+                if strategy is None:
+                    strategy, err = await self._await_result(self.read_strategy)
+                    if err or not strategy:
+                        raise Exception(err or "文档中没有保存编辑策略")
+                if task.get("output_dir"):
+                    strategy = dict(strategy, renders=[dict(r, output_path=task["output_dir"]) for r in strategy.get("renders", [])])
                 
                 # 2. 执行批量任务 (借用现有的 execute_batch_with_data)
-                batch_future = loop.create_future()
+                batch_future = asyncio.get_event_loop().create_future()
                 async def on_batch_done(res, err):
                     if err: batch_future.set_exception(Exception(err))
                     else: batch_future.set_result(res)
 
-                # 进度中继
+                # 进度中继；图层读取完毕、开始出图后再预取下一个文档，避免打扰当前文档的准备阶段
                 async def sub_progress(curr, total, status, msg):
-                    if progress_callback:
-                        if asyncio.iscoroutinefunction(progress_callback):
-                            await progress_callback(idx, len(tasks), f"PSD {idx} 进度: {curr}/{total}", msg)
-                        else:
-                            progress_callback(idx, len(tasks), f"PSD {idx} 进度: {curr}/{total}", msg)
-
-                await self.execute_batch_with_data(
-                    strategy=task["strategy"],
-                    data_table=task["data_table"],
-                    callback=on_batch_done,
-                    progress_callback=sub_progress
-                )
-                
-                batch_results = await asyncio.wait_for(batch_future, timeout=600.0) # 每个文件给 10 分钟
+                    nonlocal rows_reported
+                    if status == "processing" and prefetch and pool.max_docs > 0:
+                        upcoming = graph.peek(is_open if reorder else None)
+                        if upcoming is not None:
+                            pool.prefetch(tasks[upcoming]["psd_path"])
+                    if status in ("success", "error", "cancelled"):
+                        rows_reported += 1
+                        totals["rows_done"] += 1
+                    await self._notify_progress(progress_callback, idx, len(tasks), f"PSD {idx} 进度: {curr}/{total}", msg)
+                    await emit(index, {"row": curr, "rows": total, "status": status, "message": msg})
+
+                timeout = self.workflow_task_timeout(task, strategy, doc["name"])
+                try:
+                    await asyncio.wait_for(self.execute_batch_with_data(
+                        strategy=strategy,
+                        data_table=task["data_table"],
+                        callback=on_batch_done,
+                        progress_callback=sub_progress,
+                        target_document=doc["doc_id"]
+                    ), timeout=timeout)
+                except asyncio.TimeoutError:
+                    raise Exception(f"出图超时（{timeout:.0f}s）")
+                batch_results = await batch_future
                 
-                # 3. 关闭文件 (不保存修改，因为原子化操作已经保护了原稿)
-                await self.close_psd(name=psd_name, save=False)
+                # 3. 归还文档：超出文档池预算时关闭最久未使用的 (不保存修改，因为原子化操作已经保护了原稿)
+                released = True
+                await pool.release(psd_path, close=pool.max_docs <= 0)
                 
-                results.append({"psd": psd_name, "status": "ok", "details": batch_results})
+                ok_count = sum(1 for r in batch_results or [] if r.get("status") == "ok")
                 _log(f"文件 {psd_name} 处理完成")
-                
+                return {"psd": psd_name, "status": "ok", "details": batch_results,
+                        "doc_id": doc["doc_id"], "reused": doc["reused"]}, f"成功 {ok_count}/{rows_total}"
+
+            except asyncio.CancelledError:
+                # 工作流被停止（或外层 wait_for 取消）：解除占用，否则该文档永远不会被淘汰或关闭
+                if doc is not None and not released:
+                    await pool.release(psd_path)
+                raise
             except Exception as e:
                 _log(f"处理文件 {psd_name} 失败: {e}")
-                results.append({"psd": psd_name, "status": "error", "error": str(e)})
-                # 尝试关闭出错的文件
-                try: await self.close_psd(name=psd_name, save=False)
-                except: pass
-
-        _log(f"工作流执行完毕")
+                # 文档级失败：其余行计入已处理，保证总进度正确
+                totals["rows_done"] += rows_total - rows_reported
+                # 出错的文档状态不可信：移出文档池并尝试关闭（PS 中原本就打开的文档除外）
+                pool.forget(psd_path)
+                if doc is None or doc.get("owned"):
+                    try: await self.close_psd(doc_id=(doc or {}).get("doc_id"), name=(doc or {}).get("name", psd_name),
+                                              save=False, priority=PRIORITY_BATCH)
+                    except: pass
+                return {"psd": psd_name, "status": "error", "error": str(e)}, str(e)
+
+        def lane_alive(lane):
+            return lane is None or self.lanes.get(lane.websocket) is lane
+
+        async def worker(lane):
+            with self.use_lane(lane):
+                while True:
+                    async with changed:
+                        await changed.wait_for(lambda: graph.finished or graph.ready() or not lane_alive(lane))
+                        if graph.finished or not lane_alive(lane):
+                            return
+                        index = graph.claim(is_open if reorder else None)
+                    result, message = await run_task(index)
+                    async with changed:
+                        if not lane_alive(lane) and index not in retried:
+                            # 连接在执行中断开（剩余行均以连接断开失败）：整个任务交给其他连接重试一次
+                            _log(f"连接 #{lane.conn_id} 已断开，任务 {result['psd']} 将由其他连接重试")
+                            retried.add(index)
+                            graph.requeue(index)
+                            totals["rows_done"] -= rows_of(index)
+                            await emit(index, {"row": 0, "rows": rows_of(index), "status": "doc_requeued",
+                                               "message": "连接已断开，等待其他连接重试"})
+                        else:
+                            await finish(index, result)
+                            await emit(index, {"row": rows_of(index) if result["status"] == "ok" else 0,
+                                               "rows": rows_of(index),
+                                               "status": "doc_finished" if result["status"] == "ok" else "doc_error",
+                                               "message": message})
+                        changed.notify_all()
+
+        await asyncio.gather(*(worker(lane) for lane in lanes))
+
+        # 所有连接都已断开、仍未执行的任务
+        for index in graph.unfinished():
+            if results[index] is None:
+                totals["rows_done"] += rows_of(index)
+                await finish(index, {"psd": psd_name_of(index), "status": "error", "error": "没有可用的插件连接"})
+                await emit(index, {"row": 0, "rows": rows_of(index), "status": "doc_error", "message": "没有可用的插件连接"})
+
+        _log(f"工作流执行完毕，文档池: {pool.stats}")
         return results
 
+    async def _await_result(self, method, *args, **kwargs) -> tuple:
+        """把 (result, error) 回调式接口转换为 await"""
+        future = asyncio.get_event_loop().create_future()
+
+        async def on_done(result=None, error=None):
+            if not future.done():
+                future.set_result((result, error))
+
+        await method(*args, callback=on_done, **kwargs)
+        return await future
+
+    async def close_cached_documents(self) -> int:
+        """关闭文档池打开的全部空闲文档，返回关闭的数量"""
+        return await self.document_pool.close_all()
+
+    def get_cached_documents(self) -> list:
+        """文档池中的文档（最久未使用在前）"""
+        return self.document_pool.snapshot()
+
+    async def _notify_progress(self, progress_callback, *args):
+        """安全调用进度回调 (current, total, status, message)；也用于 row_callback 等其它逐行回调"""
+        if not progress_callback:
+            return
+        try:
+            if asyncio.iscoroutinefunction(progress_callback):
+                await progress_callback(*args)
+            else:
+                progress_callback(*args)
+        except Exception as e:
+            _log(f"进度回调异常: {e}")
+
     def _resolve_layer_path(self, layer_tree: list, target_path: str) -> tuple:
         """
         将图层路径解析为 ID 和父级链
@@ -1123,6 +1980,7 @@ def get_server() -> PSServer:
     global _server_instance
     if _server_instance is None:
         _server_instance = PSServer()
+        _server_instance.latency_model.load(default_latency_path())
     return _server_instance
 
 
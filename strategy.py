@@ -0,0 +1,407 @@
+"""
+小冰美化助手 - 编辑策略 (strategy.py)
+
+功能：
+1. StrategyParser：将模板状态序列化为《编辑策略规范 v1.1.0》JSON
+2. StrategyLoader：将策略 JSON 还原为模板状态
+3. apply_regex_steps：文本正则预处理引擎
+4. read_psd_strategy：直接从 PSD/PSB 文件的 XMP 中读取已保存的策略（无需在 PS 中打开）
+
+本模块不依赖 UI，状态对象只需提供 TemplateState 的同名字段与 reset / ensure_render_preset 方法。
+"""
+
+import datetime
+import html
+import json
+import os
+import re
+import struct
+from typing import Optional
+
+from server import get_server
+
+
+class StrategyParser:
+    """
+    负责将 TemplateState 转换为符合《编辑策略规范 v1.1.0》的 JSON 数据
+    """
+    @staticmethod
+    def serialize(state, current_layer_tree):
+        # 1. 基础校验：必须有渲染方案
+        if not state.render_presets:
+            return None, [("system", "至少需要一个渲染方案")]
+
+        # 2. 变量组标号映射 (文字层优先)
+        group_mapping = {}
+        next_group_idx = 1
+        
+        # 文字组标号
+        for key in state.text_groups:
+            if any(r['mapping_key'] == key for r in state.text_rules):
+                group_mapping[key] = next_group_idx
+                next_group_idx += 1
+        
+        # 图片组标号
+        for key in state.image_groups:
+            if any(r['mapping_key'] == key for r in state.image_rules):
+                group_mapping[key] = next_group_idx
+                next_group_idx += 1
+
+        # 3. 构建 operations
+        operations = []
+        invalid_rules = [] # 记录失效的规则路径
+        
+        # 辅助函数：校验路径并提取 ID
+        def resolve(path):
+            return get_server()._resolve_layer_path(current_layer_tree, path)
+
+        # 文本操作
+        for r in state.text_rules:
+            layer_id, parent_chain, _ = resolve(r['path'])
+            if layer_id is None:
+                invalid_rules.append(('text', r['path']))
+                continue
+            
+            op = {
+                "type": "update_text_layer",
+                "layer_id": layer_id,
+                "parent_chain": parent_chain,
+                "target_path": r['path'],
+                "group": group_mapping.get(r['mapping_key']),
+                "regex_steps": r.get('regex_steps', [])
+            }
+            operations.append(op)
+            
+        # 图片操作
+        for r in state.image_rules:
+            layer_id, parent_chain, _ = resolve(r['path'])
+            if layer_id is None:
+                invalid_rules.append(('image', r['path']))
+                continue
+            
+            op = {
+                "type": "replace_image",
+                "layer_id": layer_id,
+                "parent_chain": parent_chain,
+                "target_path": r['path'],
+                "group": group_mapping.get(r['mapping_key'])
+            }
+            operations.append(op)
+            
+        # 滤镜操作
+        for r in state.filter_rules:
+            layer_id, parent_chain, kind = resolve(r['path'])
+            if layer_id is None:
+                invalid_rules.append(('filter', r['path']))
+                continue
+            
+            # 安全性校验：局部滤镜仅支持智能对象
+            if kind != "SMARTOBJECT":
+                # 虽然 UI 层会限制只有 SO 才有滤镜按钮，但 serialize 阶段还是校验一下更稳
+                continue
+            
+            for step in r.get('filter_steps', []):
+                op = {
+                    "type": "apply_filter",
+                    "layer_id": layer_id,
+                    "parent_chain": parent_chain,
+                    "target_path": r['path'],
+                    "filter_type": step['type'],
+                    "params": step['params']
+                }
+                operations.append(op)
+
+        # 4. 构建 renders (不再对 root_layers 进行阻塞式校验)
+        renders = []
+        filename_set = set()
+        duplicate_filenames = []
+        
+        for p in state.render_presets:
+            full_filename = f"{p['filename']}.{p['format']}"
+            if full_filename in filename_set:
+                duplicate_filenames.append(full_filename)
+            else:
+                filename_set.add(full_filename)
+
+            # 解析 root_layers 路径为 root_ids
+            root_layers = [path for path in p.get('root_layers', []) if isinstance(path, str) and path.strip()]
+            root_ids = []
+            for path in root_layers:
+                rid, _, _ = resolve(path)
+                if rid: root_ids.append(rid)
+
+            render_config = {
+                "name": p['name'],
+                "description": p.get('description', ''),
+                "output_path": os.path.abspath(p.get('output_path', './output')),
+                "filename": p['filename'],
+                "format": p['format'],
+                "quality": p.get('quality', 100),
+                "root_ids": root_ids, # 插件端需要数字 ID
+                "root_layers": root_layers, # 持久化路径，供反序列化还原勾选
+                "tiling": p.get('tiling', {"enabled": False}),
+                "filters": state.global_filter_steps if state.global_filter_active else []
+            }
+            if p.get('encoding'):
+                render_config["encoding"] = dict(p['encoding'])  # 编码参数（见 encoder.DEFAULT_ENCODING）
+            renders.append(render_config)
+
+        if duplicate_filenames:
+            # 这里的 info 是给用户看的重复文件名列表
+            return None, [("system", f"检测到重复的渲染输出路径: {', '.join(duplicate_filenames)}。请修改渲染方案的命名模板或格式。")]
+
+        if invalid_rules:
+            return None, invalid_rules
+
+        return {
+            "version": "1.1.0",
+            "created": datetime.datetime.now().isoformat(),
+            "modified": datetime.datetime.now().isoformat(),
+            "operations": operations,
+            "renders": renders
+        }, None
+
+    @staticmethod
+    def _resolve_path_exists(tree, path_str):
+        if not tree: return False
+        # 统一格式化：去除两端空格
+        parts = [p.strip() for p in path_str.split('>')]
+        if not parts or parts[0] != '主文档':
+            return False
+        
+        if len(parts) == 1: 
+            return True
+            
+        current_level = tree
+        for i, part in enumerate(parts[1:]):
+            found_node = None
+            # 严格匹配每一级名称
+            for node in current_level:
+                if node['name'].strip() == part:
+                    found_node = node
+                    break
+            
+            if found_node:
+                # 如果已经是路径最后一级，匹配成功
+                if i == len(parts) - 2:
+                    return True
+                # 否则继续向子节点查找
+                current_level = found_node.get('children', [])
+            else:
+                return False
+        return False
+
+class StrategyLoader:
+    """
+    负责将 JSON 策略数据还原为 TemplateState
+    """
+    @staticmethod
+    def deserialize(data, state, current_layer_tree):
+        state.reset()
+
+        # 兼容历史策略：当仅保存了 root_ids 时，尽量还原回 root_layers 路径
+        id_to_path = {}
+        def _walk(nodes):
+            for node in nodes or []:
+                node_id = node.get('id')
+                node_path = node.get('path')
+                if node_id is not None and node_path:
+                    id_to_path[node_id] = node_path
+                _walk(node.get('children', []))
+        _walk(current_layer_tree or [])
+        
+        ops = data.get('operations', [])
+        text_ops = [op for op in ops if op['type'] == 'update_text_layer']
+        img_ops = [op for op in ops if op['type'] == 'replace_image']
+        filter_ops = [op for op in ops if op['type'] == 'apply_filter']
+        
+        # 1. 确定文字组分界
+        all_text_groups = sorted(list(set(op.get('group') for op in text_ops if op.get('group'))))
+        max_text_group = all_text_groups[-1] if all_text_groups else 0
+        
+        # 2. 还原文字规则
+        for op in text_ops:
+            path = op['target_path']
+            group_idx = op.get('group', 1)
+            group_name = f"文字组 {group_idx}"
+            if group_name not in state.text_groups:
+                while len(state.text_groups) < group_idx:
+                    state.text_groups.append(f"文字组 {len(state.text_groups) + 1}")
+            
+            rule = {
+                "name": path.split(' > ')[-1],
+                "path": path,
+                "mapping_key": group_name,
+                "regex_steps": op.get('regex_steps', [])
+            }
+            state.text_rules.append(rule)
+
+        # 3. 还原图片规则
+        for op in img_ops:
+            path = op['target_path']
+            group_idx = op.get('group', 1)
+            img_group_idx = max(1, group_idx - max_text_group)
+            group_name = f"图片组 {img_group_idx}"
+            
+            if group_name not in state.image_groups:
+                while len(state.image_groups) < img_group_idx:
+                    state.image_groups.append(f"图片组 {len(state.image_groups) + 1}")
+
+            rule = {
+                "name": path.split(' > ')[-1],
+                "path": path,
+                "mapping_key": group_name
+            }
+            state.image_rules.append(rule)
+
+        # 4. 还原滤镜规则
+        path_to_filter_rule = {}
+        for op in filter_ops:
+            path = op['target_path']
+            if path not in path_to_filter_rule:
+                path_to_filter_rule[path] = {
+                    "name": path.split(' > ')[-1],
+                    "path": path,
+                    "filter_steps": []
+                }
+            
+            path_to_filter_rule[path]['filter_steps'].append({
+                "type": op['filter_type'],
+                "params": op['params']
+            })
+        state.filter_rules = list(path_to_filter_rule.values())
+
+        # 5. 还原渲染方案
+        if data.get('renders'):
+            first_render = data['renders'][0]
+            if first_render.get('filters'):
+                state.global_filter_steps = first_render['filters']
+                state.global_filter_active = True
+            
+            for r in data['renders']:
+                root_layers = r.get('root_layers', [])
+                if not root_layers and r.get('root_ids'):
+                    root_layers = [id_to_path.get(rid) for rid in r.get('root_ids', []) if id_to_path.get(rid)]
+
+                raw_tiling = r.get('tiling', {"enabled": False})
+                if isinstance(raw_tiling, dict):
+                    tiling = {
+                        "enabled": bool(raw_tiling.get("enabled", False)),
+                        "width": int(raw_tiling.get("width", 1920) or 1920),
+                        "height": int(raw_tiling.get("height", 1080) or 1080),
+                        "ppi": int(raw_tiling.get("ppi", 300) or 300),
+                    }
+                else:
+                    # 兼容执行态结构：tiling(bool) + width/height/resolution
+                    tiling = {
+                        "enabled": bool(raw_tiling),
+                        "width": int(r.get("width", 1920) or 1920),
+                        "height": int(r.get("height", 1080) or 1080),
+                        "ppi": int(r.get("resolution", 300) or 300),
+                    }
+
+                preset = {
+                    "name": r['name'],
+                    "filename": r['filename'],
+                    "format": r['format'],
+                    "root_layers": root_layers,
+                    "tiling": tiling,
+                    "output_path": r.get('output_path', './output'),
+                    "quality": r.get('quality', 100)
+                }
+                if r.get('encoding'):
+                    preset["encoding"] = dict(r['encoding'])
+                state.render_presets.append(preset)
+        
+        # 6. 核心改进：确保文档加载后始终拥有至少一个渲染方案
+        state.ensure_render_preset()
+
+
+def apply_regex_steps(text, steps):
+    """
+    统一的正则处理引擎
+    支持 JS 风格的 $1 捕获组语法
+    """
+    result = text
+    for step in steps:
+        find_pattern = step.get('find', '')
+        replace_pattern = step.get('replace', '')
+        if not find_pattern:
+            continue
+        try:
+            # 兼容性处理：将 JS 风格的 $1, $2 转换为 Python 风格的 \1, \2
+            py_replace = re.sub(r'\$(\d+)', r'\\\1', replace_pattern)
+            result = re.sub(find_pattern, py_replace, result)
+        except Exception as e:
+            print(f"正则应用失败: {e}")
+    return result
+
+
+# ============================================
+# 从 PSD 文件读取策略
+# ============================================
+
+# 图像资源 ID：XMP 元数据
+_XMP_RESOURCE_ID = 1060
+_RESOURCE_SIGNATURES = (b'8BIM', b'MeSa', b'AgHg', b'PHUT', b'DCSR')
+_STRATEGY_ELEMENT = re.compile(r'<photoshop:edit_strategy>(.*?)</photoshop:edit_strategy>', re.S)
+# Photoshop 保存时可能把简单属性改写为 rdf:Description 上的 XML 属性
+_STRATEGY_ATTRIBUTE = re.compile(r'photoshop:edit_strategy="([^"]*)"', re.S)
+
+
+def read_psd_xmp(path: str) -> Optional[str]:
+    """
+    读取 PSD/PSB 文件中的 XMP 文本
+
+    只解析文件头与图像资源段（位于图层数据之前），不会读入整个文件。
+    非 PSD 文件或没有 XMP 时返回 None。
+    """
+    with open(path, 'rb') as f:
+        header = f.read(26)
+        if len(header) < 26 or header[:4] != b'8BPS':
+            return None
+        (color_mode_len,) = struct.unpack('>I', f.read(4))
+        f.seek(color_mode_len, os.SEEK_CUR)
+        (resources_len,) = struct.unpack('>I', f.read(4))
+        end = f.tell() + resources_len
+        while f.tell() + 12 <= end:
+            signature = f.read(4)
+            if signature not in _RESOURCE_SIGNATURES:
+                return None
+            (resource_id, name_len) = struct.unpack('>HB', f.read(3))
+            # Pascal 字符串（含长度字节）按偶数对齐
+            f.seek(name_len + (name_len + 1) % 2, os.SEEK_CUR)
+            (size,) = struct.unpack('>I', f.read(4))
+            if resource_id == _XMP_RESOURCE_ID:
+                return f.read(size).decode('utf-8', errors='replace')
+            f.seek(size + size % 2, os.SEEK_CUR)
+    return None
+
+
+def parse_xmp_strategy(xmp: str) -> Optional[dict]:
+    """从 XMP 文本中提取编辑策略（与插件 read_strategy 的解析规则一致）"""
+    match = _STRATEGY_ELEMENT.search(xmp) or _STRATEGY_ATTRIBUTE.search(xmp)
+    if not match:
+        return None
+    text = html.unescape(match.group(1)).strip()
+    first, last = text.find('{'), text.rfind('}')
+    if first == -1 or last <= first:
+        return None
+    try:
+        return json.loads(text[first:last + 1])
+    except json.JSONDecodeError:
+        return None
+
+
+def read_psd_strategy(path: str) -> Optional[dict]:
+    """
+    直接从 PSD/PSB 文件读取已保存的编辑策略；文件中没有策略或无法解析时返回 None
+
+    注意：插件写入的策略只有在文档保存后才会出现在文件中。
+    """
+    try:
+        xmp = read_psd_xmp(path)
+    except (OSError, struct.error) as e:
+        print(f"读取 PSD 元数据失败 {path}: {e}")
+        return None
+    return parse_xmp_strategy(xmp) if xmp else None
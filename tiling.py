@@ -0,0 +1,76 @@
+"""
+小冰美化助手 - 平铺 (tiling.py)
+
+插件的 applySimpleTiling 在每个渲染副本里用 batchPlay 合并图层、裁切透明边、定义图案、
+扩展画布再填充，是出图最慢的步骤之一，而且每一行都要重做一遍。本模块在 Python 端完成同样的平铺：
+1. PS 只输出未平铺的渲染结果（PNG 中间文件，见 encoder.py）
+2. 裁掉四周的全透明区域作为图案（与 PS「基于透明像素裁切」一致）
+3. 按目标尺寸生成行 / 列索引（图案从画布左上角开始重复，与 PS 图案填充一致），
+   用 NumPy 一次取出整张平铺画布；索引按 (图案尺寸, 目标尺寸) 缓存，批量中每行复用
+4. 在编码器的执行器中运行（线程池 / 进程池），不占用 PS
+
+NumPy 或 Pillow 未安装时不可用，平铺仍由 PS 完成。
+"""
+
+from functools import lru_cache
+from typing import Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# 与插件平铺参数对应的渲染方案字段
+TILING_FIELDS = ("tiling", "width", "height", "resolution")
+
+
+def available() -> bool:
+    return np is not None and Image is not None
+
+
+def tiling_size(render: dict) -> Optional[Tuple[int, int]]:
+    """渲染方案的平铺目标尺寸；未开启平铺时返回 None"""
+    if not render.get("tiling"):
+        return None
+    try:
+        width, height = int(render.get("width") or 0), int(render.get("height") or 0)
+    except (TypeError, ValueError):
+        return None
+    return (width, height) if width > 0 and height > 0 else None
+
+
+@lru_cache(maxsize=64)
+def tile_grid(source: Tuple[int, int], target: Tuple[int, int]):
+    """图案 source=(宽, 高) 铺满 target=(宽, 高) 时每个目标行 / 列取自的图案行 / 列（只读数组）"""
+    ys = np.arange(target[1], dtype=np.intp) % source[1]
+    xs = np.arange(target[0], dtype=np.intp) % source[0]
+    ys.flags.writeable = False
+    xs.flags.writeable = False
+    return ys, xs
+
+
+def trim_transparent(img):
+    """裁掉四周的全透明区域；没有透明通道或整张透明时原样返回"""
+    if img.mode not in ("RGBA", "LA"):
+        return img
+    box = img.getchannel("A").getbbox()
+    if box and box != (0, 0) + img.size:
+        return img.crop(box)
+    return img
+
+
+def tile_image(img, width: int, height: int):
+    """把 img（裁切透明边后）作为图案铺满 width x height 的画布"""
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    pattern = trim_transparent(img)
+    ys, xs = tile_grid(pattern.size, (width, height))
+    pixels = np.asarray(pattern)
+    tiled = pixels.take(ys, axis=0).take(xs, axis=1)
+    return Image.fromarray(np.ascontiguousarray(tiled))
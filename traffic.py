@@ -0,0 +1,138 @@
+"""
+小冰美化助手 - 通信录制 (traffic.py)
+
+功能：
+1. TrafficRecorder：记录 PSServer 与插件之间收发的每条 WebSocket 消息及时间戳
+2. 以 gzip 压缩的 JSON Lines 写盘，体积小、可流式读取，进程异常退出时最多丢失最后一个刷新周期
+3. load_session：读取录制文件（容忍被截断的结尾），供 replay.py 回放
+
+记录格式（每行一个 JSON，t 为相对录制开始的秒数）:
+    {"ev": "header", "version": 1, "started_at": 1700000000.0, ...}
+    {"t": 0.01, "ev": "connect", "conn": 1}
+    {"t": 0.10, "ev": "enqueue", "conn": 1, "id": 1700000000100, "type": "get_layers", "priority": 0, "timeout": 10.0, "raw": "..."}
+    {"t": 0.10, "ev": "send", "conn": 1, "id": 1700000000100}
+    {"t": 0.35, "ev": "recv", "conn": 1, "raw": "..."}
+    {"t": 0.40, "ev": "cancel", "id": 1700000000100}
+    {"t": 9.00, "ev": "disconnect", "conn": 1}
+
+send 事件只在未经派发通道的直接发送（如弹窗）时携带 raw，其余消息体已记录在 enqueue 中。
+"""
+
+import gzip
+import json
+import os
+import time
+import zlib
+from datetime import datetime
+from typing import Optional
+
+FORMAT_VERSION = 1
+
+# 两次刷新之间的最长间隔（秒）：刷新会写出完整的压缩块，保证已记录的内容可读
+FLUSH_INTERVAL = 2.0
+
+
+def default_recording_path(directory: str = "recordings") -> str:
+    return os.path.join(directory, f"ice_traffic_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl.gz")
+
+
+class TrafficRecorder:
+    """
+    WebSocket 通信录制器
+
+    由 PSServer 在入队 / 派发 / 收到消息 / 取消 / 连接变化时调用；写入失败只记录一次日志，不影响业务。
+    """
+
+    def __init__(self, path: str, meta: dict = None):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self.started_at = time.time()
+        self._last_flush = self.started_at
+        self.events = 0
+        self.closed = False
+        self.error: Optional[str] = None
+        header = {"ev": "header", "version": FORMAT_VERSION, "started_at": self.started_at}
+        header.update(meta or {})
+        self._write(header)
+
+    def _write(self, record: dict):
+        if self.closed:
+            return
+        try:
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.events += 1
+            now = time.time()
+            if now - self._last_flush >= FLUSH_INTERVAL:
+                self._file.flush(zlib.Z_SYNC_FLUSH)
+                self._last_flush = now
+        except Exception as e:
+            if self.error is None:
+                self.error = str(e)
+                print(f"[traffic] 录制写入失败，后续消息将丢失: {e}")
+
+    def _event(self, ev: str, **fields):
+        record = {"t": round(time.time() - self.started_at, 6), "ev": ev}
+        record.update(fields)
+        self._write(record)
+
+    def on_connect(self, conn: int):
+        self._event("connect", conn=conn)
+
+    def on_disconnect(self, conn: int):
+        self._event("disconnect", conn=conn)
+
+    def on_enqueue(self, conn: int, request: dict):
+        self._event("enqueue", conn=conn, id=request["id"], type=request["type"],
+                    priority=request["priority"], timeout=request["timeout"], raw=request["payload_str"])
+
+    def on_send(self, conn: int, req_id: int = None, raw: str = None):
+        fields = {"conn": conn}
+        if req_id is not None:
+            fields["id"] = req_id
+        if raw is not None:
+            fields["raw"] = raw
+        self._event("send", **fields)
+
+    def on_receive(self, conn: int, raw: str):
+        self._event("recv", conn=conn, raw=raw)
+
+    def on_cancel(self, req_id: int):
+        self._event("cancel", id=req_id)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._file.close()
+        except Exception as e:
+            print(f"[traffic] 关闭录制文件失败: {e}")
+
+
+def load_session(path: str) -> dict:
+    """
+    读取录制文件，返回 {"header": dict, "events": list}
+
+    录制进程被强制结束时，gzip 结尾可能不完整：读取到最后一个完整行为止。
+    """
+    header = {}
+    events = []
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if record.get("ev") == "header":
+                    header = record
+                else:
+                    events.append(record)
+        except (EOFError, OSError, zlib.error):
+            pass
+    return {"header": header, "events": events}
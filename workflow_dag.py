@@ -0,0 +1,130 @@
+"""
+小冰美化助手 - 工作流任务图 (workflow_dag.py)
+
+多文档工作流的任务可以声明依赖与优先级，构成有向无环图：
+    - "id": 可选，任务标识，默认为任务在列表中的序号（从 0 开始）
+    - "depends_on": 可选，依赖的任务 id 列表；依赖全部成功后任务才会就绪
+    - "priority": 可选，数值越小越先执行（与派发通道一致），默认 0
+
+依赖的任务失败时，下游任务（含间接依赖）标记为跳过。
+本模块只负责图的校验与就绪任务选择，不涉及与插件的通信。
+"""
+
+from typing import Callable, Dict, List, Optional
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class TaskGraph:
+    """
+    工作流任务图
+
+    order: 同优先级任务之间的先后顺序（任务下标列表），默认按任务列表顺序
+    """
+
+    def __init__(self, tasks: list, order: List[int] = None):
+        self.tasks = tasks
+        self.order = list(order) if order is not None else list(range(len(tasks)))
+        self._rank = {index: rank for rank, index in enumerate(self.order)}
+        self.state: Dict[int, str] = {i: PENDING for i in range(len(tasks))}
+        self.deps: Dict[int, set] = {}
+        self.dependents: Dict[int, set] = {i: set() for i in range(len(tasks))}
+        self.priority: Dict[int, int] = {}
+
+        ids = {}
+        for i, task in enumerate(tasks):
+            task_id = task.get("id", i)
+            if task_id in ids:
+                raise ValueError(f"任务 id 重复: {task_id}")
+            ids[task_id] = i
+            try:
+                self.priority[i] = int(task.get("priority") or 0)
+            except (TypeError, ValueError):
+                raise ValueError(f"任务 {task_id} 的 priority 不是整数")
+        for i, task in enumerate(tasks):
+            deps = set()
+            for dep in task.get("depends_on") or []:
+                if dep not in ids:
+                    raise ValueError(f"任务 {task.get('id', i)} 依赖的任务不存在: {dep}")
+                deps.add(ids[dep])
+            self.deps[i] = deps
+            for dep in deps:
+                self.dependents[dep].add(i)
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        remaining = {i: len(deps) for i, deps in self.deps.items()}
+        ready = [i for i, n in remaining.items() if n == 0]
+        visited = 0
+        while ready:
+            i = ready.pop()
+            visited += 1
+            for child in self.dependents[i]:
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    ready.append(child)
+        if visited != len(self.tasks):
+            cycle = [self.tasks[i].get("id", i) for i, n in remaining.items() if n > 0]
+            raise ValueError(f"任务依赖存在循环: {cycle}")
+
+    # --- 调度 ---
+
+    def ready(self) -> List[int]:
+        """依赖已全部完成、尚未开始的任务（按优先级与顺序排列）"""
+        items = [i for i, state in self.state.items()
+                 if state == PENDING and all(self.state[d] == DONE for d in self.deps[i])]
+        return sorted(items, key=lambda i: (self.priority[i], self._rank[i]))
+
+    def claim(self, prefer: Callable[[int], bool] = None) -> Optional[int]:
+        """
+        取出下一个就绪任务并标记为执行中
+
+        prefer: 同优先级时优先选择的任务（如文档已在当前连接中打开），不会越过更高优先级的任务
+        """
+        items = self.ready()
+        if not items:
+            return None
+        best = items[0]
+        if prefer:
+            best = next((i for i in items if self.priority[i] == self.priority[best] and prefer(i)), best)
+        self.state[best] = RUNNING
+        return best
+
+    def peek(self, prefer: Callable[[int], bool] = None) -> Optional[int]:
+        """下一个将被取出的就绪任务（不改变状态，用于预取）"""
+        items = self.ready()
+        if not items:
+            return None
+        if prefer:
+            return next((i for i in items if self.priority[i] == self.priority[items[0]] and prefer(i)), items[0])
+        return items[0]
+
+    def complete(self, index: int, ok: bool) -> List[int]:
+        """任务结束；失败时返回因此被跳过的下游任务"""
+        self.state[index] = DONE if ok else FAILED
+        if ok:
+            return []
+        skipped = []
+        stack = list(self.dependents[index])
+        while stack:
+            child = stack.pop()
+            if self.state[child] == PENDING:
+                self.state[child] = SKIPPED
+                skipped.append(child)
+                stack.extend(self.dependents[child])
+        return sorted(skipped, key=lambda i: self._rank[i])
+
+    def requeue(self, index: int):
+        """执行中的任务放回就绪队列（如连接断开，交给其他连接重试）"""
+        self.state[index] = PENDING
+
+    def unfinished(self) -> List[int]:
+        return [i for i, state in self.state.items() if state in (PENDING, RUNNING)]
+
+    @property
+    def finished(self) -> bool:
+        return not self.unfinished()
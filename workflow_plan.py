@@ -0,0 +1,149 @@
+"""
+小冰美化助手 - 批量出图计划 (workflow_plan.py)
+
+功能：
+1. 扫描文件夹中的 PSD / PSB，直接从文件 XMP 读取已保存的编辑策略（无需逐个在 PS 中打开）
+2. 为每个文档匹配数据表：优先同名表格（海报.psd -> 海报.csv / 海报.xlsx），否则使用共享数据表
+3. 校验数据列数与策略变量组，生成 PSServer.execute_workflow 所需的任务列表
+
+本模块不依赖 UI，供「批量出图」工作台与脚本复用。
+"""
+
+import os
+from typing import List, Optional
+
+from strategy import read_psd_strategy
+from table_import import parse_table, table_to_rows
+
+PSD_SUFFIXES = ('.psd', '.psb')
+TABLE_SUFFIXES = ('.csv', '.xlsx', '.xlsm', '.txt')
+
+
+class PlanItem:
+    """
+    单个文档的执行计划
+
+    strategy 为 None 且 read_from_document 为 True 时，执行时打开文档后再读取其中的策略
+    （文件中的策略可能尚未保存，以 PS 中的文档为准）。
+    """
+
+    def __init__(self, psd_path: str):
+        self.psd_path = psd_path
+        self.name = os.path.basename(psd_path)
+        self.strategy: Optional[dict] = None
+        self.read_from_document = False
+        self.data_path: Optional[str] = None
+        self.rows: List[dict] = []
+        self.groups = 0
+        self.output_dir: Optional[str] = None
+        self.warnings: List[str] = []
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.error is None and bool(self.rows)
+
+    def to_task(self) -> dict:
+        return {"psd_path": self.psd_path, "strategy": self.strategy, "data_table": self.rows,
+                "output_dir": self.output_dir}
+
+    def summary(self) -> dict:
+        if self.strategy is not None:
+            strategy_text = f"{len(self.strategy.get('renders', []))} 个渲染方案"
+        elif self.read_from_document:
+            strategy_text = "执行时从文档读取"
+        else:
+            strategy_text = "无"
+        return {
+            "name": self.name,
+            "strategy": strategy_text,
+            "data": os.path.basename(self.data_path) if self.data_path else "-",
+            "rows": len(self.rows),
+            "status": self.error or ("；".join(self.warnings) if self.warnings else "就绪"),
+            "ready": self.ready,
+        }
+
+
+def scan_psd_folder(folder: str, recursive: bool = False) -> List[str]:
+    """返回文件夹内的 PSD / PSB 路径（按文件名排序）"""
+    paths = []
+    if recursive:
+        for root, _, files in os.walk(folder):
+            paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(PSD_SUFFIXES))
+    else:
+        paths = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(PSD_SUFFIXES)]
+    return sorted(paths, key=lambda p: os.path.basename(p).lower())
+
+
+def find_data_table(psd_path: str) -> Optional[str]:
+    """同目录下与 PSD 同名的表格"""
+    stem = os.path.splitext(psd_path)[0]
+    for suffix in TABLE_SUFFIXES:
+        if os.path.isfile(stem + suffix):
+            return stem + suffix
+    return None
+
+
+def load_table_rows(path: str, skip_header: bool = True) -> List[dict]:
+    """读取 CSV / XLSX 为行数据；无法识别格式时抛出 ValueError"""
+    with open(path, 'rb') as f:
+        file_bytes = f.read()
+    file_type, table = parse_table(os.path.basename(path), file_bytes)
+    if file_type is None:
+        raise ValueError("无法识别表格格式")
+    return table_to_rows(table, skip_header)
+
+
+def _group_count(strategy: dict) -> int:
+    groups = [op.get("group") for op in strategy.get("operations", []) if op.get("group") is not None]
+    return max((int(g) for g in groups), default=0)
+
+
+def build_workflow_plan(folder: str, shared_table: str = None, skip_header: bool = True,
+                        recursive: bool = False, output_dir: str = None) -> List[PlanItem]:
+    """
+    扫描文件夹生成工作流计划
+
+    shared_table: 没有同名表格的文档使用该表格
+    output_dir: 覆盖所有策略中的输出目录
+    """
+    items = []
+    table_cache = {}
+    for psd_path in scan_psd_folder(folder, recursive):
+        item = PlanItem(psd_path)
+        item.output_dir = output_dir
+        items.append(item)
+
+        item.strategy = read_psd_strategy(psd_path)
+        if item.strategy is None:
+            item.read_from_document = True
+            item.warnings.append("文件中未找到策略，执行时从文档读取")
+        elif not item.strategy.get("renders"):
+            item.error = "策略中没有渲染方案"
+            continue
+
+        item.data_path = find_data_table(psd_path) or shared_table
+        if not item.data_path:
+            item.error = "没有数据表"
+            continue
+        try:
+            if item.data_path not in table_cache:
+                table_cache[item.data_path] = load_table_rows(item.data_path, skip_header)
+            # 每个任务使用独立的行副本，执行过程中不会互相影响
+            item.rows = [dict(row) for row in table_cache[item.data_path]]
+        except ImportError:
+            item.error = "未安装 openpyxl，无法解析 Excel"
+            continue
+        except (OSError, ValueError) as e:
+            item.error = f"读取数据表失败: {e}"
+            continue
+        if not item.rows:
+            item.error = "数据表为空"
+            continue
+
+        if item.strategy is not None:
+            item.groups = _group_count(item.strategy)
+            columns = max(len([k for k in row if k != "output_filename"]) for row in item.rows)
+            if columns < item.groups:
+                item.warnings.append(f"数据只有 {columns} 列，策略需要 {item.groups} 组")
+    return items